@@ -1,17 +1,55 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin
 from .models import User, Task, Trip, Specialization, Qualification, DoctorReferral, DoctorVisit, OvernightStay, PatientReferral, Admission, DoctorCommissionProfile, ClientLog
 
+
+
+class BackgroundDeleteAdminMixin:
+    """
+    Admin deletes soft-delete the rows and queue a purge job (portal.purge)
+    instead of cascading through their trips, visits and referrals in the
+    request. Soft-deleted rows are hidden from the changelist.
+    """
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).filter(deleted_at__isnull=True)
+
+    def get_deleted_objects(self, objs, request):
+        # Skip the full cascade collection; the purge job does that in batches.
+        objs = list(objs)
+        summary = [f'{obj} (related records are deleted in the background)' for obj in objs]
+        return summary, {self.model._meta.verbose_name_plural: len(objs)}, set(), []
+
+    def _queue_deletion(self, request, objects):
+        from portal.jobs import JobLimitExceeded
+        from portal.purge import queue_deletion
+
+        try:
+            job = queue_deletion(objects, request.user)
+        except JobLimitExceeded as exc:
+            self.message_user(request, str(exc), level=messages.ERROR)
+            return
+        self.message_user(request, f'Deletion queued as background job #{job.pk}.', level=messages.INFO)
+
+    def delete_model(self, request, obj):
+        self._queue_deletion(request, [obj])
+
+    def delete_queryset(self, request, queryset):
+        self._queue_deletion(request, list(queryset))
+
+
 # Register your models here.
 @admin.register(DoctorCommissionProfile)
 class DoctorCommissionProfileAdmin(admin.ModelAdmin):
     list_display = ('doctor', 'payment_category', 'updated_at')
     list_filter = ('payment_category', 'doctor')
     search_fields = ('doctor__name',)
-admin.site.register(User, UserAdmin)
+@admin.register(User)
+class PortalUserAdmin(BackgroundDeleteAdminMixin, UserAdmin):
+    pass
 admin.site.register(Task)
 @admin.register(Trip)
-class TripAdmin(admin.ModelAdmin):
+class TripAdmin(BackgroundDeleteAdminMixin, admin.ModelAdmin):
     list_display = ('id', 'agent', 'start_time', 'end_time', 'status', 'total_kilometers', 'start_lat', 'start_long', 'end_lat', 'end_long')
     list_filter = ('status', 'start_time', 'agent')
     search_fields = ('agent__username', 'status')
@@ -46,7 +84,7 @@ class AddressInline(admin.StackedInline):
     extra = 1
 
 @admin.register(Area)
-class AreaAdmin(admin.ModelAdmin):
+class AreaAdmin(BackgroundDeleteAdminMixin, admin.ModelAdmin):
     list_display = ('name', 'city', 'pincode', 'state', 'agent', 'created_at')
     list_filter = ('city', 'state', 'agent', 'created_at')
     search_fields = ('name', 'city', 'pincode', 'agent__username')
@@ -153,3 +191,34 @@ class AdmissionAdmin(admin.ModelAdmin):
     def total_charges_display(self, obj):
         return obj.total_charges
     total_charges_display.short_description = "Total Charges"
+
+from .models import AdmissionDailyRollup
+
+
+@admin.register(AdmissionDailyRollup)
+class AdmissionDailyRollupAdmin(admin.ModelAdmin):
+    list_display = ('date', 'referred_by_doctor', 'area', 'agent', 'payment_category', 'admission_type', 'patient_count', 'total_revenue', 'total_commission')
+    list_filter = ('admission_type', 'payment_category', 'date')
+    search_fields = ('referred_by_doctor__name', 'agent__username', 'area__name')
+    raw_id_fields = ('referred_by_doctor', 'area', 'agent')
+
+
+from .models import MediaBlob
+
+
+@admin.register(MediaBlob)
+class MediaBlobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'size', 'refcount', 'created_at')
+    search_fields = ('name', 'sha256')
+    readonly_fields = ('name', 'sha256', 'size', 'refcount', 'created_at')
+
+
+from .models import ChunkedUpload
+
+
+@admin.register(ChunkedUpload)
+class ChunkedUploadAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'filename', 'offset', 'size', 'status', 'updated_at')
+    list_filter = ('status',)
+    search_fields = ('user__username', 'filename')
+    readonly_fields = ('id', 'user', 'filename', 'size', 'offset', 'sha256', 'status', 'stored_name', 'created_at', 'updated_at')
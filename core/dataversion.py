@@ -0,0 +1,55 @@
+"""
+Change counters for derived data.
+
+``bump_data_version(key)`` is called from signal handlers when a source table
+changes; readers embed ``get_data_version(key)`` in cache keys.
+
+Readers on a hot path can pass ``max_age`` to reuse a version read by this
+process within the last ``max_age`` seconds. Bumps made by this process drop
+that copy at once; bumps from other processes are seen within ``max_age``.
+"""
+import time
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import DataVersion
+
+# Tables whose rows feed the reports dashboard and its exports.
+REPORTS = 'reports'
+# DoctorCommissionProfile rates (portal.commissions rate cache).
+COMMISSION_PROFILES = 'commission_profiles'
+
+
+# {key: (version, monotonic time it was read)} for ``max_age`` readers.
+_recent_versions = {}
+
+
+def get_data_version(key, max_age=0):
+    if max_age > 0:
+        recent = _recent_versions.get(key)
+        if recent is not None and time.monotonic() - recent[1] < max_age:
+            return recent[0]
+    read_at = time.monotonic()
+    version = DataVersion.objects.filter(key=key).values_list('version', flat=True).first() or 0
+    _recent_versions[key] = (version, read_at)
+    return version
+
+
+def forget_data_version(key):
+    """Make the next ``get_data_version(key, max_age)`` in this process query again."""
+    _recent_versions.pop(key, None)
+
+
+def bump_data_version(key):
+    forget_data_version(key)
+    updated = DataVersion.objects.filter(key=key).update(version=F('version') + 1, updated_at=timezone.now())
+    if updated:
+        return
+    try:
+        with transaction.atomic():
+            DataVersion.objects.create(key=key, version=1)
+    except IntegrityError:
+        # Created concurrently; bump that row instead.
+        DataVersion.objects.filter(key=key).update(version=F('version') + 1, updated_at=timezone.now())
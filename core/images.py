@@ -0,0 +1,297 @@
+"""
+Ingest pipeline for uploaded photos.
+
+Phones upload multi-megabyte camera JPEGs (odometers, visit photos, hotel
+bills). ``optimize_image`` applies the EXIF orientation, caps the longest
+side at ``PORTAL_IMAGE_MAX_SIZE``, drops metadata and re-encodes as a
+progressive JPEG at ``PORTAL_IMAGE_QUALITY`` (PNG when the image has
+transparency). ``make_thumbnails`` writes one JPEG per
+``PORTAL_IMAGE_THUMBNAIL_SIZES`` entry under ``thumbnails/<label>/``, named
+after the original so they can be found without a database column.
+
+``PORTAL_IMAGE_INGEST`` picks when this happens: ``sync`` optimizes the
+upload before it is stored and thumbnails it once the row has committed,
+``background`` stores the original and, on a worker thread after commit,
+stores the optimized copy under its own hash name and moves the rows over
+to it (``core.storage.replace_blob``), ``off`` keeps originals as they are.
+``manage.py process_images`` backfills media stored before.
+"""
+from __future__ import annotations
+
+import io
+import logging
+import os
+import posixpath
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections
+from PIL import Image, ImageOps
+
+from .models import DoctorReferral, DoctorVisit, OvernightStay, Trip
+
+logger = logging.getLogger(__name__)
+
+INGEST_SYNC = 'sync'
+INGEST_BACKGROUND = 'background'
+INGEST_OFF = 'off'
+
+# Image fields that go through the pipeline.
+IMAGE_FIELDS = {
+    Trip: ('odometer_start_image', 'odometer_end_image'),
+    DoctorReferral: ('visit_image',),
+    DoctorVisit: ('visit_image',),
+    OvernightStay: ('bill_image',),
+}
+
+THUMBNAIL_DIR = 'thumbnails'
+
+_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}
+
+_executor = None
+
+
+def ingest_mode():
+    return settings.PORTAL_IMAGE_INGEST
+
+
+def thumbnail_sizes():
+    return settings.PORTAL_IMAGE_THUMBNAIL_SIZES
+
+
+def thumbnail_name(name, label):
+    """Storage name of the ``label`` thumbnail of the image stored as ``name``."""
+    stem, _ = posixpath.splitext(name)
+    return f'{THUMBNAIL_DIR}/{label}/{stem}.jpg'
+
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def _open(source, box):
+    image = Image.open(source)
+    source_format = image.format
+    width, height = image.size
+    ratio = box / max(width, height)
+    if ratio < 1:
+        # Let the JPEG decoder downscale by a power of two while it decodes;
+        # much cheaper than decoding a 12 MP photo and resizing afterwards.
+        image.draft('RGB', (max(1, int(width * ratio)), max(1, int(height * ratio))))
+    image = ImageOps.exif_transpose(image)
+    return image, source_format
+
+
+def _flatten(image):
+    if _has_alpha(image):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def _encode(image, image_format):
+    buffer = io.BytesIO()
+    if image_format == 'PNG':
+        image.save(buffer, 'PNG', optimize=True)
+    elif image_format == 'WEBP':
+        image.save(buffer, 'WEBP', quality=settings.PORTAL_IMAGE_QUALITY, method=4)
+    else:
+        _flatten(image).save(
+            buffer, 'JPEG', quality=settings.PORTAL_IMAGE_QUALITY, optimize=True, progressive=True,
+        )
+    return buffer.getvalue()
+
+
+def optimize_image(source):
+    """
+    Re-encode the image in the binary file ``source``.
+
+    Returns ``(data, format)``, or ``None`` when the image already fits and
+    re-encoding would not make it smaller.
+    """
+    max_size = settings.PORTAL_IMAGE_MAX_SIZE
+    original_size = _size_of(source)
+    image, _ = _open(source, max_size)
+    resized = max(image.size) > max_size
+    if resized:
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+
+    image_format = 'PNG' if _has_alpha(image) else 'JPEG'
+    if image_format != 'PNG' and image.mode not in ('RGB', 'RGBA', 'L'):
+        image = image.convert('RGBA' if _has_alpha(image) else 'RGB')
+
+    data = _encode(image, image_format)
+    if not resized and original_size is not None and len(data) >= original_size:
+        return None
+    return data, image_format
+
+
+def _size_of(source):
+    try:
+        position = source.tell()
+        source.seek(0, os.SEEK_END)
+        size = source.tell()
+        source.seek(position)
+        return size
+    except (AttributeError, OSError):
+        return None
+
+
+def _write(storage, name, data):
+    """Store ``data`` under exactly ``name``, replacing any previous file."""
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        path = None
+    if path is None:
+        storage.delete(name)
+        storage.save(name, ContentFile(data))
+        return
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # Readers never see a half-written image.
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.ingest-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            out.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def make_thumbnails(storage, name):
+    """Write every configured thumbnail of ``name``; returns their storage names."""
+    sizes = thumbnail_sizes()
+    if not sizes:
+        return []
+    with storage.open(name, 'rb') as source:
+        image, _ = _open(source, max(sizes.values()))
+        image = _flatten(image)
+    written = []
+    for label, size in sorted(sizes.items(), key=lambda item: -item[1]):
+        # Largest first, each one shrinking the previous result.
+        image.thumbnail((size, size), Image.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=settings.PORTAL_IMAGE_QUALITY, optimize=True)
+        target = thumbnail_name(name, label)
+        _write(storage, target, buffer.getvalue())
+        written.append(target)
+    return written
+
+
+def has_thumbnails(storage, name):
+    return all(storage.exists(thumbnail_name(name, label)) for label in thumbnail_sizes())
+
+
+def delete_thumbnails(storage, name):
+    for label in thumbnail_sizes():
+        storage.delete(thumbnail_name(name, label))
+
+
+def optimize_upload(field_file):
+    """
+    Replace a not yet stored upload with its optimized version.
+
+    Called before the field stores it, so the optimized file is the only one
+    ever written and gets the extension of its new format. Uploads Pillow
+    cannot read are stored as they are.
+    """
+    field_file.file.seek(0)
+    try:
+        result = optimize_image(field_file.file)
+    except Exception as exc:
+        logger.warning("Could not optimize upload %s: %s", field_file.name, exc)
+        result = None
+    if result is None:
+        field_file.file.seek(0)
+        return False
+    data, image_format = result
+    stem, _ = os.path.splitext(os.path.basename(field_file.name))
+    field_file.name = stem + _EXTENSIONS[image_format]
+    field_file.file = ContentFile(data, name=field_file.name)
+    return True
+
+
+def process_stored_image(storage, name, optimize=True):
+    """
+    Optimize a stored image and (re)write its thumbnails.
+
+    A smaller version is stored under its own content-addressed name and
+    every row pointing at ``name`` (a doctor shares the photo of its latest
+    visit) is moved to it; ``name`` is then released. Stored files are never
+    rewritten, so a name keeps matching its content. Returns the number of
+    bytes saved.
+    """
+    from .storage import claim, release, replace_blob, shard_directory
+
+    if optimize:
+        with storage.open(name, 'rb') as source:
+            result = optimize_image(source)
+        if result is not None:
+            data, image_format = result
+            directory = shard_directory(name.split('/', 1)[0])
+            new_name = storage.save(f'{directory}/optimized{_EXTENSIONS[image_format]}', ContentFile(data))
+            # Held until ``replace_blob`` hands it over to the rows.
+            claim(new_name)
+            if new_name == name:
+                release(storage, new_name)
+            else:
+                saved = storage.size(name) - len(data)
+                make_thumbnails(storage, new_name)
+                # Nothing saved if the rows moved on to another image meanwhile.
+                return saved if replace_blob(storage, name, new_name) else 0
+    make_thumbnails(storage, name)
+    return 0
+
+
+def _process_safely(storage, name, optimize):
+    try:
+        process_stored_image(storage, name, optimize=optimize)
+    except Exception as exc:
+        # The original stays usable; templates fall back to it.
+        logger.warning("Could not process image %s: %s", name, exc)
+
+
+def _process_in_background(storage, name, optimize):
+    # Executor threads outlive requests, so drop stale or broken database
+    # connections around each task as request_started/finished would.
+    close_old_connections()
+    try:
+        _process_safely(storage, name, optimize)
+    finally:
+        close_old_connections()
+
+
+def schedule(storage, names, optimize):
+    """Process stored images now (sync mode) or on the worker thread."""
+    if ingest_mode() == INGEST_BACKGROUND:
+        global _executor
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='image-ingest')
+        for name in names:
+            _executor.submit(_process_in_background, storage, name, optimize)
+    else:
+        for name in names:
+            _process_safely(storage, name, optimize)
+
+
+def iter_stored_images():
+    """Distinct ``(storage, name)`` of every image referenced by a row."""
+    seen = set()
+    for model, field_names in IMAGE_FIELDS.items():
+        for field_name in field_names:
+            storage = model._meta.get_field(field_name).storage
+            names = (
+                model._base_manager.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+                .values_list(field_name, flat=True).distinct().iterator()
+            )
+            for name in names:
+                if name not in seen:
+                    seen.add(name)
+                    yield storage, name
@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.uploads import collect_stale_uploads
+
+
+class Command(BaseCommand):
+    help = "Delete resumable uploads (core/uploads.py) untouched for a while, with their partial files."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=settings.PORTAL_UPLOAD_TTL_HOURS,
+                            help="Age after which an upload is stale (default: PORTAL_UPLOAD_TTL_HOURS).")
+
+    def handle(self, *args, **options):
+        deleted = collect_stale_uploads(timezone.now() - timedelta(hours=options['hours']))
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} stale uploads."))
@@ -0,0 +1,54 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
+
+from core.images import delete_thumbnails
+from core.storage import collect_unused_blobs, media_storage, orphan_files, relocate_media
+
+
+class Command(BaseCommand):
+    help = (
+        "Move stored images to content-addressed names so identical photos share one file, "
+        "then rebuild the media blob reference counts. Safe to interrupt and rerun."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--workers', type=int, default=4, help="Threads hashing files.")
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would change.")
+        parser.add_argument('--delete-orphans', action='store_true',
+                            help="Also delete files in the image directories that no row references.")
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        stats = relocate_media(
+            batch_size=options['batch_size'], workers=options['workers'], dry_run=dry_run,
+            progress=lambda stats: self.stdout.write(f"{stats['files']} files checked..."),
+        )
+        verb = "Would free" if dry_run else "Freed"
+        self.stdout.write(
+            f"{stats['files']} referenced files: {stats['renamed']} renamed, {stats['duplicates']} duplicates, "
+            f"{stats['missing']} missing. {verb} {filesizeformat(stats['bytes_freed'])}."
+        )
+
+        orphans = list(orphan_files())
+        orphan_bytes = sum(size for _, size in orphans)
+        if options['delete_orphans'] and not dry_run:
+            for name, _ in orphans:
+                media_storage.delete(name)
+                delete_thumbnails(media_storage, name)
+            self.stdout.write(f"Deleted {len(orphans)} unreferenced files ({filesizeformat(orphan_bytes)}).")
+        elif orphans:
+            self.stdout.write(
+                f"{len(orphans)} unreferenced files ({filesizeformat(orphan_bytes)}); "
+                "rerun with --delete-orphans to remove them."
+            )
+
+        if not dry_run:
+            # Older than any upload that might still be about to save its row.
+            unused = collect_unused_blobs(timezone.now() - timedelta(days=1))
+            if unused:
+                self.stdout.write(f"Deleted {unused} stored blobs nothing referenced.")
+        self.stdout.write(self.style.SUCCESS("Done."))
@@ -0,0 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from core.images import has_thumbnails, iter_stored_images, process_stored_image
+
+BATCH_SIZE = 200
+
+
+class Command(BaseCommand):
+    help = (
+        "Downscale, recompress and thumbnail images stored before the ingest pipeline "
+        "(core/images.py). Images that already have every thumbnail are skipped, so the "
+        "command can be stopped and rerun."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Also reprocess images that have thumbnails.")
+        parser.add_argument('--thumbnails-only', action='store_true', help="Leave the originals untouched.")
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--limit', type=int, help="Stop after this many images.")
+
+    def handle(self, *args, **options):
+        optimize = not options['thumbnails_only']
+        counts = {'processed': 0, 'skipped': 0, 'missing': 0, 'failed': 0}
+        saved = 0
+
+        def process(storage, name):
+            if not storage.exists(name):
+                return 'missing', 0
+            if not options['force'] and has_thumbnails(storage, name):
+                return 'skipped', 0
+            try:
+                return 'processed', process_stored_image(storage, name, optimize=optimize)
+            except Exception as exc:
+                self.stderr.write(f"{name}: {exc}")
+                return 'failed', 0
+
+        images = iter_stored_images()
+        if options['limit']:
+            images = islice(images, options['limit'])
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as executor:
+            # A batch at a time, so the queue stays small on large media trees.
+            while batch := list(islice(images, BATCH_SIZE)):
+                for outcome, saved_bytes in executor.map(lambda image: process(*image), batch):
+                    counts[outcome] += 1
+                    saved += saved_bytes
+                if counts['processed']:
+                    self.stdout.write(f"{counts['processed']} images processed...")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {counts['processed']} images ({filesizeformat(max(saved, 0))} saved); "
+            f"{counts['skipped']} already done, {counts['missing']} missing, {counts['failed']} failed."
+        ))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from core.rollups import rebuild_admission_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute AdmissionDailyRollup rows from the admissions table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help="First day to rebuild (YYYY-MM-DD). Defaults to all history.")
+        parser.add_argument('--until', help="Last day to rebuild (YYYY-MM-DD). Defaults to all history.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        date_start = self._parse(options.get('since'), '--since')
+        date_end = self._parse(options.get('until'), '--until')
+        if date_start and date_end and date_start > date_end:
+            raise CommandError("--since must not be after --until.")
+
+        written = rebuild_admission_rollups(
+            date_start=date_start,
+            date_end=date_end,
+            batch_size=options['batch_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} admission rollup rows."))
+
+    def _parse(self, value, flag):
+        if not value:
+            return None
+        parsed = parse_date(value)
+        if parsed is None:
+            raise CommandError(f"{flag} must be a date in YYYY-MM-DD format.")
+        return parsed
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from core.storage import relocate_media
+
+
+class Command(BaseCommand):
+    help = (
+        "Move stored images from the flat upload directories to the sharded layout "
+        "(<dir>/<year>/<month>/<hash prefix>/<sha256>.<ext>) and repoint their rows, a batch "
+        "at a time, while the site keeps serving them. Safe to interrupt and rerun."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--workers', type=int, default=4, help="Threads hashing files.")
+        parser.add_argument('--pause', type=float, default=0, help="Seconds to sleep between batches.")
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would change.")
+
+    def handle(self, *args, **options):
+        stats = relocate_media(
+            batch_size=options['batch_size'], workers=options['workers'], dry_run=options['dry_run'],
+            pause=options['pause'],
+            progress=lambda stats: self.stdout.write(
+                f"{stats['files']} files checked, {stats['renamed'] + stats['duplicates']} moved..."
+            ),
+        )
+        verb = "Would move" if options['dry_run'] else "Moved"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {stats['renamed'] + stats['duplicates']} of {stats['files']} referenced files "
+            f"({stats['duplicates']} onto an identical file); {stats['missing']} missing."
+        ))
@@ -0,0 +1,194 @@
+"""
+Serving ``MEDIA_URL`` in production.
+
+``django.views.static.serve`` reads every photo through the worker thread
+in Python with no validators worth caching on and no range support, so a
+page of images could hold both gunicorn threads while API calls wait.
+``serve_media``:
+
+* sends a strong ``ETag`` (inode, size and mtime) and ``Last-Modified``,
+  and answers conditional requests with ``304``;
+* marks content-addressed originals (``core.storage``, which never
+  rewrites a stored name) cacheable for ``PORTAL_MEDIA_MAX_AGE`` and
+  ``immutable``; other files, thumbnails included (they are regenerated
+  under the same name), are revalidated against their ETag on each use;
+* honours single ``Range`` requests (and ``If-Range``) with ``206``;
+* hands the open file to ``FileResponse``, so gunicorn can ``sendfile()``
+  it instead of copying it through Python;
+* with ``PORTAL_MEDIA_ACCEL_PREFIX`` set, only returns the headers plus an
+  ``X-Accel-Redirect`` (``PORTAL_MEDIA_ACCEL_HEADER``) and lets the front
+  proxy send the file.
+"""
+from __future__ import annotations
+
+import mimetypes
+import os
+import posixpath
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+from .images import THUMBNAIL_DIR
+
+# Files whose name is the SHA-256 of their content never change.
+CONTENT_ADDRESSED_NAME = re.compile(r'^[0-9a-f]{64}\.[A-Za-z0-9]+$')
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class _RangeFile:
+    """
+    Read at most ``length`` bytes of ``file`` from ``offset`` on.
+
+    ``fileno`` is passed through: gunicorn's ``sendfile`` starts at the
+    current offset and stops at ``Content-Length``.
+    """
+
+    def __init__(self, file, offset, length):
+        file.seek(offset)
+        self._file = file
+        self._remaining = length
+
+    def read(self, size=-1):
+        if self._remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def close(self):
+        self._file.close()
+
+
+def _resolve(path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except (SuspiciousFileOperation, ValueError):
+        raise Http404("Not found.")
+    # Scratch files of uploads and rewrites in progress start with a dot.
+    if any(part.startswith('.') for part in posixpath.normpath(path).split('/')):
+        raise Http404("Not found.")
+    try:
+        file_stat = os.stat(full_path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404("Not found.")
+    if not stat.S_ISREG(file_stat.st_mode):
+        raise Http404("Not found.")
+    return full_path, file_stat
+
+
+def media_etag(file_stat):
+    return f'"{file_stat.st_ino:x}-{file_stat.st_size:x}-{file_stat.st_mtime_ns:x}"'
+
+
+def cache_control(path):
+    path = path.lstrip('/')
+    # Thumbnails are named after their original, not their own content.
+    if not path.startswith(THUMBNAIL_DIR + '/') and CONTENT_ADDRESSED_NAME.match(posixpath.basename(path)):
+        return f'private, max-age={settings.PORTAL_MEDIA_MAX_AGE}, immutable'
+    return 'private, no-cache'
+
+
+def parse_range(header, size):
+    """
+    ``(start, end)`` (inclusive) of a single-range ``Range`` header.
+
+    ``None`` means serve the whole file (no, malformed or multi-range
+    header); ``ValueError`` means the range cannot be satisfied.
+    """
+    match = _RANGE.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        # Suffix range: the last N bytes.
+        length = int(last)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or (last and int(last) < start):
+        raise ValueError(header)
+    return start, end
+
+
+def _if_range_matches(request, etag, mtime):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    since = parse_http_date_safe(if_range)
+    return since is not None and int(mtime) <= since
+
+
+@require_safe
+def serve_media(request, path):
+    full_path, file_stat = _resolve(path)
+    etag = media_etag(file_stat)
+    last_modified = int(file_stat.st_mtime)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        if isinstance(response, HttpResponseNotModified):
+            response.headers['ETag'] = etag
+            response.headers['Cache-Control'] = cache_control(path)
+        return response
+
+    size = file_stat.st_size
+    byte_range = None
+    if request.headers.get('Range') and _if_range_matches(request, etag, file_stat.st_mtime):
+        try:
+            byte_range = parse_range(request.headers['Range'], size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response.headers['Content-Range'] = f'bytes */{size}'
+            return response
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    accel_prefix = settings.PORTAL_MEDIA_ACCEL_PREFIX
+    if accel_prefix:
+        # The proxy serves the body and handles Range itself.
+        response = HttpResponse(content_type=content_type or 'application/octet-stream')
+        header = settings.PORTAL_MEDIA_ACCEL_HEADER
+        # X-Accel-Redirect takes a URI, X-Sendfile a filesystem path.
+        location = quote(path) if header.lower() == 'x-accel-redirect' else path
+        response.headers[header] = accel_prefix.rstrip('/') + '/' + location
+    elif request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type or 'application/octet-stream')
+        response.headers['Content-Length'] = str(size)
+    else:
+        source = open(full_path, 'rb')
+        if byte_range is not None:
+            start, end = byte_range
+            response = FileResponse(
+                _RangeFile(source, start, end - start + 1),
+                content_type=content_type or 'application/octet-stream', status=206,
+            )
+            response.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response.headers['Content-Length'] = str(end - start + 1)
+        else:
+            response = FileResponse(source, content_type=content_type or 'application/octet-stream')
+            response.headers['Content-Length'] = str(size)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(last_modified)
+    response.headers['Cache-Control'] = cache_control(path)
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
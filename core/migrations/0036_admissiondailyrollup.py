@@ -0,0 +1,101 @@
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+
+CHARGE_FIELDS = (
+    'bed_charges',
+    'nursing_charges',
+    'doctor_consultation_charges',
+    'investigation_charges',
+    'procedural_surgical_charges',
+    'anaesthesia_charges',
+    'surgeon_charges',
+    'other_charges',
+)
+
+
+def build_rollups(apps, schema_editor):
+    Admission = apps.get_model('core', 'Admission')
+    AdmissionDailyRollup = apps.get_model('core', 'AdmissionDailyRollup')
+
+    revenue = None
+    for field in CHARGE_FIELDS:
+        revenue = F(field) if revenue is None else revenue + F(field)
+
+    grouped = (
+        Admission.objects.annotate(day=TruncDate('created_at'))
+        .values(
+            'day',
+            'referred_by_doctor_id',
+            'referred_by_doctor__address_details__area_id',
+            'patient_referral__agent_id',
+            'payment_category_id',
+            'admission_type',
+        )
+        .annotate(
+            patient_count=Count('id'),
+            opd_count=Count('id', filter=Q(admission_type='OPD')),
+            ipd_count=Count('id', filter=Q(admission_type='IPD')),
+            total_revenue=Sum(revenue),
+            total_commission=Sum('commission_amount'),
+        )
+        .order_by()
+    )
+    AdmissionDailyRollup.objects.bulk_create(
+        [
+            AdmissionDailyRollup(
+                date=row['day'],
+                referred_by_doctor_id=row['referred_by_doctor_id'],
+                area_id=row['referred_by_doctor__address_details__area_id'],
+                agent_id=row['patient_referral__agent_id'],
+                payment_category_id=row['payment_category_id'],
+                admission_type=row['admission_type'],
+                patient_count=row['patient_count'],
+                opd_count=row['opd_count'],
+                ipd_count=row['ipd_count'],
+                total_revenue=row['total_revenue'] or 0,
+                total_commission=row['total_commission'] or 0,
+            )
+            for row in grouped
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0035_clientlog'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='admission',
+            index=models.Index(fields=['created_at'], name='admission_created_at_idx'),
+        ),
+        migrations.CreateModel(
+            name='AdmissionDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('admission_type', models.CharField(choices=[('OPD', 'Out-Patient Department (OPD)'), ('IPD', 'In-Patient Department (IPD)')], max_length=10)),
+                ('patient_count', models.IntegerField(default=0)),
+                ('opd_count', models.IntegerField(default=0)),
+                ('ipd_count', models.IntegerField(default=0)),
+                ('total_revenue', models.DecimalField(decimal_places=2, default=0.0, max_digits=14)),
+                ('total_commission', models.DecimalField(decimal_places=2, default=0.0, max_digits=14)),
+                ('agent', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='admission_rollups', to=settings.AUTH_USER_MODEL)),
+                ('area', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='admission_rollups', to='core.area')),
+                ('payment_category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='admission_rollups', to='core.paymentcategory')),
+                ('referred_by_doctor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='admission_rollups', to='core.doctorreferral')),
+            ],
+            options={
+                'ordering': ['-date'],
+                'indexes': [models.Index(fields=['date', 'referred_by_doctor', 'area', 'agent', 'payment_category', 'admission_type'], name='adm_rollup_bucket_idx')],
+            },
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0036_admissiondailyrollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['start_time'], name='trip_start_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patientreferral',
+            index=models.Index(fields=['reported_on'], name='patientref_reported_on_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='admission',
+            index=models.Index(fields=['admission_date'], name='admission_date_idx'),
+        ),
+    ]
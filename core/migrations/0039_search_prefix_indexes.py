@@ -0,0 +1,39 @@
+from django.db import migrations
+
+# Prefix searches from the portal autocomplete endpoints compile to
+# ``UPPER(col) LIKE UPPER('term%')``. PostgreSQL only uses an index for that
+# with a pattern opclass, which the model Index API cannot express on an
+# expression, so these are created by hand and skipped on other databases.
+INDEXES = [
+    ('doctor_name_upper_like_idx',
+     'core_doctorreferral (UPPER(name) varchar_pattern_ops)'),
+    ('patientref_pending_name_like_idx',
+     "core_patientreferral (UPPER(patient_name) varchar_pattern_ops) WHERE status = 'Pending'"),
+    ('patientref_pending_phone_like_idx',
+     "core_patientreferral (phone varchar_pattern_ops) WHERE status = 'Pending'"),
+]
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, definition in INDEXES:
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {definition}')
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0038_dataversion'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,23 @@
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0040_trip_status_start_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='doctorreferral',
+            index=models.Index(
+                django.db.models.functions.text.Lower(django.db.models.functions.text.Trim('name')),
+                name='doctor_canonical_name_idx',
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='doctorvisit',
+            index=models.Index(fields=['doctor', '-created_at'], name='doctorvisit_doctor_created_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0042_soft_delete'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('sha256', models.CharField(db_index=True, max_length=64)),
+                ('size', models.BigIntegerField(default=0)),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='trip',
+            name='odometer_start_image',
+            field=models.ImageField(blank=True, null=True, storage=core.storage.ContentAddressedStorage(), upload_to='trip_odometers/'),
+        ),
+        migrations.AlterField(
+            model_name='trip',
+            name='odometer_end_image',
+            field=models.ImageField(blank=True, null=True, storage=core.storage.ContentAddressedStorage(), upload_to='trip_odometers/'),
+        ),
+        migrations.AlterField(
+            model_name='doctorreferral',
+            name='visit_image',
+            field=models.ImageField(blank=True, null=True, storage=core.storage.ContentAddressedStorage(), upload_to='doctor_visits/'),
+        ),
+        migrations.AlterField(
+            model_name='doctorvisit',
+            name='visit_image',
+            field=models.ImageField(blank=True, null=True, storage=core.storage.ContentAddressedStorage(), upload_to='doctor_visits/'),
+        ),
+        migrations.AlterField(
+            model_name='overnightstay',
+            name='bill_image',
+            field=models.ImageField(blank=True, null=True, storage=core.storage.ContentAddressedStorage(), upload_to='hotel_bills/'),
+        ),
+    ]
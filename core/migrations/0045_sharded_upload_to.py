@@ -0,0 +1,37 @@
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0044_chunkedupload'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='trip',
+            name='odometer_start_image',
+            field=models.ImageField(blank=True, null=True, storage=core.storage.ContentAddressedStorage(), upload_to=core.storage.ShardedUploadTo('trip_odometers')),
+        ),
+        migrations.AlterField(
+            model_name='trip',
+            name='odometer_end_image',
+            field=models.ImageField(blank=True, null=True, storage=core.storage.ContentAddressedStorage(), upload_to=core.storage.ShardedUploadTo('trip_odometers')),
+        ),
+        migrations.AlterField(
+            model_name='doctorreferral',
+            name='visit_image',
+            field=models.ImageField(blank=True, null=True, storage=core.storage.ContentAddressedStorage(), upload_to=core.storage.ShardedUploadTo('doctor_visits')),
+        ),
+        migrations.AlterField(
+            model_name='doctorvisit',
+            name='visit_image',
+            field=models.ImageField(blank=True, null=True, storage=core.storage.ContentAddressedStorage(), upload_to=core.storage.ShardedUploadTo('doctor_visits')),
+        ),
+        migrations.AlterField(
+            model_name='overnightstay',
+            name='bill_image',
+            field=models.ImageField(blank=True, null=True, storage=core.storage.ContentAddressedStorage(), upload_to=core.storage.ShardedUploadTo('hotel_bills')),
+        ),
+    ]
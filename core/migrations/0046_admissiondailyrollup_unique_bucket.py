@@ -0,0 +1,51 @@
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+BUCKET_FIELDS = ('date', 'referred_by_doctor_id', 'area_id', 'agent_id', 'payment_category_id', 'admission_type')
+MEASURE_FIELDS = ('patient_count', 'opd_count', 'ipd_count', 'total_revenue', 'total_commission')
+
+
+def merge_duplicate_buckets(apps, schema_editor):
+    """Fold rows sharing a bucket into the oldest one before it becomes unique."""
+    AdmissionDailyRollup = apps.get_model('core', 'AdmissionDailyRollup')
+    kept = {}
+    duplicates = []
+    for row in AdmissionDailyRollup.objects.order_by('pk').iterator(chunk_size=2000):
+        key = tuple(getattr(row, field) for field in BUCKET_FIELDS)
+        first = kept.get(key)
+        if first is None:
+            kept[key] = row
+            continue
+        for field in MEASURE_FIELDS:
+            setattr(first, field, getattr(first, field) + getattr(row, field))
+        first.merged = True
+        duplicates.append(row.pk)
+    if not duplicates:
+        return
+    merged = [row for row in kept.values() if getattr(row, 'merged', False)]
+    AdmissionDailyRollup.objects.bulk_update(merged, MEASURE_FIELDS, batch_size=1000)
+    for start in range(0, len(duplicates), 1000):
+        AdmissionDailyRollup.objects.filter(pk__in=duplicates[start:start + 1000]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0045_sharded_upload_to'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_buckets, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='admissiondailyrollup',
+            constraint=models.UniqueConstraint(
+                models.F('date'),
+                django.db.models.functions.comparison.Coalesce('referred_by_doctor', models.Value(0)),
+                django.db.models.functions.comparison.Coalesce('area', models.Value(0)),
+                django.db.models.functions.comparison.Coalesce('agent', models.Value(0)),
+                django.db.models.functions.comparison.Coalesce('payment_category', models.Value(0)),
+                models.F('admission_type'),
+                name='adm_rollup_bucket_unique',
+            ),
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations
+
+# The portal list tables search by prefix (``portal.datatables``), which
+# compiles to ``UPPER(col) LIKE UPPER('term%')``. As in 0039, PostgreSQL
+# needs a pattern opclass on the expression to use an index for it.
+INDEXES = [
+    ('admission_name_upper_like_idx',
+     'core_admission (UPPER(patient_name) varchar_pattern_ops)'),
+    ('admission_phone_upper_like_idx',
+     'core_admission (UPPER(patient_phone) varchar_pattern_ops)'),
+    ('patientref_name_upper_like_idx',
+     'core_patientreferral (UPPER(patient_name) varchar_pattern_ops)'),
+    ('patientref_phone_upper_like_idx',
+     'core_patientreferral (UPPER(phone) varchar_pattern_ops)'),
+]
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, definition in INDEXES:
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {definition}')
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0046_admissiondailyrollup_unique_bucket'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
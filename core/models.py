@@ -1,6 +1,11 @@
+import uuid
+
 from django.db import models
+from django.db.models.functions import Coalesce, Lower, Trim
 from django.contrib.auth.models import AbstractUser
 
+from .storage import ShardedUploadTo, media_storage
+
 class User(AbstractUser):
     ROLE_CHOICES = (
         ('advisor', 'Advisor (Executive)'),
@@ -8,6 +13,8 @@ class User(AbstractUser):
         ('admin', 'Admin'),
     )
     role = models.CharField(max_length=20, choices=ROLE_CHOICES, default='advisor')
+    # Set when a deletion is queued; the row is purged by a background job.
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
     
     @property
     def full_name_or_username(self):
@@ -44,10 +51,11 @@ class Trip(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='ONGOING')
     
     # Expense / Travel Details
-    odometer_start_image = models.ImageField(upload_to='trip_odometers/', null=True, blank=True)
-    odometer_end_image = models.ImageField(upload_to='trip_odometers/', null=True, blank=True)
+    odometer_start_image = models.ImageField(upload_to=ShardedUploadTo('trip_odometers'), storage=media_storage, null=True, blank=True)
+    odometer_end_image = models.ImageField(upload_to=ShardedUploadTo('trip_odometers'), storage=media_storage, null=True, blank=True)
     total_kilometers = models.FloatField(default=0.0)
     additional_expenses = models.TextField(null=True, blank=True)
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
     
     # Location Tracking
     start_lat = models.DecimalField(max_digits=20, decimal_places=15, null=True, blank=True)
@@ -57,6 +65,10 @@ class Trip(models.Model):
 
     class Meta:
         ordering = ['-start_time']
+        indexes = [
+            models.Index(fields=['start_time'], name='trip_start_time_idx'),
+            models.Index(fields=['status', '-start_time'], name='trip_status_start_idx'),
+        ]
 
     def __str__(self):
         return f"Trip by {self.agent.username} on {self.start_time.date()}"
@@ -113,6 +125,7 @@ class Area(models.Model):
     agent = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, 
                             related_name='assigned_areas', limit_choices_to={'role': 'advisor'})
     created_at = models.DateTimeField(auto_now_add=True)
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     class Meta:
         ordering = ['city', 'name']
@@ -198,12 +211,15 @@ class DoctorReferral(models.Model):
         ('Internal', 'Internal'),
     )
     status = models.CharField(max_length=50, choices=DOCTOR_STATUS_CHOICES, default='Assigned')
-    visit_image = models.ImageField(upload_to='doctor_visits/', null=True, blank=True)
+    visit_image = models.ImageField(upload_to=ShardedUploadTo('doctor_visits'), storage=media_storage, null=True, blank=True)
     visit_lat = models.DecimalField(max_digits=20, decimal_places=15, null=True, blank=True)
     visit_long = models.DecimalField(max_digits=20, decimal_places=15, null=True, blank=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(Lower(Trim('name')), name='doctor_canonical_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -229,7 +245,7 @@ class DoctorVisit(models.Model):
         choices=DoctorReferral.DOCTOR_STATUS_CHOICES,
         default='Referred',
     )
-    visit_image = models.ImageField(upload_to='doctor_visits/', null=True, blank=True)
+    visit_image = models.ImageField(upload_to=ShardedUploadTo('doctor_visits'), storage=media_storage, null=True, blank=True)
     visit_lat = models.DecimalField(max_digits=20, decimal_places=15, null=True, blank=True)
     visit_long = models.DecimalField(max_digits=20, decimal_places=15, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -238,6 +254,9 @@ class DoctorVisit(models.Model):
     class Meta:
         ordering = ['-created_at']
         unique_together = ('doctor', 'trip')
+        indexes = [
+            models.Index(fields=['doctor', '-created_at'], name='doctorvisit_doctor_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.doctor.name} visit on trip {self.trip_id}"
@@ -309,7 +328,7 @@ class OvernightStay(models.Model):
     trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='overnight_stays')
     hotel_name = models.CharField(max_length=100)
     hotel_address = models.TextField()
-    bill_image = models.ImageField(upload_to='hotel_bills/', null=True, blank=True)
+    bill_image = models.ImageField(upload_to=ShardedUploadTo('hotel_bills'), storage=media_storage, null=True, blank=True)
     latitude = models.DecimalField(max_digits=20, decimal_places=15, null=True, blank=True)
     longitude = models.DecimalField(max_digits=20, decimal_places=15, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -339,6 +358,9 @@ class PatientReferral(models.Model):
 
     class Meta:
         ordering = ['-reported_on']
+        indexes = [
+            models.Index(fields=['reported_on'], name='patientref_reported_on_idx'),
+        ]
 
     def __str__(self):
         return self.patient_name
@@ -427,6 +449,10 @@ class Admission(models.Model):
     
     class Meta:
         ordering = ['-admission_date']
+        indexes = [
+            models.Index(fields=['created_at'], name='admission_created_at_idx'),
+            models.Index(fields=['admission_date'], name='admission_date_idx'),
+        ]
     
     @property
     def total_charges(self):
@@ -450,3 +476,131 @@ class Admission(models.Model):
     def __str__(self):
         return f"{self.patient_name} - {self.admission_type} ({self.admission_date.date()})"
 
+
+
+class AdmissionDailyRollup(models.Model):
+    """Pre-aggregated admission totals per day and reporting dimension.
+
+    Maintained incrementally by the Admission save/delete signals and fully
+    rebuildable with ``manage.py rebuild_admission_rollups``. There is one
+    row per bucket; the unique constraint treats empty dimensions as equal,
+    so concurrent first writes to a bucket cannot both insert.
+    """
+    date = models.DateField()
+    referred_by_doctor = models.ForeignKey(
+        DoctorReferral,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='admission_rollups',
+    )
+    area = models.ForeignKey(Area, on_delete=models.SET_NULL, null=True, blank=True, related_name='admission_rollups')
+    agent = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='admission_rollups')
+    payment_category = models.ForeignKey(
+        PaymentCategory,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='admission_rollups',
+    )
+    admission_type = models.CharField(max_length=10, choices=Admission.ADMISSION_TYPE_CHOICES)
+
+    patient_count = models.IntegerField(default=0)
+    opd_count = models.IntegerField(default=0)
+    ipd_count = models.IntegerField(default=0)
+    total_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0.00)
+    total_commission = models.DecimalField(max_digits=14, decimal_places=2, default=0.00)
+
+    class Meta:
+        ordering = ['-date']
+        indexes = [
+            models.Index(
+                fields=['date', 'referred_by_doctor', 'area', 'agent', 'payment_category', 'admission_type'],
+                name='adm_rollup_bucket_idx',
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                'date',
+                Coalesce('referred_by_doctor', models.Value(0)),
+                Coalesce('area', models.Value(0)),
+                Coalesce('agent', models.Value(0)),
+                Coalesce('payment_category', models.Value(0)),
+                'admission_type',
+                name='adm_rollup_bucket_unique',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.patient_count} admissions"
+
+
+class DataVersion(models.Model):
+    """
+    Monotonic change counter for a family of tables.
+
+    Signal handlers bump a key whenever one of its source tables changes, so
+    derived artefacts (cached report PDFs etc.) can embed the version in
+    their cache key instead of being invalidated explicitly.
+    """
+    key = models.CharField(max_length=50, unique=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.key} v{self.version}"
+
+
+class MediaBlob(models.Model):
+    """
+    One file of ``core.storage.ContentAddressedStorage``.
+
+    ``refcount`` is the number of image fields pointing at ``name``; the file
+    is deleted when it drops to zero.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.BigIntegerField(default=0)
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount})"
+
+
+class ChunkedUpload(models.Model):
+    """
+    A resumable image upload (``core.uploads``).
+
+    Chunks are appended to a partial file until ``offset`` reaches ``size``;
+    once finalized the upload can be attached to a trip, visit or overnight
+    stay by its id. ``stored_name`` is the media file it became, so a
+    retried request can attach it again.
+    """
+    STATUS_UPLOADING = 'UPLOADING'
+    STATUS_COMPLETE = 'COMPLETE'
+    STATUS_ATTACHED = 'ATTACHED'
+    STATUS_CHOICES = (
+        (STATUS_UPLOADING, 'Uploading'),
+        (STATUS_COMPLETE, 'Complete'),
+        (STATUS_ATTACHED, 'Attached'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chunked_uploads')
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64, blank=True, help_text='Checksum of the whole file, checked on finalize')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_UPLOADING)
+    stored_name = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at'], name='chunked_upload_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size})"
@@ -0,0 +1,222 @@
+"""
+Incremental maintenance of AdmissionDailyRollup rows.
+
+Every admission contributes to exactly one rollup bucket:
+(created_at local date, referring doctor, doctor's area, referral agent,
+payment category, admission type). Saves subtract the previous contribution
+and add the new one, deletes subtract it, and ``rebuild_admission_rollups``
+recomputes buckets from scratch. The area and agent come through the doctor
+and the patient referral, so changes there re-bucket the affected rollups
+too (``sync_doctor_areas``, ``rebucket_admissions``).
+"""
+from __future__ import annotations
+
+import datetime
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .dataversion import REPORTS, bump_data_version
+from .models import Admission, AdmissionDailyRollup, DoctorReferral
+
+CHARGE_FIELDS = (
+    'bed_charges',
+    'nursing_charges',
+    'doctor_consultation_charges',
+    'investigation_charges',
+    'procedural_surgical_charges',
+    'anaesthesia_charges',
+    'surgeon_charges',
+    'other_charges',
+)
+
+# Admission lookups that define a rollup bucket, mapped to rollup columns.
+BUCKET_LOOKUPS = {
+    'referred_by_doctor_id': 'referred_by_doctor_id',
+    'area_id': 'referred_by_doctor__address_details__area_id',
+    'agent_id': 'patient_referral__agent_id',
+    'payment_category_id': 'payment_category_id',
+    'admission_type': 'admission_type',
+}
+
+MEASURE_FIELDS = ('patient_count', 'opd_count', 'ipd_count', 'total_revenue', 'total_commission')
+
+
+def revenue_expression(prefix=''):
+    """Sum of all charge columns, optionally through a relation prefix."""
+    expression = None
+    for field in CHARGE_FIELDS:
+        term = F(f'{prefix}{field}')
+        expression = term if expression is None else expression + term
+    return expression
+
+
+def date_range_q(field, date_start=None, date_end=None):
+    """
+    Index-friendly inclusive date filter on a DateTimeField.
+
+    ``field__date`` lookups wrap the column in a cast; comparing against the
+    local-midnight bounds keeps the plain column usable by an index.
+    """
+    q = Q()
+    if date_start:
+        q &= Q(**{f'{field}__gte': _local_midnight(date_start)})
+    if date_end:
+        q &= Q(**{f'{field}__lt': _local_midnight(date_end + datetime.timedelta(days=1))})
+    return q
+
+
+def _local_midnight(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def _snapshots(admissions):
+    return admissions.values('pk', 'created_at', 'commission_amount', *CHARGE_FIELDS, **{
+        f'bucket_{name}': F(lookup) for name, lookup in BUCKET_LOOKUPS.items()
+    })
+
+
+def snapshot_admission(pk):
+    """Return the bucket key and measures of an admission as stored in the DB."""
+    if pk is None:
+        return None
+    return _snapshots(Admission.objects.filter(pk=pk)).first()
+
+
+def snapshot_admissions(admissions):
+    """``snapshot_admission`` for every admission of a queryset."""
+    return list(_snapshots(admissions))
+
+
+def rebucket_admissions(snapshots):
+    """
+    Move admissions whose bucket changed since ``snapshots`` were taken.
+
+    For changes made outside the admission row, e.g. a patient referral
+    getting another agent; admissions deleted meanwhile are left alone.
+    """
+    if not snapshots:
+        return
+    current = {
+        snapshot['pk']: snapshot
+        for snapshot in snapshot_admissions(Admission.objects.filter(pk__in=[s['pk'] for s in snapshots]))
+    }
+    with transaction.atomic():
+        for before in snapshots:
+            after = current.get(before['pk'])
+            if after is not None and after != before:
+                apply_snapshot(before, -1)
+                apply_snapshot(after, 1)
+    bump_data_version(REPORTS)
+
+
+def sync_doctor_areas(doctor_ids):
+    """
+    Point the rollups of ``doctor_ids`` at each doctor's current area.
+
+    A doctor's rollups all share the doctor's area, so moving the doctor
+    (or their address) to another area is a single update per doctor
+    rather than a re-bucket of each admission.
+    """
+    areas = dict(
+        DoctorReferral.objects.filter(pk__in=doctor_ids).values_list('pk', 'address_details__area_id')
+    )
+    changed = 0
+    for doctor_id in doctor_ids:
+        area_id = areas.get(doctor_id)
+        rollups = AdmissionDailyRollup.objects.filter(referred_by_doctor_id=doctor_id)
+        if area_id is None:
+            rollups = rollups.filter(area_id__isnull=False)
+        else:
+            rollups = rollups.exclude(area_id=area_id)
+        changed += rollups.update(area_id=area_id)
+    if changed:
+        bump_data_version(REPORTS)
+    return changed
+
+
+def apply_snapshot(snapshot, sign):
+    """Add (sign=1) or remove (sign=-1) one admission's contribution."""
+    if snapshot is None or snapshot.get('created_at') is None:
+        return
+
+    key = {'date': timezone.localdate(snapshot['created_at'])}
+    for name in BUCKET_LOOKUPS:
+        key[name] = snapshot[f'bucket_{name}']
+
+    revenue = sum((snapshot[field] or Decimal('0') for field in CHARGE_FIELDS), Decimal('0'))
+    admission_type = snapshot['bucket_admission_type']
+    deltas = {
+        'patient_count': sign,
+        'opd_count': sign if admission_type == 'OPD' else 0,
+        'ipd_count': sign if admission_type == 'IPD' else 0,
+        'total_revenue': revenue * sign,
+        'total_commission': (snapshot['commission_amount'] or Decimal('0')) * sign,
+    }
+
+    rollup = AdmissionDailyRollup.objects.filter(**key)
+    increments = {field: F(field) + value for field, value in deltas.items()}
+    if not rollup.update(**increments):
+        # Nothing to subtract from: rollups were never built for this bucket.
+        if sign < 0:
+            return
+        try:
+            with transaction.atomic():
+                AdmissionDailyRollup.objects.create(**key, **deltas)
+        except IntegrityError:
+            # Another admission created the bucket meanwhile; add to that row.
+            rollup.update(**increments)
+    if sign < 0:
+        rollup.filter(patient_count__lte=0).delete()
+
+
+def rebuild_admission_rollups(date_start=None, date_end=None, batch_size=1000):
+    """
+    Recompute rollups from the admissions table.
+
+    When a date range is given only that range is replaced. Returns the number
+    of rollup rows written.
+    """
+    admissions = Admission.objects.filter(date_range_q('created_at', date_start, date_end))
+    rollups = AdmissionDailyRollup.objects.all()
+    if date_start:
+        rollups = rollups.filter(date__gte=date_start)
+    if date_end:
+        rollups = rollups.filter(date__lte=date_end)
+
+    grouped = (
+        admissions.annotate(day=TruncDate('created_at'))
+        .values('day', *BUCKET_LOOKUPS.values())
+        .annotate(
+            patient_count=Count('id'),
+            opd_count=Count('id', filter=Q(admission_type='OPD')),
+            ipd_count=Count('id', filter=Q(admission_type='IPD')),
+            total_revenue=Sum(revenue_expression()),
+            total_commission=Sum('commission_amount'),
+        )
+        .order_by()
+    )
+
+    written = 0
+    with transaction.atomic():
+        rollups.delete()
+        batch = []
+        for row in grouped.iterator(chunk_size=batch_size):
+            values = {'date': row['day']}
+            for name, lookup in BUCKET_LOOKUPS.items():
+                values[name] = row[lookup]
+            for field in MEASURE_FIELDS:
+                values[field] = row[field] or 0
+            batch.append(AdmissionDailyRollup(**values))
+            if len(batch) >= batch_size:
+                AdmissionDailyRollup.objects.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        if batch:
+            AdmissionDailyRollup.objects.bulk_create(batch)
+            written += len(batch)
+        bump_data_version(REPORTS)
+    return written
@@ -1,5 +1,9 @@
+import posixpath
+import re
+
+from django.conf import settings
 from rest_framework import serializers
-from .models import User, Task, DoctorReferral, DoctorVisit, PatientReferral, Trip, OvernightStay, Specialization, Qualification, Area, Address, ClientLog
+from .models import User, Task, DoctorReferral, DoctorVisit, PatientReferral, Trip, OvernightStay, Specialization, Qualification, Area, Address, ClientLog, ChunkedUpload
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -60,7 +64,7 @@ class AreaSerializer(serializers.ModelSerializer):
 class AddressSerializer(serializers.ModelSerializer):
     area_details = AreaSerializer(source='area', read_only=True)
     area = serializers.PrimaryKeyRelatedField(
-        queryset=Area.objects.all(), write_only=True, required=False
+        queryset=Area.objects.filter(deleted_at__isnull=True), write_only=True, required=False
     )
     class Meta:
         model = Address
@@ -252,3 +256,30 @@ class PatientReferralSerializer(serializers.ModelSerializer):
         if key in mapping:
             return mapping[key]
         return value
+
+
+class ChunkedUploadSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ChunkedUpload
+        fields = ['id', 'filename', 'size', 'offset', 'sha256', 'status', 'created_at', 'updated_at']
+        read_only_fields = ['offset', 'status', 'created_at', 'updated_at']
+
+    def validate_filename(self, value):
+        # Only the name; the image field picks the directory.
+        name = posixpath.basename(value.replace('\\', '/')).strip()
+        if not name or name.startswith('.'):
+            raise serializers.ValidationError('Invalid file name.')
+        return name
+
+    def validate_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError('Size must be positive.')
+        if value > settings.PORTAL_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(f'Uploads are limited to {settings.PORTAL_UPLOAD_MAX_SIZE} bytes.')
+        return value
+
+    def validate_sha256(self, value):
+        value = value.strip().lower()
+        if value and not re.fullmatch(r'[0-9a-f]{64}', value):
+            raise serializers.ValidationError('Expected a hex SHA-256 digest.')
+        return value
@@ -1,6 +1,15 @@
-from django.db.models.signals import post_delete, post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete, pre_save
 from django.dispatch import receiver
-from .models import AgentAssignment, Area
+from .dataversion import COMMISSION_PROFILES, REPORTS, bump_data_version
+from . import images, storage as blob_storage
+from .models import (
+    Address, AgentAssignment, Area, Admission, AdmissionDailyRollup, DoctorCommissionProfile, DoctorReferral, DoctorVisit, OvernightStay,
+    PatientReferral, Trip,
+)
+from .rollups import (
+    apply_snapshot, rebucket_admissions, snapshot_admission, snapshot_admissions, sync_doctor_areas,
+)
 
 
 @receiver(post_delete, sender=AgentAssignment)
@@ -26,3 +35,264 @@ def set_area_agent_on_assignment_create(sender, instance, created, **kwargs):
         area = instance.area
         area.agent = instance.agent
         area.save(update_fields=['agent'])
+
+
+@receiver(pre_save, sender=Admission)
+def capture_admission_rollup_snapshot(sender, instance, raw=False, **kwargs):
+    """Remember the stored bucket of an admission before it is overwritten."""
+    if raw:
+        # Fixture loads skip incremental upkeep; run rebuild_admission_rollups afterwards.
+        return
+    instance._rollup_snapshot = snapshot_admission(instance.pk)
+
+
+@receiver(post_save, sender=Admission)
+def update_admission_rollups_on_save(sender, instance, raw=False, **kwargs):
+    """Move the admission's contribution from its old rollup bucket to the new one."""
+    if raw:
+        return
+    with transaction.atomic():
+        apply_snapshot(getattr(instance, '_rollup_snapshot', None), -1)
+        apply_snapshot(snapshot_admission(instance.pk), 1)
+        bump_data_version(REPORTS)
+    instance._rollup_snapshot = None
+
+
+@receiver(pre_delete, sender=Admission)
+def capture_admission_rollup_snapshot_on_delete(sender, instance, **kwargs):
+    instance._rollup_snapshot = snapshot_admission(instance.pk)
+
+
+@receiver(post_delete, sender=Admission)
+def update_admission_rollups_on_delete(sender, instance, **kwargs):
+    """Remove a deleted admission's contribution from its rollup bucket."""
+    apply_snapshot(getattr(instance, '_rollup_snapshot', None), -1)
+    bump_data_version(REPORTS)
+    instance._rollup_snapshot = None
+
+
+@receiver(post_save, sender=Address)
+def sync_rollup_area_on_address_save(sender, instance, raw=False, **kwargs):
+    """An address moved to another area moves its doctor's rollups with it."""
+    if raw:
+        return
+    sync_doctor_areas(list(DoctorReferral.objects.filter(address_details=instance).values_list('pk', flat=True)))
+
+
+@receiver(pre_delete, sender=Address)
+def capture_address_doctors_on_delete(sender, instance, **kwargs):
+    instance._rollup_doctor_ids = list(
+        DoctorReferral.objects.filter(address_details=instance).values_list('pk', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Address)
+def sync_rollup_area_on_address_delete(sender, instance, **kwargs):
+    """The doctors of a deleted address no longer have an area."""
+    sync_doctor_areas(getattr(instance, '_rollup_doctor_ids', []))
+    instance._rollup_doctor_ids = []
+
+
+@receiver(post_save, sender=DoctorReferral)
+def sync_rollup_area_on_doctor_save(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """Re-bucket a doctor's rollups when the doctor gets another address."""
+    if raw or created or (update_fields is not None and 'address_details' not in update_fields):
+        return
+    sync_doctor_areas([instance.pk])
+
+
+@receiver(pre_delete, sender=DoctorReferral)
+def clear_rollup_area_on_doctor_delete(sender, instance, **kwargs):
+    # Admissions and rollups both lose the doctor (SET_NULL), and with it the area.
+    AdmissionDailyRollup.objects.filter(referred_by_doctor_id=instance.pk).update(area_id=None)
+
+
+@receiver(pre_save, sender=PatientReferral)
+def capture_referral_rollup_snapshots(sender, instance, raw=False, **kwargs):
+    """Remember the buckets of the referral's admissions when its agent changes."""
+    instance._rollup_snapshots = []
+    if raw or instance.pk is None:
+        return
+    stored_agent = PatientReferral.objects.filter(pk=instance.pk).values_list('agent_id', flat=True).first()
+    if stored_agent != instance.agent_id:
+        instance._rollup_snapshots = snapshot_admissions(instance.admissions.all())
+
+
+@receiver(pre_delete, sender=PatientReferral)
+def capture_referral_rollup_snapshots_on_delete(sender, instance, **kwargs):
+    instance._rollup_snapshots = snapshot_admissions(instance.admissions.all())
+
+
+@receiver(post_save, sender=PatientReferral)
+@receiver(post_delete, sender=PatientReferral)
+def rebucket_referral_admissions(sender, instance, **kwargs):
+    """Move the referral's admissions to the buckets of its new agent (or none)."""
+    rebucket_admissions(getattr(instance, '_rollup_snapshots', []))
+    instance._rollup_snapshots = []
+
+
+# Fields of the report source rows that the dashboard shows. Saves that
+# change none of them (status updates, photos, GPS points) leave the
+# ``reports`` data version alone, so they don't all queue on its row.
+REPORT_FIELDS = {
+    Trip: ('agent', 'start_time', 'total_kilometers', 'deleted_at'),
+    DoctorVisit: ('trip', 'doctor'),
+    PatientReferral: ('agent', 'referred_by_doctor', 'reported_on'),
+    DoctorReferral: ('name', 'specialization', 'address_details'),
+}
+
+
+@receiver(pre_save, sender=Trip)
+@receiver(pre_save, sender=DoctorVisit)
+@receiver(pre_save, sender=PatientReferral)
+@receiver(pre_save, sender=DoctorReferral)
+def capture_report_fields(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Note whether the save changes a field the reports show."""
+    names = REPORT_FIELDS[sender]
+    instance._report_fields_changed = True
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and not set(update_fields) & set(names):
+        instance._report_fields_changed = False
+        return
+    attnames = [sender._meta.get_field(name).attname for name in names]
+    stored = sender._base_manager.filter(pk=instance.pk).values_list(*attnames).first()
+    instance._report_fields_changed = stored != tuple(getattr(instance, attname) for attname in attnames)
+
+
+@receiver(post_save, sender=Trip)
+@receiver(post_save, sender=DoctorVisit)
+@receiver(post_save, sender=PatientReferral)
+@receiver(post_save, sender=DoctorReferral)
+def bump_reports_data_version(sender, instance, raw=False, **kwargs):
+    """Invalidate cached report artefacts when a row changes what they show."""
+    if not raw and getattr(instance, '_report_fields_changed', True):
+        bump_data_version(REPORTS)
+
+
+@receiver(post_delete, sender=Trip)
+@receiver(post_delete, sender=DoctorVisit)
+@receiver(post_delete, sender=PatientReferral)
+@receiver(post_delete, sender=DoctorReferral)
+def bump_reports_data_version_on_delete(sender, **kwargs):
+    bump_data_version(REPORTS)
+
+
+@receiver(post_save, sender=DoctorCommissionProfile)
+@receiver(post_delete, sender=DoctorCommissionProfile)
+def bump_commission_profiles_version(sender, **kwargs):
+    """Invalidate in-process referral rate caches (portal.commissions)."""
+    bump_data_version(COMMISSION_PROFILES)
+
+
+@receiver(pre_save, sender=Trip)
+@receiver(pre_save, sender=DoctorReferral)
+@receiver(pre_save, sender=DoctorVisit)
+@receiver(pre_save, sender=OvernightStay)
+def ingest_uploaded_images(sender, instance, raw=False, **kwargs):
+    """Optimize new uploads before the image fields store them (core.images)."""
+    instance._ingested_images = []
+    if raw or images.ingest_mode() == images.INGEST_OFF:
+        return
+    for field_name in images.IMAGE_FIELDS[sender]:
+        field_file = getattr(instance, field_name)
+        if not field_file or field_file._committed:
+            continue
+        if images.ingest_mode() == images.INGEST_SYNC:
+            images.optimize_upload(field_file)
+        instance._ingested_images.append(field_name)
+
+
+@receiver(post_save, sender=Trip)
+@receiver(post_save, sender=DoctorReferral)
+@receiver(post_save, sender=DoctorVisit)
+@receiver(post_save, sender=OvernightStay)
+def thumbnail_uploaded_images(sender, instance, raw=False, **kwargs):
+    """Thumbnail (and in background mode optimize) the images stored by this save."""
+    field_names = getattr(instance, '_ingested_images', None)
+    instance._ingested_images = []
+    if raw or not field_names:
+        return
+    storage = sender._meta.get_field(field_names[0]).storage
+    names = [getattr(instance, field_name).name for field_name in field_names]
+    optimize = images.ingest_mode() == images.INGEST_BACKGROUND
+    transaction.on_commit(lambda: images.schedule(storage, names, optimize=optimize))
+
+
+def _image_names(instance, field_names):
+    """Stored names of the loaded image fields (deferred ones are left out)."""
+    names = {}
+    for field_name in field_names:
+        if field_name in instance.__dict__:
+            value = instance.__dict__[field_name]
+            names[field_name] = getattr(value, 'name', value) or ''
+    return names
+
+
+@receiver(post_init, sender=Trip)
+@receiver(post_init, sender=DoctorReferral)
+@receiver(post_init, sender=DoctorVisit)
+@receiver(post_init, sender=OvernightStay)
+def remember_stored_images(sender, instance, **kwargs):
+    instance._stored_images = _image_names(instance, images.IMAGE_FIELDS[sender])
+
+
+@receiver(pre_save, sender=Trip)
+@receiver(pre_save, sender=DoctorReferral)
+@receiver(pre_save, sender=DoctorVisit)
+@receiver(pre_save, sender=OvernightStay)
+def remember_new_uploads(sender, instance, **kwargs):
+    """Image fields whose file this save stores (their reference is claimed, not acquired)."""
+    instance._new_uploads = {
+        field_name for field_name in images.IMAGE_FIELDS[sender]
+        if field_name in instance.__dict__ and getattr(instance, field_name)
+        and not getattr(instance, field_name)._committed
+    }
+
+
+@receiver(post_save, sender=Trip)
+@receiver(post_save, sender=DoctorReferral)
+@receiver(post_save, sender=DoctorVisit)
+@receiver(post_save, sender=OvernightStay)
+def count_image_references(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """Keep ``MediaBlob.refcount`` in step with the image fields (core.storage)."""
+    if raw:
+        # Bulk loads are recounted afterwards (core.storage.recount_blobs).
+        return
+    field_names = images.IMAGE_FIELDS[sender]
+    if update_fields is not None:
+        field_names = [field_name for field_name in field_names if field_name in update_fields]
+    stored = {} if created else instance._stored_images
+    current = _image_names(instance, field_names)
+    new_uploads = getattr(instance, '_new_uploads', set())
+    instance._new_uploads = set()
+    released = []
+    for field_name, name in current.items():
+        if field_name in new_uploads:
+            # Storing the file counted its reference; it may have been stored
+            # before under the same name, and then the previous one goes.
+            blob_storage.claim(name)
+        elif not created and field_name not in stored:
+            continue
+        elif name == stored.get(field_name, ''):
+            continue
+        elif name:
+            blob_storage.acquire(name)
+        previous = stored.get(field_name, '')
+        if previous:
+            released.append(previous)
+    instance._stored_images.update(current)
+    if released:
+        blob_storage.release_on_commit(sender._meta.get_field(field_names[0]).storage, released)
+
+
+@receiver(post_delete, sender=Trip)
+@receiver(post_delete, sender=DoctorReferral)
+@receiver(post_delete, sender=DoctorVisit)
+@receiver(post_delete, sender=OvernightStay)
+def release_deleted_images(sender, instance, **kwargs):
+    """Drop the deleted row's references; unused files go once it has committed."""
+    field_names = images.IMAGE_FIELDS[sender]
+    names = [name for name in _image_names(instance, field_names).values() if name]
+    if names:
+        blob_storage.release_on_commit(sender._meta.get_field(field_names[0]).storage, names)
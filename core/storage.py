@@ -0,0 +1,534 @@
+"""
+Content-addressed storage for uploaded images.
+
+Mobile retries and repeated visit submissions used to store the same photo
+again under a random suffix. ``ContentAddressedStorage`` names every file
+after the SHA-256 of its bytes, so a photo that is already stored is not
+written twice and all rows share one file.
+
+Files are sharded so no directory grows past a few thousand entries: the
+``upload_to`` of every image field is a ``ShardedUploadTo``, which adds the
+year and month, and the storage adds the first two hex digits of the hash
+(``doctor_visits/2026/10/ab/<sha256>.jpg``).
+
+Each stored name has a ``MediaBlob`` row counting the image fields that
+point at it. ``core.signals`` acquires a reference when a row starts using
+a name and releases one when it stops (or is deleted); the file and its
+thumbnails are removed once the count reaches zero, after the change has
+committed. A file stored through the storage is counted by ``_save``
+itself, under the blob lock ``release`` takes, so a concurrent release of
+the last other reference cannot delete it before the row is saved. Files
+from before this storage have no blob row and are only deleted when no
+image field references them any more.
+
+``manage.py shard_media`` (and ``dedupe_media``) move existing media to
+sharded hash names while the site keeps running.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+from itertools import islice
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import Case, CharField, F, Q, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+# Hex digits of the hash used as a directory level under the month.
+SHARD_PREFIX_LENGTH = 2
+# How long a relocated file keeps its old name, for requests that loaded
+# the row before it was repointed.
+OLD_NAME_GRACE = 60
+
+# Names ``_save`` counted a reference for that the storing thread has not
+# claimed yet (``claim``).
+_unclaimed = threading.local()
+
+_HASH_FILENAME = re.compile(r'^([0-9a-f]{64})\.[A-Za-z0-9]+$')
+_SHARDED_NAME = re.compile(r'^[^/]+/\d{4}/\d{2}/([0-9a-f]{2})/([0-9a-f]{64})\.[a-z0-9]+$')
+
+
+def blob_name(directory, digest, extension):
+    return posixpath.join(directory, digest[:SHARD_PREFIX_LENGTH], digest + extension.lower())
+
+
+def shard_directory(directory, when=None):
+    """``<directory>/<year>/<month>`` of ``when`` (default now), in local time."""
+    when = timezone.localtime(when)
+    return f"{directory.strip('/')}/{when:%Y}/{when:%m}"
+
+
+def is_sharded(name):
+    match = _SHARDED_NAME.match(name)
+    return match is not None and match.group(2).startswith(match.group(1))
+
+
+@deconstructible
+class ShardedUploadTo:
+    """``upload_to`` putting files under ``<directory>/<year>/<month>/``."""
+
+    def __init__(self, directory):
+        self.directory = directory.strip('/')
+
+    def __call__(self, instance, filename):
+        return posixpath.join(shard_directory(self.directory), filename)
+
+    def __eq__(self, other):
+        return isinstance(other, ShardedUploadTo) and other.directory == self.directory
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """``FileSystemStorage`` that stores each distinct file once, under its hash."""
+
+    def _save(self, name, content):
+        from .models import MediaBlob
+
+        directory, filename = posixpath.split(name)
+        extension = posixpath.splitext(filename)[1].lower()
+        scratch_dir = self.path(directory)
+        os.makedirs(scratch_dir, exist_ok=True)
+        if self.directory_permissions_mode is not None:
+            os.chmod(scratch_dir, self.directory_permissions_mode)
+
+        # Hash while writing to a scratch file; the final name is only known
+        # once the last byte has been read.
+        digest = hashlib.sha256()
+        size = 0
+        fd, scratch = tempfile.mkstemp(dir=scratch_dir, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks(CHUNK_SIZE):
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            sha256 = digest.hexdigest()
+            top = name.split('/', 1)[0]
+            with transaction.atomic():
+                # Locks serialize with ``release`` dropping the last reference,
+                # and the caller's reference is counted before they are let go.
+                # The same photo stored in an earlier month is reused.
+                blob = (
+                    MediaBlob.objects.select_for_update()
+                    .filter(sha256=sha256, name__startswith=top + '/', name__endswith=extension)
+                    .order_by('pk').first()
+                )
+                if blob is None or not os.path.exists(self.path(blob.name)):
+                    name = blob_name(directory, sha256, extension)
+                    blob, _ = MediaBlob.objects.select_for_update().get_or_create(
+                        name=name, defaults={'sha256': sha256, 'size': size},
+                    )
+                    path = self.path(name)
+                    if not os.path.exists(path):
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        os.chmod(scratch, self.file_permissions_mode or 0o644)
+                        os.replace(scratch, path)
+                MediaBlob.objects.filter(pk=blob.pk).update(refcount=F('refcount') + 1)
+        finally:
+            if os.path.exists(scratch):
+                os.unlink(scratch)
+        _unclaimed_names()[blob.name] += 1
+        return blob.name
+
+    def get_available_name(self, name, max_length=None):
+        # ``_save`` picks the final name; identical content must map to the
+        # same file rather than get a suffix.
+        return name
+
+
+def is_referenced(name):
+    """Whether any image field still points at ``name``."""
+    from .images import IMAGE_FIELDS
+
+    for model, field_names in IMAGE_FIELDS.items():
+        query = Q()
+        for field_name in field_names:
+            query |= Q(**{field_name: name})
+        if model._base_manager.filter(query).exists():
+            return True
+    return False
+
+
+def acquire(name):
+    """Count one more image field pointing at ``name``."""
+    from .models import MediaBlob
+
+    MediaBlob.objects.filter(name=name).update(refcount=F('refcount') + 1)
+
+
+def _unclaimed_names():
+    if not hasattr(_unclaimed, 'names'):
+        _unclaimed.names = Counter()
+    return _unclaimed.names
+
+
+def claim(name):
+    """
+    ``acquire`` for a field that just stored its file as ``name``.
+
+    ``ContentAddressedStorage._save`` already counted that reference, so it
+    is only taken here for files stored by another storage.
+    """
+    unclaimed = _unclaimed_names()
+    if unclaimed.get(name):
+        unclaimed[name] -= 1
+        if not unclaimed[name]:
+            del unclaimed[name]
+        return
+    acquire(name)
+
+
+def release(storage, name):
+    """
+    Drop one reference to ``name``; delete the file once nothing uses it.
+
+    Call after the rows that stopped using it have committed.
+    """
+    from .images import delete_thumbnails
+    from .models import MediaBlob
+
+    with transaction.atomic():
+        blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+        if blob is not None:
+            if blob.refcount > 1:
+                MediaBlob.objects.filter(pk=blob.pk).update(refcount=F('refcount') - 1)
+                return False
+            blob.delete()
+        elif is_referenced(name):
+            return False
+        try:
+            storage.delete(name)
+            delete_thumbnails(storage, name)
+        except Exception:
+            # A missing or undeletable file must not fail the caller.
+            logger.warning("Could not delete %s.", name, exc_info=True)
+    return True
+
+
+def release_on_commit(storage, names):
+    for name in names:
+        transaction.on_commit(lambda name=name: release(storage, name))
+
+
+def recount_blobs(names=None):
+    """
+    Rebuild ``MediaBlob.refcount`` from the image fields.
+
+    Needed after writes that send no signals (bulk loads, backup restores).
+    ``names`` limits it to those blobs. Returns the number of blobs updated.
+    """
+    from .images import IMAGE_FIELDS
+    from .models import MediaBlob
+
+    counts = Counter()
+    for model, field_names in IMAGE_FIELDS.items():
+        for field_name in field_names:
+            rows = model._base_manager.exclude(**{field_name: ''})
+            if names is not None:
+                rows = rows.filter(**{f'{field_name}__in': names})
+            values = rows.values_list(field_name, flat=True)
+            counts.update(name for name in values.iterator() if name)
+
+    blobs = MediaBlob.objects.only('pk', 'name', 'refcount')
+    if names is not None:
+        blobs = blobs.filter(name__in=names)
+    changed = []
+    for blob in blobs.iterator():
+        refcount = counts.get(blob.name, 0)
+        if blob.refcount != refcount:
+            blob.refcount = refcount
+            changed.append(blob)
+    MediaBlob.objects.bulk_update(changed, ['refcount'], batch_size=1000)
+    return len(changed)
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        while chunk := source.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _inspect(storage, name):
+    """``(name, sha256, size, mtime)`` of a stored file; ``sha256`` is ``None`` if it is missing."""
+    path = storage.path(name)
+    try:
+        stat = os.stat(path)
+        match = _HASH_FILENAME.match(posixpath.basename(name))
+        # Content-addressed names already say what they hold (files are never
+        # rewritten under their name), no need to read them.
+        digest = match.group(1) if match else hash_file(path)
+    except FileNotFoundError:
+        return name, None, 0, None
+    return name, digest, stat.st_size, stat.st_mtime
+
+
+def _link(source, target):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        # A second name for the same inode until the old one is dropped.
+        os.link(source, target)
+    except FileExistsError:
+        pass
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def _link_thumbnails(storage, old, new):
+    from .images import thumbnail_name, thumbnail_sizes
+
+    for label in thumbnail_sizes():
+        source = storage.path(thumbnail_name(old, label))
+        target = storage.path(thumbnail_name(new, label))
+        if os.path.exists(source) and not os.path.exists(target):
+            _link(source, target)
+
+
+def _repoint(mapping):
+    """
+    Point every image field (and upload) holding an old name of ``mapping`` at its new name.
+
+    Returns the number of image fields changed.
+    """
+    from .images import IMAGE_FIELDS
+    from .models import ChunkedUpload
+
+    def renamed(field_name):
+        return Case(
+            *(When(**{field_name: old}, then=Value(new)) for old, new in mapping.items()),
+            default=F(field_name),
+            output_field=CharField(),
+        )
+
+    moved = 0
+    with transaction.atomic():
+        for model, field_names in IMAGE_FIELDS.items():
+            for field_name in field_names:
+                moved += model._base_manager.filter(**{f'{field_name}__in': list(mapping)}).update(**{
+                    field_name: renamed(field_name),
+                })
+        ChunkedUpload.objects.filter(stored_name__in=list(mapping)).update(stored_name=renamed('stored_name'))
+    return moved
+
+
+def replace_blob(storage, old, new):
+    """
+    Move every reference to ``old`` over to ``new`` and release ``old``.
+
+    For a file stored again with other content (``core.images`` optimizing
+    an upload after the fact): ``new`` is a just stored and claimed name,
+    whose reference the caller hands over here.
+    """
+    from .models import MediaBlob
+
+    with transaction.atomic():
+        # Serializes with uploads and ``release`` on both blobs.
+        list(MediaBlob.objects.select_for_update().filter(name__in=[old, new]))
+        moved = _repoint({old: new})
+        if moved:
+            MediaBlob.objects.filter(name=new).update(refcount=F('refcount') + moved)
+            # Keep one reference for the ``release`` below.
+            MediaBlob.objects.filter(name=old).update(refcount=Greatest(F('refcount') - moved, 0) + 1)
+    release(storage, new)
+    if moved:
+        release(storage, old)
+    return moved
+
+
+def _referenced_names(names):
+    from .images import IMAGE_FIELDS
+
+    referenced = set()
+    for model, field_names in IMAGE_FIELDS.items():
+        for field_name in field_names:
+            referenced.update(
+                model._base_manager.filter(**{f'{field_name}__in': names}).values_list(field_name, flat=True)
+            )
+    return referenced
+
+
+def _drop_old_names(storage, names):
+    """Delete relocated files' old names, unless a row was saved back with one."""
+    from .images import delete_thumbnails
+
+    referenced = _referenced_names(names)
+    for name in names:
+        if name not in referenced:
+            storage.delete(name)
+            delete_thumbnails(storage, name)
+
+
+def relocate_media(batch_size=200, workers=4, dry_run=False, progress=None, pause=0):
+    """
+    Move every referenced image to its sharded, content-addressed name.
+
+    Files are hashed on ``workers`` threads, ``batch_size`` at a time (names
+    that are already a hash are trusted). Each batch links the file (or
+    finds an identical one) under its new name, then repoints the rows and
+    recounts their blobs in one transaction. The old name is deleted
+    ``OLD_NAME_GRACE`` seconds later, so pages and requests that loaded a
+    row before the switch keep working; a row saved back with an old name
+    keeps it until the next run. ``pause`` sleeps between batches to leave
+    disk bandwidth to the site. Interrupted runs pick up where they stopped.
+    Returns a dict of counts and the bytes freed.
+    """
+    from .images import iter_stored_images
+    from .models import MediaBlob
+
+    stats = {'files': 0, 'renamed': 0, 'duplicates': 0, 'missing': 0, 'bytes_freed': 0}
+    pending = deque()
+    images = iter_stored_images()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        while batch := list(islice(images, batch_size)):
+            storage = batch[0][0]
+            results = list(executor.map(lambda item: _inspect(*item), batch))
+            digests = {digest for _, digest, _, _ in results if digest}
+            # Sharded copies stored earlier (another month, an earlier batch).
+            known = {}
+            for digest, name in MediaBlob.objects.filter(sha256__in=digests).values_list('sha256', 'name'):
+                if is_sharded(name):
+                    known[(name.split('/', 1)[0], digest, posixpath.splitext(name)[1])] = name
+            mapping = {}
+            blobs = {}
+            created = set()
+            for name, digest, size, mtime in results:
+                stats['files'] += 1
+                if digest is None:
+                    stats['missing'] += 1
+                    continue
+                top = name.split('/', 1)[0]
+                extension = posixpath.splitext(name)[1].lower()
+                if '/' not in name or is_sharded(name):
+                    blobs.setdefault(name, (digest, size))
+                    known.setdefault((top, digest, extension), name)
+                    continue
+                target = known.get((top, digest, extension))
+                if target is None:
+                    when = datetime.fromtimestamp(mtime, tz=dt_timezone.utc)
+                    target = blob_name(shard_directory(top, when), digest, extension)
+                    known[(top, digest, extension)] = target
+                blobs.setdefault(target, (digest, size))
+                mapping[name] = target
+                if target in created or os.path.exists(storage.path(target)):
+                    stats['duplicates'] += 1
+                    stats['bytes_freed'] += size
+                    if not dry_run:
+                        _link_thumbnails(storage, name, target)
+                    continue
+                created.add(target)
+                stats['renamed'] += 1
+                if not dry_run:
+                    _link(storage.path(name), storage.path(target))
+                    _link_thumbnails(storage, name, target)
+
+            if not dry_run:
+                names = list(set(blobs) | set(mapping))
+                with transaction.atomic():
+                    # Serializes with uploads and ``release`` on these blobs.
+                    existing = set(
+                        MediaBlob.objects.select_for_update().filter(name__in=names).values_list('name', flat=True)
+                    )
+                    MediaBlob.objects.bulk_create(
+                        [
+                            MediaBlob(name=name, sha256=digest, size=size)
+                            for name, (digest, size) in blobs.items() if name not in existing
+                        ],
+                        ignore_conflicts=True,
+                    )
+                    if mapping:
+                        _repoint(mapping)
+                    recount_blobs(names)
+                    MediaBlob.objects.filter(name__in=list(mapping), refcount=0).delete()
+                if mapping:
+                    pending.append((time.monotonic(), storage, list(mapping)))
+                while pending and time.monotonic() - pending[0][0] >= OLD_NAME_GRACE:
+                    _, old_storage, old_names = pending.popleft()
+                    _drop_old_names(old_storage, old_names)
+            if progress:
+                progress(stats)
+            if pause:
+                time.sleep(pause)
+
+    if pending:
+        time.sleep(max(0, OLD_NAME_GRACE - (time.monotonic() - pending[-1][0])))
+        for _, old_storage, old_names in pending:
+            _drop_old_names(old_storage, old_names)
+    return stats
+
+
+def collect_unused_blobs(older_than):
+    """Delete blobs nothing points at that were stored before ``older_than``."""
+    from .models import MediaBlob
+
+    deleted = 0
+    for blob in MediaBlob.objects.filter(refcount=0, created_at__lt=older_than).iterator():
+        with transaction.atomic():
+            # An upload of the same photo may have taken a reference since.
+            if not MediaBlob.objects.select_for_update().filter(pk=blob.pk, refcount=0).exists():
+                continue
+            if release(media_storage, blob.name):
+                deleted += 1
+    return deleted
+
+
+def orphan_files(min_age=24 * 3600):
+    """
+    ``(name, size)`` of files in the image upload directories no row references.
+
+    Files younger than ``min_age`` seconds may belong to an upload whose row
+    is not saved yet and are left out.
+    """
+    from .images import IMAGE_FIELDS, THUMBNAIL_DIR
+
+    referenced = set()
+    directories = set()
+    for model, field_names in IMAGE_FIELDS.items():
+        for field_name in field_names:
+            upload_to = model._meta.get_field(field_name).upload_to
+            if isinstance(upload_to, ShardedUploadTo):
+                upload_to = upload_to.directory
+            if isinstance(upload_to, str):
+                directories.add(upload_to.strip('/'))
+            referenced.update(
+                name for name in model._base_manager.values_list(field_name, flat=True).iterator() if name
+            )
+
+    cutoff = time.time() - min_age
+    for directory in sorted(directories):
+        if directory == THUMBNAIL_DIR:
+            continue
+        root = media_storage.path(directory)
+        for current, _, filenames in os.walk(root):
+            for filename in filenames:
+                if filename.startswith('.'):
+                    # Scratch files of uploads in progress.
+                    continue
+                path = os.path.join(current, filename)
+                stat = os.stat(path)
+                if stat.st_mtime > cutoff:
+                    continue
+                name = posixpath.join(directory, os.path.relpath(path, root).replace(os.sep, '/'))
+                if name not in referenced:
+                    yield name, stat.st_size
+
+
+media_storage = ContentAddressedStorage()
@@ -0,0 +1,31 @@
+import shutil
+import tempfile
+
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+
+from .. import storage as blob_storage
+from ..models import MediaBlob
+from ..storage import media_storage
+
+
+class MediaTestCase(TestCase):
+    """Runs with ``MEDIA_ROOT`` in a temporary directory."""
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root, PORTAL_IMAGE_INGEST='off')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(blob_storage._unclaimed_names().clear)
+
+    def store(self, data, name='doctor_visits/2026/10/photo.jpg'):
+        """Save ``data`` as a field would, holding one reference."""
+        name = media_storage.save(name, ContentFile(data))
+        blob_storage.claim(name)
+        return name
+
+    def refcount(self, name):
+        return MediaBlob.objects.get(name=name).refcount
@@ -0,0 +1,115 @@
+import io
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase, override_settings
+from PIL import Image
+
+from .. import images, storage as blob_storage
+from ..models import DoctorReferral, DoctorVisit, MediaBlob, Trip, User
+from ..storage import media_storage
+from .base import MediaTestCase
+
+
+def photo(size=(400, 300), mode='RGB', image_format='PNG', **options):
+    buffer = io.BytesIO()
+    image = Image.new(mode, size, (200, 30, 30, 128)[:len(mode)])
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+@override_settings(PORTAL_IMAGE_MAX_SIZE=100, PORTAL_IMAGE_QUALITY=80)
+class OptimizeImageTests(SimpleTestCase):
+    def optimize(self, data, **kwargs):
+        result = images.optimize_image(io.BytesIO(data), **kwargs)
+        if result is None:
+            return None
+        data, image_format = result
+        return Image.open(io.BytesIO(data)), image_format
+
+    def test_large_images_are_downscaled_to_jpeg(self):
+        image, image_format = self.optimize(photo())
+        self.assertEqual((image_format, image.format, image.size), ('JPEG', 'JPEG', (100, 75)))
+
+    def test_exif_orientation_is_applied(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Rotated 90 degrees.
+        image, _ = self.optimize(photo(image_format='JPEG', exif=exif.tobytes()))
+        self.assertEqual(image.size, (75, 100))
+        self.assertNotIn('exif', image.info)
+
+    def test_transparency_is_kept_as_png(self):
+        image, image_format = self.optimize(photo(mode='RGBA'))
+        self.assertEqual((image_format, image.mode), ('PNG', 'RGBA'))
+
+    def test_images_that_would_not_shrink(self):
+        data, _ = images.optimize_image(io.BytesIO(photo()))
+        self.assertIsNone(self.optimize(data))
+
+
+@override_settings(PORTAL_IMAGE_MAX_SIZE=100, PORTAL_IMAGE_THUMBNAIL_SIZES={'sm': 20, 'md': 50})
+class IngestTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.trip = Trip.objects.create(agent=User.objects.create_user('9000000001', password='x'))
+        self.doctor = DoctorReferral.objects.create(name='Dr A')
+
+    def visit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return DoctorVisit.objects.create(
+                doctor=self.doctor, trip=self.trip, visit_image=ContentFile(photo(), name='visit.png'),
+            )
+
+    def test_sync_uploads_are_optimized_and_thumbnailed(self):
+        with self.settings(PORTAL_IMAGE_INGEST='sync'):
+            visit = self.visit()
+        image = visit.visit_image
+        self.assertTrue(image.name.endswith('.jpg'))
+        self.assertEqual(Image.open(image.storage.open(image.name)).size, (100, 75))
+        self.assertTrue(images.has_thumbnails(image.storage, image.name))
+        small = images.thumbnail_name(image.name, 'sm')
+        self.assertEqual(Image.open(image.storage.open(small)).size, (20, 15))
+
+    def test_off_stores_uploads_unchanged(self):
+        image = self.visit().visit_image
+        self.assertTrue(image.name.endswith('.png'))
+        self.assertEqual(image.storage.open(image.name).read(), photo())
+        self.assertFalse(images.has_thumbnails(image.storage, image.name))
+
+    def test_background_tasks_release_their_connections(self):
+        calls = []
+        with mock.patch.object(images, 'close_old_connections', lambda: calls.append('close')), \
+                mock.patch.object(images, '_process_safely', lambda *args: calls.append('process')):
+            images._process_in_background(media_storage, 'visit.png', True)
+        self.assertEqual(calls, ['close', 'process', 'close'])
+
+
+class ProcessStoredImageTests(MediaTestCase):
+    @override_settings(PORTAL_IMAGE_MAX_SIZE=100, PORTAL_IMAGE_THUMBNAIL_SIZES={'sm': 50})
+    def test_optimized_copy_gets_its_own_name(self):
+        agent = User.objects.create_user('9000000001', password='x')
+        trip = Trip.objects.create(agent=agent)
+        doctor = DoctorReferral.objects.create(name='Dr A')
+        visit = DoctorVisit.objects.create(doctor=doctor, trip=trip, visit_image=ContentFile(photo(), name='v.png'))
+        original = visit.visit_image.name
+        doctor.visit_image = original
+        doctor.save()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertGreater(images.process_stored_image(media_storage, original), 0)
+
+        visit.refresh_from_db()
+        doctor.refresh_from_db()
+        optimized = visit.visit_image.name
+        self.assertNotEqual(optimized, original)
+        self.assertEqual(doctor.visit_image.name, optimized)
+        self.assertEqual(Image.open(media_storage.open(optimized)).size, (100, 75))
+        self.assertFalse(media_storage.exists(original))
+        self.assertFalse(MediaBlob.objects.filter(name=original).exists())
+        blob = MediaBlob.objects.get(name=optimized)
+        self.assertEqual((blob.refcount, blob.size), (2, media_storage.size(optimized)))
+        self.assertEqual(blob.sha256, blob_storage.hash_file(media_storage.path(optimized)))
+        self.assertTrue(images.has_thumbnails(media_storage, optimized))
+
+        # The original uploaded again is stored as itself, not as the copy.
+        self.assertEqual(self.store(photo(), name='doctor_visits/2026/10/again.png'), original)
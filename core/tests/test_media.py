@@ -0,0 +1,97 @@
+import hashlib
+import os
+
+from django.conf import settings
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from .. import images
+from ..media import parse_range, serve_media
+from .base import MediaTestCase
+
+
+class ParseRangeTests(SimpleTestCase):
+    def test_whole_file(self):
+        for header in (None, '', 'bytes=', 'bytes=-', 'items=0-1', 'bytes=0-1,4-5', 'bytes=a-b'):
+            with self.subTest(header=header):
+                self.assertIsNone(parse_range(header, 100))
+
+    def test_ranges(self):
+        cases = {
+            'bytes=0-0': (0, 0),
+            'bytes=0-9': (0, 9),
+            ' bytes=10-19 ': (10, 19),
+            'bytes=90-': (90, 99),
+            'bytes=90-500': (90, 99),
+            'bytes=-10': (90, 99),
+            'bytes=-500': (0, 99),
+        }
+        for header, expected in cases.items():
+            with self.subTest(header=header):
+                self.assertEqual(parse_range(header, 100), expected)
+
+    def test_unsatisfiable(self):
+        for header, size in (('bytes=100-', 100), ('bytes=100-200', 100), ('bytes=5-2', 100), ('bytes=-0', 100),
+                             ('bytes=0-', 0)):
+            with self.subTest(header=header, size=size), self.assertRaises(ValueError):
+                parse_range(header, size)
+
+
+@override_settings(PORTAL_MEDIA_MAX_AGE=31536000, PORTAL_MEDIA_ACCEL_PREFIX='')
+class ServeMediaTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = RequestFactory()
+        self.name = f"doctor_visits/{hashlib.sha256(b'0123456789').hexdigest()}.jpg"
+        self.write(self.name, b'0123456789')
+
+    def write(self, name, data):
+        path = os.path.join(settings.MEDIA_ROOT, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as out:
+            out.write(data)
+
+    def get(self, name, **headers):
+        return serve_media(self.factory.get(f'/media/{name}', headers=headers), name)
+
+    def test_whole_file_with_validators(self):
+        response = self.get(self.name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Cache-Control'], 'private, max-age=31536000, immutable')
+
+        cached = self.get(self.name, if_none_match=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_ranges(self):
+        response = self.get(self.name, range='bytes=2-4')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-4/10')
+        self.assertEqual(b''.join(response.streaming_content), b'234')
+
+        stale = self.get(self.name, range='bytes=2-4', if_range='"other"')
+        self.assertEqual(stale.status_code, 200)
+
+        unsatisfiable = self.get(self.name, range='bytes=20-')
+        self.assertEqual((unsatisfiable.status_code, unsatisfiable['Content-Range']), (416, 'bytes */10'))
+
+    def test_other_files_and_thumbnails_are_revalidated(self):
+        thumbnail = images.thumbnail_name(self.name, 'sm')
+        for name in ('doctor_visits/photo.jpg', thumbnail):
+            self.write(name, b'x')
+            with self.subTest(name=name):
+                self.assertEqual(self.get(name)['Cache-Control'], 'private, no-cache')
+
+    def test_hidden_and_missing_files(self):
+        self.write('doctor_visits/.upload-1', b'x')
+        for name in ('doctor_visits/.upload-1', '../secret', 'doctor_visits', 'missing.jpg'):
+            with self.subTest(name=name), self.assertRaises(Http404):
+                self.get(name)
+
+    @override_settings(PORTAL_MEDIA_ACCEL_PREFIX='/protected/', PORTAL_MEDIA_ACCEL_HEADER='X-Accel-Redirect')
+    def test_proxy_sends_the_file(self):
+        response = self.get(self.name)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected/{self.name}')
+        self.assertEqual(response.content, b'')
@@ -0,0 +1,174 @@
+import datetime
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.db.models import QuerySet
+from django.test import TestCase
+from django.utils import timezone
+
+from core.dataversion import REPORTS, get_data_version
+from core.models import (
+    Address, Admission, AdmissionDailyRollup, Area, DoctorReferral, DoctorVisit, PatientReferral, PaymentCategory,
+    Trip, User,
+)
+from core.rollups import apply_snapshot, rebuild_admission_rollups, snapshot_admission
+from portal.reports import parse_report_filters, summary_stats
+
+
+class RollupTestCase(TestCase):
+    def setUp(self):
+        self.north = Area.objects.create(name='North', city='Nagpur')
+        self.south = Area.objects.create(name='South', city='Nagpur')
+        self.address = Address.objects.create(area=self.north)
+        self.doctor = DoctorReferral.objects.create(name='Dr A', address_details=self.address)
+        self.agent = User.objects.create_user('9000000001', password='x')
+        self.referral = PatientReferral.objects.create(
+            agent=self.agent, patient_name='P', age=30, gender='M', phone='1',
+        )
+        self.category = PaymentCategory.objects.create(name='Rollup Test', code='rollup-test')
+        self.admissions = [
+            Admission.objects.create(
+                patient_name=f'P{i}', referred_by_doctor=self.doctor,
+                patient_referral=self.referral if i % 2 else None, payment_category=self.category,
+                admission_type='IPD' if i % 3 else 'OPD', bed_charges=Decimal(100 * i),
+            )
+            for i in range(6)
+        ]
+
+    def totals(self):
+        """Rollup measures per bucket."""
+        totals = {}
+        for row in AdmissionDailyRollup.objects.all():
+            key = (row.date, row.referred_by_doctor_id, row.area_id, row.agent_id, row.payment_category_id,
+                   row.admission_type)
+            counts = totals.setdefault(key, [0, 0, 0, Decimal('0'), Decimal('0')])
+            for index, field in enumerate(('patient_count', 'opd_count', 'ipd_count', 'total_revenue',
+                                           'total_commission')):
+                counts[index] += getattr(row, field)
+        return {key: counts for key, counts in totals.items() if counts[0]}
+
+    def assertMatchesRebuild(self):
+        incremental = self.totals()
+        rebuild_admission_rollups()
+        self.assertEqual(incremental, self.totals())
+
+
+class AdmissionRollupTests(RollupTestCase):
+    def test_admission_changes(self):
+        self.assertEqual(sum(counts[0] for counts in self.totals().values()), 6)
+        first, second, third = self.admissions[:3]
+        first.bed_charges = Decimal('999')
+        first.admission_type = 'IPD'
+        first.save()
+        second.referred_by_doctor = None
+        second.save()
+        third.delete()
+        self.assertMatchesRebuild()
+
+    def test_doctor_area_changes(self):
+        self.address.area = self.south
+        self.address.save()
+        self.assertMatchesRebuild()
+
+        self.doctor.address_details = Address.objects.create(area=self.north)
+        self.doctor.save()
+        self.assertMatchesRebuild()
+
+        self.doctor.address_details.delete()
+        self.assertMatchesRebuild()
+
+    def test_referral_agent_changes(self):
+        self.referral.agent = User.objects.create_user('9000000002', password='x')
+        self.referral.save()
+        self.assertMatchesRebuild()
+
+        self.referral.delete()
+        self.assertMatchesRebuild()
+
+    def test_buckets_are_unique(self):
+        row = AdmissionDailyRollup.objects.filter(agent__isnull=True).first()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            AdmissionDailyRollup.objects.create(
+                date=row.date, referred_by_doctor=row.referred_by_doctor, area=row.area, agent=None,
+                payment_category=row.payment_category, admission_type=row.admission_type,
+            )
+
+    def test_concurrent_first_writes_share_the_bucket(self):
+        admission = self.admissions[0]
+        bucket = AdmissionDailyRollup.objects.filter(agent__isnull=True, admission_type=admission.admission_type)
+        self.assertEqual(bucket.get().patient_count, 1)
+        update = QuerySet.update
+
+        def update_before_another_writer(queryset, **values):
+            # The first update finds no row: the other admission's insert
+            # lands between it and this writer's insert.
+            if not calls:
+                calls.append(values)
+                return 0
+            return update(queryset, **values)
+
+        calls = []
+        with mock.patch.object(QuerySet, 'update', autospec=True, side_effect=update_before_another_writer):
+            apply_snapshot(snapshot_admission(admission.pk), 1)
+        self.assertEqual(bucket.get().patient_count, 2)
+
+    def test_summary_reads_the_rollups(self):
+        stats = summary_stats(parse_report_filters({}))
+        self.assertEqual(stats['patient_count'], 6)
+        self.assertEqual(stats['opd_count'], 2)
+        self.assertEqual(stats['ipd_count'], 4)
+        self.assertEqual(stats['total_revenue'], Decimal('1500'))
+
+        agent_stats = summary_stats(parse_report_filters({'agent': str(self.agent.pk)}))
+        self.assertEqual(agent_stats['patient_count'], 3)
+
+    def test_rebuild_of_a_date_range_keeps_other_days(self):
+        earlier = timezone.now() - datetime.timedelta(days=10)
+        Admission.objects.filter(pk=self.admissions[0].pk).update(created_at=earlier)
+        rebuild_admission_rollups()
+        AdmissionDailyRollup.objects.filter(date=timezone.localdate(earlier)).update(patient_count=99)
+
+        today = timezone.localdate()
+        call_command('rebuild_admission_rollups', since=today.isoformat(), stdout=StringIO())
+
+        self.assertEqual(
+            AdmissionDailyRollup.objects.get(date=timezone.localdate(earlier)).patient_count, 99,
+        )
+        self.assertEqual(summary_stats(parse_report_filters({'date_start': today.isoformat()}))['patient_count'], 5)
+
+
+class ReportsDataVersionTests(RollupTestCase):
+    def assertBumps(self, change, bumped=True):
+        before = get_data_version(REPORTS)
+        change()
+        self.assertEqual(get_data_version(REPORTS) > before, bumped)
+
+    def test_admission_changes_bump(self):
+        admission = self.admissions[0]
+        admission.patient_name = 'Renamed'
+        self.assertBumps(admission.save)
+        self.assertBumps(admission.delete)
+
+    def test_only_reported_fields_bump(self):
+        trip = Trip.objects.create(agent=self.agent)
+        visit = DoctorVisit.objects.create(doctor=self.doctor, trip=trip)
+
+        trip.status = 'COMPLETED'
+        trip.end_lat = 1
+        self.assertBumps(trip.save, bumped=False)
+        trip.total_kilometers = 12
+        self.assertBumps(trip.save)
+
+        visit.status = 'Visited'
+        self.assertBumps(visit.save, bumped=False)
+        self.doctor.contact_number = '99'
+        self.assertBumps(lambda: self.doctor.save(update_fields=['contact_number']), bumped=False)
+        self.assertBumps(self.doctor.save, bumped=False)
+        self.doctor.name = 'Dr B'
+        self.assertBumps(self.doctor.save)
+
+        self.assertBumps(visit.delete)
+        self.assertBumps(lambda: DoctorVisit.objects.create(doctor=self.doctor, trip=trip))
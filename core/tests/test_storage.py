@@ -0,0 +1,156 @@
+import hashlib
+from datetime import timedelta
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
+
+from .. import storage as blob_storage
+from ..models import DoctorReferral, DoctorVisit, MediaBlob, Trip, User
+from ..storage import media_storage
+from .base import MediaTestCase
+
+
+class ContentAddressedStorageTests(MediaTestCase):
+    def test_identical_content_is_stored_once(self):
+        first = media_storage.save('doctor_visits/photo.JPG', ContentFile(b'photo'))
+        second = media_storage.save('doctor_visits/again.jpg', ContentFile(b'photo'))
+        digest = hashlib.sha256(b'photo').hexdigest()
+        self.assertEqual(first, f'doctor_visits/{digest[:2]}/{digest}.jpg')
+        self.assertEqual(second, first)
+        self.assertEqual(len(media_storage.listdir(f'doctor_visits/{digest[:2]}')[1]), 1)
+
+    def test_uploads_are_sharded_by_month(self):
+        trip = Trip.objects.create(agent=User.objects.create_user('9000000001', password='x'))
+        doctor = DoctorReferral.objects.create(name='Dr A')
+        visit = DoctorVisit.objects.create(doctor=doctor, trip=trip, visit_image=ContentFile(b'one', name='v.jpg'))
+        name = visit.visit_image.name
+        self.assertTrue(blob_storage.is_sharded(name))
+        self.assertTrue(name.startswith(blob_storage.shard_directory('doctor_visits') + '/'))
+
+    def test_save_counts_the_reference_before_returning(self):
+        first = self.store(b'photo')
+        # Another upload of the same photo resolves to the stored file, and
+        # the row using ``first`` goes away before the second row is saved.
+        second = media_storage.save('doctor_visits/2026/10/again.jpg', ContentFile(b'photo'))
+        self.assertEqual(second, first)
+        blob_storage.release(media_storage, first)
+
+        self.assertTrue(media_storage.exists(second))
+        self.assertEqual(self.refcount(second), 1)
+        blob_storage.claim(second)
+        self.assertEqual(self.refcount(second), 1)
+
+    def test_reused_unreferenced_blob_is_not_collected(self):
+        name = self.store(b'photo')
+        # The row went away; the blob waits for ``collect_unused_blobs``.
+        MediaBlob.objects.filter(name=name).update(refcount=0)
+        self.assertEqual(self.store(b'photo'), name)
+
+        self.assertEqual(blob_storage.collect_unused_blobs(timezone.now() + timedelta(minutes=1)), 0)
+        self.assertTrue(media_storage.exists(name))
+        self.assertEqual(self.refcount(name), 1)
+
+    def test_release_deletes_the_file_with_the_last_reference(self):
+        name = self.store(b'photo')
+        blob_storage.acquire(name)
+        self.assertEqual(self.refcount(name), 2)
+
+        self.assertFalse(blob_storage.release(media_storage, name))
+        self.assertEqual(self.refcount(name), 1)
+        self.assertTrue(media_storage.exists(name))
+
+        self.assertTrue(blob_storage.release(media_storage, name))
+        self.assertFalse(media_storage.exists(name))
+        self.assertFalse(MediaBlob.objects.filter(name=name).exists())
+
+    def test_release_keeps_referenced_files_without_a_blob(self):
+        # Stored before content-addressed storage: no blob row.
+        name = FileSystemStorage(location=media_storage.location).save('doctor_visits/old.jpg', ContentFile(b'x'))
+        agent = User.objects.create_user('9000000001', password='x')
+        Trip.objects.create(agent=agent, odometer_start_image=name)
+
+        self.assertFalse(blob_storage.release(media_storage, name))
+        self.assertTrue(media_storage.exists(name))
+
+    def test_rows_share_and_release_files(self):
+        trip = Trip.objects.create(agent=User.objects.create_user('9000000001', password='x'))
+        doctor = DoctorReferral.objects.create(name='Dr A')
+        with self.captureOnCommitCallbacks(execute=True):
+            visit = DoctorVisit.objects.create(doctor=doctor, trip=trip, visit_image=ContentFile(b'one', name='v.jpg'))
+            doctor.visit_image = visit.visit_image.name
+            doctor.save()
+        first = visit.visit_image.name
+        self.assertEqual(self.refcount(first), 2)
+
+        # The visit is submitted again with another photo.
+        with self.captureOnCommitCallbacks(execute=True):
+            visit.visit_image = ContentFile(b'two', name='v.jpg')
+            visit.save()
+        self.assertEqual(self.refcount(first), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            doctor.visit_image = None
+            doctor.save()
+        self.assertFalse(media_storage.exists(first))
+        self.assertTrue(media_storage.exists(visit.visit_image.name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            doctor.delete()
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_model_saves_count_each_field_once(self):
+        agent = User.objects.create_user('9000000001', password='x')
+        trip = Trip.objects.create(agent=agent)
+        doctor = DoctorReferral.objects.create(name='Dr A')
+        visit = DoctorVisit(doctor=doctor, trip=trip)
+        visit.visit_image = ContentFile(b'photo', name='visit.jpg')
+        visit.save()
+        name = visit.visit_image.name
+        self.assertEqual(self.refcount(name), 1)
+
+        doctor.visit_image = name
+        doctor.save()
+        self.assertEqual(self.refcount(name), 2)
+
+        # The same photo uploaded again to the same field.
+        with self.captureOnCommitCallbacks(execute=True):
+            visit.visit_image = ContentFile(b'photo', name='visit.jpg')
+            visit.save()
+        self.assertEqual(visit.visit_image.name, name)
+        self.assertEqual(self.refcount(name), 2)
+        self.assertEqual(blob_storage._unclaimed_names(), {})
+
+    @mock.patch.object(blob_storage, 'OLD_NAME_GRACE', 0)
+    def test_relocate_media(self):
+        legacy = FileSystemStorage(location=media_storage.location)
+        names = [legacy.save(f'doctor_visits/{index}.jpg', ContentFile(b'same')) for index in range(2)]
+        agent = User.objects.create_user('9000000001', password='x')
+        trips = [Trip.objects.create(agent=agent, odometer_start_image=name) for name in names]
+
+        stats = blob_storage.relocate_media(batch_size=1)
+
+        self.assertEqual((stats['files'], stats['renamed'], stats['duplicates']), (2, 1, 1))
+        trip = trips[0]
+        trip.refresh_from_db()
+        target = trip.odometer_start_image.name
+        self.assertTrue(blob_storage.is_sharded(target))
+        self.assertTrue(target.endswith(f"/{hashlib.sha256(b'same').hexdigest()}.jpg"))
+        trips[1].refresh_from_db()
+        self.assertEqual(trips[1].odometer_start_image.name, target)
+        self.assertEqual(self.refcount(target), 2)
+        for name in names:
+            self.assertFalse(media_storage.exists(name))
+
+        # A rerun finds nothing left to move.
+        stats = blob_storage.relocate_media()
+        self.assertEqual((stats['files'], stats['renamed'], stats['duplicates']), (1, 0, 0))
+
+    def test_collect_unused_blobs(self):
+        name = self.store(b'photo')
+        # The row went away without releasing its reference in time.
+        MediaBlob.objects.filter(name=name).update(refcount=0)
+        self.assertEqual(blob_storage.collect_unused_blobs(timezone.now() - timedelta(minutes=1)), 0)
+        self.assertEqual(blob_storage.collect_unused_blobs(timezone.now() + timedelta(minutes=1)), 1)
+        self.assertFalse(media_storage.exists(name))
@@ -0,0 +1,110 @@
+import hashlib
+import io
+import shutil
+import tempfile
+
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from ..models import ChunkedUpload, Trip, User
+from ..uploads import UploadError, UploadOffsetMismatch, append_chunk, part_path
+from .base import MediaTestCase
+from .test_images import photo
+
+
+class AppendChunkTests(TestCase):
+    def setUp(self):
+        upload_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, upload_dir, ignore_errors=True)
+        settings_override = override_settings(PORTAL_UPLOAD_DIR=upload_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        user = User.objects.create_user('9000000001', password='x')
+        self.upload = ChunkedUpload.objects.create(user=user, filename='a.jpg', size=10)
+
+    def append(self, upload, data, offset, checksum=None):
+        return append_chunk(upload, io.BytesIO(data), offset, len(data), checksum)
+
+    def test_chunks_append_in_order(self):
+        upload = self.append(self.upload, b'01234', 0, hashlib.sha256(b'01234').hexdigest())
+        upload = self.append(upload, b'56789', 5)
+        self.assertEqual(upload.offset, 10)
+        self.assertEqual(part_path(upload).read_bytes(), b'0123456789')
+
+    def test_resent_or_skipped_chunk_conflicts(self):
+        upload = self.append(self.upload, b'01234', 0)
+        for offset in (0, 7):
+            with self.subTest(offset=offset), self.assertRaises(UploadOffsetMismatch) as caught:
+                self.append(upload, b'xx', offset)
+            self.assertEqual(caught.exception.status, 409)
+            self.assertEqual(caught.exception.offset, 5)
+
+    def test_concurrent_chunk_at_the_same_offset_conflicts(self):
+        # Both requests loaded the upload at offset 0; the second one only
+        # finds out once it holds the row lock.
+        stale = ChunkedUpload.objects.get(pk=self.upload.pk)
+        self.append(self.upload, b'01234', 0)
+        with self.assertRaises(UploadOffsetMismatch) as caught:
+            self.append(stale, b'abcde', 0)
+        self.assertEqual(caught.exception.offset, 5)
+        self.assertEqual(part_path(self.upload).read_bytes(), b'01234')
+
+    def test_bad_chunk_is_not_appended(self):
+        with self.assertRaises(UploadError):
+            self.append(self.upload, b'01234', 0, hashlib.sha256(b'other').hexdigest())
+        with self.assertRaises(UploadError):
+            append_chunk(self.upload, io.BytesIO(b'012'), 0, 5)
+        self.upload.refresh_from_db()
+        self.assertEqual(self.upload.offset, 0)
+
+
+class ChunkedUploadApiTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        upload_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, upload_dir, ignore_errors=True)
+        settings_override = override_settings(PORTAL_UPLOAD_DIR=upload_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.agent = User.objects.create_user('9000000001', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.agent)
+
+    def send(self, upload_id, data, offset):
+        return self.client.generic('PUT', f'/api/uploads/{upload_id}/chunk/', data,
+                                   content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset))
+
+    def test_upload_in_chunks_and_attach_to_a_trip(self):
+        data = photo()
+        response = self.client.post('/api/uploads/', {
+            'filename': 'odometer.png', 'size': len(data), 'sha256': hashlib.sha256(data).hexdigest(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        upload_id = response.data['id']
+
+        half = len(data) // 2
+        self.assertEqual(self.send(upload_id, data[:half], 0).status_code, 200)
+        # The app lost the answer and resends the first chunk.
+        response = self.send(upload_id, data[:half], 0)
+        self.assertEqual((response.status_code, response['Upload-Offset']), (409, str(half)))
+        self.assertEqual(self.client.get(f'/api/uploads/{upload_id}/').data['offset'], half)
+        self.assertEqual(self.client.post(f'/api/uploads/{upload_id}/finalize/').status_code, 400)
+
+        self.assertEqual(self.send(upload_id, data[half:], half)['Upload-Offset'], str(len(data)))
+        response = self.client.post(f'/api/uploads/{upload_id}/finalize/')
+        self.assertEqual(response.data['status'], ChunkedUpload.STATUS_COMPLETE)
+
+        response = self.client.post('/api/trips/', {'odometer_start_image_upload': upload_id}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        trip = Trip.objects.get()
+        self.assertEqual(trip.odometer_start_image.read(), data)
+        upload = ChunkedUpload.objects.get(pk=upload_id)
+        self.assertEqual((upload.status, upload.stored_name),
+                         (ChunkedUpload.STATUS_ATTACHED, trip.odometer_start_image.name))
+
+    def test_unfinished_upload_is_rejected(self):
+        upload = ChunkedUpload.objects.create(user=self.agent, filename='a.png', size=10)
+        response = self.client.post('/api/trips/', {'odometer_start_image_upload': str(upload.pk)}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('odometer_start_image_upload', response.data)
+        self.assertFalse(Trip.objects.exists())
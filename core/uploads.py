@@ -0,0 +1,295 @@
+"""
+Resumable uploads for visit, odometer and hotel-bill photos.
+
+Sending a photo inside the multipart visit request means a dropped
+connection on a slow network restarts the whole upload. Instead the app
+can:
+
+1. ``POST /api/uploads/`` with ``filename``, ``size`` and optionally the
+   ``sha256`` of the whole file;
+2. ``PUT /api/uploads/<id>/chunk/`` the bytes in order, each with an
+   ``Upload-Offset`` header and optionally ``Upload-Checksum: sha256 <hex>``.
+   Each chunk is appended to a partial file under ``PORTAL_UPLOAD_DIR``
+   once it has arrived whole and matched its checksum; after a dropped
+   connection ``GET /api/uploads/<id>/`` tells where to resume;
+3. ``POST /api/uploads/<id>/finalize/``, which checks the size, the
+   whole-file checksum and that the file is an image;
+4. send ``<field>_upload=<id>`` instead of the file (``visit_image_upload``,
+   ``odometer_end_image_upload``, ``bill_image_upload``...). The file then
+   goes through the usual ingest pipeline (``core.images``) and storage.
+
+Uploads untouched for ``PORTAL_UPLOAD_TTL_HOURS`` are deleted by
+``collect_stale_uploads`` (``manage.py clean_uploads``, and opportunistically
+when uploads are created).
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+
+from .models import ChunkedUpload
+from .storage import media_storage
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+# Chunks up to this size are checked in memory before they are appended.
+SPOOL_SIZE = 1024 * 1024
+
+
+class UploadError(Exception):
+    """A request the upload cannot accept; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class UploadOffsetMismatch(UploadError):
+    """The chunk does not start where the upload stands (e.g. a resent chunk)."""
+
+    def __init__(self, offset):
+        super().__init__('Upload-Offset does not match the upload offset.', status=409)
+        self.offset = offset
+
+
+def upload_dir():
+    return Path(settings.PORTAL_UPLOAD_DIR)
+
+
+def part_path(upload):
+    return upload_dir() / f'{upload.pk}.part'
+
+
+def parse_checksum(header):
+    """The hex digest of an ``Upload-Checksum: sha256 <hex>`` header, or ``None``."""
+    if not header:
+        return None
+    algorithm, _, value = header.strip().partition(' ')
+    value = value.strip().lower()
+    if algorithm.lower() != 'sha256' or len(value) != 64:
+        raise UploadError('Upload-Checksum must be "sha256 <hex digest>".')
+    return value
+
+
+def append_chunk(upload, stream, offset, length, checksum=None):
+    """
+    Append ``length`` bytes read from ``stream`` at ``offset``.
+
+    The chunk is read and checked before the upload row is locked, so a
+    slow client does not hold the lock, and it is only appended if the
+    upload still stands at ``offset``; a concurrent or repeated chunk gets
+    ``UploadOffsetMismatch``. Returns the updated upload.
+    """
+    if upload.status != ChunkedUpload.STATUS_UPLOADING:
+        raise UploadError('Upload is already finalized.', status=409)
+    if offset != upload.offset:
+        raise UploadOffsetMismatch(upload.offset)
+    if length > settings.PORTAL_UPLOAD_MAX_CHUNK:
+        raise UploadError('Chunk is larger than %d bytes.' % settings.PORTAL_UPLOAD_MAX_CHUNK, status=413)
+    if offset + length > upload.size:
+        raise UploadError('Chunk goes past the declared upload size.')
+
+    directory = upload_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    received = 0
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, dir=directory) as chunk:
+        while received < length:
+            data = stream.read(min(READ_SIZE, length - received)) if stream is not None else b''
+            if not data:
+                break
+            digest.update(data)
+            chunk.write(data)
+            received += len(data)
+        if received != length:
+            raise UploadError('Chunk ended after %d of %d bytes.' % (received, length))
+        if checksum is not None and digest.hexdigest() != checksum:
+            raise UploadError('Chunk checksum does not match.')
+
+        with transaction.atomic():
+            upload = ChunkedUpload.objects.select_for_update().get(pk=upload.pk)
+            if upload.status != ChunkedUpload.STATUS_UPLOADING:
+                raise UploadError('Upload is already finalized.', status=409)
+            if upload.offset != offset:
+                raise UploadOffsetMismatch(upload.offset)
+            chunk.seek(0)
+            path = part_path(upload)
+            with open(path, 'r+b' if path.exists() else 'wb') as part:
+                # Drop anything past the offset left by a write that never
+                # got recorded.
+                part.truncate(offset)
+                part.seek(offset)
+                shutil.copyfileobj(chunk, part, READ_SIZE)
+                part.flush()
+                os.fsync(part.fileno())
+            upload.offset = offset + length
+            upload.save(update_fields=['offset', 'updated_at'])
+    return upload
+
+
+def finalize_upload(upload):
+    """
+    Check a fully sent upload and mark it complete.
+
+    Finalizing a finalized upload returns it unchanged, so the app can
+    retry the request.
+    """
+    with transaction.atomic():
+        upload = ChunkedUpload.objects.select_for_update().get(pk=upload.pk)
+        if upload.status != ChunkedUpload.STATUS_UPLOADING:
+            return upload
+        path = part_path(upload)
+        if upload.offset != upload.size or not path.exists() or path.stat().st_size != upload.size:
+            raise UploadError('Upload is incomplete: %d of %d bytes received.' % (upload.offset, upload.size))
+        if upload.sha256:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as part:
+                while data := part.read(READ_SIZE):
+                    digest.update(data)
+            if digest.hexdigest() != upload.sha256:
+                raise UploadError('Upload checksum does not match.')
+        try:
+            with Image.open(path) as image:
+                image.verify()
+        except Exception:
+            raise UploadError('Upload is not a valid image.')
+        upload.status = ChunkedUpload.STATUS_COMPLETE
+        upload.save(update_fields=['status', 'updated_at'])
+    return upload
+
+
+def resolve_uploads(user, data, field_names):
+    """
+    Finalized uploads of ``user`` named by ``<field>_upload`` keys of ``data``.
+
+    Returns ``{field_name: upload}``; unknown, unfinished or expired uploads
+    raise a ``ValidationError`` keyed by the ``_upload`` parameter.
+    """
+    uploads = {}
+    errors = {}
+    for field_name in field_names:
+        key = f'{field_name}_upload'
+        upload_id = data.get(key)
+        if not upload_id:
+            continue
+        try:
+            upload = ChunkedUpload.objects.get(pk=upload_id, user=user)
+        except (ChunkedUpload.DoesNotExist, DjangoValidationError):
+            errors[key] = 'Unknown upload.'
+            continue
+        if upload.status == ChunkedUpload.STATUS_UPLOADING:
+            errors[key] = 'Upload is not finalized.'
+        elif upload.stored_name and not media_storage.exists(upload.stored_name):
+            errors[key] = 'Upload has expired.'
+        else:
+            uploads[field_name] = upload
+    if errors:
+        raise ValidationError(errors)
+    return uploads
+
+
+def _upload_value(upload):
+    if not upload.stored_name:
+        try:
+            return File(open(part_path(upload), 'rb'), name=upload.filename)
+        except FileNotFoundError:
+            # Attached by a concurrent request in the meantime.
+            upload.refresh_from_db()
+            if not upload.stored_name:
+                raise ValidationError({'upload': 'Upload has expired.'})
+    return upload.stored_name
+
+
+@contextmanager
+def uploaded_files(uploads):
+    """
+    ``{field_name: value}`` to assign to the image fields of ``uploads``.
+
+    A value is the partial file on the first attach, which the field then
+    stores as if it had been uploaded, and the stored name afterwards.
+    Files are closed on exit; call ``mark_attached`` once the row is saved.
+    """
+    values = {}
+    try:
+        for field_name, upload in uploads.items():
+            values[field_name] = _upload_value(upload)
+        yield values
+    finally:
+        for value in values.values():
+            if isinstance(value, File):
+                value.close()
+
+
+def mark_attached(instance, uploads):
+    """Record what ``uploads`` were stored as and drop their partial files."""
+    for field_name, upload in uploads.items():
+        name = getattr(instance, field_name).name
+        ChunkedUpload.objects.filter(pk=upload.pk).update(
+            status=ChunkedUpload.STATUS_ATTACHED, stored_name=name, updated_at=timezone.now(),
+        )
+        transaction.on_commit(lambda path=part_path(upload): _unlink(path))
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def collect_stale_uploads(older_than=None):
+    """
+    Delete uploads not touched since ``older_than`` and their partial files.
+
+    Defaults to ``PORTAL_UPLOAD_TTL_HOURS`` ago. Files in the upload
+    directory without an upload row (left by a crash) go too. Returns the
+    number of uploads deleted.
+    """
+    if older_than is None:
+        older_than = timezone.now() - timedelta(hours=settings.PORTAL_UPLOAD_TTL_HOURS)
+    deleted = 0
+    for upload in ChunkedUpload.objects.filter(updated_at__lt=older_than).iterator():
+        _unlink(part_path(upload))
+        upload.delete()
+        deleted += 1
+
+    directory = upload_dir()
+    if directory.is_dir():
+        known = {f'{pk}.part' for pk in ChunkedUpload.objects.values_list('pk', flat=True).iterator()}
+        cutoff = older_than.timestamp()
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.name not in known and entry.stat().st_mtime < cutoff:
+                _unlink(entry.path)
+    return deleted
+
+
+_last_collected = 0.0
+
+
+def collect_stale_uploads_now_and_then(interval=3600):
+    """``collect_stale_uploads`` at most once per ``interval`` seconds per process."""
+    global _last_collected
+    if time.monotonic() - _last_collected < interval:
+        return 0
+    _last_collected = time.monotonic()
+    try:
+        return collect_stale_uploads()
+    except Exception as exc:
+        logger.warning("Could not collect stale uploads: %s", exc)
+        return 0
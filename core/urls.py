@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import TaskViewSet, DoctorReferralViewSet, PatientReferralViewSet, TripViewSet, OvernightStayViewSet, CustomAuthToken, SpecializationViewSet, QualificationViewSet, AreaViewSet, ClientLogViewSet
+from .views import TaskViewSet, DoctorReferralViewSet, PatientReferralViewSet, TripViewSet, OvernightStayViewSet, CustomAuthToken, SpecializationViewSet, QualificationViewSet, AreaViewSet, ClientLogViewSet, ChunkedUploadViewSet
 
 router = DefaultRouter()
 router.register(r'areas', AreaViewSet, basename='area')
@@ -12,6 +12,7 @@ router.register(r'patient-referrals', PatientReferralViewSet)
 router.register(r'specializations', SpecializationViewSet)
 router.register(r'qualifications', QualificationViewSet)
 router.register(r'logs', ClientLogViewSet, basename='client-log')
+router.register(r'uploads', ChunkedUploadViewSet, basename='upload')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -6,9 +6,13 @@ from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.exceptions import ValidationError
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.authtoken.models import Token
-from .models import Task, DoctorReferral, DoctorVisit, PatientReferral, Trip, OvernightStay, Specialization, Qualification, Area, Address, User, AgentAssignment, AgentAssignmentDoctorStatus, ClientLog
-from .serializers import TaskSerializer, DoctorReferralSerializer, TripDoctorVisitSerializer, PatientReferralSerializer, TripSerializer, OvernightStaySerializer, SpecializationSerializer, QualificationSerializer, AreaSerializer, AddressSerializer, ClientLogSerializer
+from .models import Task, DoctorReferral, DoctorVisit, PatientReferral, Trip, OvernightStay, Specialization, Qualification, Area, Address, User, AgentAssignment, AgentAssignmentDoctorStatus, ClientLog, ChunkedUpload
+from .serializers import TaskSerializer, DoctorReferralSerializer, TripDoctorVisitSerializer, PatientReferralSerializer, TripSerializer, OvernightStaySerializer, SpecializationSerializer, QualificationSerializer, AreaSerializer, AddressSerializer, ClientLogSerializer, ChunkedUploadSerializer
 from .permissions import DynamicAPIPermission
+from .uploads import (
+    UploadError, UploadOffsetMismatch, append_chunk, collect_stale_uploads_now_and_then, finalize_upload,
+    mark_attached, parse_checksum, part_path, resolve_uploads, uploaded_files,
+)
 
 class SpecializationViewSet(viewsets.ModelViewSet):
     """ViewSet for managing doctor specializations"""
@@ -52,14 +56,17 @@ class TripViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         # Filter trips by the current agent
-        return Trip.objects.filter(agent=self.request.user).prefetch_related(
+        return Trip.objects.filter(agent=self.request.user, deleted_at__isnull=True).prefetch_related(
             'doctor_visits__doctor__address_details__area',
             'doctor_referrals__address_details__area',
             'overnight_stays',
         )
 
     def perform_create(self, serializer):
-        serializer.save(agent=self.request.user)
+        uploads = resolve_uploads(self.request.user, self.request.data, ('odometer_start_image', 'odometer_end_image'))
+        with uploaded_files(uploads) as images:
+            trip = serializer.save(agent=self.request.user, **images)
+        mark_attached(trip, uploads)
 
     @action(detail=False, methods=['get'])
     def current(self, request):
@@ -75,7 +82,8 @@ class TripViewSet(viewsets.ModelViewSet):
         trip = self.get_object()
         if trip.status == 'COMPLETED':
              return Response({'error': 'Trip already completed'}, status=status.HTTP_400_BAD_REQUEST)
-        
+        uploads = resolve_uploads(request.user, request.data, ('odometer_end_image',))
+
         trip.status = 'COMPLETED'
         trip.end_time = timezone.now()
         # Update other fields if provided appropriately
@@ -89,8 +97,12 @@ class TripViewSet(viewsets.ModelViewSet):
              trip.end_lat = request.data['end_lat']
         if 'end_long' in request.data:
              trip.end_long = request.data['end_long']
-        
-        trip.save()
+
+        with uploaded_files(uploads) as images:
+            if 'odometer_end_image' in images:
+                trip.odometer_end_image = images['odometer_end_image']
+            trip.save()
+        mark_attached(trip, uploads)
         # After trip completion, update assignment statuses for completed visits
         try:
             from core.models import AgentAssignmentDoctorStatus, AgentAssignment
@@ -172,7 +184,7 @@ class ClientLogViewSet(
 
     def get_queryset(self):
         if self.request.user.is_staff:
-            return Area.objects.all()
+            return Area.objects.filter(deleted_at__isnull=True)
         # Backward-compatible assignment resolution:
         # 1) AgentAssignment history (new source of truth)
         # 2) Area.agent pointer (legacy/admin edits)
@@ -185,7 +197,7 @@ class ClientLogViewSet(
             Area.objects.filter(agent=self.request.user).values_list('id', flat=True)
         )
         assigned_area_ids = assignment_area_ids | legacy_area_ids
-        return Area.objects.filter(id__in=assigned_area_ids)
+        return Area.objects.filter(id__in=assigned_area_ids, deleted_at__isnull=True)
 
     @action(detail=True, methods=['post'])
     def assign_agent(self, request, pk=None):
@@ -484,17 +496,23 @@ class DoctorReferralViewSet(viewsets.ModelViewSet):
                     visit.is_draft = is_draft
                     changed = True
 
+        uploads = resolve_uploads(request.user, request.data, ('visit_image',))
         if 'visit_image' in request.FILES:
             visit.visit_image = request.FILES['visit_image']
             changed = True
 
         if is_draft is not True:
-            has_image = bool(visit.visit_image) or 'visit_image' in request.FILES
+            has_image = bool(visit.visit_image) or 'visit_image' in request.FILES or 'visit_image' in uploads
             if not has_image:
                 raise ValidationError({'visit_image': 'This field is required for completed visits.'})
 
-        if changed:
-            visit.save()
+        with uploaded_files(uploads) as images:
+            if 'visit_image' in images:
+                visit.visit_image = images['visit_image']
+                changed = True
+            if changed:
+                visit.save()
+        mark_attached(visit, uploads)
 
         # Keep doctor-level visit fields synced to the latest trip visit for backward compatibility.
         doctor_update_fields = []
@@ -649,6 +667,18 @@ class OvernightStayViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return OvernightStay.objects.filter(trip__agent=self.request.user)
 
+    def perform_create(self, serializer):
+        self._save_with_upload(serializer)
+
+    def perform_update(self, serializer):
+        self._save_with_upload(serializer)
+
+    def _save_with_upload(self, serializer):
+        uploads = resolve_uploads(self.request.user, self.request.data, ('bill_image',))
+        with uploaded_files(uploads) as images:
+            stay = serializer.save(**images)
+        mark_attached(stay, uploads)
+
 class PatientReferralViewSet(viewsets.ModelViewSet):
     queryset = PatientReferral.objects.all()
     serializer_class = PatientReferralSerializer
@@ -659,3 +689,56 @@ class PatientReferralViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         serializer.save(agent=self.request.user)
+
+
+class ChunkedUploadViewSet(
+    mixins.CreateModelMixin,
+    mixins.RetrieveModelMixin,
+    mixins.DestroyModelMixin,
+    viewsets.GenericViewSet,
+):
+    """Resumable image uploads; see core/uploads.py for the protocol."""
+    serializer_class = ChunkedUploadSerializer
+    permission_classes = [IsAuthenticated, DynamicAPIPermission]
+
+    def get_queryset(self):
+        return ChunkedUpload.objects.filter(user=self.request.user)
+
+    def perform_create(self, serializer):
+        collect_stale_uploads_now_and_then()
+        serializer.save(user=self.request.user)
+
+    def perform_destroy(self, instance):
+        part = part_path(instance)
+        instance.delete()
+        part.unlink(missing_ok=True)
+
+    @action(detail=True, methods=['put'])
+    def chunk(self, request, pk=None):
+        upload = self.get_object()
+        try:
+            offset = int(request.headers['Upload-Offset'])
+        except (KeyError, ValueError):
+            return Response({'error': 'Upload-Offset header required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or '')
+        except ValueError:
+            return Response({'error': 'Content-Length header required'}, status=status.HTTP_411_LENGTH_REQUIRED)
+        try:
+            checksum = parse_checksum(request.headers.get('Upload-Checksum'))
+            # Read the raw body; request.data would buffer and parse it.
+            upload = append_chunk(upload, request.stream, offset, length, checksum)
+        except UploadOffsetMismatch as exc:
+            return Response({'error': str(exc), 'offset': exc.offset}, status=exc.status,
+                            headers={'Upload-Offset': str(exc.offset)})
+        except UploadError as exc:
+            return Response({'error': str(exc)}, status=exc.status)
+        return Response(self.get_serializer(upload).data, headers={'Upload-Offset': str(upload.offset)})
+
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        try:
+            upload = finalize_upload(self.get_object())
+        except UploadError as exc:
+            return Response({'error': str(exc)}, status=exc.status)
+        return Response(self.get_serializer(upload).data)
@@ -183,6 +183,22 @@ else:
     else:
         MEDIA_ROOT = Path(BASE_DIR) / 'media'
 SERVE_MEDIA_IN_PROD = os.environ.get('SERVE_MEDIA_IN_PROD', 'true').lower() == 'true'
+# core.media.serve_media: browser cache lifetime of content-addressed files,
+# and an optional hand-off to the front proxy (e.g. prefix '/protected-media/'
+# mapped to MEDIA_ROOT by an nginx `internal` location; use header
+# 'X-Sendfile' and prefix = MEDIA_ROOT for Apache/lighttpd).
+PORTAL_MEDIA_MAX_AGE = int(os.environ.get('PORTAL_MEDIA_MAX_AGE', str(365 * 24 * 3600)))
+PORTAL_MEDIA_ACCEL_PREFIX = os.environ.get('PORTAL_MEDIA_ACCEL_PREFIX', '')
+PORTAL_MEDIA_ACCEL_HEADER = os.environ.get('PORTAL_MEDIA_ACCEL_HEADER', 'X-Accel-Redirect')
+
+# Uploaded photos (core/images.py): 'sync' downscales and recompresses them
+# during the upload request, 'background' rewrites them on a worker thread
+# after commit, 'off' stores originals untouched.
+PORTAL_IMAGE_INGEST = os.environ.get('PORTAL_IMAGE_INGEST', 'sync')
+PORTAL_IMAGE_MAX_SIZE = int(os.environ.get('PORTAL_IMAGE_MAX_SIZE', '1600'))
+PORTAL_IMAGE_QUALITY = int(os.environ.get('PORTAL_IMAGE_QUALITY', '80'))
+# Thumbnail label -> longest side in pixels, served by the |thumbnail_url filter.
+PORTAL_IMAGE_THUMBNAIL_SIZES = {'sm': 160, 'md': 480}
 
 # Authentication Redirects
 LOGIN_REDIRECT_URL = '/portal/'
@@ -190,3 +206,47 @@ LOGOUT_REDIRECT_URL = '/portal/'
 LOGIN_URL = '/admin/login/' # Default to admin login if needed, or custom portal login if it exists
 
 
+
+# Background jobs (portal/jobs.py)
+# 'process' spawns `manage.py run_portal_jobs --until-idle` on enqueue when
+# no spawned runner is alive, 'thread' runs jobs inside the web process,
+# 'external' expects a separate `manage.py run_portal_jobs` service (e.g. a
+# Render background worker with the same build command and environment).
+PORTAL_JOB_RUNNER = os.environ.get('PORTAL_JOB_RUNNER', 'process')
+PORTAL_JOB_MAX_ACTIVE_PER_USER = int(os.environ.get('PORTAL_JOB_MAX_ACTIVE_PER_USER', '2'))
+PORTAL_JOB_TIMEOUT = int(os.environ.get('PORTAL_JOB_TIMEOUT', '1800'))
+PORTAL_JOB_RESULT_TTL_DAYS = int(os.environ.get('PORTAL_JOB_RESULT_TTL_DAYS', '7'))
+
+# Seconds a process reuses the referral rate cache version (portal/commissions.py)
+# before checking the database again for changes made by other processes.
+PORTAL_RATE_CACHE_VERSION_TTL = float(os.environ.get('PORTAL_RATE_CACHE_VERSION_TTL', '5'))
+
+# Files that must not be reachable through MEDIA_URL (job results, report cache).
+PRIVATE_FILES_ROOT = Path(os.environ.get('PRIVATE_FILES_ROOT') or Path(MEDIA_ROOT).parent / 'private')
+
+# Rendered report PDFs (portal/pdfcache.py), evicted oldest-first by size and age.
+# PORTAL_DEPLOY_VERSION is part of every cache key so a deploy that changes a
+# template, an included template or the rendering code never serves an old
+# PDF; Render sets RENDER_GIT_COMMIT for each deploy.
+PORTAL_DEPLOY_VERSION = os.environ.get('PORTAL_DEPLOY_VERSION') or os.environ.get('RENDER_GIT_COMMIT', '')
+PORTAL_PDF_CACHE_DIR = Path(os.environ.get('PORTAL_PDF_CACHE_DIR') or PRIVATE_FILES_ROOT / 'report_cache')
+PORTAL_PDF_CACHE_MAX_BYTES = int(os.environ.get('PORTAL_PDF_CACHE_MAX_BYTES', str(200 * 1024 * 1024)))
+PORTAL_PDF_CACHE_MAX_AGE = int(os.environ.get('PORTAL_PDF_CACHE_MAX_AGE', str(7 * 24 * 3600)))
+
+# Resumable image uploads (core/uploads.py): partial files, the largest
+# upload and chunk accepted, and how long an unused upload is kept.
+PORTAL_UPLOAD_DIR = Path(os.environ.get('PORTAL_UPLOAD_DIR') or PRIVATE_FILES_ROOT / 'chunked_uploads')
+PORTAL_UPLOAD_MAX_SIZE = int(os.environ.get('PORTAL_UPLOAD_MAX_SIZE', str(30 * 1024 * 1024)))
+PORTAL_UPLOAD_MAX_CHUNK = int(os.environ.get('PORTAL_UPLOAD_MAX_CHUNK', str(4 * 1024 * 1024)))
+PORTAL_UPLOAD_TTL_HOURS = int(os.environ.get('PORTAL_UPLOAD_TTL_HOURS', '24'))
+
+# Media manifests of past backups (portal/backups.py); incremental exports
+# only ship files that changed since the manifest they are based on.
+PORTAL_BACKUP_MANIFEST_DIR = Path(os.environ.get('PORTAL_BACKUP_MANIFEST_DIR') or PRIVATE_FILES_ROOT / 'backup_manifests')
+
+# Archives written by `manage.py run_backup` (portal/backup_runs.py) and how
+# many daily / weekly / monthly ones its retention policy keeps.
+PORTAL_BACKUP_DIR = Path(os.environ.get('PORTAL_BACKUP_DIR') or PRIVATE_FILES_ROOT / 'backups')
+PORTAL_BACKUP_KEEP_DAILY = int(os.environ.get('PORTAL_BACKUP_KEEP_DAILY', '7'))
+PORTAL_BACKUP_KEEP_WEEKLY = int(os.environ.get('PORTAL_BACKUP_KEEP_WEEKLY', '4'))
+PORTAL_BACKUP_KEEP_MONTHLY = int(os.environ.get('PORTAL_BACKUP_KEEP_MONTHLY', '6'))
@@ -1,11 +1,13 @@
+import re
+
 from django.contrib import admin
 from django.urls import path, include
 from django.views.generic import RedirectView
 from django.conf import settings
-from django.conf.urls.static import static
-from django.views.static import serve
 from django.urls import re_path
 
+from core.media import serve_media
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('accounts/', include('django.contrib.auth.urls')), # Added for better redirect control
@@ -14,15 +16,13 @@ urlpatterns = [
     path('', RedirectView.as_view(url='/portal/', permanent=False)),
 ]
 
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-elif getattr(settings, 'SERVE_MEDIA_IN_PROD', False):
-    # Production fallback for user-uploaded media.
-    # For Render, pair this with a persistent disk-backed MEDIA_ROOT.
+if settings.DEBUG or getattr(settings, 'SERVE_MEDIA_IN_PROD', False):
+    # User-uploaded media with validators, caching headers and Range support.
+    # For Render, pair this with a persistent disk-backed MEDIA_ROOT; behind
+    # nginx set PORTAL_MEDIA_ACCEL_PREFIX so the proxy sends the files.
     urlpatterns += [
         re_path(
-            r'^media/(?P<path>.*)$',
-            serve,
-            {'document_root': settings.MEDIA_ROOT},
+            r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')),
+            serve_media,
         ),
     ]
@@ -1,3 +1,17 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import BackgroundJob, BackupRecord
+
+
+@admin.register(BackgroundJob)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'progress', 'user', 'created_at', 'finished_at')
+    list_filter = ('kind', 'status')
+    readonly_fields = ('created_at', 'started_at', 'finished_at')
+
+
+@admin.register(BackupRecord)
+class BackupRecordAdmin(admin.ModelAdmin):
+    list_display = ('backup_id', 'kind', 'status', 'size_bytes', 'media_files', 'started_at', 'finished_at', 'pruned_at')
+    list_filter = ('kind', 'status')
+    readonly_fields = ('started_at', 'finished_at', 'pruned_at')
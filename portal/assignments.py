@@ -0,0 +1,136 @@
+"""
+Set-based reassignment of doctors to executives.
+
+``DoctorAssignmentView`` used to resolve busy doctors in Python and could only
+move the checked rows of one page. ``reassign_doctors`` takes any doctor
+queryset (a checkbox selection or every doctor matching a filter), leaves out
+busy doctors in SQL, moves the rest with one UPDATE and records the move as
+``AgentAssignment`` history with ``bulk_create``, all in one transaction.
+"""
+from __future__ import annotations
+
+from django.db import transaction
+from django.db.models import Count, Q
+
+from core.dataversion import REPORTS, bump_data_version
+from core.models import AgentAssignment, AgentAssignmentDoctorStatus, Area, DoctorReferral
+
+BULK_BATCH_SIZE = 1000
+
+# Query-string keys understood by ``filter_doctors``.
+FILTER_KEYS = ('search', 'status', 'area', 'city', 'specialization', 'current_agent')
+
+
+def busy_doctor_q():
+    """Doctors whose last trip is still running; they keep their executive."""
+    return Q(trip__status='ONGOING')
+
+
+def filter_doctors(params, queryset=None):
+    """
+    Apply the assignment page filters in ``params`` (a QueryDict or dict).
+
+    Internal doctors are never listed: they cannot be assigned to executives.
+    """
+    queryset = DoctorReferral.objects.filter(is_internal=False) if queryset is None else queryset
+    search = (params.get('search') or '').strip()
+    if search:
+        queryset = queryset.filter(
+            Q(name__icontains=search) |
+            Q(address_details__area__name__icontains=search) |
+            Q(address_details__area__city__icontains=search) |
+            Q(specialization__icontains=search)
+        )
+
+    status = params.get('status')
+    if status == 'unassigned':
+        queryset = queryset.filter(agent__isnull=True)
+    elif status == 'assigned':
+        queryset = queryset.filter(agent__isnull=False)
+
+    area = params.get('area')
+    if area and area.isdigit():
+        queryset = queryset.filter(address_details__area_id=int(area))
+    city = (params.get('city') or '').strip()
+    if city:
+        queryset = queryset.filter(address_details__area__city__iexact=city)
+    specialization = (params.get('specialization') or '').strip()
+    if specialization:
+        queryset = queryset.filter(specialization__iexact=specialization)
+
+    agent = params.get('current_agent')
+    if agent == 'none':
+        queryset = queryset.filter(agent__isnull=True)
+    elif agent and agent.isdigit():
+        queryset = queryset.filter(agent_id=int(agent))
+    return queryset
+
+
+def reassign_doctors(doctors, agent, notes=''):
+    """
+    Assign every non-busy, non-internal doctor in ``doctors`` to ``agent``.
+
+    Each area that received doctors gets one ``AgentAssignment`` with a fresh
+    doctor status for each moved doctor, and its ``Area.agent`` pointer moves
+    to ``agent`` as the ``AgentAssignment`` post_save signal would (bulk
+    writes send no signals).
+
+    Returns a dict of counts: ``matched``, ``internal`` (skipped internal
+    doctors), ``busy``, ``updated``, ``areas`` and ``without_area`` (moved
+    doctors with no address, so no history row).
+    """
+    candidates = doctors.filter(is_internal=False).order_by()
+    with transaction.atomic():
+        totals = doctors.order_by().aggregate(
+            matched=Count('pk'), internal=Count('pk', filter=Q(is_internal=True)),
+        )
+        matched, internal = totals['matched'], totals['internal']
+        # Lock the doctors being moved so a trip starting meanwhile cannot
+        # pick one up halfway through. ``of`` keeps the lock off the
+        # nullable side of the joins, which PostgreSQL rejects.
+        rows = list(
+            candidates.exclude(busy_doctor_q())
+            .select_for_update(of=('self',))
+            .values_list('pk', 'address_details__area_id')
+        )
+        counts = {
+            'matched': matched, 'internal': internal, 'busy': matched - internal - len(rows),
+            'updated': 0, 'areas': 0, 'without_area': 0,
+        }
+        if not rows:
+            return counts
+
+        doctor_ids = [pk for pk, _ in rows]
+        counts['updated'] = DoctorReferral.objects.filter(pk__in=doctor_ids).update(agent=agent, status='Assigned')
+
+        by_area = {}
+        for pk, area_id in rows:
+            if area_id is None:
+                counts['without_area'] += 1
+            else:
+                by_area.setdefault(area_id, []).append(pk)
+        if by_area:
+            assignments = AgentAssignment.objects.bulk_create(
+                [
+                    AgentAssignment(
+                        agent=agent, area_id=area_id,
+                        notes=notes or f'Bulk reassignment of {len(ids)} doctor(s).',
+                    )
+                    for area_id, ids in by_area.items()
+                ],
+                batch_size=BULK_BATCH_SIZE,
+            )
+            AgentAssignmentDoctorStatus.objects.bulk_create(
+                [
+                    AgentAssignmentDoctorStatus(assignment=assignment, doctor_id=doctor_id)
+                    for assignment in assignments
+                    for doctor_id in by_area[assignment.area_id]
+                ],
+                batch_size=BULK_BATCH_SIZE,
+            )
+            Area.objects.filter(pk__in=by_area).update(agent=agent)
+            counts['areas'] = len(by_area)
+
+        # The UPDATE above bypasses the DoctorReferral post_save signal.
+        bump_data_version(REPORTS)
+    return counts
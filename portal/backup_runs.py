@@ -0,0 +1,142 @@
+"""
+Scheduled backups kept on local disk.
+
+``run_backup`` writes a ``portal.backups`` archive into
+``PORTAL_BACKUP_DIR`` (outside any web request) and records it as a
+``BackupRecord``. Incremental runs build on the newest stored archive with
+media, so every chain can be restored from this directory alone.
+
+``apply_retention`` keeps the newest archive of each of the last N days,
+ISO weeks and months that have one (grandfather-father-son), plus every
+archive a kept incremental still depends on; the other archive files are
+deleted and their records marked pruned.
+"""
+from __future__ import annotations
+
+import os
+import zipfile
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from .backups import BackupError, load_manifest, manifest_dir, new_backup_id, read_manifest, stream_backup
+from .models import BackupRecord
+
+
+def backup_dir():
+    return Path(settings.PORTAL_BACKUP_DIR)
+
+
+def _latest_stored_parent():
+    record = (
+        BackupRecord.objects.filter(
+            status=BackupRecord.STATUS_SUCCEEDED, pruned_at__isnull=True, included_media=True,
+        ).exclude(file_name='').order_by('-started_at').first()
+    )
+    return load_manifest(record.backup_id) if record else None
+
+
+def run_backup(include_media=True, incremental=False):
+    """Write one archive and return its ``BackupRecord``; failures are recorded, then re-raised."""
+    parent = _latest_stored_parent() if include_media and incremental else None
+    backup_id = new_backup_id()
+    record = BackupRecord.objects.create(
+        backup_id=backup_id,
+        parent_id=parent['backup_id'] if parent else '',
+        kind=BackupRecord.KIND_INCREMENTAL if parent else BackupRecord.KIND_FULL,
+        included_media=include_media,
+    )
+    directory = backup_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f'hospitalemr-backup-{backup_id}.zip'
+    partial = path.with_name(path.name + '.part')
+    try:
+        with partial.open('wb') as out:
+            for chunk in stream_backup(include_media=include_media, parent=parent, backup_id=backup_id):
+                out.write(chunk)
+        os.replace(partial, path)
+        with zipfile.ZipFile(path) as zf:
+            manifest = read_manifest(zf)
+    except Exception as exc:
+        partial.unlink(missing_ok=True)
+        record.status = BackupRecord.STATUS_FAILED
+        record.error = str(exc) or exc.__class__.__name__
+        record.finished_at = timezone.now()
+        record.save(update_fields=['status', 'error', 'finished_at'])
+        raise
+
+    record.status = BackupRecord.STATUS_SUCCEEDED
+    record.file_name = path.name
+    record.size_bytes = path.stat().st_size
+    record.media_files = len(manifest['included']) if manifest else 0
+    record.finished_at = timezone.now()
+    record.save(update_fields=['status', 'file_name', 'size_bytes', 'media_files', 'finished_at'])
+    return record
+
+
+def retained_ids(records, keep_daily, keep_weekly, keep_monthly):
+    """
+    ``backup_id``s to keep among ``records`` (newest first).
+
+    The newest archive of each day, ISO week and month counts towards its
+    bucket; parents of anything kept are kept as well.
+    """
+    buckets = (
+        (keep_daily, lambda moment: moment.date()),
+        (keep_weekly, lambda moment: moment.isocalendar()[:2]),
+        (keep_monthly, lambda moment: (moment.year, moment.month)),
+    )
+    keep = set()
+    for limit, key in buckets:
+        seen = set()
+        for record in records:
+            bucket = key(timezone.localtime(record.started_at))
+            if bucket in seen:
+                continue
+            if len(seen) >= limit:
+                break
+            seen.add(bucket)
+            keep.add(record.backup_id)
+
+    parents = {record.backup_id: record.parent_id for record in records}
+    for backup_id in list(keep):
+        parent_id = parents.get(backup_id)
+        while parent_id and parent_id not in keep:
+            keep.add(parent_id)
+            parent_id = parents.get(parent_id)
+    return keep
+
+
+def apply_retention(keep_daily=None, keep_weekly=None, keep_monthly=None, dry_run=False):
+    """Prune stored archives outside the policy; returns the pruned records."""
+    keep_daily = settings.PORTAL_BACKUP_KEEP_DAILY if keep_daily is None else keep_daily
+    keep_weekly = settings.PORTAL_BACKUP_KEEP_WEEKLY if keep_weekly is None else keep_weekly
+    keep_monthly = settings.PORTAL_BACKUP_KEEP_MONTHLY if keep_monthly is None else keep_monthly
+
+    records = list(
+        BackupRecord.objects.filter(status=BackupRecord.STATUS_SUCCEEDED, pruned_at__isnull=True)
+        .exclude(file_name='').order_by('-started_at')
+    )
+    keep = retained_ids(records, keep_daily, keep_weekly, keep_monthly)
+    pruned = [record for record in records if record.backup_id not in keep]
+    if dry_run:
+        return pruned
+
+    now = timezone.now()
+    for record in pruned:
+        (backup_dir() / record.file_name).unlink(missing_ok=True)
+        (manifest_dir() / f'{record.backup_id}.json').unlink(missing_ok=True)
+        record.pruned_at = now
+        record.save(update_fields=['pruned_at'])
+    return pruned
+
+
+def archive_path(record):
+    """Path of a stored archive, or ``BackupError`` if it is gone."""
+    if not record.is_available:
+        raise BackupError("This backup archive is no longer stored.")
+    path = backup_dir() / Path(record.file_name).name
+    if not path.exists():
+        raise BackupError("This backup archive is missing from the backup directory.")
+    return path
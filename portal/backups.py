@@ -0,0 +1,463 @@
+"""
+Streaming backup archives.
+
+``stream_backup`` yields a zip archive as it is written: ``meta.json``, the
+database and optionally every file under ``MEDIA_ROOT`` as
+``media/<path>``, through ``portal.zipstream`` so the first bytes reach the
+client immediately and nothing is staged on disk.
+
+The database is stored as one gzipped NDJSON stream per model
+(``data/<app_label>.<model>.ndjson.gz``, one natural-key fixture object per
+line). A thread pool dumps the models concurrently, each worker on its own
+connection (sharing one snapshot on PostgreSQL) into a spooled buffer that
+only spills to disk for large models. ``meta.json`` lists the models in
+dependency order and fingerprints the applied migrations. The older single
+fixture (``fixture/data.json``, ``data_format='json'``) is still written on
+request and read by ``portal.restore``.
+
+Media backups carry ``manifest.json``: the path, size, mtime and SHA-256
+of every file under ``MEDIA_ROOT`` at the time. The manifest is also kept
+in ``PORTAL_BACKUP_MANIFEST_DIR`` so a later export can be incremental:
+it ships the fixture, the new manifest and only the files that are new or
+whose size or mtime changed. ``resolve_chain`` puts a full backup and its
+incrementals back in order and finds, for every file of the newest
+manifest, the archive that holds its latest copy.
+"""
+from __future__ import annotations
+
+import contextlib
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+from django.db.migrations.recorder import MigrationRecorder
+from django.utils import timezone
+
+from .zipstream import ZipStream
+
+logger = logging.getLogger(__name__)
+
+FIXTURE_NAME = 'fixture/data.json'
+META_NAME = 'meta.json'
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+MEDIA_PREFIX = 'media'
+DATA_PREFIX = 'data'
+DATA_FORMAT_NDJSON = 'ndjson'
+DATA_FORMAT_JSON = 'json'
+
+FIXTURE_BATCH_SIZE = 500
+FILE_CHUNK_SIZE = 1024 * 1024
+DUMP_WORKERS = 4
+# Per-model dumps stay in memory up to this size, then spill to a temp file.
+DUMP_SPOOL_SIZE = 8 * 1024 * 1024
+
+
+class BackupError(Exception):
+    """A backup archive or chain is unusable."""
+
+
+def backup_models(using=DEFAULT_DB_ALIAS):
+    """Concrete models in the order ``dumpdata`` would serialize them."""
+    app_list = [(config, None) for config in apps.get_app_configs() if config.models_module is not None]
+    return [
+        model for model in serializers.sort_dependencies(app_list, allow_cycles=True)
+        if not model._meta.proxy and router.allow_migrate_model(using, model)
+    ]
+
+
+def _natural_key_relations(model):
+    """
+    Relations the serializer follows to write natural foreign keys.
+
+    Selecting them with the rows avoids a query per row and relation.
+    """
+    related = []
+    for field in model._meta.concrete_fields:
+        target = field.remote_field.model if field.is_relation else None
+        if target is None or not hasattr(target, 'natural_key'):
+            continue
+        related.append(field.name)
+        related.extend(
+            f'{field.name}__{inner.name}' for inner in target._meta.concrete_fields
+            if inner.is_relation and hasattr(inner.remote_field.model, 'natural_key')
+        )
+    return related
+
+
+def backup_queryset(model, using=DEFAULT_DB_ALIAS):
+    queryset = model._base_manager.using(using).order_by(model._meta.pk.name)
+    related = _natural_key_relations(model)
+    return queryset.select_related(*related) if related else queryset
+
+
+def iter_fixture(models=None, batch_size=FIXTURE_BATCH_SIZE, using=DEFAULT_DB_ALIAS):
+    """
+    Yield ``dumpdata``-compatible JSON for ``models`` in encoded pieces.
+
+    Rows are read with a server-side iterator and serialized ``batch_size``
+    objects at a time, so neither the queryset nor the document is ever held
+    in memory. ``loaddata`` reads the result like any other fixture.
+    """
+    yield b'['
+    first = True
+    for model in models or backup_models(using):
+        queryset = backup_queryset(model, using)
+        batch = []
+        for obj in queryset.iterator(chunk_size=batch_size):
+            batch.append(obj)
+            if len(batch) >= batch_size:
+                yield _serialize_batch(batch, first)
+                first = False
+                batch = []
+        if batch:
+            yield _serialize_batch(batch, first)
+            first = False
+    yield b']'
+
+
+def _serialize_batch(objects, first):
+    data = serializers.serialize(
+        'json', objects, use_natural_foreign_keys=True, use_natural_primary_keys=True,
+    )
+    # Each batch is a complete JSON array; splice its items into the outer one.
+    body = data[1:-1]
+    return (body if first else ', ' + body).encode('utf-8')
+
+
+def data_member(label):
+    return f'{DATA_PREFIX}/{label}.ndjson.gz'
+
+
+def schema_fingerprint(using=DEFAULT_DB_ALIAS):
+    """Applied migrations and a hash of them, to compare a backup with this database."""
+    applied = sorted(
+        f'{app}.{name}' for app, name in MigrationRecorder(connections[using]).applied_migrations()
+    )
+    return {
+        'migrations': applied,
+        'fingerprint': hashlib.sha256('\n'.join(applied).encode('utf-8')).hexdigest(),
+    }
+
+
+@contextlib.contextmanager
+def _shared_snapshot(using):
+    """
+    Yield a PostgreSQL snapshot id other connections can read at (else None).
+
+    The exporting transaction stays open until the block ends.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        yield None
+        return
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+        cursor.execute('SELECT pg_export_snapshot()')
+        yield cursor.fetchone()[0]
+
+
+def _dump_model(model, snapshot, batch_size, using):
+    """Gzipped NDJSON for ``model`` in a spooled file; runs on a worker thread."""
+    spool = tempfile.SpooledTemporaryFile(max_size=DUMP_SPOOL_SIZE)
+    count = 0
+    try:
+        with transaction.atomic(using=using):
+            if snapshot:
+                with connections[using].cursor() as cursor:
+                    cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+                    cursor.execute('SET TRANSACTION SNAPSHOT %s', [snapshot])
+            queryset = backup_queryset(model, using)
+            with gzip.GzipFile(fileobj=spool, mode='wb', compresslevel=6, mtime=0) as out:
+                batch = []
+                for obj in queryset.iterator(chunk_size=batch_size):
+                    batch.append(obj)
+                    if len(batch) >= batch_size:
+                        count += _write_ndjson(out, batch)
+                        batch = []
+                if batch:
+                    count += _write_ndjson(out, batch)
+    except BaseException:
+        spool.close()
+        raise
+    finally:
+        # Worker threads own their connections; don't leave them open.
+        connections.close_all()
+    size = spool.tell()
+    spool.seek(0)
+    return model, spool, size, count
+
+
+def _write_ndjson(out, objects):
+    rows = serializers.serialize('python', objects, use_natural_foreign_keys=True, use_natural_primary_keys=True)
+    out.write(''.join(
+        json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':')) + '\n' for row in rows
+    ).encode('utf-8'))
+    return len(rows)
+
+
+def iter_model_dumps(models, batch_size=FIXTURE_BATCH_SIZE, workers=DUMP_WORKERS, using=DEFAULT_DB_ALIAS):
+    """Yield ``(model, spooled file, size, rows)`` as the parallel dumps finish."""
+    with _shared_snapshot(using) as snapshot, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_dump_model, model, snapshot, batch_size, using) for model in models]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            for future in futures:
+                if future.cancel() or not future.done():
+                    continue
+                if future.exception() is None:
+                    future.result()[1].close()
+
+
+def iter_media_files(media_root):
+    """``(relative posix path, absolute path)`` for every file under ``media_root``, sorted per directory."""
+    media_root = Path(media_root)
+    for directory, dirnames, filenames in os.walk(media_root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = Path(directory) / filename
+            if path.is_file():
+                yield path.relative_to(media_root).as_posix(), path
+
+
+def new_backup_id():
+    # Sorts chronologically, which ``latest_manifest`` relies on.
+    return f"{timezone.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+def manifest_dir():
+    return Path(settings.PORTAL_BACKUP_MANIFEST_DIR)
+
+
+def save_manifest(manifest):
+    directory = manifest_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{manifest['backup_id']}.json"
+    tmp = path.with_suffix('.tmp')
+    tmp.write_text(json.dumps(manifest), encoding='utf-8')
+    os.replace(tmp, path)
+
+
+def load_manifest(backup_id):
+    name = Path(str(backup_id)).name
+    try:
+        return json.loads((manifest_dir() / f'{name}.json').read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        raise BackupError(f"No stored manifest for backup {backup_id}.")
+
+
+def recent_manifests(limit=10):
+    """Summaries of the newest stored manifests, newest first."""
+    directory = manifest_dir()
+    if not directory.exists():
+        return []
+    summaries = []
+    for path in sorted(directory.glob('*.json'), reverse=True)[:limit]:
+        try:
+            manifest = json.loads(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            continue
+        summaries.append({
+            'backup_id': manifest['backup_id'],
+            'kind': manifest['kind'],
+            'created_at': manifest['created_at'],
+            'files': len(manifest['files']),
+            'included': len(manifest['included']),
+            'bytes': sum(entry['size'] for entry in manifest['files'].values()),
+        })
+    return summaries
+
+
+def latest_manifest():
+    directory = manifest_dir()
+    names = sorted(directory.glob('*.json'), reverse=True) if directory.exists() else []
+    return load_manifest(names[0].stem) if names else None
+
+
+def backup_meta(include_media, media_root, backup_id=None, parent=None):
+    return {
+        'data_format': DATA_FORMAT_JSON,
+        'created_at': timezone.now().isoformat(),
+        'base_dir': str(getattr(settings, 'BASE_DIR', Path.cwd())),
+        'included_media': bool(include_media),
+        'media_root': str(media_root) if include_media and media_root else None,
+        'backup_id': backup_id,
+        'kind': 'incremental' if parent else 'full',
+        'parent_id': parent['backup_id'] if parent else None,
+    }
+
+
+def _unchanged(previous, stat):
+    return previous is not None and previous['size'] == stat.st_size and previous['mtime'] == stat.st_mtime_ns
+
+
+def stream_backup(include_media=True, parent=None, backup_id=None, data_format=DATA_FORMAT_NDJSON):
+    """
+    Yield a complete backup zip (see the module docstring).
+
+    ``parent`` is a stored manifest to make the media part incremental
+    against; it is ignored without media.
+    """
+    media_root = Path(settings.MEDIA_ROOT) if include_media and getattr(settings, 'MEDIA_ROOT', '') else None
+    parent = parent if media_root else None
+    backup_id = backup_id or new_backup_id()
+    archive = ZipStream()
+    meta = backup_meta(include_media, media_root, backup_id, parent)
+    if data_format == DATA_FORMAT_NDJSON:
+        models = backup_models()
+        meta.update({
+            'data_format': DATA_FORMAT_NDJSON,
+            'models': [model._meta.label_lower for model in models],
+            'schema': schema_fingerprint(),
+        })
+        archive.writestr(META_NAME, json.dumps(meta, indent=2))
+        yield archive.drain()
+        for model, spool, size, _ in iter_model_dumps(models):
+            with spool:
+                # Already gzipped; deflating again would only cost time.
+                yield from archive.write_fileobj(
+                    data_member(model._meta.label_lower), spool, size,
+                    compress_type=zipfile.ZIP_STORED, chunk_size=FILE_CHUNK_SIZE,
+                )
+    else:
+        archive.writestr(META_NAME, json.dumps(meta, indent=2))
+        yield archive.drain()
+        with archive.open(FIXTURE_NAME) as member:
+            for part in iter_fixture():
+                member.write(part)
+                data = archive.drain()
+                if data:
+                    yield data
+
+    if media_root is None:
+        yield archive.close()
+        return
+
+    previous_files = parent['files'] if parent else {}
+    files = {}
+    included = []
+    if media_root.exists():
+        for relative, path in iter_media_files(media_root):
+            try:
+                stat = path.stat()
+                previous = previous_files.get(relative)
+                if _unchanged(previous, stat):
+                    files[relative] = previous
+                    continue
+                digest = yield from archive.write_file(
+                    f'{MEDIA_PREFIX}/{relative}', path,
+                    compress_type=zipfile.ZIP_STORED, chunk_size=FILE_CHUNK_SIZE, stat=stat,
+                )
+            except FileNotFoundError:
+                # Deleted between listing and reading; the row that used it is gone too.
+                logger.warning("Skipped %s: removed during backup.", path)
+                continue
+            files[relative] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': digest}
+            included.append(relative)
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'backup_id': backup_id,
+        'kind': meta['kind'],
+        'parent_id': meta['parent_id'],
+        'base_id': parent.get('base_id', parent['backup_id']) if parent else backup_id,
+        'created_at': meta['created_at'],
+        'files': files,
+        'included': included,
+    }
+    archive.writestr(MANIFEST_NAME, json.dumps(manifest))
+    yield archive.close()
+    # Only a fully written archive may serve as the parent of the next one.
+    save_manifest(manifest)
+
+
+def read_meta(zf):
+    try:
+        return json.loads(zf.read(META_NAME))
+    except KeyError:
+        return {}
+    except ValueError:
+        raise BackupError(f"{zf.filename or 'Backup'}: meta.json is corrupt.")
+
+
+def has_data(zf):
+    """True if ``zf`` holds a database dump in either format."""
+    if FIXTURE_NAME in zf.namelist():
+        return True
+    return read_meta(zf).get('data_format') == DATA_FORMAT_NDJSON
+
+
+def read_manifest(zf):
+    """The archive's manifest, or None for backups that predate manifests."""
+    try:
+        return json.loads(zf.read(MANIFEST_NAME))
+    except KeyError:
+        return None
+    except ValueError:
+        raise BackupError(f"{zf.filename or 'Backup'}: manifest.json is corrupt.")
+
+
+def resolve_chain(archives):
+    """
+    Order ``archives`` (open ``ZipFile`` objects) from the full backup to the
+    newest incremental.
+
+    Returns ``(chain, sources)``: the ordered archives and ``{relative path:
+    (archive, member name, sha256 or None)}`` giving the latest copy of every
+    media file in the newest state. Raises ``BackupError`` if the archives
+    do not form one unbroken chain or a file has no copy.
+    """
+    entries = [(zf, read_manifest(zf)) for zf in archives]
+    bases = [entry for entry in entries if entry[1] is None or entry[1]['kind'] == 'full']
+    if len(bases) != 1:
+        raise BackupError("Select exactly one full backup, plus any incremental backups taken after it.")
+    by_parent = {}
+    for entry in entries:
+        manifest = entry[1]
+        if manifest is not None and manifest['kind'] == 'incremental':
+            if manifest['parent_id'] in by_parent:
+                raise BackupError(f"Two backups continue {manifest['parent_id']}.")
+            by_parent[manifest['parent_id']] = entry
+
+    chain = [bases[0]]
+    while chain[-1][1] is not None and chain[-1][1]['backup_id'] in by_parent:
+        chain.append(by_parent.pop(chain[-1][1]['backup_id']))
+    if by_parent:
+        missing = ', '.join(sorted(by_parent))
+        raise BackupError(f"The selected backups do not form one chain (no archive for backup(s) {missing}).")
+
+    newest = chain[-1][1]
+    prefix = f'{MEDIA_PREFIX}/'
+    if newest is None:
+        # A pre-manifest full backup: every media entry it holds.
+        zf = chain[-1][0]
+        sources = {
+            name[len(prefix):]: (zf, name, None)
+            for name in zf.namelist() if name.startswith(prefix) and not name.endswith('/')
+        }
+        return [zf for zf, _ in chain], sources
+
+    included = [(zf, set(manifest['included'])) for zf, manifest in reversed(chain)]
+    sources = {}
+    for relative, entry in newest['files'].items():
+        for zf, names in included:
+            if relative in names:
+                sources[relative] = (zf, f'{prefix}{relative}', entry['sha256'])
+                break
+        else:
+            raise BackupError(f"No archive in the chain contains {relative}.")
+    return [zf for zf, _ in chain], sources
@@ -0,0 +1,265 @@
+"""
+Vectorized recomputation of ``Admission.commission_amount``.
+
+Admissions store the commission worked out by ``AdmissionForm`` when they
+were saved; later rate changes do not touch them. ``recompute_commissions``
+loads the charge columns of any admission queryset and the matching
+``DoctorCommissionProfile`` rate vectors into NumPy arrays, computes every
+commission in one pass and either reports the deltas (what-if) or writes the
+changed rows back in chunks.
+
+The formula matches ``AdmissionForm._calculate_total_commission``: each
+charge times its rate, plus the standard referral percentage on the total,
+rounded half-even to the paisa. The float pass can land on either side of a
+half paisa, so those rows are worked out again in ``Decimal`` exactly as the
+form does, and amounts are compared and summed in integer paisa.
+Admissions without a referring doctor or payment category, or whose pair
+has no profile, get zero. NumPy is imported lazily so the rest of the portal
+works without it.
+"""
+from __future__ import annotations
+
+from decimal import Decimal
+from itertools import islice
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.models import Admission, DoctorCommissionProfile
+from core.rollups import rebuild_admission_rollups
+
+CHARGE_RATE_FIELDS = (
+    ('bed_charges', 'bed_charges_rate'),
+    ('nursing_charges', 'nursing_charges_rate'),
+    ('doctor_consultation_charges', 'doctor_consultation_charges_rate'),
+    ('investigation_charges', 'investigation_charges_rate'),
+    ('procedural_surgical_charges', 'procedural_surgical_charges_rate'),
+    ('anaesthesia_charges', 'anaesthesia_charges_rate'),
+    ('surgeon_charges', 'surgeon_charges_rate'),
+    ('other_charges', 'other_charges_rate'),
+)
+CHARGE_FIELDS = tuple(charge for charge, _ in CHARGE_RATE_FIELDS)
+RATE_COLUMNS = tuple(rate for _, rate in CHARGE_RATE_FIELDS) + ('discount_percentage',)
+
+DEFAULT_CHUNK_SIZE = 5000
+# How close (in paisa) a float result must be to a half paisa to be
+# recomputed in Decimal; far above the float error at these magnitudes.
+HALF_PAISA_TOLERANCE = 1e-3
+
+
+class CommissionEngineUnavailable(Exception):
+    """NumPy is not installed."""
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError as exc:
+        raise CommissionEngineUnavailable(
+            "Commission recomputation is not available (missing dependency numpy)."
+        ) from exc
+    return numpy
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _load_admissions(queryset, chunk_size):
+    """Column arrays for ``queryset``, read in chunks to bound driver memory."""
+    np = _numpy()
+    columns = (
+        'pk', 'referred_by_doctor_id', 'payment_category_id', 'updated_at', 'created_at', 'commission_amount',
+    ) + CHARGE_FIELDS
+    parts = {name: [] for name in ('pk', 'doctor', 'category', 'updated_at', 'created_at', 'current', 'charges')}
+    rows = queryset.order_by().values_list(*columns).iterator(chunk_size=chunk_size)
+    for chunk in _chunks(rows, chunk_size):
+        count = len(chunk)
+        parts['pk'].append(np.fromiter((r[0] for r in chunk), np.int64, count))
+        parts['doctor'].append(np.fromiter((-1 if r[1] is None else r[1] for r in chunk), np.int64, count))
+        parts['category'].append(np.fromiter((-1 if r[2] is None else r[2] for r in chunk), np.int64, count))
+        parts['updated_at'].append([r[3] for r in chunk])
+        parts['created_at'].append([r[4] for r in chunk])
+        parts['current'].append(np.fromiter((r[5] or 0 for r in chunk), np.float64, count))
+        parts['charges'].append(np.array([r[6:] for r in chunk], dtype=np.float64).reshape(count, len(CHARGE_FIELDS)))
+
+    if not parts['pk']:
+        return None
+    return {
+        'pk': np.concatenate(parts['pk']),
+        'doctor': np.concatenate(parts['doctor']),
+        'category': np.concatenate(parts['category']),
+        # Kept as Python datetimes: concurrent edit checks and rollup dates.
+        'updated_at': [value for part in parts['updated_at'] for value in part],
+        'created_at': [value for part in parts['created_at'] for value in part],
+        'current': np.concatenate(parts['current']),
+        'charges': np.nan_to_num(np.vstack(parts['charges'])),
+    }
+
+
+def _rate_table(doctor_ids, category_ids, rate_overrides=None):
+    """``{(doctor_id, category_id): rates in RATE_COLUMNS order}`` with overrides applied."""
+    profiles = DoctorCommissionProfile.objects.filter(
+        payment_category_id__in=category_ids,
+    ).values_list('doctor_id', 'payment_category_id', *RATE_COLUMNS)
+    table = {
+        (row[0], row[1]): row[2:]
+        for row in profiles.iterator(chunk_size=DEFAULT_CHUNK_SIZE)
+        if row[0] in doctor_ids
+    }
+    defaults = tuple(DoctorCommissionProfile._meta.get_field(name).default for name in RATE_COLUMNS)
+    for pair, overrides in (rate_overrides or {}).items():
+        rates = dict(zip(RATE_COLUMNS, table.get(pair, defaults)))
+        rates.update(overrides)
+        table[pair] = tuple(rates[name] for name in RATE_COLUMNS)
+    return table
+
+
+def _exact_commission(charges, rates):
+    """``AdmissionForm._calculate_total_commission`` for one row of the arrays."""
+    amounts = [Decimal(f'{amount:.2f}') for amount in charges]
+    rates = [Decimal(str(float(rate))) for rate in rates]
+    charge_wise = sum((amount * rate / 100 for amount, rate in zip(amounts, rates)), Decimal('0'))
+    standard = sum(amounts, Decimal('0')) * rates[-1] / 100
+    return (charge_wise + standard).quantize(Decimal('0.01'))
+
+
+def _paisa_to_decimal(paisa):
+    return Decimal(int(paisa)).scaleb(-2)
+
+
+def recompute_commissions(queryset=None, apply=False, rate_overrides=None,
+                          chunk_size=DEFAULT_CHUNK_SIZE, largest=10, report=None):
+    """
+    Recompute commissions for ``queryset`` (all admissions by default).
+
+    ``rate_overrides`` maps ``(doctor_id, category_id)`` to ``{rate_field:
+    value}`` and simulates rates that are not saved yet; it is only allowed
+    in what-if mode. With ``apply=True`` changed rows are written in chunks
+    of ``chunk_size``; rows edited since they were read are skipped.
+    ``report(percent, message)`` receives progress.
+
+    Returns a summary dict with counts, totals before/after and the
+    ``largest`` absolute changes.
+    """
+    if apply and rate_overrides:
+        raise ValueError("Rate overrides are for what-if runs; save the rates before applying.")
+    np = _numpy()
+    report = report or (lambda percent, message='': None)
+    queryset = Admission.objects.all() if queryset is None else queryset
+
+    report(5, 'Loading admissions')
+    data = _load_admissions(queryset, chunk_size)
+    summary = {
+        'admissions': 0, 'changed': 0, 'applied': 0, 'skipped': 0,
+        'total_before': Decimal('0.00'), 'total_after': Decimal('0.00'), 'delta': Decimal('0.00'),
+        'largest_changes': [],
+    }
+    if data is None:
+        return summary
+
+    report(40, 'Computing commissions')
+    doctors, categories = data['doctor'], data['category']
+    linked = (doctors >= 0) & (categories >= 0)
+    table = _rate_table(
+        set(np.unique(doctors[linked]).tolist()),
+        set(np.unique(categories[linked]).tolist()),
+        rate_overrides,
+    )
+
+    rates = np.zeros((len(doctors), len(RATE_COLUMNS)), dtype=np.float64)
+    if table:
+        width = int(max(categories.max(), max(c for _, c in table))) + 1
+        pairs = np.array(list(table.keys()), dtype=np.int64)
+        table_keys = pairs[:, 0] * width + pairs[:, 1]
+        order = np.argsort(table_keys)
+        table_keys = table_keys[order]
+        table_rates = np.nan_to_num(np.array(list(table.values()), dtype=np.float64)[order])
+
+        keys = doctors * width + categories
+        positions = np.clip(np.searchsorted(table_keys, keys), 0, len(table_keys) - 1)
+        matched = linked & (table_keys[positions] == keys)
+        rates[matched] = table_rates[positions[matched]]
+
+    charges = data['charges']
+    charge_wise = (charges * rates[:, :len(CHARGE_FIELDS)]).sum(axis=1) / 100.0
+    standard = charges.sum(axis=1) * rates[:, -1] / 100.0
+    raw_paisa = (charge_wise + standard) * 100
+    new = np.rint(raw_paisa).astype(np.int64)
+    for i in np.flatnonzero(np.abs(raw_paisa - np.floor(raw_paisa) - 0.5) < HALF_PAISA_TOLERANCE):
+        exact = _exact_commission(charges[i], rates[i])
+        new[i] = int(exact.scaleb(2))
+    # Stored amounts have two decimals, so these are exact.
+    current = np.rint(data['current'] * 100).astype(np.int64)
+    delta = new - current
+    changed = np.flatnonzero(delta)
+
+    summary.update({
+        'admissions': int(len(new)),
+        'changed': int(len(changed)),
+        'total_before': _paisa_to_decimal(current.sum()),
+        'total_after': _paisa_to_decimal(new.sum()),
+        'delta': _paisa_to_decimal(delta.sum()),
+    })
+    if largest and len(changed):
+        top = changed[np.argsort(-np.abs(delta[changed]), kind='stable')[:largest]]
+        summary['largest_changes'] = [
+            {
+                'admission_id': int(data['pk'][i]),
+                'before': _paisa_to_decimal(current[i]),
+                'after': _paisa_to_decimal(new[i]),
+            }
+            for i in top
+        ]
+
+    if apply and len(changed):
+        summary['applied'], summary['skipped'] = _write_back(data, new, changed, chunk_size, report)
+        report(95, 'Rebuilding report rollups')
+        created = [data['created_at'][i] for i in changed]
+        rebuild_admission_rollups(timezone.localdate(min(created)), timezone.localdate(max(created)))
+    report(100, 'Done')
+    return summary
+
+
+def _write_back(data, new, changed, chunk_size, report):
+    """
+    Write changed commissions, one transaction per chunk.
+
+    ``bulk_update`` builds and resolves a CASE expression per row, which
+    costs more than the whole vectorized pass at this scale, so each chunk
+    is a single parametrized UPDATE run with ``executemany``. Matching on the
+    ``updated_at`` read earlier skips rows saved in the meantime, so a
+    concurrent edit is never overwritten with a stale commission.
+    """
+    meta = Admission._meta
+    amount_field = meta.get_field('commission_amount')
+    updated_field = meta.get_field('updated_at')
+    quote = connection.ops.quote_name
+    sql = (
+        f"UPDATE {quote(meta.db_table)} SET {quote(amount_field.column)} = %s, {quote(updated_field.column)} = %s "
+        f"WHERE {quote(meta.pk.column)} = %s AND {quote(updated_field.column)} = %s"
+    )
+
+    applied = 0
+    total = len(changed)
+    for start in range(0, total, chunk_size):
+        now = updated_field.get_db_prep_value(timezone.now(), connection)
+        params = [
+            (
+                amount_field.get_db_prep_save(_paisa_to_decimal(new[i]), connection),
+                now,
+                int(data['pk'][i]),
+                updated_field.get_db_prep_value(data['updated_at'][i], connection),
+            )
+            for i in changed[start:start + chunk_size]
+        ]
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, params)
+            applied += max(cursor.rowcount, 0)
+        report(50 + int(45 * min(start + chunk_size, total) / total), f'Saved {applied} of {total}')
+    return applied, total - applied
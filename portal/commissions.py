@@ -0,0 +1,225 @@
+"""
+Bulk reads and writes of doctor referral rates (``DoctorCommissionProfile``).
+
+The matrix editor and its JSON API work on many doctors and payment
+categories at once: missing profiles are filled with one
+``bulk_create(ignore_conflicts=True)``, edits are written with one
+``bulk_update``, and both happen in a single transaction.
+
+Lookups for the admission form go through an in-process cache of the
+doctor x category matrix (``get_rates`` / ``get_rates_many``). It is keyed
+on the ``commission_profiles`` data version, which profile saves and
+deletes bump (``core.signals``) and ``apply_rate_updates`` bumps after its
+bulk writes. The version itself is read at most once every
+``PORTAL_RATE_CACHE_VERSION_TTL`` seconds, so a change made in another
+process reaches this one's cache within that time.
+"""
+from __future__ import annotations
+
+import math
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core.dataversion import COMMISSION_PROFILES, bump_data_version, forget_data_version, get_data_version
+from core.models import DoctorCommissionProfile, DoctorReferral, PaymentCategory
+
+RATE_FIELDS = (
+    ('discount_percentage', 'Standard Referral %'),
+    ('bed_charges_rate', 'Bed Charges'),
+    ('nursing_charges_rate', 'Nursing Charges'),
+    ('doctor_consultation_charges_rate', 'Doctor Consultation'),
+    ('investigation_charges_rate', 'Investigation'),
+    ('procedural_surgical_charges_rate', 'Procedural/Surgical'),
+    ('anaesthesia_charges_rate', 'Anaesthesia'),
+    ('surgeon_charges_rate', 'Surgeon Charges'),
+    ('other_charges_rate', 'Other Charges'),
+)
+RATE_FIELD_NAMES = tuple(name for name, _ in RATE_FIELDS)
+
+BULK_BATCH_SIZE = 500
+RATE_CACHE_MAX_ENTRIES = 20000
+
+_rate_cache = {}
+_rate_cache_version = None
+_rate_cache_lock = threading.Lock()
+
+
+class RateUpdateError(ValueError):
+    """A submitted rate update is malformed; nothing was written."""
+
+
+def clean_rate(value):
+    try:
+        rate = float(value)
+    except (TypeError, ValueError):
+        raise RateUpdateError(f"{value!r} is not a number.")
+    if not math.isfinite(rate) or not 0 <= rate <= 100:
+        raise RateUpdateError(f"Rate {value!r} must be between 0 and 100.")
+    return rate
+
+
+def ensure_profiles(pairs):
+    """Create the missing profiles among ``(doctor_id, category_id)`` pairs; returns how many were new."""
+    pairs = set(pairs)
+    if not pairs:
+        return 0
+    existing = set(
+        DoctorCommissionProfile.objects.filter(
+            doctor_id__in={d for d, _ in pairs}, payment_category_id__in={c for _, c in pairs},
+        ).values_list('doctor_id', 'payment_category_id')
+    )
+    missing = pairs - existing
+    DoctorCommissionProfile.objects.bulk_create(
+        [DoctorCommissionProfile(doctor_id=d, payment_category_id=c) for d, c in missing],
+        ignore_conflicts=True,
+        batch_size=BULK_BATCH_SIZE,
+    )
+    return len(missing)
+
+
+def rate_matrix(doctor_ids, category_ids, fields=RATE_FIELD_NAMES):
+    """
+    ``{doctor_id: {category_id: {field: rate}}}`` for the given ids.
+
+    Pairs without a profile report the model defaults; reading never creates
+    rows.
+    """
+    defaults = {name: DoctorCommissionProfile._meta.get_field(name).default for name in fields}
+    matrix = {d: {c: dict(defaults) for c in category_ids} for d in doctor_ids}
+    profiles = DoctorCommissionProfile.objects.filter(
+        doctor_id__in=doctor_ids, payment_category_id__in=category_ids,
+    ).values('doctor_id', 'payment_category_id', *fields)
+    for row in profiles:
+        matrix[row['doctor_id']][row['payment_category_id']] = {name: row[name] for name in fields}
+    return matrix
+
+
+def normalize_updates(cells):
+    """
+    Validate ``[{'doctor': id, 'category': id, 'rates': {field: value}}]``.
+
+    Returns ``{(doctor_id, category_id): {field: rate}}``; later cells for the
+    same pair override earlier ones.
+    """
+    updates = {}
+    for cell in cells:
+        try:
+            key = (int(cell['doctor']), int(cell['category']))
+            rates = cell['rates']
+        except (KeyError, TypeError, ValueError):
+            raise RateUpdateError("Each update needs integer 'doctor' and 'category' ids and a 'rates' object.")
+        if not isinstance(rates, dict) or not rates:
+            raise RateUpdateError("'rates' must be a non-empty object.")
+        unknown = set(rates) - set(RATE_FIELD_NAMES)
+        if unknown:
+            raise RateUpdateError(f"Unknown rate field(s): {', '.join(sorted(unknown))}.")
+        updates.setdefault(key, {}).update({name: clean_rate(value) for name, value in rates.items()})
+    return updates
+
+
+def unknown_ids(updates):
+    """``(doctor_ids, category_ids)`` named by ``updates`` that do not exist, each sorted."""
+    doctor_ids = {d for d, _ in updates}
+    category_ids = {c for _, c in updates}
+    doctor_ids -= set(DoctorReferral.objects.filter(pk__in=doctor_ids).values_list('pk', flat=True))
+    category_ids -= set(PaymentCategory.objects.filter(pk__in=category_ids).values_list('pk', flat=True))
+    return sorted(doctor_ids), sorted(category_ids)
+
+
+def apply_rate_updates(updates):
+    """
+    Write ``{(doctor_id, category_id): {field: rate}}`` in one transaction.
+
+    Returns ``(created, updated)``: profiles created for missing pairs and
+    profiles whose rates actually changed.
+    """
+    if not updates:
+        return 0, 0
+    doctor_ids = {d for d, _ in updates}
+    category_ids = {c for _, c in updates}
+    with transaction.atomic():
+        created = ensure_profiles(updates.keys())
+        profiles = DoctorCommissionProfile.objects.select_for_update().filter(
+            doctor_id__in=doctor_ids, payment_category_id__in=category_ids,
+        )
+        changed = []
+        touched_fields = set()
+        now = timezone.now()
+        for profile in profiles:
+            rates = updates.get((profile.doctor_id, profile.payment_category_id))
+            if not rates:
+                continue
+            dirty = [name for name, rate in rates.items() if getattr(profile, name) != rate]
+            if not dirty:
+                continue
+            for name in dirty:
+                setattr(profile, name, rates[name])
+            # bulk_update skips auto_now, so stamp it explicitly.
+            profile.updated_at = now
+            touched_fields.update(dirty)
+            changed.append(profile)
+        if changed:
+            DoctorCommissionProfile.objects.bulk_update(
+                changed, sorted(touched_fields) + ['updated_at'], batch_size=BULK_BATCH_SIZE,
+            )
+            # bulk_update sends no post_save, so invalidate the rate cache here.
+            bump_data_version(COMMISSION_PROFILES)
+    return created, len(changed)
+
+
+def _load_rates(pairs):
+    defaults = {name: DoctorCommissionProfile._meta.get_field(name).default for name in RATE_FIELD_NAMES}
+    loaded = {pair: dict(defaults) for pair in pairs}
+    profiles = DoctorCommissionProfile.objects.filter(
+        doctor_id__in={d for d, _ in pairs}, payment_category_id__in={c for _, c in pairs},
+    ).values('doctor_id', 'payment_category_id', *RATE_FIELD_NAMES)
+    for row in profiles:
+        pair = (row['doctor_id'], row['payment_category_id'])
+        if pair in loaded:
+            loaded[pair] = {name: row[name] for name in RATE_FIELD_NAMES}
+    return loaded
+
+
+def get_rates_many(pairs):
+    """
+    ``{(doctor_id, category_id): {field: rate}}`` for ``pairs``, from the cache.
+
+    Pairs without a profile get the model defaults (all zero). Misses are
+    loaded with one query. Callers must not mutate the returned dicts.
+    """
+    global _rate_cache_version
+    pairs = {(int(d), int(c)) for d, c in pairs}
+    # Read the version before any data, so entries loaded below are at
+    # least as new as the version they are stored under.
+    version = get_data_version(COMMISSION_PROFILES, max_age=settings.PORTAL_RATE_CACHE_VERSION_TTL)
+    with _rate_cache_lock:
+        if version != _rate_cache_version:
+            _rate_cache.clear()
+            _rate_cache_version = version
+        found = {pair: _rate_cache[pair] for pair in pairs if pair in _rate_cache}
+
+    missing = pairs - found.keys()
+    if missing:
+        loaded = _load_rates(missing)
+        with _rate_cache_lock:
+            if _rate_cache_version == version:
+                if len(_rate_cache) + len(loaded) > RATE_CACHE_MAX_ENTRIES:
+                    _rate_cache.clear()
+                _rate_cache.update(loaded)
+        found.update(loaded)
+    return found
+
+
+def get_rates(doctor_id, category_id):
+    return get_rates_many([(doctor_id, category_id)])[(int(doctor_id), int(category_id))]
+
+
+def clear_rate_cache():
+    global _rate_cache_version
+    with _rate_cache_lock:
+        _rate_cache.clear()
+        _rate_cache_version = None
+    forget_data_version(COMMISSION_PROFILES)
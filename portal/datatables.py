@@ -0,0 +1,109 @@
+"""
+Server-side processing for DataTables-backed portal lists.
+
+A view opts in with ``ServerSideTableMixin``: when a request carries the
+DataTables ``draw`` parameter the view answers with a single JSON page
+(``draw``, ``recordsTotal``, ``recordsFiltered``, ``data``) instead of the
+HTML page. Paging, ordering and the global search box are all applied in
+the database, so only ``length`` rows are ever rendered per request. The
+search box matches prefixes, like the autocomplete pickers, so PostgreSQL
+can answer it from the ``UPPER(col) varchar_pattern_ops`` indexes (core
+migrations 0039 and 0047) instead of scanning every row.
+Cells are inserted as HTML by DataTables, so plain strings are escaped and
+markup must be built with ``format_html``.
+"""
+from django.db.models import Q
+from django.http import JsonResponse
+from django.utils.html import conditional_escape
+
+
+def _int(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class ServerSideTableMixin:
+    """
+    Answer DataTables server-side requests from ``get_table_queryset()``.
+
+    ``table_columns`` lists ``(name, order_field)`` pairs in the same order as
+    the table headers; ``order_field`` is ``None`` for columns that cannot be
+    sorted. ``table_search_fields`` are matched with ``istartswith`` against
+    the search box value. Subclasses render one row with ``get_table_row()``.
+    """
+    table_columns = ()
+    table_search_fields = ()
+    table_default_ordering = ('-pk',)
+    # Unique column appended to every ordering; grouped querysets override it.
+    table_tiebreaker = '-pk'
+    table_page_size = 25
+    table_max_page_size = 100
+
+    def get(self, request, *args, **kwargs):
+        if 'draw' in request.GET:
+            return self.render_table_page(request)
+        return super().get(request, *args, **kwargs)
+
+    def get_table_queryset(self):
+        return self.get_queryset()
+
+    def get_table_row(self, obj):
+        raise NotImplementedError('ServerSideTableMixin requires get_table_row().')
+
+    def get_table_ordering(self, params):
+        ordering = []
+        index = 0
+        while f'order[{index}][column]' in params:
+            column = _int(params.get(f'order[{index}][column]'), -1)
+            direction = params.get(f'order[{index}][dir]')
+            if 0 <= column < len(self.table_columns):
+                field = self.table_columns[column][1]
+                if field:
+                    ordering.append(f'-{field}' if direction == 'desc' else field)
+            index += 1
+        if not ordering:
+            ordering = list(self.table_default_ordering)
+        # A unique tie-breaker keeps LIMIT/OFFSET pages stable.
+        tiebreaker = self.table_tiebreaker.lstrip('-')
+        if tiebreaker and not any(field.lstrip('-') in (tiebreaker, 'pk', 'id') for field in ordering):
+            ordering.append(self.table_tiebreaker)
+        return ordering
+
+    def filter_table_search(self, queryset, search):
+        if not search or not self.table_search_fields:
+            return queryset
+        q = Q()
+        for field in self.table_search_fields:
+            q |= Q(**{f'{field}__istartswith': search})
+        return queryset.filter(q)
+
+    def render_table_page(self, request):
+        params = request.GET
+        draw = _int(params.get('draw'), 0)
+        start = max(_int(params.get('start'), 0), 0)
+        length = _int(params.get('length'), self.table_page_size)
+        if length <= 0 or length > self.table_max_page_size:
+            length = self.table_max_page_size
+
+        queryset = self.get_table_queryset()
+        records_total = queryset.count()
+
+        search = (params.get('search[value]') or '').strip()
+        if search:
+            queryset = self.filter_table_search(queryset, search)
+            records_filtered = queryset.count()
+        else:
+            records_filtered = records_total
+
+        page = queryset.order_by(*self.get_table_ordering(params))[start:start + length]
+        return JsonResponse({
+            'draw': draw,
+            'recordsTotal': records_total,
+            'recordsFiltered': records_filtered,
+            'data': [
+                [conditional_escape(cell) for cell in self.get_table_row(obj)]
+                for obj in page
+            ],
+        })
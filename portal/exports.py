@@ -0,0 +1,379 @@
+"""
+Streaming CSV/XLSX exports for the reports dashboard.
+
+Every export takes the dashboard's GET parameters, so a download matches
+what is on screen. Row-level datasets read ``values()`` rows through
+``iterator(chunk_size=...)`` and are written out as they arrive, so
+memory stays flat and the first bytes go out before the query finishes.
+"""
+from __future__ import annotations
+
+import csv
+import datetime
+import re
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.db.models import Count, Q
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.text import slugify
+
+from core.models import DoctorVisit, PatientReferral, Trip
+from core.rollups import date_range_q, revenue_expression
+
+from .reports import (
+    agent_activity_rows,
+    category_rows,
+    doctor_revenue_rows,
+    filtered_admissions,
+    parse_report_filters,
+)
+from .zipstream import ZipStream
+
+CHUNK_SIZE = 2000
+
+EXPORT_FORMATS = ('csv', 'xlsx')
+
+
+def _cell(value):
+    """Normalize a DB value for a spreadsheet cell."""
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        if timezone.is_aware(value):
+            value = timezone.localtime(value)
+        return value.strftime('%Y-%m-%d %H:%M')
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value
+
+
+def _visit_filter_q(filters):
+    """Doctor-side dashboard filters applied through a DoctorVisit relation."""
+    q = Q()
+    if filters['area_id']:
+        q &= Q(doctor__address_details__area_id=filters['area_id'])
+    if filters['doctor_id']:
+        q &= Q(doctor_id=filters['doctor_id'])
+    if filters['specialization']:
+        q &= Q(doctor__specialization__iexact=filters['specialization'])
+    return q
+
+
+# --- Datasets -------------------------------------------------------------
+
+def admission_rows(filters):
+    rows = (
+        filtered_admissions(filters)
+        .annotate(revenue=revenue_expression())
+        .order_by('-created_at', '-pk')
+        .values_list(
+            'id',
+            'created_at',
+            'patient_name',
+            'patient_phone',
+            'referred_by_doctor__name',
+            'referred_by_doctor__specialization',
+            'patient_referral__agent__username',
+            'admission_type',
+            'payment_category__name',
+            'status',
+            'revenue',
+            'commission_amount',
+        )
+    )
+    yield from rows.iterator(chunk_size=CHUNK_SIZE)
+
+
+def doctor_rows(filters):
+    for row in doctor_revenue_rows(filters).iterator(chunk_size=CHUNK_SIZE):
+        yield (
+            row['doctor_name'],
+            row['opd_count'] or 0,
+            row['ipd_count'] or 0,
+            row['total_revenue'] or 0,
+            row['total_commission'] or 0,
+        )
+
+
+def agent_rows(filters):
+    for row in agent_activity_rows(filters).iterator(chunk_size=CHUNK_SIZE):
+        yield (
+            row['username'],
+            ' '.join(filter(None, [row['first_name'], row['last_name']])),
+            row['doctors_visited'],
+            row['areas_visited'],
+            round(row['kms_travelled'], 1),
+            row['direct_patients_referred'],
+        )
+
+
+def category_export_rows(filters):
+    for row in category_rows(filters):
+        yield (
+            row['payment_category__name'],
+            row['patient_count'] or 0,
+            row['total_revenue'] or 0,
+        )
+
+
+def trip_rows(filters):
+    trips = Trip.objects.filter(
+        date_range_q('start_time', filters['date_start'], filters['date_end']), deleted_at__isnull=True,
+    )
+    if filters['agent_id']:
+        trips = trips.filter(agent_id=filters['agent_id'])
+    visit_q = _visit_filter_q(filters)
+    if visit_q:
+        trips = trips.filter(id__in=DoctorVisit.objects.filter(visit_q).values('trip_id'))
+    rows = (
+        trips.annotate(visit_count=Count('doctor_visits'))
+        .order_by('-start_time', '-pk')
+        .values_list(
+            'id',
+            'agent__username',
+            'start_time',
+            'end_time',
+            'status',
+            'visit_count',
+            'total_kilometers',
+            'additional_expenses',
+        )
+    )
+    yield from rows.iterator(chunk_size=CHUNK_SIZE)
+
+
+def visit_rows(filters):
+    visits = DoctorVisit.objects.filter(
+        date_range_q('trip__start_time', filters['date_start'], filters['date_end']),
+        _visit_filter_q(filters),
+        trip__deleted_at__isnull=True,
+    )
+    if filters['agent_id']:
+        visits = visits.filter(trip__agent_id=filters['agent_id'])
+    rows = (
+        visits.order_by('-created_at', '-pk')
+        .values_list(
+            'created_at',
+            'trip_id',
+            'trip__agent__username',
+            'doctor__name',
+            'doctor__specialization',
+            'doctor__address_details__area__name',
+            'status',
+            'remarks',
+        )
+    )
+    yield from rows.iterator(chunk_size=CHUNK_SIZE)
+
+
+def patient_referral_rows(filters):
+    referrals = PatientReferral.objects.filter(
+        date_range_q('reported_on', filters['date_start'], filters['date_end'])
+    )
+    if filters['agent_id']:
+        referrals = referrals.filter(agent_id=filters['agent_id'])
+    if filters['area_id']:
+        referrals = referrals.filter(referred_by_doctor__address_details__area_id=filters['area_id'])
+    if filters['doctor_id']:
+        referrals = referrals.filter(referred_by_doctor_id=filters['doctor_id'])
+    if filters['specialization']:
+        referrals = referrals.filter(referred_by_doctor__specialization__iexact=filters['specialization'])
+    rows = (
+        referrals.order_by('-reported_on', '-pk')
+        .values_list(
+            'reported_on',
+            'patient_name',
+            'age',
+            'gender',
+            'phone',
+            'illness',
+            'agent__username',
+            'referred_by_doctor__name',
+            'status',
+            'is_urgent',
+        )
+    )
+    yield from rows.iterator(chunk_size=CHUNK_SIZE)
+
+
+# name -> (sheet title, header, row generator)
+EXPORTS = {
+    'admissions': (
+        'Admissions',
+        ('ID', 'Date', 'Patient', 'Phone', 'Doctor', 'Specialization', 'Executive',
+         'Type', 'Category', 'Status', 'Revenue', 'Referral'),
+        admission_rows,
+    ),
+    'doctors': (
+        'Doctor Revenue',
+        ('Doctor', 'OPD', 'IPD', 'Revenue', 'Referral'),
+        doctor_rows,
+    ),
+    'agents': (
+        'Executive Activity',
+        ('Username', 'Name', 'Doctors Visited', 'Areas Visited', 'KM Travelled', 'Direct Patients'),
+        agent_rows,
+    ),
+    'category': (
+        'Categories',
+        ('Category', 'Patients', 'Revenue'),
+        category_export_rows,
+    ),
+    'trips': (
+        'Trips',
+        ('ID', 'Executive', 'Start', 'End', 'Status', 'Doctors Visited', 'KM', 'Expenses'),
+        trip_rows,
+    ),
+    'visits': (
+        'Doctor Visits',
+        ('Date', 'Trip', 'Executive', 'Doctor', 'Specialization', 'Area', 'Status', 'Remarks'),
+        visit_rows,
+    ),
+    'patients': (
+        'Patient Referrals',
+        ('Reported On', 'Patient', 'Age', 'Gender', 'Phone', 'Illness', 'Executive',
+         'Referred By', 'Status', 'Urgent'),
+        patient_referral_rows,
+    ),
+}
+
+
+# --- Writers --------------------------------------------------------------
+
+class _Echo:
+    """csv.writer target that hands each formatted line straight back."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(header, rows):
+    writer = csv.writer(_Echo())
+    # BOM so Excel opens UTF-8 names correctly.
+    yield '\ufeff' + writer.writerow(header)
+    for row in rows:
+        yield writer.writerow([_cell(value) for value in row])
+
+
+_XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+_XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+_XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+
+
+def _xlsx_workbook(sheet_name):
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name="{escape(sheet_name[:31], {chr(34): "&quot;"})}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    )
+
+
+def _xlsx_row(values):
+    cells = []
+    for value in values:
+        value = _cell(value)
+        if isinstance(value, bool):
+            cells.append(f'<c t="b"><v>{int(value)}</v></c>')
+        elif isinstance(value, (int, float, Decimal)):
+            cells.append(f'<c><v>{value}</v></c>')
+        else:
+            text = escape(_XML_ILLEGAL.sub('', str(value)))
+            cells.append(f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+    return '<row>' + ''.join(cells) + '</row>'
+
+
+def stream_xlsx(sheet_name, header, rows, flush_every=500):
+    """
+    Minimal single-sheet workbook with inline strings.
+
+    Shared strings and styles would need every value up front; inline
+    strings let each row be written and compressed as soon as it is read.
+    """
+    archive = ZipStream()
+    archive.writestr('[Content_Types].xml', _XLSX_CONTENT_TYPES)
+    archive.writestr('_rels/.rels', _XLSX_ROOT_RELS)
+    archive.writestr('xl/workbook.xml', _xlsx_workbook(sheet_name))
+    archive.writestr('xl/_rels/workbook.xml.rels', _XLSX_WORKBOOK_RELS)
+    yield archive.drain()
+
+    with archive.open('xl/worksheets/sheet1.xml') as sheet:
+        sheet.write(
+            b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+        )
+        sheet.write(_xlsx_row(header).encode('utf-8'))
+        pending = []
+        for row in rows:
+            pending.append(_xlsx_row(row))
+            if len(pending) >= flush_every:
+                sheet.write(''.join(pending).encode('utf-8'))
+                pending = []
+                data = archive.drain()
+                if data:
+                    yield data
+        if pending:
+            sheet.write(''.join(pending).encode('utf-8'))
+        sheet.write(b'</sheetData></worksheet>')
+    yield archive.drain()
+    yield archive.close()
+
+
+def export_filename(dataset, fmt, filters):
+    parts = ['reports', dataset]
+    if filters['date_start']:
+        parts.append(str(filters['date_start']))
+    if filters['date_end']:
+        parts.append(str(filters['date_end']))
+    return f"{slugify('_'.join(parts)) or 'reports'}.{fmt}"
+
+
+def export_response(dataset, fmt, params):
+    """Return a StreamingHttpResponse for one dataset, or None if unknown."""
+    if dataset not in EXPORTS or fmt not in EXPORT_FORMATS:
+        return None
+
+    filters = parse_report_filters(params)
+    title, header, row_source = EXPORTS[dataset]
+    rows = row_source(filters)
+
+    if fmt == 'csv':
+        response = StreamingHttpResponse(stream_csv(header, rows), content_type='text/csv; charset=utf-8')
+    else:
+        response = StreamingHttpResponse(
+            stream_xlsx(title, header, rows),
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        )
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(dataset, fmt, filters)}"'
+    # Keep proxies from buffering the whole body before sending it on.
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -2,6 +2,7 @@ from django import forms
 from django.contrib.auth.forms import UserCreationForm, SetPasswordForm
 from decimal import Decimal
 from core.models import User, Trip, DoctorReferral, Admission, Specialization, Qualification, Area, Address, AgentAssignment, PatientReferral, DoctorCommissionProfile
+from .widgets import AutocompleteSelect
 
 
 class AgentCreationForm(UserCreationForm):
@@ -269,7 +270,7 @@ class TripCreateForm(forms.ModelForm):
     """Form for creating trips and assigning to executives."""
     
     agent = forms.ModelChoiceField(
-        queryset=User.objects.filter(custom_role_assignment__role__name='Mobile App User', is_active=True),
+        queryset=User.objects.filter(custom_role_assignment__role__name='Mobile App User', is_active=True, deleted_at__isnull=True),
         widget=forms.Select(attrs={'class': 'form-select'}),
         label='Assign to Executive'
     )
@@ -348,7 +349,7 @@ class AreaForm(forms.ModelForm):
 class AddressForm(forms.ModelForm):
     """Child form for Address details."""
     area = forms.ModelChoiceField(
-        queryset=Area.objects.all(),
+        queryset=Area.objects.filter(deleted_at__isnull=True),
         widget=forms.Select(attrs={'class': 'form-select'}),
         empty_label="Select Area"
     )
@@ -456,27 +457,41 @@ class DoctorForm(forms.ModelForm):
         return instance
 
 
+def doctor_option_label(doctor):
+    """Picker label; the doctor's ``agent`` must be select_related."""
+    return f"{doctor.name} (Executive: {doctor.agent.username})" if doctor.agent else doctor.name
+
+
+def patient_referral_option_label(referral):
+    return f"{referral.patient_name} | Executive: {referral.agent.full_name_or_username} | {referral.illness}"
+
+
 class AdmissionForm(forms.ModelForm):
     """Form for creating/editing admission records with billing."""
 
     patient_referral = forms.ModelChoiceField(
-        queryset=PatientReferral.objects.all(),
+        queryset=PatientReferral.objects.select_related('agent'),
         required=False,
-        widget=forms.HiddenInput()
+        widget=AutocompleteSelect('portal:patient_referral_search', placeholder='Search pending referrals...'),
+        label='Pending Referral',
     )
     
     referred_by_doctor = forms.ModelChoiceField(
-        queryset=DoctorReferral.objects.filter(is_internal=False).select_related('agent').all(),
+        queryset=DoctorReferral.objects.filter(is_internal=False).select_related('agent'),
         required=False,
-        widget=forms.Select(attrs={'class': 'form-select'}),
+        widget=AutocompleteSelect(
+            'portal:doctor_search', url_params={'internal': '0'}, placeholder='Search external doctors...'
+        ),
         label='Referred by (External Doctor)',
         help_text='Select the external doctor who referred this patient'
     )
 
     referred_to_doctor = forms.ModelChoiceField(
-        queryset=DoctorReferral.objects.filter(is_internal=True).all(),
+        queryset=DoctorReferral.objects.filter(is_internal=True),
         required=False,
-        widget=forms.Select(attrs={'class': 'form-select'}),
+        widget=AutocompleteSelect(
+            'portal:doctor_search', url_params={'internal': '1'}, placeholder='Search internal doctors...'
+        ),
         label='Referred to (Internal Doctor)',
         help_text='Select the internal hospital doctor managing this admission'
     )
@@ -518,14 +533,12 @@ class AdmissionForm(forms.ModelForm):
             else:
                 field.widget.attrs['class'] = 'form-control'
 
-        # Enable datalist autocomplete on patient name input
-        self.fields['patient_name'].widget.attrs['list'] = 'patient-referral-list'
-        
         # Format doctor choices to show executive info
-        self.fields['referred_by_doctor'].label_from_instance = lambda obj: f"{obj.name} (Executive: {obj.agent.username})" if obj.agent else obj.name
+        self.fields['referred_by_doctor'].label_from_instance = doctor_option_label
         self.fields['referred_to_doctor'].label_from_instance = lambda obj: obj.name
+        self.fields['patient_referral'].label_from_instance = patient_referral_option_label
 
-    def _calculate_total_commission(self, profile):
+    def _calculate_total_commission(self, rates):
         charge_rate_map = (
             ('bed_charges', 'bed_charges_rate'),
             ('nursing_charges', 'nursing_charges_rate'),
@@ -543,10 +556,10 @@ class AdmissionForm(forms.ModelForm):
         for charge_field, rate_field in charge_rate_map:
             amount = Decimal(self.cleaned_data.get(charge_field) or 0)
             total_charges += amount
-            rate = Decimal(str(getattr(profile, rate_field, 0.0) or 0.0))
+            rate = Decimal(str(rates.get(rate_field) or 0.0))
             charge_wise_commission += (amount * rate) / Decimal('100')
 
-        standard_referral_rate = Decimal(str(profile.discount_percentage or 0.0))
+        standard_referral_rate = Decimal(str(rates.get('discount_percentage') or 0.0))
         standard_referral_amount = (total_charges * standard_referral_rate) / Decimal('100')
 
         # Standard referral is always added on top of charge-wise commission.
@@ -565,15 +578,11 @@ class AdmissionForm(forms.ModelForm):
             cleaned_data['referred_by_doctor'] = referred_by_doctor
 
         if referred_by_doctor and payment_category:
-            try:
-                profile = DoctorCommissionProfile.objects.get(
-                    doctor=referred_by_doctor,
-                    payment_category=payment_category,
-                )
-            except DoctorCommissionProfile.DoesNotExist:
-                cleaned_data['commission_amount'] = Decimal('0.00')
-            else:
-                cleaned_data['commission_amount'] = self._calculate_total_commission(profile)
+            # Same cached matrix the form's rate lookups are served from; a
+            # missing profile yields all-zero rates.
+            from .commissions import get_rates
+            rates = get_rates(referred_by_doctor.pk, payment_category.pk)
+            cleaned_data['commission_amount'] = self._calculate_total_commission(rates)
         else:
             cleaned_data['commission_amount'] = Decimal('0.00')
 
@@ -605,7 +614,7 @@ class DoctorCommissionForm(forms.ModelForm):
 
 class AgentSelectionForm(forms.Form):
     agent = forms.ModelChoiceField(
-        queryset=User.objects.filter(custom_role_assignment__role__name='Mobile App User'),
+        queryset=User.objects.filter(custom_role_assignment__role__name='Mobile App User', deleted_at__isnull=True),
         empty_label="Select Executive",
         widget=forms.Select(attrs={'class': 'form-select'}),
         label="Assign to Executive"
@@ -616,13 +625,13 @@ class AgentAssignmentForm(forms.ModelForm):
     """Form for creating a new executive assignment to an area."""
     
     agent = forms.ModelChoiceField(
-        queryset=User.objects.filter(custom_role_assignment__role__name='Mobile App User', is_active=True),
+        queryset=User.objects.filter(custom_role_assignment__role__name='Mobile App User', is_active=True, deleted_at__isnull=True),
         widget=forms.Select(attrs={'class': 'form-select'}),
         label='Select Executive'
     )
     
     area = forms.ModelChoiceField(
-        queryset=Area.objects.all(),
+        queryset=Area.objects.filter(deleted_at__isnull=True),
         widget=forms.Select(attrs={'class': 'form-select'}),
         label='Select Area'
     )
@@ -0,0 +1,355 @@
+"""
+Background jobs for slow portal work.
+
+A request calls ``enqueue_job()`` and gets a ``BackgroundJob`` back straight
+away; a runner claims queued jobs and executes the handler registered for
+the job kind with ``@job_handler``. ``settings.PORTAL_JOB_RUNNER`` picks how
+the runner is started:
+
+- ``process`` (default): the enqueueing request spawns
+  ``manage.py run_portal_jobs --until-idle`` unless one is already running.
+  Rendering then runs in its own interpreter, so it neither holds the web
+  worker's GIL nor counts against the gunicorn request timeout. Spawned
+  runners hold ``runner_lock()``, so at most one is alive at a time.
+- ``thread``: the same loop on a daemon thread in the web process (dev only).
+- ``external``: nothing is spawned. Run ``manage.py run_portal_jobs`` as a
+  separate service (on Render, a background worker with the web service's
+  build command and environment), which polls the queue every few seconds.
+
+Claiming is a conditional UPDATE on the job status, so any number of
+runners can poll the same table without running a job twice.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections, transaction
+from django.utils import timezone
+
+from .models import BackgroundJob
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory file locks (Windows): every enqueue spawns a runner.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+JOB_HANDLERS = {}
+
+_thread_lock = threading.Lock()
+_progress_connections = threading.local()
+_thread_running = False
+
+
+class JobLimitExceeded(Exception):
+    """The user already has the maximum number of queued/running jobs."""
+
+
+def job_handler(kind):
+    """
+    Register ``func(job, report)`` as the handler for ``kind``.
+
+    ``report(percent, message='')`` records progress. The handler returns
+    ``(filename, content_bytes)`` to attach a result file, or ``None``.
+    """
+    def decorator(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def active_job_count(user):
+    return BackgroundJob.objects.filter(user=user, status__in=BackgroundJob.ACTIVE_STATUSES).count()
+
+
+def enqueue_job(user, kind, params=None):
+    """Queue a job for ``user`` and make sure a runner will pick it up."""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"No handler registered for job kind {kind!r}.")
+
+    limit = getattr(settings, 'PORTAL_JOB_MAX_ACTIVE_PER_USER', 2)
+    with transaction.atomic():
+        # Serialize enqueues per user so two clicks cannot both pass the limit.
+        get_user_model().objects.select_for_update().filter(pk=user.pk).first()
+        if limit and active_job_count(user) >= limit:
+            raise JobLimitExceeded(
+                f"You already have {limit} background job(s) in progress. "
+                "Wait for one to finish before starting another."
+            )
+        job = BackgroundJob.objects.create(user=user, kind=kind, params=params or {})
+        transaction.on_commit(start_runner)
+    return job
+
+
+def start_runner():
+    mode = getattr(settings, 'PORTAL_JOB_RUNNER', 'process')
+    if mode == 'process':
+        _spawn_runner_process()
+    elif mode == 'thread':
+        _start_runner_thread()
+
+
+@contextmanager
+def runner_lock():
+    """
+    Yield whether this process got the spawned runner's lock.
+
+    The lock is an ``flock`` on a file under ``PRIVATE_FILES_ROOT``; the
+    kernel drops it when its holder exits, so a crashed runner never
+    leaves it behind.
+    """
+    if fcntl is None:
+        yield True
+        return
+    path = Path(settings.PRIVATE_FILES_ROOT) / 'run_portal_jobs.lock'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def runner_is_alive():
+    with runner_lock() as acquired:
+        return not acquired
+
+
+def has_queued_jobs():
+    return BackgroundJob.objects.filter(status=BackgroundJob.STATUS_QUEUED).exists()
+
+
+def _spawn_runner_process():
+    if runner_is_alive():
+        # It checks the queue again after letting go of the lock, so it
+        # picks this job up; a second interpreter would only cost memory.
+        return
+    manage_py = Path(settings.BASE_DIR) / 'manage.py'
+    try:
+        subprocess.Popen(
+            [sys.executable, str(manage_py), 'run_portal_jobs', '--until-idle'],
+            cwd=str(settings.BASE_DIR),
+            env=os.environ.copy(),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+    except OSError:
+        logger.exception("Could not start the portal job runner process.")
+
+
+def _start_runner_thread():
+    global _thread_running
+    with _thread_lock:
+        if _thread_running:
+            return
+        _thread_running = True
+
+    def loop():
+        global _thread_running
+        try:
+            run_pending_jobs()
+        finally:
+            with _thread_lock:
+                _thread_running = False
+            close_old_connections()
+
+    threading.Thread(target=loop, name='portal-jobs', daemon=True).start()
+
+
+def fail_stale_jobs():
+    """Mark RUNNING jobs whose runner died (or hung) past the timeout as failed."""
+    timeout = getattr(settings, 'PORTAL_JOB_TIMEOUT', 1800)
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    return BackgroundJob.objects.filter(
+        status=BackgroundJob.STATUS_RUNNING,
+        started_at__lt=cutoff,
+    ).update(
+        status=BackgroundJob.STATUS_FAILED,
+        error="The job did not finish within the time limit.",
+        finished_at=timezone.now(),
+    )
+
+
+def claim_next_job():
+    """Atomically move the oldest queued job to RUNNING and return it."""
+    while True:
+        candidate = (
+            BackgroundJob.objects.filter(status=BackgroundJob.STATUS_QUEUED)
+            .order_by('created_at', 'pk')
+            .values_list('pk', flat=True)
+            .first()
+        )
+        if candidate is None:
+            return None
+        claimed = BackgroundJob.objects.filter(
+            pk=candidate, status=BackgroundJob.STATUS_QUEUED,
+        ).update(status=BackgroundJob.STATUS_RUNNING, started_at=timezone.now(), progress=0)
+        if claimed:
+            return BackgroundJob.objects.get(pk=candidate)
+        # Another runner took it; try the next one.
+
+
+def set_progress(job, percent, message=''):
+    percent = max(0, min(100, int(percent)))
+    connection = transaction.get_connection()
+    if connection.in_atomic_block and connection.vendor != 'sqlite':
+        # Inside a long transaction (backup restore) the update would stay
+        # invisible until commit, so write it on a connection of its own.
+        # SQLite allows one writer at a time; there progress shows at commit.
+        _write_progress_outside_transaction(job.pk, percent, message[:255])
+        return
+    BackgroundJob.objects.filter(pk=job.pk).update(progress=percent, message=message[:255])
+
+
+def _write_progress_outside_transaction(pk, percent, message):
+    side = getattr(_progress_connections, 'connection', None)
+    if side is None:
+        side = _progress_connections.connection = connections.create_connection(DEFAULT_DB_ALIAS)
+    meta = BackgroundJob._meta
+    quote = side.ops.quote_name
+    with side.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {quote(meta.db_table)} SET {quote('progress')} = %s, {quote('message')} = %s "
+            f"WHERE {quote(meta.pk.column)} = %s",
+            [percent, message, pk],
+        )
+
+
+def _close_progress_connection():
+    side = getattr(_progress_connections, 'connection', None)
+    if side is not None:
+        side.close()
+        _progress_connections.connection = None
+
+
+def run_job(job):
+    handler = JOB_HANDLERS.get(job.kind)
+    try:
+        if handler is None:
+            raise ValueError(f"No handler registered for job kind {job.kind!r}.")
+        result = handler(job, lambda percent, message='': set_progress(job, percent, message))
+        job.refresh_from_db(fields=['progress', 'message'])
+        if result:
+            filename, content = result
+            job.result_name = filename
+            job.result_file.save(f"{job.pk}-{filename}", ContentFile(content), save=False)
+        job.status = BackgroundJob.STATUS_SUCCEEDED
+        # A handler may finish with its own summary at 100%.
+        if job.progress < 100 or not job.message:
+            job.message = 'Done'
+        job.progress = 100
+    except Exception as exc:
+        logger.exception("Background job %s failed.", job.pk)
+        job.status = BackgroundJob.STATUS_FAILED
+        job.error = str(exc) or exc.__class__.__name__
+    finally:
+        _close_progress_connection()
+    job.finished_at = timezone.now()
+    job.save(update_fields=[
+        'status', 'progress', 'message', 'error', 'result_file', 'result_name', 'finished_at',
+    ])
+    return job
+
+
+def run_pending_jobs(max_jobs=None):
+    """Run queued jobs until the queue is empty (or ``max_jobs`` ran)."""
+    fail_stale_jobs()
+    ran = 0
+    while max_jobs is None or ran < max_jobs:
+        job = claim_next_job()
+        if job is None:
+            break
+        run_job(job)
+        ran += 1
+    return ran
+
+
+def purge_finished_jobs(older_than_days):
+    """Delete finished jobs (and their result files) older than the cutoff."""
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    finished = BackgroundJob.objects.exclude(status__in=BackgroundJob.ACTIVE_STATUSES).filter(created_at__lt=cutoff)
+    count = 0
+    for job in finished.iterator():
+        if job.result_file:
+            job.result_file.delete(save=False)
+        job.delete()
+        count += 1
+    return count
+
+
+# ============ Job handlers ============
+
+REPORTS_PDF_TEMPLATE = 'portal/reports/dashboard_pdf.html'
+
+
+@job_handler('report_pdf')
+def render_reports_pdf(job, report):
+    from . import pdfcache
+    from .pdf import render_pdf_bytes
+    from .reports import build_reports_context, parse_report_filters, report_pdf_filename
+
+    filename = report_pdf_filename(parse_report_filters(job.params))
+    # Key on the data version read *before* the data, so a concurrent change
+    # can only make the stored entry newer than its key, never older.
+    key = pdfcache.report_cache_key(REPORTS_PDF_TEMPLATE, job.params)
+    cached = pdfcache.get_cached(key)
+    if cached is not None:
+        report(90, 'Using cached PDF')
+        return filename, cached.read_bytes()
+
+    report(5, 'Collecting report data')
+    context = build_reports_context(job.params)
+    # Cache hits serve these bytes later, so stamp the render time rather
+    # than letting the template print the time of every download.
+    context['generated_at'] = timezone.now()
+
+    report(35, 'Rendering PDF')
+    content = render_pdf_bytes(template_name=REPORTS_PDF_TEMPLATE, context=context)
+
+    report(95, 'Saving file')
+    pdfcache.store(key, content)
+    return filename, content
+
+
+@job_handler('purge')
+def purge_records(job, report):
+    from .purge import purge
+
+    counts = purge(job.params['model'], job.params['pks'], report=report)
+    summary = ', '.join(f'{count} {name}' for name, count in counts.items() if count)
+    report(100, f'Deleted {summary}' if summary else 'Nothing left to delete')
+
+
+@job_handler('restore')
+def restore_from_backup(job, report):
+    from .restore import restore_backup
+
+    params = job.params
+    try:
+        summary = restore_backup(
+            params['paths'], flush=params.get('flush', False), media_mode=params.get('media_mode', 'merge'),
+            report=report,
+        )
+    finally:
+        # The staged uploads are only needed for this run.
+        shutil.rmtree(params['staging_dir'], ignore_errors=True)
+    report(100, f"Restored {summary['objects']} records of {summary['models']} models and {summary['media']} media files")
@@ -0,0 +1,74 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from portal.reports import (
+    agent_activity_rows,
+    category_rows,
+    doctor_revenue_rows,
+    filtered_admissions,
+    parse_report_filters,
+    summary_stats,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the reports dashboard queries against the current database. "
+        "Read-only; pass dashboard filters to benchmark a specific view."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help="Runs per benchmark (median is reported).")
+        parser.add_argument('--page-size', type=int, default=25)
+        parser.add_argument('--area')
+        parser.add_argument('--agent')
+        parser.add_argument('--doctor')
+        parser.add_argument('--specialization')
+        parser.add_argument('--date-start')
+        parser.add_argument('--date-end')
+
+    def handle(self, *args, **options):
+        filters = parse_report_filters({
+            'area': options['area'],
+            'agent': options['agent'],
+            'doctor': options['doctor'],
+            'specialization': options['specialization'],
+            'date_start': options['date_start'],
+            'date_end': options['date_end'],
+        })
+        page = options['page_size']
+
+        benchmarks = [
+            ('summary', lambda: summary_stats(filters)),
+            ('doctor revenue page', lambda: (
+                doctor_revenue_rows(filters).count(),
+                list(doctor_revenue_rows(filters)[:page]),
+            )),
+            ('executive activity page', lambda: (
+                agent_activity_rows(filters).count(),
+                list(agent_activity_rows(filters)[:page]),
+            )),
+            ('categories', lambda: category_rows(filters)),
+            ('admissions page', lambda: (
+                filtered_admissions(filters).count(),
+                list(filtered_admissions(filters).order_by('-created_at', '-pk')[:page]),
+            )),
+        ]
+
+        self.stdout.write(f"{'benchmark':<26}{'queries':>8}{'median ms':>12}{'min ms':>10}")
+        for name, func in benchmarks:
+            timings = []
+            queries = 0
+            for _ in range(max(options['repeat'], 1)):
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    func()
+                    timings.append((time.perf_counter() - started) * 1000)
+                queries = len(captured.captured_queries)
+            self.stdout.write(
+                f"{name:<26}{queries:>8}{statistics.median(timings):>12.1f}{min(timings):>10.1f}"
+            )
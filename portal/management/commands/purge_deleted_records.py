@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from portal.purge import DEFAULT_BATCH_SIZE, PURGE_PLANS, purge
+
+
+class Command(BaseCommand):
+    help = (
+        "Purge every soft-deleted executive, area and trip now. "
+        "Use it to finish deletions whose background job failed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        for label, (model, _) in PURGE_PLANS.items():
+            pks = list(model.objects.filter(deleted_at__isnull=False).values_list('pk', flat=True))
+            if not pks:
+                continue
+            counts = purge(label, pks, batch_size=options['batch_size'])
+            summary = ', '.join(f'{count} {name}' for name, count in counts.items() if count)
+            self.stdout.write(f"{label}: {summary or 'nothing to delete'}")
+        self.stdout.write(self.style.SUCCESS("Done."))
@@ -0,0 +1,104 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from core.models import Admission, PaymentCategory
+from core.rollups import date_range_q
+from portal.commission_engine import RATE_COLUMNS, CommissionEngineUnavailable, recompute_commissions
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute admission referral commissions from the current doctor rates. "
+        "Reports the deltas only (what-if) unless --apply is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctor', type=int, action='append', default=[], help="Referring doctor id (repeatable).")
+        parser.add_argument('--category', type=int, action='append', default=[], help="Payment category id (repeatable).")
+        parser.add_argument('--status', choices=[value for value, _ in Admission.STATUS_CHOICES])
+        parser.add_argument('--since', help="First admission day (YYYY-MM-DD).")
+        parser.add_argument('--until', help="Last admission day (YYYY-MM-DD).")
+        parser.add_argument(
+            '--rate', action='append', default=[], metavar='FIELD=VALUE',
+            help="What-if only: pretend the selected doctors/categories had this rate (repeatable).",
+        )
+        parser.add_argument('--apply', action='store_true', help="Write the recomputed commissions.")
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--largest', type=int, default=10, help="Show the N largest changes.")
+
+    def handle(self, *args, **options):
+        since = self._parse_date(options['since'], '--since')
+        until = self._parse_date(options['until'], '--until')
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be positive.")
+
+        admissions = Admission.objects.filter(date_range_q('created_at', since, until))
+        if options['doctor']:
+            admissions = admissions.filter(referred_by_doctor_id__in=options['doctor'])
+        if options['category']:
+            admissions = admissions.filter(payment_category_id__in=options['category'])
+        if options['status']:
+            admissions = admissions.filter(status=options['status'])
+
+        overrides = self._rate_overrides(options, admissions)
+        if overrides and options['apply']:
+            raise CommandError("--rate is for what-if runs; save the rates first, then use --apply.")
+
+        started = time.perf_counter()
+        try:
+            summary = recompute_commissions(
+                admissions,
+                apply=options['apply'],
+                rate_overrides=overrides,
+                chunk_size=options['chunk_size'],
+                largest=options['largest'],
+            )
+        except CommissionEngineUnavailable as exc:
+            raise CommandError(str(exc))
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(f"Admissions checked: {summary['admissions']}")
+        self.stdout.write(f"Commissions that differ: {summary['changed']}")
+        self.stdout.write(
+            f"Total commission: {summary['total_before']} -> {summary['total_after']} "
+            f"(delta {summary['delta']})"
+        )
+        for change in summary['largest_changes']:
+            self.stdout.write(
+                f"  Admission #{change['admission_id']}: {change['before']} -> {change['after']}"
+            )
+        if options['apply']:
+            self.stdout.write(self.style.SUCCESS(
+                f"Updated {summary['applied']} admission(s); skipped {summary['skipped']} edited meanwhile "
+                f"({elapsed:.1f}s)."
+            ))
+        else:
+            self.stdout.write(self.style.WARNING(f"What-if only, nothing written ({elapsed:.1f}s)."))
+
+    def _rate_overrides(self, options, admissions):
+        if not options['rate']:
+            return None
+        rates = {}
+        for item in options['rate']:
+            field, _, value = item.partition('=')
+            if field not in RATE_COLUMNS:
+                raise CommandError(f"Unknown rate field {field!r}; choose from {', '.join(RATE_COLUMNS)}.")
+            try:
+                rates[field] = float(value)
+            except ValueError:
+                raise CommandError(f"--rate {item!r} needs a numeric value.")
+        doctors = options['doctor'] or set(
+            admissions.exclude(referred_by_doctor=None).values_list('referred_by_doctor_id', flat=True).distinct()
+        )
+        categories = options['category'] or list(PaymentCategory.objects.values_list('pk', flat=True))
+        return {(d, c): rates for d in doctors for c in categories}
+
+    def _parse_date(self, value, flag):
+        if not value:
+            return None
+        parsed = parse_date(value)
+        if parsed is None:
+            raise CommandError(f"{flag} must be a date in YYYY-MM-DD format.")
+        return parsed
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
+
+from portal.backup_runs import apply_retention, backup_dir, run_backup
+
+
+class Command(BaseCommand):
+    help = (
+        "Write a backup archive to PORTAL_BACKUP_DIR and apply the retention policy. "
+        "Meant for cron, e.g. a nightly `run_backup --incremental` and a weekly full run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help="Only store media changed since the newest stored backup.")
+        parser.add_argument('--no-media', action='store_true', help="Database only.")
+        parser.add_argument('--prune-only', action='store_true', help="Apply retention without backing up.")
+        parser.add_argument('--keep-daily', type=int, help="Defaults to PORTAL_BACKUP_KEEP_DAILY.")
+        parser.add_argument('--keep-weekly', type=int, help="Defaults to PORTAL_BACKUP_KEEP_WEEKLY.")
+        parser.add_argument('--keep-monthly', type=int, help="Defaults to PORTAL_BACKUP_KEEP_MONTHLY.")
+        parser.add_argument('--dry-run', action='store_true', help="With --prune-only: list what would be pruned.")
+
+    def handle(self, *args, **options):
+        if not options['prune_only']:
+            try:
+                record = run_backup(include_media=not options['no_media'], incremental=options['incremental'])
+            except Exception as exc:
+                raise CommandError(f"Backup failed: {exc}")
+            self.stdout.write(
+                f"{record.get_kind_display()} backup {backup_dir() / record.file_name}: "
+                f"{filesizeformat(record.size_bytes)}, {record.media_files} media files, "
+                f"{record.duration.total_seconds():.1f}s"
+            )
+
+        pruned = apply_retention(
+            keep_daily=options['keep_daily'], keep_weekly=options['keep_weekly'],
+            keep_monthly=options['keep_monthly'], dry_run=options['dry_run'] and options['prune_only'],
+        )
+        for record in pruned:
+            self.stdout.write(f"Pruned {record.file_name}")
+        self.stdout.write(self.style.SUCCESS("Done."))
@@ -0,0 +1,58 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from portal.jobs import has_queued_jobs, purge_finished_jobs, run_pending_jobs, runner_lock
+
+
+class Command(BaseCommand):
+    help = "Run queued portal background jobs (PDF reports etc.)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--until-idle',
+            action='store_true',
+            help="Exit once the queue is empty instead of polling forever.",
+        )
+        parser.add_argument('--poll-interval', type=float, default=5.0, help="Seconds between queue polls.")
+        parser.add_argument('--max-jobs', type=int, default=None, help="Exit after running this many jobs.")
+
+    def handle(self, *args, **options):
+        if not options['until_idle']:
+            total = self.run_jobs(options)
+        else:
+            # Spawned per enqueue (PORTAL_JOB_RUNNER=process): one at a time.
+            total = 0
+            while True:
+                with runner_lock() as acquired:
+                    if not acquired:
+                        break
+                    total += self.run_jobs(options)
+                # A job queued while the lock was held was left to this runner.
+                if options['max_jobs'] is not None or not has_queued_jobs():
+                    break
+
+        self.stdout.write(self.style.SUCCESS(f"Ran {total} job(s)."))
+
+    def run_jobs(self, options):
+        ttl_days = getattr(settings, 'PORTAL_JOB_RESULT_TTL_DAYS', 7)
+        remaining = options['max_jobs']
+        total = 0
+
+        while True:
+            ran = run_pending_jobs(max_jobs=remaining)
+            total += ran
+            if remaining is not None:
+                remaining -= ran
+                if remaining <= 0:
+                    break
+            if ttl_days:
+                purge_finished_jobs(ttl_days)
+            if options['until_idle'] and ran == 0:
+                break
+            if ran == 0:
+                close_old_connections()
+                time.sleep(options['poll_interval'])
+        return total
@@ -0,0 +1,18 @@
+from django.db import migrations, models
+
+import portal.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0002_backgroundjob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='backgroundjob',
+            name='result_file',
+            field=models.FileField(blank=True, null=True, storage=portal.models.private_storage, upload_to='portal_jobs/'),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0004_backgroundjob_purge_kind'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='backgroundjob',
+            name='kind',
+            field=models.CharField(choices=[('report_pdf', 'Reports PDF'), ('purge', 'Delete records'), ('restore', 'Restore backup')], max_length=30),
+        ),
+    ]
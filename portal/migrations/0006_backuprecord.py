@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0005_backgroundjob_restore_kind'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackupRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('backup_id', models.CharField(max_length=40, unique=True)),
+                ('parent_id', models.CharField(blank=True, max_length=40)),
+                ('kind', models.CharField(choices=[('full', 'Full'), ('incremental', 'Incremental')], default='full', max_length=20)),
+                ('status', models.CharField(choices=[('RUNNING', 'Running'), ('SUCCEEDED', 'Succeeded'), ('FAILED', 'Failed')], default='RUNNING', max_length=20)),
+                ('included_media', models.BooleanField(default=True)),
+                ('file_name', models.CharField(blank=True, max_length=255)),
+                ('size_bytes', models.BigIntegerField(default=0)),
+                ('media_files', models.PositiveIntegerField(default=0, help_text='Media files stored in this archive.')),
+                ('error', models.TextField(blank=True)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('pruned_at', models.DateTimeField(blank=True, help_text='When retention removed the archive.', null=True)),
+            ],
+            options={
+                'ordering': ['-started_at'],
+                'indexes': [models.Index(fields=['status', '-started_at'], name='backuprecord_status_idx')],
+            },
+        ),
+    ]
@@ -1,5 +1,12 @@
 from django.db import models
 from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+
+def private_storage():
+    """Storage outside MEDIA_ROOT, which is publicly served."""
+    return FileSystemStorage(location=settings.PRIVATE_FILES_ROOT)
+
 
 class CustomRole(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -38,3 +45,101 @@ class UserRoleAssignment(models.Model):
 
     def __str__(self):
         return f"{self.user.username} -> {self.role.name}"
+
+class BackgroundJob(models.Model):
+    """Long-running portal work (PDF reports etc.) executed outside the request thread."""
+
+    KIND_CHOICES = (
+        ('report_pdf', 'Reports PDF'),
+        ('purge', 'Delete records'),
+        ('restore', 'Restore backup'),
+    )
+    STATUS_QUEUED = 'QUEUED'
+    STATUS_RUNNING = 'RUNNING'
+    STATUS_SUCCEEDED = 'SUCCEEDED'
+    STATUS_FAILED = 'FAILED'
+    STATUS_CHOICES = (
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    )
+    ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    progress = models.PositiveSmallIntegerField(default=0)
+    message = models.CharField(max_length=255, blank=True)
+    params = models.JSONField(default=dict, blank=True)
+    result_file = models.FileField(upload_to='portal_jobs/', storage=private_storage, null=True, blank=True)
+    result_name = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='background_jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='bgjob_status_created_idx'),
+            models.Index(fields=['user', 'status'], name='bgjob_user_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.pk} ({self.status})"
+
+    @property
+    def is_active(self):
+        return self.status in self.ACTIVE_STATUSES
+
+
+class BackupRecord(models.Model):
+    """One run of ``manage.py run_backup`` and the archive it left in PORTAL_BACKUP_DIR."""
+
+    KIND_FULL = 'full'
+    KIND_INCREMENTAL = 'incremental'
+    KIND_CHOICES = (
+        (KIND_FULL, 'Full'),
+        (KIND_INCREMENTAL, 'Incremental'),
+    )
+    STATUS_RUNNING = 'RUNNING'
+    STATUS_SUCCEEDED = 'SUCCEEDED'
+    STATUS_FAILED = 'FAILED'
+    STATUS_CHOICES = (
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    )
+
+    backup_id = models.CharField(max_length=40, unique=True)
+    parent_id = models.CharField(max_length=40, blank=True)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default=KIND_FULL)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_RUNNING)
+    included_media = models.BooleanField(default=True)
+    file_name = models.CharField(max_length=255, blank=True)
+    size_bytes = models.BigIntegerField(default=0)
+    media_files = models.PositiveIntegerField(default=0, help_text="Media files stored in this archive.")
+    error = models.TextField(blank=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    pruned_at = models.DateTimeField(null=True, blank=True, help_text="When retention removed the archive.")
+
+    class Meta:
+        ordering = ['-started_at']
+        indexes = [
+            models.Index(fields=['status', '-started_at'], name='backuprecord_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} backup {self.backup_id} ({self.status})"
+
+    @property
+    def duration(self):
+        if self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+    @property
+    def is_available(self):
+        return self.status == self.STATUS_SUCCEEDED and self.pruned_at is None and bool(self.file_name)
@@ -41,18 +41,25 @@ def _link_callback(uri: str, rel: str | None = None) -> str:
     return uri
 
 
-def render_pdf_response(*, template_name: str, context: dict, filename: str) -> HttpResponse:
+class PdfUnavailable(Exception):
+    """xhtml2pdf is not installed."""
+
+
+class PdfRenderError(Exception):
+    """xhtml2pdf reported errors while rendering."""
+
+
+def render_pdf_bytes(*, template_name: str, context: dict) -> bytes:
     """
-    Render a Django template to a downloadable PDF using xhtml2pdf.
+    Render a Django template to PDF bytes using xhtml2pdf.
+
+    This is CPU-bound and can take minutes for large reports; call it from a
+    background job (see ``portal.jobs``) rather than a request thread.
     """
     try:
         from xhtml2pdf import pisa
     except Exception as exc:  # pragma: no cover
-        return HttpResponse(
-            "PDF generation is not available (missing dependency xhtml2pdf).",
-            status=501,
-            content_type="text/plain",
-        )
+        raise PdfUnavailable("PDF generation is not available (missing dependency xhtml2pdf).") from exc
 
     template = get_template(template_name)
     html = template.render(context)
@@ -65,13 +72,21 @@ def render_pdf_response(*, template_name: str, context: dict, filename: str) ->
         link_callback=_link_callback,
     )
     if pdf.err:
-        return HttpResponse(
-            "Could not generate PDF.",
-            status=500,
-            content_type="text/plain",
-        )
+        raise PdfRenderError("Could not generate PDF.")
+    return result.getvalue()
+
 
-    response = HttpResponse(result.getvalue(), content_type="application/pdf")
+def render_pdf_response(*, template_name: str, context: dict, filename: str) -> HttpResponse:
+    """
+    Render a Django template to a downloadable PDF using xhtml2pdf.
+    """
+    try:
+        content = render_pdf_bytes(template_name=template_name, context=context)
+    except PdfUnavailable as exc:
+        return HttpResponse(str(exc), status=501, content_type="text/plain")
+    except PdfRenderError as exc:
+        return HttpResponse(str(exc), status=500, content_type="text/plain")
+
+    response = HttpResponse(content, content_type="application/pdf")
     response["Content-Disposition"] = f'attachment; filename="{filename}"'
     return response
-
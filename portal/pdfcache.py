@@ -0,0 +1,138 @@
+"""
+On-disk, content-addressed cache for rendered report PDFs.
+
+The cache key is a SHA-256 over the template (name and source), the deploy
+version (``PORTAL_DEPLOY_VERSION``, which covers included templates and the
+rendering code), the normalized report filters and the ``reports`` data
+version. Admission
+changes, rollup rebuilds and changes to the trip, visit, referral and
+doctor fields the dashboard shows bump the version (see ``core.signals``),
+so stale entries are never looked up again; they are removed by the
+size/age eviction in ``evict()``.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.template.loader import get_template
+
+from core.dataversion import REPORTS, get_data_version
+
+from .reports import parse_report_filters
+
+# Filter values that change what the PDF shows.
+KEY_FILTERS = ('area_id', 'agent_id', 'doctor_id', 'specialization', 'date_start', 'date_end', 'active_tab')
+
+
+def cache_dir():
+    return Path(settings.PORTAL_PDF_CACHE_DIR)
+
+
+def _template_digest(template_name):
+    template = get_template(template_name)
+    source = getattr(getattr(template, 'template', None), 'source', '') or ''
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+def report_cache_key(template_name, params):
+    """Hash of template, deploy version, normalized filters and the current data version."""
+    filters = parse_report_filters(params)
+    normalized = {}
+    for name in KEY_FILTERS:
+        value = filters[name]
+        if name == 'specialization' and value:
+            value = value.strip().lower()
+        normalized[name] = str(value) if value is not None else None
+    payload = {
+        'template': template_name,
+        'template_sha256': _template_digest(template_name),
+        'deploy': settings.PORTAL_DEPLOY_VERSION,
+        'filters': normalized,
+        'data_version': get_data_version(REPORTS),
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _path_for(key):
+    return cache_dir() / key[:2] / f'{key}.pdf'
+
+
+def get_cached(key):
+    """Return the cached file path for ``key`` or None."""
+    path = _path_for(key)
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    if time.time() - stat.st_mtime > settings.PORTAL_PDF_CACHE_MAX_AGE:
+        return None
+    # Touch on hit so eviction drops the least recently used entries first.
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return path
+
+
+def store(key, content):
+    """Write ``content`` atomically under ``key`` and evict old entries."""
+    path = _path_for(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            out.write(content)
+        os.replace(tmp_name, path)
+    except BaseException:
+        try:
+            os.remove(tmp_name)
+        except OSError:
+            pass
+        raise
+    evict()
+    return path
+
+
+def evict(max_bytes=None, max_age=None):
+    """Drop entries older than ``max_age`` seconds, then oldest until under ``max_bytes``."""
+    max_bytes = settings.PORTAL_PDF_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    max_age = settings.PORTAL_PDF_CACHE_MAX_AGE if max_age is None else max_age
+    root = cache_dir()
+    if not root.exists():
+        return 0
+
+    now = time.time()
+    entries = []
+    removed = 0
+    for path in root.glob('*/*.pdf'):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        if now - stat.st_mtime > max_age:
+            removed += _remove(path)
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        removed += _remove(path)
+        total -= size
+    return removed
+
+
+def _remove(path):
+    try:
+        path.unlink()
+        return 1
+    except FileNotFoundError:
+        return 0
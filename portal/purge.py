@@ -0,0 +1,143 @@
+"""
+Soft delete, then purge in bounded batches.
+
+Deleting an executive, area or trip used to cascade through every trip,
+visit, stay, referral and assignment inside one request. ``queue_deletion``
+now only marks the rows (``deleted_at``; users are also deactivated) and
+queues a ``purge`` background job. The job removes the dependent rows
+leaf-first, ``batch_size`` rows per transaction (their image files are
+released through ``core.storage`` once each batch has committed), and
+finally deletes the marked rows, whose remaining cascade is then small.
+"""
+from __future__ import annotations
+
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import (
+    Address,
+    AgentAssignment,
+    AgentAssignmentDoctorStatus,
+    Area,
+    DoctorVisit,
+    OvernightStay,
+    PatientReferral,
+    Task,
+    Trip,
+    User,
+)
+
+DEFAULT_BATCH_SIZE = 500
+
+# model label -> (model, dependent querysets in deletion order). Every step
+# is a function of the root ids and is drained before the next one starts.
+PURGE_PLANS = {
+    'core.user': (User, (
+        lambda ids: DoctorVisit.objects.filter(trip__agent_id__in=ids),
+        lambda ids: OvernightStay.objects.filter(trip__agent_id__in=ids),
+        lambda ids: Trip.objects.filter(agent_id__in=ids),
+        lambda ids: AgentAssignmentDoctorStatus.objects.filter(assignment__agent_id__in=ids),
+        lambda ids: AgentAssignment.objects.filter(agent_id__in=ids),
+        lambda ids: PatientReferral.objects.filter(agent_id__in=ids),
+        lambda ids: Task.objects.filter(raised_by_id__in=ids),
+    )),
+    'core.area': (Area, (
+        lambda ids: AgentAssignmentDoctorStatus.objects.filter(assignment__area_id__in=ids),
+        lambda ids: AgentAssignment.objects.filter(area_id__in=ids),
+        lambda ids: Address.objects.filter(area_id__in=ids),
+    )),
+    'core.trip': (Trip, (
+        lambda ids: DoctorVisit.objects.filter(trip_id__in=ids),
+        lambda ids: OvernightStay.objects.filter(trip_id__in=ids),
+    )),
+}
+
+# Purges that can change report rollup buckets through SET_NULL updates
+# (admission -> referral agent, doctor -> address area), which send no signals.
+REBUILDS_ROLLUPS = {'core.user', 'core.area'}
+
+
+def model_label(model):
+    return model._meta.label_lower
+
+
+def queue_deletion(objects, requested_by, next_url=''):
+    """
+    Soft-delete ``objects`` (all of one model) and queue their purge.
+
+    Returns the ``BackgroundJob``; raises ``JobLimitExceeded`` like any other
+    enqueue, in which case nothing is marked.
+    """
+    from .jobs import enqueue_job
+
+    objects = list(objects)
+    if not objects:
+        raise ValueError("Nothing to delete.")
+    model = type(objects[0])
+    label = model_label(model)
+    if label not in PURGE_PLANS:
+        raise ValueError(f"{label} has no purge plan.")
+
+    pks = [obj.pk for obj in objects]
+    names = ', '.join(str(obj) for obj in objects[:3])
+    if len(objects) > 3:
+        names += f' and {len(objects) - 3} more'
+    with transaction.atomic():
+        job = enqueue_job(requested_by, 'purge', {
+            'model': label,
+            'pks': pks,
+            'label': f'Delete {model._meta.verbose_name_plural}: {names}',
+            'next': next_url,
+        })
+        updates = {'deleted_at': timezone.now()}
+        if model is User:
+            # Blocks portal and API logins straight away.
+            updates['is_active'] = False
+        model.objects.filter(pk__in=pks).update(**updates)
+    return job
+
+
+def delete_in_batches(queryset, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """Delete every row of ``queryset`` in transactions of ``batch_size`` rows."""
+    model = queryset.model
+    deleted = 0
+    while True:
+        pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        with transaction.atomic():
+            # post_delete releases image files on commit (core.signals).
+            model.objects.filter(pk__in=pks).delete()
+        deleted += len(pks)
+        if progress:
+            progress(deleted)
+
+
+def purge(label, pks, batch_size=DEFAULT_BATCH_SIZE, report=None):
+    """Delete soft-deleted ``pks`` of ``label`` and everything hanging off them."""
+    from core.rollups import rebuild_admission_rollups
+
+    model, steps = PURGE_PLANS[label]
+    report = report or (lambda percent, message='': None)
+    # Only rows still marked: an undeleted (or never marked) row is left alone.
+    pks = list(model.objects.filter(pk__in=pks, deleted_at__isnull=False).values_list('pk', flat=True))
+    if not pks:
+        return {}
+
+    counts = {}
+    for number, step in enumerate(steps):
+        queryset = step(pks)
+        name = queryset.model._meta.verbose_name_plural
+        base = 5 + int(85 * number / len(steps))
+        report(base, f'Deleting {name}')
+        counts[name] = delete_in_batches(
+            queryset, batch_size,
+            progress=lambda done, name=name, base=base: report(base, f'Deleted {done} {name}'),
+        )
+
+    report(90, f'Deleting {model._meta.verbose_name_plural}')
+    counts[model._meta.verbose_name_plural] = delete_in_batches(model.objects.filter(pk__in=pks), batch_size)
+    if label in REBUILDS_ROLLUPS:
+        report(95, 'Rebuilding report rollups')
+        rebuild_admission_rollups()
+    return counts
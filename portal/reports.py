@@ -0,0 +1,335 @@
+"""
+Query builders for the reports dashboard.
+
+Everything here works from a plain mapping of GET parameters so the same
+numbers can be produced for the HTML dashboard and for PDF exports.
+Revenue, referral and patient-count figures come from AdmissionDailyRollup;
+only the detailed admission list reads the admissions table directly.
+"""
+from __future__ import annotations
+
+from decimal import Decimal
+
+from django.db.models import Count, DecimalField, Exists, FloatField, Min, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Lower, Trim
+from django.utils.dateparse import parse_date
+from django.utils.text import slugify
+
+from core.models import (
+    Admission,
+    AdmissionDailyRollup,
+    Area,
+    DoctorReferral,
+    DoctorVisit,
+    PatientReferral,
+    PaymentCategory,
+    Trip,
+    User,
+)
+from core.rollups import date_range_q
+
+REPORT_TABS = ('patients', 'doctors', 'agents', 'category')
+
+
+def _int_or_none(value):
+    value = (value or '').strip() if isinstance(value, str) else value
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    if isinstance(value, int):
+        return value
+    return None
+
+
+def parse_report_filters(params):
+    """Normalize dashboard GET parameters into typed filter values."""
+    date_start_raw = params.get('date_start') or ''
+    date_end_raw = params.get('date_end') or ''
+    active_tab = params.get('active_tab') or 'patients'
+    return {
+        'area_id': _int_or_none(params.get('area')),
+        'agent_id': _int_or_none(params.get('agent')),
+        'doctor_id': _int_or_none(params.get('doctor')),
+        'specialization': params.get('specialization') or None,
+        'date_start': parse_date(date_start_raw) if date_start_raw else None,
+        'date_end': parse_date(date_end_raw) if date_end_raw else None,
+        'date_start_raw': date_start_raw,
+        'date_end_raw': date_end_raw,
+        'active_tab': active_tab if active_tab in REPORT_TABS else 'patients',
+    }
+
+
+def report_pdf_filename(filters):
+    """Download name for a reports PDF, e.g. ``reports_doctors_2025-01-01.pdf``."""
+    name_parts = ['reports', filters['active_tab']]
+    if filters['date_start_raw']:
+        name_parts.append(filters['date_start_raw'])
+    if filters['date_end_raw']:
+        name_parts.append(filters['date_end_raw'])
+    return f"{slugify('_'.join(name_parts)) or 'reports'}.pdf"
+
+
+def admission_filter_q(filters):
+    """Filter for raw Admission rows (detailed entries table)."""
+    q = Q()
+    if filters['area_id']:
+        q &= Q(referred_by_doctor__address_details__area_id=filters['area_id'])
+    if filters['agent_id']:
+        q &= Q(patient_referral__agent_id=filters['agent_id'])
+    if filters['doctor_id']:
+        q &= Q(referred_by_doctor_id=filters['doctor_id'])
+    if filters['specialization']:
+        q &= Q(referred_by_doctor__specialization__iexact=filters['specialization'])
+    q &= date_range_q('created_at', filters['date_start'], filters['date_end'])
+    return q
+
+
+def rollup_filter_q(filters, prefix=''):
+    """Filter for AdmissionDailyRollup rows, optionally through a relation prefix."""
+    q = Q()
+    if filters['area_id']:
+        q &= Q(**{f'{prefix}area_id': filters['area_id']})
+    if filters['agent_id']:
+        q &= Q(**{f'{prefix}agent_id': filters['agent_id']})
+    if filters['doctor_id']:
+        q &= Q(**{f'{prefix}referred_by_doctor_id': filters['doctor_id']})
+    if filters['specialization']:
+        q &= Q(**{f'{prefix}referred_by_doctor__specialization__iexact': filters['specialization']})
+    if filters['date_start']:
+        q &= Q(**{f'{prefix}date__gte': filters['date_start']})
+    if filters['date_end']:
+        q &= Q(**{f'{prefix}date__lte': filters['date_end']})
+    return q
+
+
+def filtered_rollups(filters):
+    return AdmissionDailyRollup.objects.filter(rollup_filter_q(filters))
+
+
+def filtered_admissions(filters):
+    return Admission.objects.filter(admission_filter_q(filters))
+
+
+def summary_stats(filters):
+    """Revenue, referral and patient totals for the filtered period."""
+    return filtered_rollups(filters).aggregate(
+        total_revenue=Sum('total_revenue'),
+        total_referral_amount=Sum('total_commission'),
+        patient_count=Sum('patient_count'),
+        opd_count=Sum('opd_count'),
+        ipd_count=Sum('ipd_count'),
+    )
+
+
+def doctor_context_q(filters):
+    """Doctors that belong to the filter context even without any revenue."""
+    q = Q()
+    if filters['area_id']:
+        q &= Q(address_details__area_id=filters['area_id'])
+    if filters['specialization']:
+        q &= Q(specialization__iexact=filters['specialization'])
+    if filters['doctor_id']:
+        q &= Q(id=filters['doctor_id'])
+    if filters['agent_id']:
+        # Check legacy executive field OR area-based assignment
+        q &= Q(agent_id=filters['agent_id']) | Q(address_details__area__agent_id=filters['agent_id'])
+    return q
+
+
+def doctor_revenue_rows(filters):
+    """
+    Doctor-wise revenue as one grouped query from the doctor side.
+
+    Doctors in the filter context plus any doctor with matching rollups are
+    LEFT JOINed to their rollups, grouped by canonical name (trimmed,
+    case-folded) and sorted by revenue in the database. Context doctors
+    without admissions come out with zero totals. The result is a lazy
+    values() queryset, so callers can slice it for paging.
+    """
+    rollup_q = rollup_filter_q(filters, prefix='admission_rollups__')
+    has_revenue = Exists(
+        AdmissionDailyRollup.objects.filter(rollup_filter_q(filters), referred_by_doctor=OuterRef('pk'))
+    )
+    zero = Value(Decimal('0.00'), output_field=DecimalField(max_digits=14, decimal_places=2))
+    doctors = DoctorReferral.objects.all()
+    context_q = doctor_context_q(filters)
+    if context_q:
+        # Without filters every doctor is in context already.
+        doctors = doctors.filter(context_q | Q(has_revenue))
+    return (
+        doctors
+        .annotate(canonical_name=Lower(Trim('name')))
+        .values('canonical_name')
+        .annotate(
+            doctor_name=Min('name'),
+            opd_count=Coalesce(Sum('admission_rollups__opd_count', filter=rollup_q), 0),
+            ipd_count=Coalesce(Sum('admission_rollups__ipd_count', filter=rollup_q), 0),
+            total_revenue=Coalesce(Sum('admission_rollups__total_revenue', filter=rollup_q), zero),
+            total_commission=Coalesce(Sum('admission_rollups__total_commission', filter=rollup_q), zero),
+        )
+        .order_by('-total_revenue', 'canonical_name')
+    )
+
+
+def category_rows(filters):
+    """Patient count and revenue per payment category, including empty categories."""
+    category_stats = (
+        filtered_rollups(filters)
+        .values('payment_category__name')
+        .annotate(
+            patient_count=Sum('patient_count'),
+            total_revenue=Sum('total_revenue'),
+        )
+        .order_by('-patient_count')
+    )
+
+    cat_map = {c['payment_category__name']: c for c in category_stats}
+    full_category_stats = []
+    for cat in PaymentCategory.objects.values('name'):
+        cat_name = cat['name']
+        if cat_name in cat_map:
+            full_category_stats.append(cat_map[cat_name])
+        else:
+            full_category_stats.append({
+                'payment_category__name': cat_name,
+                'patient_count': 0,
+                'total_revenue': 0,
+            })
+    full_category_stats.sort(key=lambda x: x.get('patient_count', 0) or 0, reverse=True)
+    return full_category_stats
+
+
+def aggregate_subquery(queryset, group_field, expression):
+    """Correlated scalar subquery: ``expression`` aggregated per ``group_field``."""
+    return Subquery(
+        queryset.order_by().values(group_field).annotate(value=expression).values('value')[:1]
+    )
+
+
+def agent_activity_rows(filters):
+    """
+    Executive-wise visits, kilometres and direct patient referrals.
+
+    One statement over the active executives with a correlated subquery per
+    measure, sorted in the database. Returns a lazy values() queryset, so
+    callers can slice it for paging.
+    """
+    area_id = filters['area_id']
+    doctor_id = filters['doctor_id']
+    spec = filters['specialization']
+    date_start = filters['date_start']
+    date_end = filters['date_end']
+
+    agent_qs = User.objects.filter(role='advisor', is_active=True, deleted_at__isnull=True)
+    if filters['agent_id']:
+        agent_qs = agent_qs.filter(id=filters['agent_id'])
+
+    # Doctors visited / areas visited via DoctorVisit records.
+    visit_q = Q()
+    if area_id:
+        visit_q &= Q(doctor__address_details__area_id=area_id)
+    if doctor_id:
+        visit_q &= Q(doctor_id=doctor_id)
+    if spec:
+        visit_q &= Q(doctor__specialization__iexact=spec)
+    visits = DoctorVisit.objects.filter(
+        visit_q,
+        date_range_q('trip__start_time', date_start, date_end),
+        trip__agent_id=OuterRef('pk'),
+        trip__deleted_at__isnull=True,
+    )
+
+    # KM travelled via Trip records; each trip counts once however many
+    # matching visits it has.
+    trips = Trip.objects.filter(
+        date_range_q('start_time', date_start, date_end), agent_id=OuterRef('pk'), deleted_at__isnull=True,
+    )
+    if visit_q:
+        trips = trips.filter(id__in=DoctorVisit.objects.filter(visit_q).values('trip_id'))
+
+    # Direct patients referred via PatientReferral records.
+    referrals = PatientReferral.objects.filter(
+        date_range_q('reported_on', date_start, date_end),
+        agent_id=OuterRef('pk'),
+    )
+    if area_id:
+        referrals = referrals.filter(referred_by_doctor__address_details__area_id=area_id)
+    if doctor_id:
+        referrals = referrals.filter(referred_by_doctor_id=doctor_id)
+    if spec:
+        referrals = referrals.filter(referred_by_doctor__specialization__iexact=spec)
+
+    return (
+        agent_qs.annotate(
+            doctors_visited=Coalesce(
+                aggregate_subquery(visits, 'trip__agent_id', Count('doctor_id', distinct=True)), 0
+            ),
+            areas_visited=Coalesce(
+                aggregate_subquery(visits, 'trip__agent_id', Count(
+                    'doctor__address_details__area_id', distinct=True,
+                    filter=Q(doctor__address_details__area__deleted_at__isnull=True),
+                )), 0
+            ),
+            kms_travelled=Coalesce(
+                aggregate_subquery(trips, 'agent_id', Sum('total_kilometers')), 0.0, output_field=FloatField()
+            ),
+            direct_patients_referred=Coalesce(
+                aggregate_subquery(referrals, 'agent_id', Count('id')), 0
+            ),
+        )
+        .values(
+            'id', 'username', 'first_name', 'last_name',
+            'doctors_visited', 'areas_visited', 'kms_travelled', 'direct_patients_referred',
+        )
+        .order_by('-direct_patients_referred', '-doctors_visited', '-kms_travelled', 'id')
+    )
+
+
+def build_reports_context(params):
+    """Build the full dashboard/PDF context from GET-style parameters."""
+    filters = parse_report_filters(params)
+    summary = summary_stats(filters)
+
+    explorer_stats = {
+        'total_revenue': summary['total_revenue'],
+        'total_referral_amount': summary['total_referral_amount'],
+        'patient_count': summary['patient_count'] or 0,
+        'opd_count': summary['opd_count'] or 0,
+        'ipd_count': summary['ipd_count'] or 0,
+    }
+    total_summary = {
+        'total_revenue': summary['total_revenue'],
+        'total_patients': summary['patient_count'] or 0,
+        'opd_total': summary['opd_count'] or 0,
+        'ipd_total': summary['ipd_count'] or 0,
+    }
+
+    return {
+        # --- Filters for Dropdowns ---
+        'areas': Area.objects.filter(deleted_at__isnull=True).order_by('name'),
+        'agents': User.objects.filter(role='advisor', is_active=True, deleted_at__isnull=True).order_by('username'),
+        'doctors_list': DoctorReferral.objects.all().order_by('name'),
+        'specializations': DoctorReferral.objects.values_list('specialization', flat=True).distinct().order_by('specialization'),
+        # Provide a cleaner filters dict for the template to avoid complex logic/formatting issues
+        'filters_data': {
+            'area_id': filters['area_id'],
+            'agent_id': filters['agent_id'],
+            'doctor_id': filters['doctor_id'],
+            'specialization': filters['specialization'],
+            'date_start': filters['date_start_raw'],
+            'date_end': filters['date_end_raw'],
+        },
+        'has_filters': any([
+            filters['area_id'], filters['agent_id'], filters['doctor_id'],
+            filters['specialization'], filters['date_start'], filters['date_end'],
+        ]),
+        'doctor_revenue': doctor_revenue_rows(filters),
+        'agent_revenue': agent_activity_rows(filters),
+        'category_stats': category_rows(filters),
+        'explorer_stats': explorer_stats,
+        'filtered_admissions': filtered_admissions(filters).select_related(
+            'patient_referral', 'patient_referral__agent', 'referred_by_doctor', 'payment_category'
+        ).order_by('-created_at'),
+        'total_summary': total_summary,
+        'title': 'Hospital Reports Dashboard',
+        'active_tab': filters['active_tab'],
+    }
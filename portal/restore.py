@@ -0,0 +1,443 @@
+"""
+Restore backups produced by ``portal.backups`` (or older fixture zips).
+
+``restore_backup`` runs as the ``restore`` background job. The per-model
+NDJSON streams are read in the dependency order recorded in ``meta.json``
+(after checking the schema fingerprint); a single fixture is streamed out
+of the zip and parsed one object at a time. Either way rows are collected
+per model and written ``batch_size`` at a time with ``bulk_create`` (an
+upsert on the primary key, like ``loaddata``'s save), all in one transaction
+with constraint checks deferred to the end. Natural keys are resolved once
+per distinct key. Media are copied after the commit by a thread pool, each
+worker reading its own handle on the archive.
+
+Background jobs are never restored from a backup: their rows, including the
+running restore, are kept and pointed at the restored user with the same
+username (or a restored superuser).
+"""
+from __future__ import annotations
+
+import contextlib
+import gzip
+import hashlib
+import io
+import json
+import logging
+import shutil
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.color import no_style
+from django.core.serializers import python as python_serializer
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from core.storage import recount_blobs
+
+from .backups import (
+    DATA_FORMAT_NDJSON,
+    FIXTURE_NAME,
+    BackupError,
+    backup_models,
+    data_member,
+    has_data,
+    read_meta,
+    resolve_chain,
+    schema_fingerprint,
+)
+from .models import BackgroundJob
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+MEDIA_WORKERS = 4
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def iter_fixture_objects(stream, total_size=None, progress=None):
+    """
+    Yield the objects of a JSON array read from the binary ``stream``.
+
+    Only the current object and one read chunk are held in memory.
+    ``progress(fraction)`` is called after every chunk when ``total_size``
+    (uncompressed bytes) is known.
+    """
+    decoder = json.JSONDecoder()
+    text = io.TextIOWrapper(stream, encoding='utf-8')
+    buffer = ''
+    position = 0
+    consumed = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, position, consumed, eof
+        chunk = text.read(READ_CHUNK_SIZE)
+        if not chunk:
+            eof = True
+            return
+        consumed += position
+        buffer = buffer[position:] + chunk
+        position = 0
+        if progress and total_size:
+            progress(min(1.0, consumed / total_size))
+
+    def skip(separators):
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in separators:
+                position += 1
+            if position < len(buffer) or eof:
+                return
+            fill()
+
+    skip(' \t\r\n')
+    if position >= len(buffer) or buffer[position] != '[':
+        raise BackupError("The fixture is not a JSON array.")
+    position += 1
+    while True:
+        skip(' \t\r\n,')
+        if position >= len(buffer):
+            raise BackupError("The fixture ends before its closing bracket.")
+        if buffer[position] == ']':
+            return
+        try:
+            obj, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise BackupError("The fixture is not valid JSON.")
+            fill()
+            continue
+        position = end
+        yield obj
+
+
+class NaturalKeyCache:
+    """Resolve natural-key references to primary keys, one query per distinct key."""
+
+    def __init__(self, using):
+        self.using = using
+        self._pks = {}
+
+    def resolve(self, model, key, field_name=None):
+        cache_key = (model, field_name, tuple(key))
+        if cache_key not in self._pks:
+            manager = model._default_manager.db_manager(self.using)
+            try:
+                obj = manager.get_by_natural_key(*key)
+            except model.DoesNotExist:
+                raise BackupError(f"{model._meta.label} {key!r} is referenced but missing from the backup.")
+            value = getattr(obj, field_name or model._meta.pk.attname)
+            self._pks[cache_key] = getattr(value, 'pk', value)
+        return self._pks[cache_key]
+
+    def forget(self, model):
+        # Rows of ``model`` were (re)written; their pks may have changed.
+        for cache_key in [k for k in self._pks if k[0] is model]:
+            del self._pks[cache_key]
+
+    def resolve_fields(self, model, fields):
+        """Replace natural-key values in a fixture ``fields`` dict with pks, in place."""
+        for field in model._meta.get_fields():
+            if not field.concrete or field.name not in fields or not field.is_relation:
+                continue
+            value = fields[field.name]
+            target = field.remote_field.model
+            if field.many_to_many:
+                if value and isinstance(value[0], (list, tuple)):
+                    fields[field.name] = [self.resolve(target, item) for item in value]
+            elif isinstance(value, (list, tuple)):
+                fields[field.name] = self.resolve(target, value, field.target_field.attname)
+
+
+def _model_for(label):
+    try:
+        return apps.get_model(label)
+    except (LookupError, ValueError):
+        return None
+
+
+def _write_batch(model, rows, cache, using):
+    """Insert or update ``rows`` (fixture dicts of ``model``); returns the count."""
+    for row in rows:
+        cache.resolve_fields(model, row.setdefault('fields', {}))
+    objects = list(python_serializer.Deserializer(rows, using=using, ignorenonexistent=True))
+
+    keyed = [obj for obj in objects if obj.object.pk is not None]
+    # Rows identified by natural key only (users, permissions, content
+    # types) and multi-table children keep loaddata's row-by-row save.
+    if model._meta.parents or len(keyed) != len(objects):
+        for obj in objects:
+            obj.save(using=using)
+        cache.forget(model)
+        return len(objects)
+
+    update_fields = [
+        field.name for field in model._meta.concrete_fields
+        if not field.primary_key and not field.generated
+    ]
+    instances = [obj.object for obj in objects]
+    if update_fields:
+        model._base_manager.using(using).bulk_create(
+            instances, update_conflicts=True, unique_fields=[model._meta.pk.name], update_fields=update_fields,
+        )
+    else:
+        model._base_manager.using(using).bulk_create(instances, ignore_conflicts=True)
+
+    for obj in objects:
+        for name, values in (obj.m2m_data or {}).items():
+            _set_m2m(model, obj.object.pk, name, values, using)
+    return len(objects)
+
+
+def _set_m2m(model, pk, name, values, using):
+    field = model._meta.get_field(name)
+    through = field.remote_field.through
+    source = field.m2m_field_name()
+    target = field.m2m_reverse_field_name()
+    manager = through._base_manager.using(using)
+    manager.filter(**{source: pk}).delete()
+    manager.bulk_create(
+        [through(**{f'{source}_id': pk, f'{target}_id': value}) for value in values],
+        ignore_conflicts=True,
+    )
+
+
+def _flush_tables(models, using):
+    """Delete every row of ``models`` and their auto-created m2m tables."""
+    connection = connections[using]
+    tables = set()
+    for model in models:
+        tables.add(model._meta.db_table)
+        for field in model._meta.local_many_to_many:
+            if field.remote_field.through._meta.auto_created:
+                tables.add(field.remote_field.through._meta.db_table)
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for table in sorted(tables):
+            # DELETE rather than TRUNCATE: the job tables keep their rows and
+            # the checks on them are deferred to the end of the transaction.
+            cursor.execute(f'DELETE FROM {quote(table)}')
+
+
+def _keep_jobs(job_users, using):
+    """Point kept background jobs at restored users (see the module docstring)."""
+    User = get_user_model()
+    users = dict(User._base_manager.using(using).filter(
+        username__in=set(job_users.values()),
+    ).values_list('username', 'pk'))
+    missing = [pk for pk, username in job_users.items() if username not in users]
+    fallback = None
+    if missing:
+        fallback = (
+            User._base_manager.using(using).filter(is_superuser=True, is_active=True)
+            .order_by('pk').values_list('pk', flat=True).first()
+        )
+        if fallback is None:
+            raise BackupError("The backup has no active superuser; restoring it would lock everyone out.")
+    jobs = BackgroundJob._base_manager.using(using)
+    for username, user_pk in users.items():
+        jobs.filter(pk__in=[pk for pk, name in job_users.items() if name == username]).update(user_id=user_pk)
+    if missing:
+        jobs.filter(pk__in=missing).update(user_id=fallback)
+
+
+def check_schema(meta, using=DEFAULT_DB_ALIAS):
+    """Refuse backups taken with migrations this database has not applied."""
+    schema = meta.get('schema')
+    if not schema:
+        return
+    current = schema_fingerprint(using)
+    if schema['fingerprint'] == current['fingerprint']:
+        return
+    unknown = sorted(set(schema['migrations']) - set(current['migrations']))
+    if unknown:
+        shown = ', '.join(unknown[:5]) + (f' and {len(unknown) - 5} more' if len(unknown) > 5 else '')
+        raise BackupError(f"The backup needs migrations this installation does not have ({shown}); update it first.")
+    logger.info("Restoring a backup from an older schema; missing fields get their defaults.")
+
+
+def iter_backup_rows(zf, report, using=DEFAULT_DB_ALIAS):
+    """
+    Yield the fixture objects of ``zf`` in dependency order, from either format.
+
+    ``report(fraction, message)`` receives read progress.
+    """
+    if FIXTURE_NAME in zf.namelist():
+        info = zf.getinfo(FIXTURE_NAME)
+        with zf.open(info) as stream:
+            yield from iter_fixture_objects(
+                stream, info.file_size, progress=lambda fraction: report(fraction, 'Loading data'),
+            )
+        return
+
+    meta = read_meta(zf)
+    if meta.get('data_format') != DATA_FORMAT_NDJSON:
+        raise BackupError("Invalid backup: no database dump found.")
+    check_schema(meta, using)
+    names = set(zf.namelist())
+    members = [(label, data_member(label)) for label in meta['models'] if data_member(label) in names]
+    total = sum(zf.getinfo(member).compress_size for _, member in members) or 1
+    done = 0
+    for label, member in members:
+        model = _model_for(label)
+        report(done / total, f"Loading {model._meta.verbose_name_plural if model else label}")
+        with zf.open(member) as raw, gzip.open(raw) as lines:
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+        done += zf.getinfo(member).compress_size
+
+
+def load_backup_data(zf, flush=False, batch_size=DEFAULT_BATCH_SIZE, report=None, using=DEFAULT_DB_ALIAS):
+    """
+    Load the database dump of ``zf`` in one transaction; returns ``{model label: rows}``.
+
+    ``report(fraction, message)`` receives progress.
+    """
+    from core.dataversion import COMMISSION_PROFILES, REPORTS, bump_data_version
+    from core.rollups import rebuild_admission_rollups
+
+    report = report or (lambda fraction, message='': None)
+    connection = connections[using]
+    cache = NaturalKeyCache(using)
+    counts = {}
+    touched = set()
+
+    with transaction.atomic(using=using), connection.constraint_checks_disabled():
+        if flush:
+            job_users = dict(BackgroundJob._base_manager.using(using).values_list('pk', 'user__username'))
+            _flush_tables([m for m in backup_models(using) if m is not BackgroundJob], using)
+
+        pending_model = None
+        pending = []
+
+        def write_pending():
+            if pending:
+                counts[pending_model._meta.label] = (
+                    counts.get(pending_model._meta.label, 0) + _write_batch(pending_model, pending, cache, using)
+                )
+                touched.add(pending_model)
+                pending.clear()
+
+        for row in iter_backup_rows(zf, report, using):
+            model = _model_for(row.get('model', ''))
+            if model is None or model is BackgroundJob:
+                continue
+            if model is not pending_model or len(pending) >= batch_size:
+                write_pending()
+                pending_model = model
+            pending.append(row)
+        write_pending()
+
+        if flush:
+            _keep_jobs(job_users, using)
+        if touched:
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), list(touched)):
+                    cursor.execute(sql)
+        connection.check_constraints(table_names=[model._meta.db_table for model in touched])
+
+    # Content type pks may have changed; bulk writes send no signals.
+    ContentType.objects.clear_cache()
+    bump_data_version(REPORTS)
+    bump_data_version(COMMISSION_PROFILES)
+    rebuild_admission_rollups()
+    return counts
+
+
+def _clear_directory(root):
+    for child in root.iterdir():
+        if child.is_dir():
+            shutil.rmtree(child, ignore_errors=True)
+        else:
+            try:
+                child.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def copy_media(sources, media_root, replace=False, workers=MEDIA_WORKERS, report=None):
+    """
+    Copy ``{relative path: (archive, member, sha256)}`` into ``media_root``.
+
+    Every worker thread opens its own ``ZipFile`` per archive, so reads and
+    decompression run in parallel. Returns the number of files copied.
+    """
+    media_root = Path(media_root)
+    media_root.mkdir(parents=True, exist_ok=True)
+    if replace:
+        _clear_directory(media_root)
+    root = media_root.resolve()
+    local = threading.local()
+
+    def handle(path):
+        handles = local.__dict__.setdefault('handles', {})
+        if path not in handles:
+            handles[path] = zipfile.ZipFile(path)
+        return handles[path]
+
+    def copy(relative, path, member, sha256):
+        dest = media_root / relative
+        if root not in dest.resolve().parents:
+            raise BackupError(f"Refusing to write outside MEDIA_ROOT: {relative}")
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha256()
+        with handle(path).open(member) as source, dest.open('wb') as out:
+            for chunk in iter(lambda: source.read(READ_CHUNK_SIZE), b''):
+                digest.update(chunk)
+                out.write(chunk)
+        if sha256 and digest.hexdigest() != sha256:
+            raise BackupError(f"{relative} does not match its manifest checksum.")
+
+    total = len(sources)
+    done = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(copy, relative, zf.filename, member, sha256)
+            for relative, (zf, member, sha256) in sources.items()
+        ]
+        for future in as_completed(futures):
+            future.result()
+            done += 1
+            if report and (done % 50 == 0 or done == total):
+                report(done / total, f'Copied {done} of {total} media files')
+    return done
+
+
+def restore_backup(paths, flush=False, media_mode='merge', batch_size=DEFAULT_BATCH_SIZE, report=None):
+    """
+    Restore the backup chain stored at ``paths`` (see ``resolve_chain``).
+
+    ``media_mode`` is ``merge``, ``replace`` or ``skip``. Returns a summary
+    dict.
+    """
+    report = report or (lambda percent, message='': None)
+    with contextlib.ExitStack() as stack:
+        archives = [stack.enter_context(zipfile.ZipFile(path)) for path in paths]
+        chain, sources = resolve_chain(archives)
+        newest = chain[-1]
+        if not has_data(newest):
+            raise BackupError("Invalid backup: no database dump found.")
+
+        report(2, 'Loading data')
+        counts = load_backup_data(
+            newest, flush=flush, batch_size=batch_size,
+            report=lambda fraction, message='': report(2 + int(68 * fraction), message),
+        )
+        # Rows were bulk-written without signals; media blob counts follow them.
+        recount_blobs()
+
+        copied = 0
+        if media_mode != 'skip' and sources:
+            report(70, 'Copying media')
+            copied = copy_media(
+                sources, settings.MEDIA_ROOT, replace=media_mode == 'replace',
+                report=lambda fraction, message='': report(70 + int(28 * fraction), message),
+            )
+    return {'objects': sum(counts.values()), 'models': len(counts), 'media': copied}
+
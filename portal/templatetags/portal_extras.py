@@ -1,4 +1,5 @@
 from django import template
+from core.images import thumbnail_name
 from portal.models import UserRoleAssignment, RolePageRestriction, UserPageRestriction
 
 register = template.Library()
@@ -17,3 +18,14 @@ def has_portal_permission(user, url_name):
             return False
             
     return True
+
+
+@register.filter
+def thumbnail_url(image, label='md'):
+    """URL of an image field's thumbnail, or of the original until one exists."""
+    if not image:
+        return ''
+    name = thumbnail_name(image.name, label)
+    if image.storage.exists(name):
+        return image.storage.url(name)
+    return image.url
@@ -0,0 +1,72 @@
+from django.test import TestCase
+from django.urls import reverse
+
+from core.models import Address, AgentAssignment, AgentAssignmentDoctorStatus, Area, DoctorReferral, Trip, User
+
+from ..assignments import filter_doctors, reassign_doctors
+from ..models import CustomRole, UserRoleAssignment
+
+
+class ReassignDoctorsTests(TestCase):
+    def setUp(self):
+        self.agent = User.objects.create_user('9000000001', password='x')
+        self.previous = User.objects.create_user('9000000002', password='x')
+        self.north = Area.objects.create(name='North', city='Nagpur')
+        self.south = Area.objects.create(name='South', city='Pune')
+        self.doctors = {
+            name: DoctorReferral.objects.create(
+                name=name, agent=self.previous, specialization=specialization,
+                address_details=Address.objects.create(area=area) if area else None,
+            )
+            for name, area, specialization in (
+                ('Dr North', self.north, 'Cardiology'),
+                ('Dr North 2', self.north, 'Ortho'),
+                ('Dr South', self.south, 'Cardiology'),
+                ('Dr Nowhere', None, 'Cardiology'),
+            )
+        }
+        busy = DoctorReferral.objects.create(name='Dr Busy', address_details=Address.objects.create(area=self.north))
+        busy.trip = Trip.objects.create(agent=self.previous, status='ONGOING')
+        busy.save()
+        self.busy = busy
+        DoctorReferral.objects.create(name='Dr Internal', is_internal=True)
+
+    def test_filters(self):
+        names = lambda params: sorted(filter_doctors(params).values_list('name', flat=True))
+        self.assertEqual(names({'specialization': 'cardiology', 'city': 'nagpur'}), ['Dr North'])
+        self.assertEqual(names({'area': str(self.north.pk), 'search': 'dr north'}), ['Dr North', 'Dr North 2'])
+        # Internal doctors cannot be assigned, so the page does not list them.
+        self.assertEqual(names({'current_agent': 'none'}), ['Dr Busy'])
+
+    def test_reassign_matching_doctors(self):
+        counts = reassign_doctors(DoctorReferral.objects.all(), self.agent)
+        self.assertEqual(counts, {
+            'matched': 6, 'internal': 1, 'busy': 1, 'updated': 4, 'areas': 2, 'without_area': 1,
+        })
+        self.assertEqual(
+            sorted(DoctorReferral.objects.filter(agent=self.agent).values_list('name', flat=True)),
+            ['Dr North', 'Dr North 2', 'Dr Nowhere', 'Dr South'],
+        )
+        self.busy.refresh_from_db()
+        self.assertIsNone(self.busy.agent)
+
+        north = AgentAssignment.objects.get(area=self.north)
+        self.assertEqual(north.agent, self.agent)
+        self.assertEqual(
+            sorted(AgentAssignmentDoctorStatus.objects.filter(assignment=north).values_list('doctor__name', flat=True)),
+            ['Dr North', 'Dr North 2'],
+        )
+        self.north.refresh_from_db()
+        self.assertEqual(self.north.agent, self.agent)
+
+    def test_view_moves_every_matching_doctor(self):
+        role, _ = CustomRole.objects.get_or_create(name='Mobile App User')
+        UserRoleAssignment.objects.create(user=self.agent, role=role)
+        self.client.force_login(User.objects.create_superuser('root', 'root@example.com', 'pw'))
+        response = self.client.post(reverse('portal:doctor_assignment'), {
+            'agent': self.agent.pk, 'scope': 'matching', 'specialization': 'Cardiology',
+        })
+        self.assertRedirects(
+            response, reverse('portal:doctor_assignment') + '?specialization=Cardiology', fetch_redirect_response=False,
+        )
+        self.assertEqual(DoctorReferral.objects.filter(agent=self.agent).count(), 3)
@@ -0,0 +1,57 @@
+import json
+
+from django.test import TestCase
+from django.urls import reverse
+
+from core.models import DoctorReferral, PatientReferral, User
+
+from ..models import UserPageRestriction
+
+
+class AutocompleteSearchTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user('9000000001', password='x', is_staff=True)
+        self.client.force_login(self.staff)
+        for name in ('Dr. Mehta', 'Mehra', 'Dr Meera', 'Anand'):
+            DoctorReferral.objects.create(name=name)
+        DoctorReferral.objects.create(name='Dr. Menon', is_internal=True)
+
+    def search(self, url_name, **params):
+        response = self.client.get(reverse(url_name), params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_doctor_prefix_search(self):
+        data = self.search('portal:doctor_search', q='me')
+        self.assertEqual([row['text'].split(' (')[0] for row in data['results']],
+                         ['Dr Meera', 'Dr. Mehta', 'Dr. Menon', 'Mehra'])
+        data = self.search('portal:doctor_search', q='me', internal='1')
+        self.assertEqual(len(data['results']), 1)
+        self.assertEqual(self.search('portal:doctor_search', q='hta')['results'], [])
+
+    def test_pages(self):
+        for index in range(25):
+            DoctorReferral.objects.create(name=f'Page {index:02d}')
+        first = self.search('portal:doctor_search', q='page')
+        self.assertEqual((len(first['results']), first['pagination']['more']), (20, True))
+        second = self.search('portal:doctor_search', q='page', page=2)
+        self.assertEqual((len(second['results']), second['pagination']['more']), (5, False))
+
+    def test_only_pending_referrals(self):
+        agent = User.objects.create_user('9000000002', password='x')
+        for name, status in (('Ravi', 'Pending'), ('Rahul', 'Admitted')):
+            PatientReferral.objects.create(agent=agent, patient_name=name, age=30, gender='M', phone='98', status=status)
+        data = self.search('portal:patient_referral_search', q='ra')
+        self.assertEqual([row['patient_name'] for row in data['results']], ['Ravi'])
+        self.assertEqual(len(self.search('portal:patient_referral_search', q='98')['results']), 1)
+
+    def test_restricted_from_both_forms(self):
+        UserPageRestriction.objects.create(user=self.staff, url_name='admission_create')
+        self.search('portal:doctor_search', q='me')
+        UserPageRestriction.objects.create(user=self.staff, url_name='admission_edit')
+        self.assertEqual(self.client.get(reverse('portal:doctor_search'), {'q': 'me'}).status_code, 403)
+
+    def test_form_does_not_list_every_doctor(self):
+        response = self.client.get(reverse('portal:admission_create'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'Anand')
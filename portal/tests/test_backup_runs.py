@@ -0,0 +1,91 @@
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from core.models import DoctorReferral
+
+from ..backup_runs import apply_retention, archive_path, backup_dir, retained_ids, run_backup
+from ..backups import BackupError
+from ..models import BackupRecord
+
+
+def record(backup_id, started_at, parent_id=''):
+    return SimpleNamespace(backup_id=backup_id, started_at=started_at, parent_id=parent_id)
+
+
+class RetainedIdsTests(SimpleTestCase):
+    def setUp(self):
+        # Two backups a day for 70 days, newest first, ending on a Sunday.
+        end = timezone.make_aware(datetime(2026, 3, 29, 22))
+        self.records = [
+            record(f'{day:02d}-{run}', end - timedelta(days=day, hours=12 * run))
+            for day in range(70) for run in (0, 1)
+        ]
+
+    def test_newest_of_each_bucket(self):
+        keep = retained_ids(self.records, keep_daily=3, keep_weekly=2, keep_monthly=3)
+        self.assertEqual(keep, {
+            '00-0', '01-0', '02-0',  # days
+            '07-0',  # previous ISO week (Sunday 22 March)
+            '29-0',  # February
+            '57-0',  # January
+        })
+
+    def test_nothing_kept_without_buckets(self):
+        self.assertEqual(retained_ids(self.records, 0, 0, 0), set())
+
+    def test_parents_of_kept_backups_are_kept(self):
+        records = [
+            record('c', self.records[0].started_at, parent_id='b'),
+            record('b', self.records[0].started_at - timedelta(hours=1), parent_id='a'),
+            record('a', self.records[0].started_at - timedelta(days=5)),
+            record('z', self.records[0].started_at - timedelta(days=6)),
+        ]
+        self.assertEqual(retained_ids(records, keep_daily=1, keep_weekly=0, keep_monthly=0), {'a', 'b', 'c'})
+
+
+class RunBackupTests(TransactionTestCase):
+    def setUp(self):
+        root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        settings_override = override_settings(
+            MEDIA_ROOT=str(root / 'media'),
+            PORTAL_BACKUP_DIR=root / 'backups',
+            PORTAL_BACKUP_MANIFEST_DIR=root / 'manifests',
+            PORTAL_IMAGE_INGEST='off',
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_incremental_runs_build_on_the_stored_archive(self):
+        DoctorReferral.objects.create(name='Dr A', visit_image=ContentFile(b'one', name='a.jpg'))
+        full = run_backup()
+        DoctorReferral.objects.create(name='Dr B', visit_image=ContentFile(b'two', name='b.jpg'))
+        incremental = run_backup(incremental=True)
+
+        self.assertEqual((full.kind, full.status, full.media_files), ('full', 'SUCCEEDED', 1))
+        self.assertEqual((incremental.kind, incremental.parent_id, incremental.media_files),
+                         ('incremental', full.backup_id, 1))
+        self.assertTrue(archive_path(incremental).exists())
+
+    def test_retention_prunes_archives(self):
+        old, parent, child = run_backup(), run_backup(), run_backup(incremental=True)
+        self.assertEqual(child.parent_id, parent.backup_id)
+
+        pruned = apply_retention(keep_daily=1, keep_weekly=0, keep_monthly=0)
+
+        self.assertEqual([record.backup_id for record in pruned], [old.backup_id])
+        self.assertEqual(
+            sorted(path.name for path in backup_dir().iterdir()), sorted([parent.file_name, child.file_name]),
+        )
+        old.refresh_from_db()
+        self.assertIsNotNone(old.pruned_at)
+        with self.assertRaises(BackupError):
+            archive_path(old)
+        self.assertEqual(BackupRecord.objects.filter(pruned_at__isnull=True).count(), 2)
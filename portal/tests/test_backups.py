@@ -0,0 +1,132 @@
+import gzip
+import io
+import json
+import shutil
+import tempfile
+import zipfile
+from pathlib import Path
+
+from django.core import serializers
+from django.core.files.base import ContentFile
+from django.test import TransactionTestCase, override_settings
+
+from core.models import Area, DoctorReferral, MediaBlob
+
+from ..backups import BackupError, load_manifest, resolve_chain, stream_backup
+from ..restore import restore_backup
+
+
+class StreamBackupTests(TransactionTestCase):
+    """Transactional: models are dumped on worker threads with their own connections."""
+
+    def setUp(self):
+        root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        self.media_root = root / 'media'
+        settings_override = override_settings(
+            MEDIA_ROOT=str(self.media_root), PORTAL_BACKUP_MANIFEST_DIR=root / 'manifests', PORTAL_IMAGE_INGEST='off',
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def backup(self, **kwargs):
+        return zipfile.ZipFile(io.BytesIO(b''.join(stream_backup(**kwargs))))
+
+    def backup_id(self, archive):
+        return json.loads(archive.read('meta.json'))['backup_id']
+
+    def test_archive_layout(self):
+        Area.objects.create(name='North', city='Nagpur')
+        doctor = DoctorReferral.objects.create(name='Dr A', visit_image=ContentFile(b'photo', name='a.jpg'))
+        archive = self.backup()
+
+        self.assertIsNone(archive.testzip())
+        meta = json.loads(archive.read('meta.json'))
+        self.assertEqual(meta['data_format'], 'ndjson')
+        self.assertTrue(meta['included_media'])
+        self.assertIn('core.area', meta['models'])
+        lines = gzip.decompress(archive.read('data/core.area.ndjson.gz')).decode('utf-8').splitlines()
+        objects = [item.object for line in lines for item in serializers.deserialize('json', f'[{line}]')]
+        self.assertEqual([(obj.name, obj.city) for obj in objects], [('North', 'Nagpur')])
+
+        member = archive.getinfo(f'media/{doctor.visit_image.name}')
+        self.assertEqual(member.compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(archive.read(member), b'photo')
+
+    def test_single_fixture_format(self):
+        Area.objects.create(name='North', city='Nagpur')
+        archive = self.backup(data_format='json')
+        self.assertFalse([name for name in archive.namelist() if name.startswith('data/')])
+        objects = [item.object for item in serializers.deserialize('json', archive.read('fixture/data.json'))]
+        self.assertIn(('North', 'Nagpur'), [(obj.name, obj.city) for obj in objects if isinstance(obj, Area)])
+
+    def test_without_media(self):
+        DoctorReferral.objects.create(name='Dr A', visit_image=ContentFile(b'photo', name='a.jpg'))
+        archive = self.backup(include_media=False)
+        self.assertFalse([name for name in archive.namelist() if name.startswith('media/')])
+
+    def test_incremental_media(self):
+        first = DoctorReferral.objects.create(name='Dr A', visit_image=ContentFile(b'one', name='a.jpg'))
+        full = self.backup()
+        second = DoctorReferral.objects.create(name='Dr B', visit_image=ContentFile(b'two', name='b.jpg'))
+        incremental = self.backup(parent=load_manifest(self.backup_id(full)))
+
+        media = [name for name in incremental.namelist() if name.startswith('media/')]
+        self.assertEqual(media, [f'media/{second.visit_image.name}'])
+        manifest = load_manifest(self.backup_id(incremental))
+        self.assertEqual((manifest['kind'], sorted(manifest['files'])),
+                         ('incremental', sorted([first.visit_image.name, second.visit_image.name])))
+
+        chain, sources = resolve_chain([incremental, full])
+        self.assertEqual(chain, [full, incremental])
+        self.assertIs(sources[first.visit_image.name][0], full)
+        self.assertIs(sources[second.visit_image.name][0], incremental)
+
+        with self.assertRaises(BackupError):
+            resolve_chain([incremental])
+        with self.assertRaises(BackupError):
+            resolve_chain([full, self.backup()])
+
+
+class BackupRestoreTests(TransactionTestCase):
+    def setUp(self):
+        root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        settings_override = override_settings(
+            MEDIA_ROOT=str(root / 'media'),
+            PORTAL_BACKUP_MANIFEST_DIR=root / 'manifests',
+            PORTAL_IMAGE_INGEST='off',
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.archive = root / 'backup.zip'
+
+    def test_restore_of_a_streamed_backup(self):
+        self.assertRestores()
+
+    def test_restore_of_a_single_fixture_backup(self):
+        self.assertRestores(data_format='json')
+
+    def assertRestores(self, **backup_options):
+        area = Area.objects.create(name='North', city='Nagpur')
+        doctor = DoctorReferral.objects.create(name='Dr A', visit_image=ContentFile(b'photo', name='a.jpg'))
+        image = doctor.visit_image
+        storage, name = image.storage, image.name
+        with open(self.archive, 'wb') as out:
+            for part in stream_backup(**backup_options):
+                out.write(part)
+
+        doctor.delete()
+        area.delete()
+        Area.objects.create(name='Added later', city='Pune')
+        storage.delete(name)
+
+        summary = restore_backup([self.archive], flush=True)
+
+        self.assertGreater(summary['objects'], 0)
+        self.assertEqual(summary['media'], 1)
+        self.assertEqual(list(Area.objects.values_list('name', flat=True)), ['North'])
+        restored = DoctorReferral.objects.get()
+        self.assertEqual((restored.name, restored.visit_image.name), ('Dr A', name))
+        self.assertEqual(storage.open(name).read(), b'photo')
+        self.assertEqual(MediaBlob.objects.get(name=name).refcount, 1)
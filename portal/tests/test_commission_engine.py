@@ -0,0 +1,83 @@
+import datetime
+from decimal import Decimal
+
+from django.test import TestCase
+from django.utils import timezone
+
+from core.models import Admission, AdmissionDailyRollup, DoctorCommissionProfile, DoctorReferral, PaymentCategory
+from core.rollups import rebuild_admission_rollups
+
+from ..commission_engine import recompute_commissions
+
+
+class RecomputeCommissionsTests(TestCase):
+    def setUp(self):
+        self.doctor = DoctorReferral.objects.create(name='Dr A')
+        self.other = DoctorReferral.objects.create(name='Dr B')
+        self.category = PaymentCategory.objects.create(name='Engine Test', code='engine-test')
+        DoctorCommissionProfile.objects.create(
+            doctor=self.doctor, payment_category=self.category, bed_charges_rate=10, discount_percentage=1,
+        )
+        self.admission = Admission.objects.create(
+            patient_name='P1', referred_by_doctor=self.doctor, payment_category=self.category,
+            bed_charges=Decimal('1000'), nursing_charges=Decimal('500'), commission_amount=Decimal('50'),
+        )
+        # No profile for this pair: its commission is zero.
+        self.unpriced = Admission.objects.create(
+            patient_name='P2', referred_by_doctor=self.other, payment_category=self.category,
+            bed_charges=Decimal('1000'), commission_amount=Decimal('20'),
+        )
+        self.unchanged = Admission.objects.create(patient_name='P3', bed_charges=Decimal('300'))
+
+    def commissions(self):
+        return {
+            admission.patient_name: admission.commission_amount
+            for admission in Admission.objects.order_by('patient_name')
+        }
+
+    def test_what_if_writes_nothing(self):
+        summary = recompute_commissions()
+        self.assertEqual((summary['admissions'], summary['changed'], summary['applied']), (3, 2, 0))
+        # 10% of 1000 bed charges + 1% of the 1500 total.
+        self.assertEqual(summary['total_after'], Decimal('115.00'))
+        self.assertEqual(summary['delta'], Decimal('45.00'))
+        self.assertEqual(summary['largest_changes'][0], {
+            'admission_id': self.admission.pk, 'before': Decimal('50.00'), 'after': Decimal('115.00'),
+        })
+        self.assertEqual(self.commissions()['P1'], Decimal('50'))
+
+    def test_rate_overrides(self):
+        overrides = {(self.other.pk, self.category.pk): {'bed_charges_rate': 5}}
+        summary = recompute_commissions(Admission.objects.filter(pk=self.unpriced.pk), rate_overrides=overrides)
+        self.assertEqual(summary['total_after'], Decimal('50.00'))
+        with self.assertRaises(ValueError):
+            recompute_commissions(apply=True, rate_overrides=overrides)
+
+    def test_apply_updates_admissions_and_rollups(self):
+        summary = recompute_commissions(apply=True)
+        self.assertEqual((summary['applied'], summary['skipped']), (2, 0))
+        self.assertEqual(self.commissions(), {'P1': Decimal('115'), 'P2': Decimal('0'), 'P3': Decimal('0')})
+        self.assertEqual(
+            sum(row.total_commission for row in AdmissionDailyRollup.objects.all()), Decimal('115'),
+        )
+        self.assertEqual(recompute_commissions()['changed'], 0)
+
+    def test_half_paisa_rounds_like_the_form(self):
+        # 0.4% of 16971.25 is 67.885: half-even gives 67.88, float rounding 67.89.
+        category = PaymentCategory.objects.create(name='Engine Test 2', code='engine-test-2')
+        DoctorCommissionProfile.objects.create(doctor=self.doctor, payment_category=category, discount_percentage=0.4)
+        admission = Admission.objects.create(
+            patient_name='P4', referred_by_doctor=self.doctor, payment_category=category,
+            bed_charges=Decimal('16971.25'), commission_amount=Decimal('67.88'),
+        )
+        summary = recompute_commissions(Admission.objects.filter(pk=admission.pk))
+        self.assertEqual((summary['changed'], summary['total_after']), (0, Decimal('67.88')))
+
+    def test_apply_rebuilds_only_the_changed_days(self):
+        earlier = timezone.now() - datetime.timedelta(days=10)
+        Admission.objects.filter(pk=self.unchanged.pk).update(created_at=earlier)
+        rebuild_admission_rollups()
+        AdmissionDailyRollup.objects.filter(date=timezone.localdate(earlier)).update(patient_count=99)
+
+        recompute_commissions(apply=True)
+        self.assertEqual(AdmissionDailyRollup.objects.get(date=timezone.localdate(earlier)).patient_count, 99)
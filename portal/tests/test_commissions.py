@@ -0,0 +1,182 @@
+import json
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core.dataversion import COMMISSION_PROFILES
+from core.models import DataVersion, DoctorCommissionProfile, DoctorReferral, PaymentCategory, User
+
+from ..commissions import apply_rate_updates, clear_rate_cache, get_rates, get_rates_many
+
+
+class CommissionTestCase(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('root', 'root@example.com', 'pw')
+        self.client.force_login(self.admin)
+        self.doctors = [DoctorReferral.objects.create(name=f'Dr {name}') for name in 'AB']
+        self.categories = [
+            PaymentCategory.objects.create(name=f'Rate Test {index}', code=f'rate-test-{index}') for index in range(2)
+        ]
+        # Versions restart with each test's rolled-back database.
+        clear_rate_cache()
+        self.addCleanup(clear_rate_cache)
+
+    def rate(self, doctor, category, field='bed_charges_rate'):
+        return getattr(DoctorCommissionProfile.objects.get(doctor=doctor, payment_category=category), field)
+
+
+class CommissionMatrixApiTests(CommissionTestCase):
+    def post(self, payload):
+        return self.client.post(reverse('portal:commission_matrix_api'), json.dumps(payload),
+                                content_type='application/json')
+
+    def test_broadcast_writes_only_changes(self):
+        payload = {
+            'doctors': [d.pk for d in self.doctors],
+            'categories': [c.pk for c in self.categories],
+            'rates': {'bed_charges_rate': 12.5},
+        }
+        response = self.post(payload)
+        self.assertEqual(json.loads(response.content), {'created': 4, 'updated': 4})
+        self.assertEqual(self.rate(self.doctors[1], self.categories[1]), 12.5)
+
+        response = self.post(payload)
+        self.assertEqual(json.loads(response.content), {'created': 0, 'updated': 0})
+
+    def test_cell_updates_create_only_their_profiles(self):
+        (d1, d2), (c1, c2) = self.doctors, self.categories
+        response = self.post({'updates': [
+            {'doctor': d1.pk, 'category': c1.pk, 'rates': {'bed_charges_rate': 1}},
+            {'doctor': d2.pk, 'category': c2.pk, 'rates': {'bed_charges_rate': 2}},
+        ]})
+        self.assertEqual(json.loads(response.content), {'created': 2, 'updated': 2})
+        self.assertEqual(
+            set(DoctorCommissionProfile.objects.values_list('doctor', 'payment_category')),
+            {(d1.pk, c1.pk), (d2.pk, c2.pk)},
+        )
+
+    def test_invalid_updates_write_nothing(self):
+        doctor, category = self.doctors[0].pk, self.categories[0].pk
+        for cells in (
+            [{'doctor': doctor, 'category': category, 'rates': {'bed_charges_rate': 101}}],
+            [{'doctor': doctor, 'category': category, 'rates': {'no_such_rate': 1}}],
+            [{'doctor': doctor, 'category': category, 'rates': {'bed_charges_rate': 1}},
+             {'doctor': 999999, 'category': category, 'rates': {'bed_charges_rate': 1}}],
+        ):
+            with self.subTest(cells=cells):
+                self.assertEqual(self.post({'updates': cells}).status_code, 400)
+        self.assertFalse(DoctorCommissionProfile.objects.exists())
+
+    def test_read_does_not_create_profiles(self):
+        response = self.client.get(reverse('portal:commission_matrix_api'), {
+            'doctors': f'{self.doctors[0].pk},999999',
+            'categories': str(self.categories[0].pk),
+            'fields': 'bed_charges_rate',
+        })
+        data = json.loads(response.content)
+        self.assertEqual(data['doctors'], [
+            {'id': self.doctors[0].pk, 'rates': [{'category': self.categories[0].pk, 'bed_charges_rate': 0.0}]},
+        ])
+        self.assertFalse(DoctorCommissionProfile.objects.exists())
+
+
+class CommissionMatrixFormTests(CommissionTestCase):
+    def test_cells_are_saved(self):
+        doctor, category = self.doctors[0], self.categories[1]
+        response = self.client.post(reverse('portal:doctor_commission_matrix'), {
+            'field': 'nursing_charges_rate',
+            f'cell-{doctor.pk}-{category.pk}': '7',
+            f'cell-{self.doctors[1].pk}-{category.pk}': '',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.rate(doctor, category, 'nursing_charges_rate'), 7)
+        self.assertEqual(DoctorCommissionProfile.objects.count(), 1)
+
+        page = self.client.get(reverse('portal:doctor_commission_matrix'), {'field': 'nursing_charges_rate'})
+        self.assertEqual(page.status_code, 200)
+
+    def test_unknown_ids_are_reported(self):
+        category = self.categories[0]
+        response = self.client.post(reverse('portal:doctor_commission_matrix'), {
+            'field': 'nursing_charges_rate',
+            f'cell-{self.doctors[0].pk}-{category.pk}': '7',
+            f'cell-999999-{category.pk}': '7',
+        }, follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Nothing saved: unknown doctor ids 999999.')
+        self.assertFalse(DoctorCommissionProfile.objects.exists())
+
+
+class DoctorReferralFormTests(CommissionTestCase):
+    def test_viewing_creates_no_profiles(self):
+        url = reverse('portal:doctor_referral', args=[self.doctors[0].pk])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(DoctorCommissionProfile.objects.exists())
+
+        data = {}
+        for form in response.context['forms']:
+            for name in form.fields:
+                data[form.add_prefix(name)] = form.initial.get(name, 0)
+        data[f'category-{self.categories[1].pk}-bed_charges_rate'] = 4
+        self.assertEqual(self.client.post(url, data).status_code, 302)
+        self.assertEqual(list(DoctorCommissionProfile.objects.values_list('payment_category', flat=True)),
+                         [self.categories[1].pk])
+        self.assertEqual(self.rate(self.doctors[0], self.categories[1]), 4)
+
+
+class RateCacheTests(CommissionTestCase):
+    def test_missing_profiles_read_as_zero(self):
+        rates = get_rates(self.doctors[0].pk, self.categories[0].pk)
+        self.assertEqual(rates['bed_charges_rate'], 0)
+        self.assertFalse(DoctorCommissionProfile.objects.exists())
+
+    def test_hits_do_not_query(self):
+        pairs = [(d.pk, c.pk) for d in self.doctors for c in self.categories]
+        with CaptureQueriesContext(connection) as queries:
+            get_rates_many(pairs)
+        self.assertEqual(len(queries), 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(get_rates_many(pairs)), 4)
+        with override_settings(PORTAL_RATE_CACHE_VERSION_TTL=0), self.assertNumQueries(1):
+            self.assertEqual(len(get_rates_many(pairs)), 4)
+
+    def test_changes_from_other_processes_show_after_the_ttl(self):
+        doctor, category = self.doctors[0], self.categories[0]
+        self.assertEqual(get_rates(doctor.pk, category.pk)['bed_charges_rate'], 0)
+        # Another process writes the profile and bumps the shared version.
+        DoctorCommissionProfile.objects.bulk_create(
+            [DoctorCommissionProfile(doctor=doctor, payment_category=category, bed_charges_rate=5)],
+        )
+        DataVersion.objects.update_or_create(key=COMMISSION_PROFILES, defaults={'version': 99})
+        self.assertEqual(get_rates(doctor.pk, category.pk)['bed_charges_rate'], 0)
+        with override_settings(PORTAL_RATE_CACHE_VERSION_TTL=0):
+            self.assertEqual(get_rates(doctor.pk, category.pk)['bed_charges_rate'], 5)
+
+    def test_changes_invalidate_the_cache(self):
+        doctor, category = self.doctors[0], self.categories[0]
+        self.assertEqual(get_rates(doctor.pk, category.pk)['bed_charges_rate'], 0)
+
+        profile = DoctorCommissionProfile.objects.create(doctor=doctor, payment_category=category, bed_charges_rate=5)
+        self.assertEqual(get_rates(doctor.pk, category.pk)['bed_charges_rate'], 5)
+
+        apply_rate_updates({(doctor.pk, category.pk): {'bed_charges_rate': 6.0}})
+        self.assertEqual(get_rates(doctor.pk, category.pk)['bed_charges_rate'], 6)
+
+        profile.delete()
+        self.assertEqual(get_rates(doctor.pk, category.pk)['bed_charges_rate'], 0)
+
+    def test_batch_endpoint(self):
+        doctor = self.doctors[0]
+        DoctorCommissionProfile.objects.create(
+            doctor=doctor, payment_category=self.categories[1], discount_percentage=3,
+        )
+        response = self.client.get(reverse('portal:get_referral_rates_batch'), {'doctor_id': doctor.pk})
+        rates = {row['category']: row for row in json.loads(response.content)['rates']}
+        self.assertEqual(set(rates), set(PaymentCategory.objects.values_list('pk', flat=True)))
+        self.assertEqual(rates[self.categories[1].pk]['referral_percentage'], 3)
+
+        response = self.client.get(reverse('portal:get_referral_rates_batch'), {'pairs': '1:x'})
+        self.assertEqual(response.status_code, 400)
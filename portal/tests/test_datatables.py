@@ -0,0 +1,51 @@
+import json
+
+from django.test import TestCase
+from django.urls import reverse
+
+from core.models import Admission, User
+
+
+class ServerSideTableTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('root', 'root@example.com', 'pw')
+        self.client.force_login(self.admin)
+        self.admissions = [Admission.objects.create(patient_name=f'Patient {i:02d}') for i in range(30)]
+
+    def page(self, url_name='portal:admission_list', **params):
+        params.setdefault('draw', 1)
+        response = self.client.get(reverse(url_name), params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_html_page_without_draw(self):
+        response = self.client.get(reverse('portal:admission_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'].split(';')[0], 'text/html')
+
+    def test_paging_and_ordering(self):
+        data = self.page(**{'draw': 7, 'start': 10, 'length': 5, 'order[0][column]': 0, 'order[0][dir]': 'asc'})
+        self.assertEqual(data['draw'], 7)
+        self.assertEqual((data['recordsTotal'], data['recordsFiltered']), (30, 30))
+        self.assertEqual(len(data['data']), 5)
+        self.assertIn(f'#{self.admissions[10].pk}', data['data'][0][0])
+        self.assertIn(f'#{self.admissions[14].pk}', data['data'][-1][0])
+
+    def test_page_size_is_capped(self):
+        self.assertEqual(len(self.page(length=10_000)['data']), 30)
+        self.assertEqual(len(self.page(length=-1)['data']), 30)
+
+    def test_search(self):
+        data = self.page(**{'search[value]': 'Patient 2'})
+        self.assertEqual((data['recordsTotal'], data['recordsFiltered']), (30, 10))
+        self.assertEqual(self.page(**{'search[value]': 'Nobody'})['recordsFiltered'], 0)
+        # Prefix matches only, so the name indexes can be used.
+        self.assertEqual(self.page(**{'search[value]': 'atient'})['recordsFiltered'], 0)
+
+    def test_cells_are_escaped(self):
+        Admission.objects.create(patient_name='<script>x</script>')
+        data = self.page(**{'search[value]': '<script>'})
+        self.assertEqual(data['recordsFiltered'], 1)
+        row = ''.join(data['data'][0])
+        self.assertNotIn('<script>', row)
+        self.assertIn('&lt;script&gt;', row)
@@ -0,0 +1,40 @@
+from unittest import mock
+
+from django.test import TestCase
+from django.urls import reverse
+
+from core.models import DoctorReferral, DoctorVisit, Trip, User
+
+from ..views import DoctorDetailView
+
+
+class PortalTestCase(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('root', 'root@example.com', 'pw')
+        self.client.force_login(self.admin)
+        self.agent = User.objects.create_user('9000000001', password='x')
+
+
+class DoctorDetailTests(PortalTestCase):
+    def setUp(self):
+        super().setUp()
+        self.doctor = DoctorReferral.objects.create(name='Dr A')
+        duplicate = DoctorReferral.objects.create(name=' dr a ')
+        other = DoctorReferral.objects.create(name='Dr B')
+        for doctor in (self.doctor, duplicate):
+            DoctorVisit.objects.create(doctor=doctor, trip=Trip.objects.create(agent=self.agent))
+        DoctorVisit.objects.create(
+            doctor=other, trip=Trip.objects.create(agent=User.objects.create_user('9000000002', password='x')),
+        )
+
+    def test_visit_timeline_covers_duplicate_records(self):
+        response = self.client.get(reverse('portal:doctor_detail', args=[self.doctor.pk]))
+        summary = response.context['visit_summary']
+        self.assertEqual((summary['total_visits'], summary['trip_count'], summary['executive_count']), (2, 2, 1))
+        self.assertEqual(len(response.context['visit_page'].object_list), 2)
+
+    def test_visit_timeline_pages(self):
+        with mock.patch.object(DoctorDetailView, 'visit_page_size', 1):
+            response = self.client.get(reverse('portal:doctor_detail', args=[self.doctor.pk]), {'page': 2})
+        page = response.context['visit_page']
+        self.assertEqual((page.number, page.paginator.num_pages, len(page.object_list)), (2, 2, 1))
@@ -0,0 +1,54 @@
+import csv
+import io
+import zipfile
+
+from django.test import TestCase
+from django.urls import reverse
+
+from core.models import Admission, Trip, User
+
+
+class ReportsExportTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('root', 'root@example.com', 'pw')
+        self.client.force_login(self.admin)
+        self.agent = User.objects.create_user('9000000001', password='x')
+        for i in range(3):
+            Admission.objects.create(patient_name=f'Patient {i}')
+        Admission.objects.create(patient_name='Tab\tand "quotes", <b>')
+
+    def export(self, dataset, **params):
+        response = self.client.get(reverse('portal:reports_export', args=[dataset]), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_csv(self):
+        response, body = self.export('admissions', format='csv')
+        self.assertIn('attachment; filename="reports_admissions.csv"', response['Content-Disposition'])
+        rows = list(csv.reader(io.StringIO(body.decode('utf-8-sig'))))
+        self.assertEqual(rows[0][:3], ['ID', 'Date', 'Patient'])
+        self.assertEqual(len(rows), 5)
+        self.assertIn('Tab\tand "quotes", <b>', [row[2] for row in rows])
+
+    def test_xlsx(self):
+        response, body = self.export('admissions', format='xlsx')
+        with zipfile.ZipFile(io.BytesIO(body)) as workbook:
+            self.assertIsNone(workbook.testzip())
+            sheet = workbook.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        self.assertEqual(sheet.count('<row>'), 5)
+        self.assertIn('&lt;b&gt;', sheet)
+
+    def test_filters_match_the_dashboard(self):
+        other = User.objects.create_user('9000000002', password='x')
+        Trip.objects.create(agent=self.agent)
+        Trip.objects.create(agent=other)
+        _, body = self.export('trips', format='csv', agent=str(self.agent.pk))
+        rows = list(csv.reader(io.StringIO(body.decode('utf-8-sig'))))
+        self.assertEqual([row[1] for row in rows[1:]], ['9000000001'])
+
+    def test_unknown_export(self):
+        url = reverse('portal:reports_export', args=['admissions'])
+        self.assertEqual(self.client.get(url, {'format': 'pdf'}).status_code, 404)
+        url = reverse('portal:reports_export', args=['nothing'])
+        self.assertEqual(self.client.get(url).status_code, 404)
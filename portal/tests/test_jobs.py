@@ -0,0 +1,114 @@
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core.models import User
+
+from ..jobs import (
+    JOB_HANDLERS, JobLimitExceeded, enqueue_job, purge_finished_jobs, run_pending_jobs, runner_lock,
+)
+from ..models import BackgroundJob
+
+
+def write_file(job, report):
+    report(50, 'Half way')
+    return 'result.txt', job.params['text'].encode()
+
+
+def fail(job, report):
+    raise RuntimeError('Broken')
+
+
+@override_settings(PORTAL_JOB_RUNNER='external', PORTAL_JOB_MAX_ACTIVE_PER_USER=2)
+class BackgroundJobTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root, PRIVATE_FILES_ROOT=f'{media_root}/private')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        handlers = mock.patch.dict(JOB_HANDLERS, {'write': write_file, 'fail': fail})
+        handlers.start()
+        self.addCleanup(handlers.stop)
+        self.user = User.objects.create_user('9000000001', password='x')
+
+    def test_jobs_run_in_order(self):
+        first = enqueue_job(self.user, 'write', {'text': 'one'})
+        second = enqueue_job(self.user, 'fail')
+        self.assertEqual(first.status, BackgroundJob.STATUS_QUEUED)
+
+        with self.assertLogs('portal.jobs', 'ERROR'):
+            self.assertEqual(run_pending_jobs(), 2)
+
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.progress, first.result_name),
+                         (BackgroundJob.STATUS_SUCCEEDED, 100, 'result.txt'))
+        self.assertEqual(first.result_file.read(), b'one')
+        second.refresh_from_db()
+        self.assertEqual((second.status, second.error), (BackgroundJob.STATUS_FAILED, 'Broken'))
+        self.assertEqual(run_pending_jobs(), 0)
+
+    def test_active_jobs_per_user_are_limited(self):
+        enqueue_job(self.user, 'write', {'text': 'one'})
+        enqueue_job(self.user, 'write', {'text': 'two'})
+        with self.assertRaises(JobLimitExceeded):
+            enqueue_job(self.user, 'write', {'text': 'three'})
+        other = User.objects.create_user('9000000002', password='x')
+        enqueue_job(other, 'write', {'text': 'other'})
+
+        run_pending_jobs(max_jobs=1)
+        enqueue_job(self.user, 'write', {'text': 'three'})
+
+    def test_unknown_kind_is_rejected(self):
+        with self.assertRaises(ValueError):
+            enqueue_job(self.user, 'nothing')
+
+    @override_settings(PORTAL_JOB_TIMEOUT=60)
+    def test_stale_running_jobs_fail(self):
+        job = BackgroundJob.objects.create(
+            user=self.user, kind='write', status=BackgroundJob.STATUS_RUNNING,
+            started_at=timezone.now() - timedelta(minutes=5),
+        )
+        run_pending_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, BackgroundJob.STATUS_FAILED)
+
+    def test_purge_deletes_old_results(self):
+        job = enqueue_job(self.user, 'write', {'text': 'one'})
+        run_pending_jobs()
+        job.refresh_from_db()
+        storage, name = job.result_file.storage, job.result_file.name
+        BackgroundJob.objects.filter(pk=job.pk).update(created_at=timezone.now() - timedelta(days=10))
+
+        self.assertEqual(purge_finished_jobs(7), 1)
+        self.assertFalse(BackgroundJob.objects.exists())
+        self.assertFalse(storage.exists(name))
+
+    @override_settings(PORTAL_JOB_RUNNER='process')
+    def test_runner_process_is_spawned_only_when_none_is_alive(self):
+        with mock.patch('portal.jobs.subprocess.Popen') as popen:
+            with self.captureOnCommitCallbacks(execute=True):
+                enqueue_job(self.user, 'write', {'text': 'one'})
+            self.assertEqual(popen.call_count, 1)
+
+            with runner_lock() as acquired, self.captureOnCommitCallbacks(execute=True):
+                self.assertTrue(acquired)
+                enqueue_job(self.user, 'write', {'text': 'two'})
+            self.assertEqual(popen.call_count, 1)
+
+    def test_spawned_runner_leaves_the_queue_to_the_live_one(self):
+        job = enqueue_job(self.user, 'write', {'text': 'one'})
+        with runner_lock():
+            call_command('run_portal_jobs', until_idle=True, stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, BackgroundJob.STATUS_QUEUED)
+
+        call_command('run_portal_jobs', until_idle=True, stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, BackgroundJob.STATUS_SUCCEEDED)
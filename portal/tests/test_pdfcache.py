@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.test import TestCase, override_settings
+
+from core.models import Admission
+
+from .. import pdfcache
+
+TEMPLATE = 'portal/reports/dashboard_pdf.html'
+
+
+class PdfCacheTests(TestCase):
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        settings_override = override_settings(
+            PORTAL_PDF_CACHE_DIR=cache_dir, PORTAL_PDF_CACHE_MAX_BYTES=10_000, PORTAL_PDF_CACHE_MAX_AGE=3600,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_key_depends_on_filters_and_data(self):
+        key = pdfcache.report_cache_key(TEMPLATE, {'specialization': 'Cardiology', 'date_start': '2026-01-01'})
+        self.assertEqual(
+            key, pdfcache.report_cache_key(TEMPLATE, {'specialization': ' cardiology ', 'date_start': '2026-01-01'}),
+        )
+        self.assertNotEqual(key, pdfcache.report_cache_key(TEMPLATE, {'specialization': 'Cardiology'}))
+
+        Admission.objects.create(patient_name='P')
+        self.assertNotEqual(
+            key, pdfcache.report_cache_key(TEMPLATE, {'specialization': 'Cardiology', 'date_start': '2026-01-01'}),
+        )
+
+    def test_key_depends_on_the_deploy(self):
+        with override_settings(PORTAL_DEPLOY_VERSION='a1'):
+            key = pdfcache.report_cache_key(TEMPLATE, {})
+            self.assertEqual(key, pdfcache.report_cache_key(TEMPLATE, {}))
+        with override_settings(PORTAL_DEPLOY_VERSION='b2'):
+            self.assertNotEqual(key, pdfcache.report_cache_key(TEMPLATE, {}))
+
+    def test_store_and_get(self):
+        key = pdfcache.report_cache_key(TEMPLATE, {})
+        self.assertIsNone(pdfcache.get_cached(key))
+        path = pdfcache.store(key, b'%PDF-1')
+        self.assertEqual(pdfcache.get_cached(key), path)
+        self.assertEqual(path.read_bytes(), b'%PDF-1')
+
+        old = time.time() - 7200
+        os.utime(path, (old, old))
+        self.assertIsNone(pdfcache.get_cached(key))
+
+    def test_eviction_drops_least_recently_used(self):
+        paths = {}
+        for index, key in enumerate(('a' * 64, 'b' * 64, 'c' * 64)):
+            paths[key] = pdfcache.store(key, b'x' * 400)
+            stamp = time.time() - 100 + index
+            os.utime(paths[key], (stamp, stamp))
+        # The first entry is read again, so the second is now the oldest.
+        pdfcache.get_cached('a' * 64)
+
+        self.assertEqual(pdfcache.evict(max_bytes=1000), 1)
+        self.assertEqual(sorted(key for key, path in paths.items() if path.exists()), ['a' * 64, 'c' * 64])
+        self.assertEqual(pdfcache.evict(max_age=0), 2)
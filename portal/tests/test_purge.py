@@ -0,0 +1,108 @@
+import shutil
+import tempfile
+
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import Address, Area, DoctorReferral, DoctorVisit, OvernightStay, PatientReferral, Trip, User
+
+from ..exports import trip_rows, visit_rows
+from ..jobs import run_pending_jobs
+from ..models import BackgroundJob
+from ..purge import purge, queue_deletion
+from ..reports import agent_activity_rows, parse_report_filters
+
+
+@override_settings(PORTAL_JOB_RUNNER='external')
+class PurgeTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root, PORTAL_IMAGE_INGEST='off')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.admin = User.objects.create_superuser('root', 'root@example.com', 'pw')
+        self.agent = User.objects.create_user('9000000001', password='x')
+        self.doctor = DoctorReferral.objects.create(name='Dr A')
+        self.trips = [Trip.objects.create(agent=self.agent) for _ in range(3)]
+        self.visit = DoctorVisit.objects.create(
+            doctor=self.doctor, trip=self.trips[0], visit_image=ContentFile(b'photo', name='visit.jpg'),
+        )
+        OvernightStay.objects.create(trip=self.trips[1], hotel_name='Hotel', hotel_address='-')
+        PatientReferral.objects.create(agent=self.agent, patient_name='P', age=30, gender='M', phone='1')
+
+    def test_user_deletion_is_queued_then_purged(self):
+        image = self.visit.visit_image
+        storage, name = image.storage, image.name
+        job = queue_deletion([self.agent], self.admin)
+
+        self.agent.refresh_from_db()
+        self.assertIsNotNone(self.agent.deleted_at)
+        self.assertFalse(self.agent.is_active)
+        self.assertEqual(Trip.objects.filter(agent=self.agent).count(), 3)
+
+        # Files are released once the batches commit.
+        with self.captureOnCommitCallbacks(execute=True):
+            run_pending_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, BackgroundJob.STATUS_SUCCEEDED)
+        self.assertFalse(User.objects.filter(pk=self.agent.pk).exists())
+        self.assertFalse(Trip.objects.exists())
+        self.assertFalse(DoctorVisit.objects.exists())
+        self.assertFalse(OvernightStay.objects.exists())
+        self.assertFalse(PatientReferral.objects.exists())
+        self.assertTrue(DoctorReferral.objects.filter(pk=self.doctor.pk).exists())
+        self.assertFalse(storage.exists(name))
+
+    def test_batches_and_unmarked_rows(self):
+        self.assertEqual(purge('core.trip', [self.trips[0].pk]), {})
+
+        Trip.objects.filter(pk__in=[self.trips[0].pk, self.trips[1].pk]).update(deleted_at=self.agent.date_joined)
+        counts = purge('core.trip', [trip.pk for trip in self.trips], batch_size=1)
+        self.assertEqual(counts['trips'], 2)
+        self.assertEqual(list(Trip.objects.values_list('pk', flat=True)), [self.trips[2].pk])
+
+    def test_delete_view_redirects_to_the_job(self):
+        self.client.force_login(self.admin)
+        response = self.client.post(reverse('portal:user_portal_delete', args=[self.agent.pk]))
+        job = BackgroundJob.objects.get(kind='purge')
+        self.assertRedirects(response, reverse('portal:job_detail', args=[job.pk]), fetch_redirect_response=False)
+        self.assertTrue(User.objects.filter(pk=self.agent.pk).exists())
+
+
+class SoftDeletedRowsTests(TestCase):
+    def setUp(self):
+        self.agent = User.objects.create_user('9000000001', password='x')
+        self.north = Area.objects.create(name='North', city='Nagpur')
+        self.south = Area.objects.create(name='South', city='Nagpur')
+        self.trips = []
+        for km, area in ((10, self.north), (5, self.south)):
+            trip = Trip.objects.create(agent=self.agent, total_kilometers=km)
+            address = Address.objects.create(area=area)
+            doctor = DoctorReferral.objects.create(name=f'Dr {area.name}', address_details=address)
+            DoctorVisit.objects.create(doctor=doctor, trip=trip)
+            self.trips.append(trip)
+        self.filters = parse_report_filters({})
+
+    def activity(self):
+        return [
+            (row['username'], row['doctors_visited'], row['areas_visited'], row['kms_travelled'])
+            for row in agent_activity_rows(self.filters)
+        ]
+
+    def test_marked_trips_users_and_areas_are_left_out(self):
+        self.assertEqual(self.activity(), [('9000000001', 2, 2, 15.0)])
+
+        Trip.objects.filter(pk=self.trips[1].pk).update(deleted_at=timezone.now())
+        self.assertEqual([row[0] for row in trip_rows(self.filters)], [self.trips[0].pk])
+        self.assertEqual([row[1] for row in visit_rows(self.filters)], [self.trips[0].pk])
+        self.assertEqual(self.activity(), [('9000000001', 1, 1, 10.0)])
+
+        Area.objects.filter(pk=self.north.pk).update(deleted_at=timezone.now())
+        self.assertEqual(self.activity(), [('9000000001', 1, 0, 10.0)])
+
+        User.objects.filter(pk=self.agent.pk).update(deleted_at=timezone.now())
+        self.assertEqual(self.activity(), [])
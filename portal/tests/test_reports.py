@@ -0,0 +1,103 @@
+import json
+from decimal import Decimal
+
+from django.test import TestCase
+from django.urls import reverse
+
+from core.models import Address, Admission, Area, DoctorReferral, DoctorVisit, PatientReferral, Trip, User
+
+from ..reports import agent_activity_rows, doctor_revenue_rows, parse_report_filters
+
+
+class ReportTestCase(TestCase):
+    def setUp(self):
+        self.north = Area.objects.create(name='North', city='Nagpur')
+        self.south = Area.objects.create(name='South', city='Nagpur')
+        self.agent = User.objects.create_user('9000000001', password='x')
+
+    def doctor(self, name, area):
+        return DoctorReferral.objects.create(name=name, address_details=Address.objects.create(area=area))
+
+    def admit(self, doctor, admission_type='IPD', bed_charges=100, **fields):
+        return Admission.objects.create(
+            patient_name='P', referred_by_doctor=doctor, admission_type=admission_type,
+            bed_charges=Decimal(bed_charges), **fields,
+        )
+
+
+class DoctorRevenueTests(ReportTestCase):
+    def setUp(self):
+        super().setUp()
+        self.a = self.doctor('Dr A', self.north)
+        self.a_again = self.doctor(' dr a', self.south)
+        self.b = self.doctor('Dr B', self.north)
+        self.idle = self.doctor('Dr Idle', self.north)
+        self.admit(self.a, bed_charges=300)
+        self.admit(self.a_again, 'OPD', bed_charges=200)
+        self.admit(self.b, bed_charges=100)
+
+    def rows(self, **params):
+        return [
+            (row['canonical_name'], row['opd_count'], row['ipd_count'], row['total_revenue'])
+            for row in doctor_revenue_rows(parse_report_filters(params))
+        ]
+
+    def test_doctors_grouped_by_name_and_sorted_by_revenue(self):
+        self.assertEqual(self.rows(), [
+            ('dr a', 1, 1, Decimal('500')),
+            ('dr b', 0, 1, Decimal('100')),
+            ('dr idle', 0, 0, Decimal('0')),
+        ])
+
+    def test_area_filter_keeps_context_doctors_without_revenue(self):
+        self.assertEqual(self.rows(area=str(self.south.pk)), [('dr a', 1, 0, Decimal('200'))])
+        self.assertEqual(self.rows(area=str(self.north.pk)), [
+            ('dr a', 0, 1, Decimal('300')),
+            ('dr b', 0, 1, Decimal('100')),
+            ('dr idle', 0, 0, Decimal('0')),
+        ])
+
+    def test_table_pages(self):
+        admin = User.objects.create_superuser('root', 'root@example.com', 'pw')
+        self.client.force_login(admin)
+        response = self.client.get(reverse('portal:reports_doctor_table'), {'draw': 1, 'start': 1, 'length': 1})
+        data = json.loads(response.content)
+        self.assertEqual((data['recordsTotal'], len(data['data'])), (3, 1))
+        self.assertIn('Dr B', data['data'][0][0])
+
+
+class AgentActivityTests(ReportTestCase):
+    def setUp(self):
+        super().setUp()
+        self.x = self.doctor('Dr X', self.north)
+        self.y = self.doctor('Dr Y', self.south)
+        first = Trip.objects.create(agent=self.agent, total_kilometers=10)
+        DoctorVisit.objects.create(doctor=self.x, trip=first)
+        DoctorVisit.objects.create(doctor=self.y, trip=first)
+        second = Trip.objects.create(agent=self.agent, total_kilometers=5)
+        DoctorVisit.objects.create(doctor=self.x, trip=second)
+        self.other = User.objects.create_user('9000000002', password='x')
+        PatientReferral.objects.create(
+            agent=self.other, referred_by_doctor=self.x, patient_name='P', age=30, gender='M', phone='1',
+        )
+        User.objects.create_user('9000000003', password='x', is_active=False)
+
+    def rows(self, **params):
+        return [
+            (row['username'], row['doctors_visited'], row['areas_visited'], row['kms_travelled'],
+             row['direct_patients_referred'])
+            for row in agent_activity_rows(parse_report_filters(params))
+        ]
+
+    def test_activity_per_executive(self):
+        self.assertEqual(self.rows(), [
+            ('9000000002', 0, 0, 0.0, 1),
+            ('9000000001', 2, 2, 15.0, 0),
+        ])
+
+    def test_trips_count_once_per_filter_match(self):
+        self.assertEqual(self.rows(area=str(self.north.pk), agent=str(self.agent.pk)), [('9000000001', 1, 1, 15.0, 0)])
+        self.assertEqual(self.rows(doctor=str(self.y.pk)), [
+            ('9000000001', 1, 1, 10.0, 0),
+            ('9000000002', 0, 0, 0.0, 0),
+        ])
@@ -0,0 +1,29 @@
+import json
+
+from django.test import TestCase
+from django.urls import reverse
+
+from core.models import DoctorReferral, DoctorVisit, OvernightStay, Trip, User
+
+
+class TripListTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('root', 'root@example.com', 'pw')
+        self.client.force_login(self.admin)
+        agent = User.objects.create_user('9000000001', password='x')
+        self.trip = Trip.objects.create(agent=agent, total_kilometers=12)
+        for name in ('Dr A', 'Dr B'):
+            DoctorVisit.objects.create(doctor=DoctorReferral.objects.create(name=name), trip=self.trip)
+        for index in range(3):
+            OvernightStay.objects.create(trip=self.trip, hotel_name=f'Hotel {index}', hotel_address='-')
+
+    def test_visit_count_is_not_multiplied_by_stays(self):
+        response = self.client.get(reverse('portal:trip_list'), {'draw': 1})
+        row = json.loads(response.content)['data'][0]
+        self.assertIn('2 doctors', row[5])
+
+    def test_detail_lists_the_visits(self):
+        response = self.client.get(reverse('portal:trip_detail', args=[self.trip.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(doctor.name for doctor, _ in response.context['doctor_rows']), ['Dr A', 'Dr B'])
+        self.assertContains(response, 'Doctors Visited (2)')
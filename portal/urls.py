@@ -11,6 +11,7 @@ urlpatterns = [
     path('backups/', views.BackupDashboardView.as_view(), name='backup_dashboard'),
     path('backups/export/', views.backup_export, name='backup_export'),
     path('backups/import/', views.backup_import, name='backup_import'),
+    path('backups/<int:pk>/download/', views.backup_download, name='backup_download'),
     
     # Agent Management
     path('agents/', views.AgentListView.as_view(), name='agent_list'),
@@ -39,6 +40,7 @@ urlpatterns = [
     path('doctors/create/', views.DoctorCreateView.as_view(), name='doctor_create'),
     path('doctors/<int:pk>/', views.DoctorDetailView.as_view(), name='doctor_detail'),
     path('doctors/<int:pk>/edit/', views.DoctorUpdateView.as_view(), name='doctor_edit'),
+    path('doctors/commission-matrix/', views.DoctorCommissionMatrixView.as_view(), name='doctor_commission_matrix'),
     path('doctors/<int:pk>/commission/', views.DoctorCommissionUpdateView.as_view(), name='doctor_commission'),
     path('doctors/<int:pk>/referrals/', views.DoctorCommissionUpdateView.as_view(), name='doctor_referral'),
     
@@ -62,8 +64,12 @@ urlpatterns = [
     path('patients/<int:pk>/status/', views.PatientReferralStatusUpdateView.as_view(), name='patient_status_update'),
     
     # API
+    path('api/commission-matrix/', views.DoctorCommissionMatrixAPIView.as_view(), name='commission_matrix_api'),
     path('api/commission-rates/', views.get_commission_rates, name='get_commission_rates'),
+    path('api/doctors/search/', views.DoctorSearchView.as_view(), name='doctor_search'),
+    path('api/patient-referrals/search/', views.PatientReferralSearchView.as_view(), name='patient_referral_search'),
     path('api/referral-rates/', views.get_commission_rates, name='get_referral_rates'),
+    path('api/referral-rates/batch/', views.get_commission_rates_batch, name='get_referral_rates_batch'),
     
     # Doctor Toggle for Agent Assignments
     path('assignments/<int:assignment_id>/doctors/<int:doctor_id>/toggle/', views.toggle_doctor_assignment_status, name='toggle_doctor_assignment_status'),
@@ -73,6 +79,12 @@ urlpatterns = [
     
     # Reports
     path('reports/', views.ReportsDashboardView.as_view(), name='reports_dashboard'),
+    path('reports/tables/doctors/', views.ReportsDoctorRevenueTableView.as_view(), name='reports_doctor_table'),
+    path('reports/tables/agents/', views.ReportsAgentActivityTableView.as_view(), name='reports_agent_table'),
+    path('reports/export/<slug:dataset>/', views.ReportsExportView.as_view(), name='reports_export'),
+    path('jobs/<int:pk>/', views.BackgroundJobDetailView.as_view(), name='job_detail'),
+    path('jobs/<int:pk>/status/', views.BackgroundJobStatusView.as_view(), name='job_status'),
+    path('jobs/<int:pk>/download/', views.BackgroundJobDownloadView.as_view(), name='job_download'),
     
     # Permissions
     path('permissions/', views.UserPermissionListView.as_view(), name='permission_list'),
@@ -1,27 +1,54 @@
+import contextlib
 import json
 import os
 import shutil
-import tempfile
+import uuid
 import zipfile
 from pathlib import Path
+from urllib.parse import urlencode
 
 from django.shortcuts import render, redirect, get_object_or_404
+from django.middleware.csrf import get_token
+from django.template.defaultfilters import date as date_filter, floatformat
+from django.utils.html import format_html
 from django.views import View
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView, DetailView, TemplateView
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
-from django.db.models import Count, Q, Sum, F
+from django.db.models import Count, Q, Sum, F, Max, Min, OuterRef
+from django.db.models.functions import Coalesce, Lower, Trim
+from django.core.paginator import Paginator
 from django.utils import timezone
-from django.http import FileResponse, HttpResponseForbidden, HttpResponse
+from django.http import FileResponse, Http404, HttpResponseForbidden, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.core.management import call_command
 from django.conf import settings
-from django.utils.text import slugify
 
 from core.models import User, Trip, DoctorReferral, DoctorVisit, PatientReferral, OvernightStay, Admission, Area, Address, AgentAssignment, DoctorCommissionProfile, PaymentCategory, AgentAssignmentDoctorStatus
 from .forms import AgentCreationForm, AgentUpdateForm, AgentPasswordForm, TripCreateForm, DoctorAssignmentForm, AdmissionForm, DoctorForm, AgentSelectionForm, AreaForm, AddressForm, AgentAssignmentForm
+from .forms import doctor_option_label, patient_referral_option_label
+from . import pdfcache
+from .assignments import FILTER_KEYS, filter_doctors, reassign_doctors
+from .backup_runs import archive_path
+from .backups import (
+    DATA_FORMAT_JSON, DATA_FORMAT_NDJSON, BackupError, has_data, latest_manifest, load_manifest, recent_manifests,
+    resolve_chain, stream_backup,
+)
+from .commissions import (
+    RATE_FIELDS, RATE_FIELD_NAMES, RateUpdateError, apply_rate_updates, get_rates, get_rates_many, normalize_updates,
+    rate_matrix, unknown_ids,
+)
+from .datatables import ServerSideTableMixin
+from .exports import EXPORTS, export_response
+from .jobs import REPORTS_PDF_TEMPLATE, JobLimitExceeded, enqueue_job
+from .models import BackgroundJob, BackupRecord
+from .purge import queue_deletion
+from .reports import (
+    agent_activity_rows, aggregate_subquery, build_reports_context, doctor_revenue_rows, filtered_admissions,
+    parse_report_filters, report_pdf_filename,
+)
 from core.serializers import (
     UserSerializer, DoctorReferralSerializer, PatientReferralSerializer, 
     TripSerializer, AreaSerializer, AddressSerializer
@@ -29,31 +56,67 @@ from core.serializers import (
 
 
 # Require staff/admin access for all portal views
+def is_page_restricted(user, url_name):
+    """True if a role or per-user page restriction hides ``url_name`` from ``user``."""
+    if user.is_superuser or not url_name:
+        return False
+    from .models import UserRoleAssignment, UserPageRestriction, RolePageRestriction
+    role_assignment = UserRoleAssignment.objects.filter(user=user).first()
+    if role_assignment:
+        return RolePageRestriction.objects.filter(role=role_assignment.role, url_name=url_name).exists()
+    return UserPageRestriction.objects.filter(user=user, url_name=url_name).exists()
+
+
 class PortalMixin:
     """Base mixin for all portal views - requires staff access."""
     
     @method_decorator(staff_member_required)
     def dispatch(self, request, *args, **kwargs):
-        if not request.user.is_superuser:
-            url_name = request.resolver_match.url_name
-            if url_name:
-                from .models import UserRoleAssignment, UserPageRestriction, RolePageRestriction
-                is_restricted = False
-                
-                role_assignment = UserRoleAssignment.objects.filter(user=request.user).first()
-                if role_assignment:
-                    if RolePageRestriction.objects.filter(role=role_assignment.role, url_name=url_name).exists():
-                        is_restricted = True
-                else:
-                    if UserPageRestriction.objects.filter(user=request.user, url_name=url_name).exists():
-                        is_restricted = True
-                        
-                if is_restricted:
-                    return HttpResponseForbidden("You do not have permission to view this page.")
-                    
+        if is_page_restricted(request.user, request.resolver_match.url_name):
+            return HttpResponseForbidden("You do not have permission to view this page.")
         return super().dispatch(request, *args, **kwargs)
 
 
+def queue_deletion_response(request, obj, description, success_url):
+    """
+    Soft-delete ``obj`` and hand its cascade to a background purge job.
+
+    Redirects to the job's progress page, or back to ``success_url`` with an
+    error when the user already has too many jobs running.
+    """
+
+    success_url = str(success_url)
+    try:
+        job = queue_deletion([obj], request.user, next_url=success_url)
+    except JobLimitExceeded as exc:
+        messages.error(request, str(exc))
+        return redirect(success_url)
+    messages.success(request, f'{description} was removed; related records are being deleted in the background.')
+    return redirect('portal:job_detail', pk=job.pk)
+
+
+def _user_table_cells(user, edit_url, password_url, delete_url):
+    """Shared row cells for the executive and user server-side tables."""
+    role = getattr(getattr(user, 'custom_role_assignment', None), 'role', None)
+    if user.is_active:
+        status_badge = format_html('<span class="badge bg-success">Active</span>')
+    else:
+        status_badge = format_html('<span class="badge bg-danger">Inactive</span>')
+    return [
+        format_html('<span class="badge bg-primary">{}</span>', role.name if role else 'No Role'),
+        status_badge,
+        date_filter(user.date_joined, 'M d, Y'),
+        format_html(
+            '<div class="btn-group btn-group-sm">'
+            '<a href="{}" class="btn btn-outline-primary" title="Edit"><i class="bi bi-pencil"></i></a>'
+            '<a href="{}" class="btn btn-outline-warning" title="Change Password"><i class="bi bi-key"></i></a>'
+            '<a href="{}" class="btn btn-outline-danger" title="Delete"><i class="bi bi-trash"></i></a>'
+            '</div>',
+            edit_url, password_url, delete_url,
+        ),
+    ]
+
+
 class DashboardView(PortalMixin, TemplateView):
     """Admin dashboard with summary statistics."""
     template_name = 'portal/dashboard.html'
@@ -81,6 +144,9 @@ class BackupDashboardView(PortalMixin, TemplateView):
         context = super().get_context_data(**kwargs)
         context['media_root'] = str(getattr(settings, 'MEDIA_ROOT', ''))
         context['media_url'] = getattr(settings, 'MEDIA_URL', '/media/')
+        context['recent_manifests'] = recent_manifests()
+        context['backup_records'] = BackupRecord.objects.all()[:30]
+        context['backup_dir'] = str(getattr(settings, 'PORTAL_BACKUP_DIR', ''))
         return context
 
 
@@ -95,63 +161,41 @@ def backup_export(request):
     if not _require_superuser(request):
         return HttpResponseForbidden("Only superusers can export backups.")
 
+
     include_media = request.GET.get('include_media', '1') == '1'
-    indent = int(request.GET.get('indent', '2') or 2)
+    data_format = DATA_FORMAT_JSON if request.GET.get('data_format') == DATA_FORMAT_JSON else DATA_FORMAT_NDJSON
+    parent = None
+    since = request.GET.get('since', '')
+    if include_media and since:
+        try:
+            parent = latest_manifest() if since == 'latest' else load_manifest(since)
+        except BackupError as e:
+            messages.error(request, f"Export failed: {e}")
+            return redirect('portal:backup_dashboard')
+        if parent is None:
+            messages.error(request, "Export failed: there is no earlier media backup to continue from.")
+            return redirect('portal:backup_dashboard')
+    download_name = f"hospitalemr-backup-{timezone.now().strftime('%Y%m%d-%H%M%S')}.zip"
+    # Entries are produced while the response is sent; nothing is staged on disk.
+    response = StreamingHttpResponse(stream_backup(include_media=include_media, parent=parent, data_format=data_format), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="{download_name}"'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
-    base_dir = Path(getattr(settings, 'BASE_DIR', Path.cwd()))
-    media_root = Path(getattr(settings, 'MEDIA_ROOT', '')) if include_media else None
 
-    tmp_file = tempfile.NamedTemporaryFile(prefix='backup_', suffix='.zip', delete=False)
-    tmp_path = Path(tmp_file.name)
-    tmp_file.close()
+@staff_member_required
+def backup_download(request, pk):
+    if not _require_superuser(request):
+        return HttpResponseForbidden("Only superusers can download backups.")
 
-    try:
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            tmp_dir_path = Path(tmp_dir)
-            fixture_path = tmp_dir_path / 'data.json'
-            meta_path = tmp_dir_path / 'meta.json'
-
-            with fixture_path.open('w', encoding='utf-8') as out:
-                call_command(
-                    'dumpdata',
-                    natural_foreign=True,
-                    natural_primary=True,
-                    indent=indent,
-                    stdout=out,
-                )
 
-            meta = {
-                'created_at': timezone.now().isoformat(),
-                'base_dir': str(base_dir),
-                'included_media': bool(include_media),
-                'media_root': str(media_root) if media_root else None,
-            }
-            meta_path.write_text(json.dumps(meta, indent=2), encoding='utf-8')
-
-            with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
-                zf.write(fixture_path, arcname='fixture/data.json')
-                zf.write(meta_path, arcname='meta.json')
-
-                if include_media and media_root and media_root.exists():
-                    for file_path in media_root.rglob('*'):
-                        if not file_path.is_file():
-                            continue
-                        rel = file_path.relative_to(media_root)
-                        zf.write(file_path, arcname=str(Path('media') / rel))
-    except Exception as e:
-        try:
-            os.remove(tmp_path)
-        except OSError:
-            pass
-        messages.error(request, f"Export failed: {e}")
+    record = get_object_or_404(BackupRecord, pk=pk)
+    try:
+        path = archive_path(record)
+    except BackupError as e:
+        messages.error(request, str(e))
         return redirect('portal:backup_dashboard')
-
-    download_name = f"hospitalemr-backup-{timezone.now().strftime('%Y%m%d-%H%M%S')}.zip"
-    response = FileResponse(open(tmp_path, 'rb'), as_attachment=True, filename=download_name)
-
-    # Ensure temp file is removed after response is closed.
-    response._resource_closers.append(lambda: os.remove(tmp_path))
-    return response
+    return FileResponse(path.open('rb'), as_attachment=True, filename=record.file_name)
 
 
 @staff_member_required
@@ -162,8 +206,8 @@ def backup_import(request):
     if request.method != 'POST':
         return redirect('portal:backup_dashboard')
 
-    bundle = request.FILES.get('bundle')
-    if bundle is None:
+    bundles = request.FILES.getlist('bundle')
+    if not bundles:
         messages.error(request, "Please choose a backup .zip file to import.")
         return redirect('portal:backup_dashboard')
 
@@ -182,70 +226,71 @@ def backup_import(request):
         messages.error(request, "MEDIA_ROOT is not configured; use media mode 'skip'.")
         return redirect('portal:backup_dashboard')
 
+
+    # Zip archives need random access, so uploads are staged once in private
+    # storage; the restore job reads them in place and removes them.
+    staging_dir = Path(settings.PRIVATE_FILES_ROOT) / 'backup_uploads' / uuid.uuid4().hex
+    staging_dir.mkdir(parents=True, exist_ok=True)
     try:
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            tmp_dir_path = Path(tmp_dir)
-            bundle_path = tmp_dir_path / 'bundle.zip'
+        paths = []
+        for index, bundle in enumerate(bundles):
+            bundle_path = staging_dir / f'bundle-{index}.zip'
             with bundle_path.open('wb') as out:
                 for chunk in bundle.chunks():
                     out.write(chunk)
-
-            with zipfile.ZipFile(bundle_path, 'r') as zf:
-                zf.extractall(tmp_dir_path)
-
-            fixture_path = tmp_dir_path / 'fixture' / 'data.json'
-            if not fixture_path.exists():
-                messages.error(request, "Invalid backup: fixture/data.json not found.")
-                return redirect('portal:backup_dashboard')
-
-            if do_flush:
-                # WARNING: This will wipe sessions/tokens; you may need to log in again.
-                call_command('flush', '--noinput')
-
-            call_command('loaddata', str(fixture_path))
-
-            bundle_media = tmp_dir_path / 'media'
-            if media_mode != 'skip' and bundle_media.exists():
-                media_root.mkdir(parents=True, exist_ok=True)
-                if media_mode == 'replace':
-                    for child in media_root.iterdir():
-                        if child.is_dir():
-                            shutil.rmtree(child, ignore_errors=True)
-                        else:
-                            try:
-                                child.unlink()
-                            except FileNotFoundError:
-                                pass
-                for source in bundle_media.rglob('*'):
-                    if not source.is_file():
-                        continue
-                    rel = source.relative_to(bundle_media)
-                    dest = media_root / rel
-                    dest.parent.mkdir(parents=True, exist_ok=True)
-                    shutil.copy2(source, dest)
-
-    except Exception as e:
+            paths.append(str(bundle_path))
+
+        with contextlib.ExitStack() as stack:
+            archives = [stack.enter_context(zipfile.ZipFile(path)) for path in paths]
+            chain, _ = resolve_chain(archives)
+            if not has_data(chain[-1]):
+                raise BackupError("Invalid backup: no database dump found.")
+            # Run the job's reads in chain order.
+            paths = [archive.filename for archive in chain]
+
+        job = enqueue_job(request.user, 'restore', {
+            'paths': paths,
+            'staging_dir': str(staging_dir),
+            'flush': do_flush,
+            'media_mode': media_mode,
+            'label': 'Restore backup',
+            'next': reverse('portal:backup_dashboard'),
+        })
+    except (BackupError, JobLimitExceeded, zipfile.BadZipFile) as e:
+        shutil.rmtree(staging_dir, ignore_errors=True)
         messages.error(request, f"Import failed: {e}")
         return redirect('portal:backup_dashboard')
 
-    messages.success(
+    messages.info(
         request,
-        "Backup imported successfully. If you selected flush, you may need to log in again.",
+        "Restore queued. If you selected flush, you may need to log in again once it finishes.",
     )
-    return redirect('portal:backup_dashboard')
+    return redirect('portal:job_detail', pk=job.pk)
 
 
 # ============ Agent Management ============
 
-class AgentListView(PortalMixin, ListView):
+class AgentListView(PortalMixin, ServerSideTableMixin, ListView):
     """List all executives (advisors)."""
     model = User
     template_name = 'portal/agents/list.html'
     context_object_name = 'agents'
+    table_columns = (
+        ('full_name', 'first_name'),
+        ('username', 'username'),
+        ('role', 'custom_role_assignment__role__name'),
+        ('status', 'is_active'),
+        ('joined', 'date_joined'),
+        ('actions', None),
+    )
+    table_search_fields = ('username', 'first_name', 'last_name')
+    table_default_ordering = ('-date_joined',)
     
     def get_queryset(self):
-        queryset = User.objects.filter(custom_role_assignment__role__name='Mobile App User').annotate(
-            trip_count=Count('trips')
+        queryset = User.objects.filter(
+            custom_role_assignment__role__name='Mobile App User', deleted_at__isnull=True,
+        ).select_related(
+            'custom_role_assignment__role'
         ).order_by('-date_joined')
         
         # Search
@@ -266,6 +311,18 @@ class AgentListView(PortalMixin, ListView):
             
         return queryset
 
+    def get_table_row(self, agent):
+        return [
+            agent.get_full_name() or '-',
+            format_html('<i class="bi bi-person-circle me-1"></i><strong>{}</strong>', agent.username),
+            *_user_table_cells(
+                agent,
+                reverse('portal:agent_edit', args=[agent.pk]),
+                reverse('portal:agent_password', args=[agent.pk]),
+                reverse('portal:agent_delete', args=[agent.pk]),
+            ),
+        ]
+
 
 class AgentCreateView(PortalMixin, CreateView):
     """Create a new user."""
@@ -347,25 +404,36 @@ class AgentDeleteView(PortalMixin, DeleteView):
     context_object_name = 'agent'
     
     def get_queryset(self):
-        return User.objects.filter(custom_role_assignment__role__name='Mobile App User')
+        return User.objects.filter(custom_role_assignment__role__name='Mobile App User', deleted_at__isnull=True)
     
     def form_valid(self, form):
-        messages.success(self.request, f'Executive "{self.object.username}" deleted successfully.')
-        return super().form_valid(form)
+        return queue_deletion_response(self.request, self.object, f'Executive "{self.object.username}"', self.success_url)
 
 
 # ============ User Management (General) ============
 
 from .forms import UserPortalCreationForm, UserPortalUpdateForm
 
-class UserPortalListView(PortalMixin, ListView):
+class UserPortalListView(PortalMixin, ServerSideTableMixin, ListView):
     """List all users (except superusers)."""
     model = User
     template_name = 'portal/users/list.html'
     context_object_name = 'user_list'
+    table_columns = (
+        ('name', 'first_name'),
+        ('username', 'username'),
+        ('role', 'custom_role_assignment__role__name'),
+        ('status', 'is_active'),
+        ('joined', 'date_joined'),
+        ('actions', None),
+    )
+    table_search_fields = ('username', 'first_name', 'last_name')
+    table_default_ordering = ('-date_joined',)
     
     def get_queryset(self):
-        queryset = User.objects.exclude(is_superuser=True).order_by('-date_joined')
+        queryset = User.objects.exclude(is_superuser=True).filter(deleted_at__isnull=True).select_related(
+            'custom_role_assignment__role'
+        ).order_by('-date_joined')
         q = self.request.GET.get('q')
         if q:
             queryset = queryset.filter(
@@ -375,6 +443,18 @@ class UserPortalListView(PortalMixin, ListView):
             )
         return queryset
 
+    def get_table_row(self, user):
+        return [
+            user.get_full_name() or user.username,
+            format_html('<strong>{}</strong>', user.username),
+            *_user_table_cells(
+                user,
+                reverse('portal:user_portal_edit', args=[user.pk]),
+                reverse('portal:user_portal_password', args=[user.pk]),
+                reverse('portal:user_portal_delete', args=[user.pk]),
+            ),
+        ]
+
 class UserPortalCreateView(PortalMixin, CreateView):
     """Create a new user."""
     model = User
@@ -439,23 +519,43 @@ class UserPortalDeleteView(PortalMixin, DeleteView):
     success_url = reverse_lazy('portal:user_portal_list')
     context_object_name = 'user_obj'
     
+    def get_queryset(self):
+        return User.objects.filter(deleted_at__isnull=True)
+    
     def form_valid(self, form):
-        messages.success(self.request, f'User "{self.object.username}" deleted successfully.')
-        return super().form_valid(form)
+        return queue_deletion_response(self.request, self.object, f'User "{self.object.username}"', self.success_url)
 
 
 # ============ Trip Management ============
 
-class TripListView(PortalMixin, ListView):
+class TripListView(PortalMixin, ServerSideTableMixin, ListView):
     """List all trips with details."""
     model = Trip
     template_name = 'portal/trips/list.html'
     context_object_name = 'trips'
+    table_columns = (
+        ('id', 'id'),
+        ('agent', 'agent__username'),
+        ('start_time', 'start_time'),
+        ('end_time', 'end_time'),
+        ('status', 'status'),
+        ('doctor_count', 'doctor_count'),
+        ('total_kilometers', 'total_kilometers'),
+        ('actions', None),
+    )
+    table_search_fields = ('status', 'additional_expenses', 'agent__username', 'agent__first_name')
+    table_default_ordering = ('-start_time',)
     
     def get_queryset(self):
-        queryset = Trip.objects.select_related('agent').annotate(
-            doctor_count=Count('doctor_referrals'),
-            stay_count=Count('overnight_stays')
+        # Independent per-trip subqueries: joining both relations in one
+        # GROUP BY multiplied visits by stays.
+        queryset = Trip.objects.filter(deleted_at__isnull=True).select_related('agent').annotate(
+            doctor_count=Coalesce(
+                aggregate_subquery(DoctorVisit.objects.filter(trip=OuterRef('pk')), 'trip_id', Count('id')), 0
+            ),
+            stay_count=Coalesce(
+                aggregate_subquery(OvernightStay.objects.filter(trip=OuterRef('pk')), 'trip_id', Count('id')), 0
+            ),
         ).order_by('-start_time')
         
         # Search
@@ -486,6 +586,26 @@ class TripListView(PortalMixin, ListView):
         context['agents'] = User.objects.filter(custom_role_assignment__role__name='Mobile App User', is_active=True)
         return context
 
+    def get_table_row(self, trip):
+        if trip.status == 'ONGOING':
+            status_badge = format_html('<span class="badge badge-ongoing">Ongoing</span>')
+        else:
+            status_badge = format_html('<span class="badge badge-completed">Completed</span>')
+        return [
+            format_html('<strong>#{}</strong>', trip.id),
+            format_html('<i class="bi bi-person-circle me-1"></i>{}', trip.agent.full_name_or_username),
+            date_filter(trip.start_time, 'M d, Y H:i'),
+            date_filter(trip.end_time, 'M d, Y H:i') or '-',
+            status_badge,
+            format_html('<span class="badge bg-info">{} doctors</span>', trip.doctor_count),
+            f"{floatformat(trip.total_kilometers, 1)} km",
+            format_html(
+                '<a href="{}" class="btn btn-sm btn-outline-primary" title="View Details">'
+                '<i class="bi bi-eye me-1"></i>View</a>',
+                reverse('portal:trip_detail', args=[trip.pk]),
+            ),
+        ]
+
 
 class TripCreateView(PortalMixin, CreateView):
     """Create a new trip and assign to an executive."""
@@ -512,9 +632,17 @@ class TripDetailView(PortalMixin, DetailView):
     context_object_name = 'trip'
     
     def get_queryset(self):
-        return Trip.objects.select_related('agent').prefetch_related(
-            'doctor_referrals', 'overnight_stays'
-        )
+        return Trip.objects.select_related('agent').prefetch_related('overnight_stays')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        visits = list(self.object.doctor_visits.select_related('doctor').order_by('-created_at'))
+        if visits:
+            context['doctor_rows'] = [(visit.doctor, visit.status) for visit in visits]
+        else:
+            # Trips recorded before DoctorVisit only link their doctors directly.
+            context['doctor_rows'] = [(doctor, doctor.status) for doctor in self.object.doctor_referrals.all()]
+        return context
 
 
 class AssignDoctorsView(PortalMixin, View):
@@ -668,6 +796,7 @@ class DoctorDetailView(PortalMixin, DetailView):
     model = DoctorReferral
     template_name = 'portal/doctors/detail.html'
     context_object_name = 'doctor'
+    visit_page_size = 20
     
     def get_queryset(self):
         return DoctorReferral.objects.select_related(
@@ -681,27 +810,28 @@ class DoctorDetailView(PortalMixin, DetailView):
         context = super().get_context_data(**kwargs)
         doctor = self.object
 
-        area_agent_cache = {}
-
-        def resolve_assigned_agent(doctor_ref):
-            area_obj = getattr(getattr(doctor_ref, 'address_details', None), 'area', None)
-            return doctor_ref.agent or getattr(area_obj, 'agent', None)
-
-        context['assigned_agent'] = resolve_assigned_agent(doctor)
-
-        # Visit history - all entries with the same doctor name (excluding current).
-        visit_history = list(
-            DoctorReferral.objects.filter(
-            name=doctor.name
-            )
-            .exclude(pk=doctor.pk)
-            .select_related('agent', 'trip', 'address_details__area', 'address_details__area__agent')
-            .order_by('-created_at')
+        area_obj = getattr(getattr(doctor, 'address_details', None), 'area', None)
+        context['assigned_agent'] = doctor.agent or getattr(area_obj, 'agent', None)
+
+        # Visit timeline from DoctorVisit across every record for this doctor
+        # (duplicates share the canonical name; see doctor_canonical_name_idx).
+        same_doctor_ids = DoctorReferral.objects.annotate(
+            canonical_name=Lower(Trim('name')),
+        ).filter(canonical_name=doctor.name.strip().lower()).values('pk')
+        visits = DoctorVisit.objects.filter(doctor_id__in=same_doctor_ids)
+
+        context['visit_summary'] = visits.aggregate(
+            total_visits=Count('id'),
+            trip_count=Count('trip_id', distinct=True),
+            executive_count=Count('trip__agent_id', distinct=True),
+            first_visit=Min('created_at'),
+            last_visit=Max('created_at'),
+        )
+        paginator = Paginator(
+            visits.select_related('trip__agent').order_by('-created_at', '-pk'),
+            self.visit_page_size,
         )
-        for entry in visit_history:
-            entry.effective_agent = resolve_assigned_agent(entry)
-        context['visit_history'] = visit_history
-        context['visit_history_count'] = len(visit_history)
+        context['visit_page'] = paginator.get_page(self.request.GET.get('page'))
         return context
 
 
@@ -791,51 +921,214 @@ class DoctorUpdateView(PortalMixin, UpdateView):
             return self.render_to_response(self.get_context_data(form=form))
 
 
-from django.forms import modelformset_factory
 from .forms import DoctorCommissionForm
 
 class DoctorCommissionUpdateView(PortalMixin, TemplateView):
     """Manage referral profiles for a doctor."""
     template_name = 'portal/doctors/commission_form.html'
-    
+
+    def get_forms(self, doctor, data=None):
+        """
+        One form per payment category, filled from ``rate_matrix``.
+
+        Categories without a profile show the defaults; the form is built on
+        an unsaved profile, so viewing the page writes nothing.
+        """
+
+        categories = list(PaymentCategory.objects.all())
+        matrix = rate_matrix([doctor.pk], [c.pk for c in categories])[doctor.pk]
+        return [
+            (category, DoctorCommissionForm(
+                data,
+                prefix=f'category-{category.pk}',
+                instance=DoctorCommissionProfile(doctor=doctor, payment_category=category, **matrix[category.pk]),
+            ))
+            for category in categories
+        ]
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         doctor = get_object_or_404(DoctorReferral, pk=self.kwargs['pk'])
         context['doctor'] = doctor
         context['title'] = f'Manage Referrals: {doctor.name}'
-        
-        # Ensure profiles exist for all payment categories
-        for cat in PaymentCategory.objects.all():
-            DoctorCommissionProfile.objects.get_or_create(
-                doctor=doctor,
-                payment_category=cat
-            )
-            
-        CommissionFormSet = modelformset_factory(
-            DoctorCommissionProfile,
-            form=DoctorCommissionForm,
-            extra=0,
-            can_delete=False
+        context.setdefault('forms', [form for _, form in self.get_forms(doctor)])
+        return context
+
+    def post(self, request, *args, **kwargs):
+        doctor = get_object_or_404(DoctorReferral, pk=self.kwargs['pk'])
+        forms = self.get_forms(doctor, request.POST)
+        if all(form.is_valid() for _, form in forms):
+            # Only categories that were edited get a profile.
+            cells = [
+                {
+                    'doctor': doctor.pk,
+                    'category': category.pk,
+                    'rates': {name: form.cleaned_data[name] for name in RATE_FIELD_NAMES},
+                }
+                for category, form in forms
+                if form.has_changed()
+            ]
+            try:
+                apply_rate_updates(normalize_updates(cells))
+            except RateUpdateError as exc:
+                messages.error(request, str(exc))
+            else:
+                messages.success(request, 'Referral rates updated successfully.')
+                return redirect('portal:doctor_list')
+
+        return self.render_to_response(self.get_context_data(forms=[form for _, form in forms]))
+
+
+class DoctorCommissionMatrixView(PortalMixin, TemplateView):
+    """Edit one referral rate across many doctors and payment categories."""
+    template_name = 'portal/doctors/commission_matrix.html'
+    paginate_by = 50
+
+    def get_field(self, data):
+        field = data.get('field')
+        return field if field in RATE_FIELD_NAMES else RATE_FIELD_NAMES[0]
+
+    def get_doctors(self):
+        doctors = DoctorReferral.objects.all()
+        q = self.request.GET.get('q', '').strip()
+        if q:
+            doctors = doctors.filter(name__istartswith=q)
+        internal = self.request.GET.get('internal')
+        if internal in ('0', '1'):
+            doctors = doctors.filter(is_internal=internal == '1')
+        return doctors.order_by('name', 'pk')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        field = self.get_field(self.request.GET)
+        page = Paginator(self.get_doctors().only('id', 'name', 'is_internal'), self.paginate_by).get_page(
+            self.request.GET.get('page')
         )
-        
-        if self.request.POST:
-            formset = CommissionFormSet(self.request.POST, queryset=doctor.commission_profiles.select_related('payment_category').all())
-        else:
-            formset = CommissionFormSet(queryset=doctor.commission_profiles.select_related('payment_category').all())
-            
-        context['formset'] = formset
+        categories = list(PaymentCategory.objects.all())
+        matrix = rate_matrix([d.pk for d in page], [c.pk for c in categories], fields=(field,))
+        context.update({
+            'title': 'Referral Rate Matrix',
+            'rate_fields': RATE_FIELDS,
+            'field': field,
+            'field_label': dict(RATE_FIELDS)[field],
+            'categories': categories,
+            'page_obj': page,
+            'rows': [
+                (doctor, [(category, matrix[doctor.pk][category.pk][field]) for category in categories])
+                for doctor in page
+            ],
+            'query_params': self.request.GET.urlencode(),
+        })
         return context
-    
+
     def post(self, request, *args, **kwargs):
-        context = self.get_context_data()
-        formset = context['formset']
-        
-        if formset.is_valid():
-            formset.save()
-            messages.success(request, 'Referral rates updated successfully.')
-            return redirect('portal:doctor_list')
-            
-        return self.render_to_response(context)
+        field = self.get_field(request.POST)
+        cells = []
+        for key, value in request.POST.items():
+            if not key.startswith('cell-') or value == '':
+                continue
+            try:
+                _, doctor_id, category_id = key.split('-')
+            except ValueError:
+                continue
+            cells.append({'doctor': doctor_id, 'category': category_id, 'rates': {field: value}})
+        try:
+            updates = normalize_updates(cells)
+        except RateUpdateError as exc:
+            messages.error(request, str(exc))
+        else:
+            missing_doctors, missing_categories = unknown_ids(updates)
+            unknown = [
+                f"{label} {', '.join(map(str, ids))}"
+                for label, ids in (('doctor ids', missing_doctors), ('payment category ids', missing_categories))
+                if ids
+            ]
+            if unknown:
+                messages.error(request, f"Nothing saved: unknown {'; '.join(unknown)}.")
+            else:
+                created, updated = apply_rate_updates(updates)
+                messages.success(request, f'Referral rates saved: {updated} profile(s) changed, {created} created.')
+        url = reverse('portal:doctor_commission_matrix')
+        params = request.POST.get('query_params', '')
+        return redirect(f'{url}?{params}' if params else url)
+
+
+class DoctorCommissionMatrixAPIView(PortalMixin, View):
+    """
+    JSON read/write of referral rates for many doctors at once.
+
+    GET ``?doctors=1,2&categories=3,4&fields=bed_charges_rate`` returns the
+    matrix (categories default to all, fields to every rate). POST takes
+    ``{"updates": [{"doctor": 1, "category": 3, "rates": {...}}]}`` or, to
+    roll one change out, ``{"doctors": [...], "categories": [...], "rates": {...}}``.
+    """
+    max_doctors = 500
+
+    @staticmethod
+    def _ids(raw):
+        return [int(part) for part in str(raw).split(',') if part.strip()]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            doctor_ids = self._ids(request.GET.get('doctors', ''))
+            category_ids = self._ids(request.GET.get('categories', ''))
+        except ValueError:
+            return JsonResponse({'error': 'doctors and categories must be comma-separated ids.'}, status=400)
+        if not doctor_ids or len(doctor_ids) > self.max_doctors:
+            return JsonResponse({'error': f'Pass between 1 and {self.max_doctors} doctor ids.'}, status=400)
+        fields = [f for f in request.GET.get('fields', '').split(',') if f] or list(RATE_FIELD_NAMES)
+        if set(fields) - set(RATE_FIELD_NAMES):
+            return JsonResponse({'error': 'Unknown rate field.'}, status=400)
+        if not category_ids:
+            category_ids = list(PaymentCategory.objects.values_list('pk', flat=True))
+
+        doctor_ids = list(DoctorReferral.objects.filter(pk__in=doctor_ids).values_list('pk', flat=True))
+        matrix = rate_matrix(doctor_ids, category_ids, fields=fields)
+        return JsonResponse({
+            'fields': fields,
+            'doctors': [
+                {'id': d, 'rates': [{'category': c, **rates} for c, rates in matrix[d].items()]}
+                for d in doctor_ids
+            ],
+        })
+
+    def post(self, request, *args, **kwargs):
+        try:
+            payload = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'error': 'Invalid JSON.'}, status=400)
+        if not isinstance(payload, dict):
+            return JsonResponse({'error': 'Expected a JSON object.'}, status=400)
+
+        cells = payload.get('updates')
+        if cells is None:
+            doctors = payload.get('doctors') or []
+            categories = payload.get('categories') or []
+            if not isinstance(doctors, list) or not isinstance(categories, list):
+                return JsonResponse({'error': 'doctors and categories must be lists of ids.'}, status=400)
+            cells = [
+                {'doctor': d, 'category': c, 'rates': payload.get('rates')}
+                for d in doctors for c in categories
+            ]
+        if not isinstance(cells, list) or not cells:
+            return JsonResponse({'error': 'No updates given.'}, status=400)
+
+        try:
+            updates = normalize_updates(cells)
+        except RateUpdateError as exc:
+            return JsonResponse({'error': str(exc)}, status=400)
+        if len({d for d, _ in updates}) > self.max_doctors:
+            return JsonResponse({'error': f'At most {self.max_doctors} doctors per request.'}, status=400)
+        missing_doctors, missing_categories = unknown_ids(updates)
+        if missing_doctors or missing_categories:
+            return JsonResponse({
+                'error': 'Unknown doctor or payment category ids.',
+                'doctors': missing_doctors,
+                'categories': missing_categories,
+            }, status=400)
+
+        created, updated = apply_rate_updates(updates)
+        return JsonResponse({'created': created, 'updated': updated})
 
 
 # ============ Area Management ============
@@ -846,6 +1139,7 @@ class AreaListView(PortalMixin, ListView):
     template_name = 'portal/areas/list.html'
     context_object_name = 'areas'
     paginate_by = 50
+    queryset = Area.objects.filter(deleted_at__isnull=True)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -913,16 +1207,31 @@ class AreaUpdateView(PortalMixin, UpdateView):
 
 # ============ Admission & Billing ============
 
-class AdmissionListView(PortalMixin, ListView):
+class AdmissionListView(PortalMixin, ServerSideTableMixin, ListView):
     """List all admission records."""
     model = Admission
     template_name = 'portal/admissions/list.html'
     context_object_name = 'admissions'
+    table_columns = (
+        ('id', 'id'),
+        ('patient_name', 'patient_name'),
+        ('admission_type', 'admission_type'),
+        ('referred_by', 'referred_by_doctor__name'),
+        ('referred_to', 'referred_to_doctor__name'),
+        ('executive', None),
+        ('status', 'status'),
+        ('total_charges', None),
+        ('admission_date', 'admission_date'),
+        ('actions', None),
+    )
+    table_search_fields = ('patient_name', 'patient_phone', 'referred_by_doctor__name')
+    table_default_ordering = ('-admission_date',)
     
     def get_queryset(self):
         queryset = Admission.objects.select_related(
             'referred_by_doctor',
             'referred_by_doctor__agent',
+            'referred_to_doctor',
             'patient_referral',
             'patient_referral__agent',
         ).order_by('-admission_date')
@@ -954,6 +1263,63 @@ class AdmissionListView(PortalMixin, ListView):
         context['admitted_count'] = Admission.objects.filter(status='ADMITTED').count()
         return context
 
+    def get_table_row(self, admission):
+        muted = format_html('<span class="text-muted">-</span>')
+        type_badge = (
+            format_html('<span class="badge bg-success">IPD</span>')
+            if admission.admission_type == 'IPD'
+            else format_html('<span class="badge bg-info">OPD</span>')
+        )
+        if admission.status == 'ADMITTED':
+            status_badge = format_html('<span class="badge bg-warning text-dark">Admitted</span>')
+        elif admission.status == 'DISCHARGED':
+            status_badge = format_html('<span class="badge bg-success">Discharged</span>')
+        else:
+            status_badge = format_html('<span class="badge bg-secondary">Cancelled</span>')
+
+        executive = None
+        if admission.referred_by_doctor and admission.referred_by_doctor.agent:
+            executive = admission.referred_by_doctor.agent
+        elif admission.patient_referral and admission.patient_referral.agent:
+            executive = admission.patient_referral.agent
+
+        actions = format_html(
+            '<div class="btn-group btn-group-sm">'
+            '<a href="{}" class="btn btn-outline-primary" title="View Details"><i class="bi bi-eye"></i></a>'
+            '<a href="{}" class="btn btn-outline-secondary" title="Edit"><i class="bi bi-pencil"></i></a>'
+            '</div>',
+            reverse('portal:admission_detail', args=[admission.pk]),
+            reverse('portal:admission_edit', args=[admission.pk]),
+        )
+        if admission.status == 'ADMITTED':
+            actions += format_html(
+                '<form method="post" action="{}" class="d-inline ms-1">'
+                '<input type="hidden" name="csrfmiddlewaretoken" value="{}">'
+                '<button type="submit" class="btn btn-outline-success btn-sm" title="Dismiss">'
+                '<i class="bi bi-check2-circle"></i></button></form>',
+                reverse('portal:admission_discharge', args=[admission.pk]),
+                get_token(self.request),
+            )
+
+        return [
+            format_html('<strong>#{}</strong>', admission.id),
+            format_html('<i class="bi bi-person me-1"></i>{}', admission.patient_name),
+            type_badge,
+            admission.referred_by_doctor.name if admission.referred_by_doctor else muted,
+            (
+                format_html('<span class="badge bg-secondary">{}</span>', admission.referred_to_doctor.name)
+                if admission.referred_to_doctor else muted
+            ),
+            (
+                format_html('<i class="bi bi-person-circle me-1"></i>{}', executive.full_name_or_username)
+                if executive else muted
+            ),
+            status_badge,
+            format_html('<strong>Rs {}</strong>', floatformat(admission.total_charges, 2)),
+            date_filter(admission.admission_date, 'M d, Y'),
+            actions,
+        ]
+
 
 class AdmissionCreateView(PortalMixin, CreateView):
     """Create a new admission record."""
@@ -966,7 +1332,6 @@ class AdmissionCreateView(PortalMixin, CreateView):
         context = super().get_context_data(**kwargs)
         context['title'] = 'New Admission'
         context['button_text'] = 'Create Admission'
-        context['patient_referrals'] = PatientReferral.objects.filter(status='Pending').order_by('patient_name')
         return context
     
     def form_valid(self, form):
@@ -998,12 +1363,6 @@ class AdmissionUpdateView(PortalMixin, UpdateView):
         context['title'] = f'Edit Admission: {self.object.patient_name}'
         context['button_text'] = 'Save Changes'
         context['is_edit'] = True
-        if self.object.patient_referral:
-            context['patient_referrals'] = PatientReferral.objects.filter(
-                Q(status='Pending') | Q(pk=self.object.patient_referral_id)
-            ).order_by('patient_name')
-        else:
-            context['patient_referrals'] = PatientReferral.objects.filter(status='Pending').order_by('patient_name')
         return context
     
     def form_valid(self, form):
@@ -1023,6 +1382,84 @@ class AdmissionUpdateView(PortalMixin, UpdateView):
         return response
 
 
+class AutocompleteSearchMixin(PortalMixin):
+    """
+    JSON search endpoint for ``AutocompleteSelect`` pickers (select2 format).
+
+    Subclasses implement ``search(term)`` returning an ordered queryset and
+    ``result(obj)``. Only users who can open one of ``form_url_names`` may
+    search, so the endpoints expose no more than the forms they serve.
+    """
+    form_url_names = ()
+    page_size = 20
+
+    def search(self, term):
+        raise NotImplementedError
+
+    def result(self, obj):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        if self.form_url_names and all(is_page_restricted(request.user, name) for name in self.form_url_names):
+            return HttpResponseForbidden("You do not have permission to view this page.")
+        term = request.GET.get('q', '').strip()
+        try:
+            page = max(1, int(request.GET.get('page', 1)))
+        except ValueError:
+            page = 1
+        start = (page - 1) * self.page_size
+        # Fetch one extra row to know whether another page exists.
+        rows = list(self.search(term)[start:start + self.page_size + 1])
+        return JsonResponse({
+            'results': [self.result(obj) for obj in rows[:self.page_size]],
+            'pagination': {'more': len(rows) > self.page_size},
+        })
+
+
+class DoctorSearchView(AutocompleteSearchMixin, View):
+    """Doctor picker search; ``?internal=1`` limits to hospital doctors."""
+    form_url_names = ('admission_create', 'admission_edit')
+
+    def search(self, term):
+        queryset = DoctorReferral.objects.select_related('agent')
+        internal = self.request.GET.get('internal')
+        if internal in ('0', '1'):
+            queryset = queryset.filter(is_internal=internal == '1')
+        if term:
+            # Prefix matches use the upper(name) index (core migration 0039).
+            queryset = queryset.filter(
+                Q(name__istartswith=term)
+                | Q(name__istartswith=f'Dr. {term}')
+                | Q(name__istartswith=f'Dr {term}')
+            )
+        return queryset.order_by('name', 'pk')
+
+    def result(self, doctor):
+        return {'id': doctor.pk, 'text': doctor_option_label(doctor)}
+
+
+class PatientReferralSearchView(AutocompleteSearchMixin, View):
+    """Pending patient referrals by name or phone prefix."""
+    form_url_names = ('admission_create', 'admission_edit')
+
+    def search(self, term):
+        queryset = PatientReferral.objects.filter(status='Pending').select_related('agent')
+        if term:
+            queryset = queryset.filter(Q(patient_name__istartswith=term) | Q(phone__startswith=term))
+        return queryset.order_by('patient_name', 'pk')
+
+    def result(self, referral):
+        return {
+            'id': referral.pk,
+            'text': patient_referral_option_label(referral),
+            'patient_name': referral.patient_name,
+            'phone': referral.phone,
+            'age': referral.age,
+            'gender': referral.gender,
+            'agent': referral.agent.full_name_or_username,
+        }
+
+
 class AdmissionDetailView(PortalMixin, DetailView):
     """View full admission details with billing breakdown."""
     model = Admission
@@ -1054,354 +1491,291 @@ class AdmissionDischargeView(PortalMixin, View):
             messages.info(request, f'Admission #{admission.id} is already discharged.')
         return redirect('portal:admission_detail', pk=pk)
 
-class ReportsDashboardView(PortalMixin, TemplateView):
+class ReportsDashboardView(PortalMixin, ServerSideTableMixin, TemplateView):
     template_name = 'portal/reports/dashboard.html'
+    table_columns = (
+        ('created_at', 'created_at'),
+        ('patient', 'patient_name'),
+        ('doctor', 'referred_by_doctor__name'),
+        ('executive', 'patient_referral__agent__username'),
+        ('type', 'admission_type'),
+        ('category', 'payment_category__name'),
+        ('revenue', None),
+        ('referral', 'commission_amount'),
+    )
+    table_search_fields = ('patient_name', 'patient_phone', 'referred_by_doctor__name')
+    table_default_ordering = ('-created_at',)
+
+    def get_table_queryset(self):
+        return filtered_admissions(parse_report_filters(self.request.GET)).select_related(
+            'patient_referral__agent', 'referred_by_doctor', 'payment_category'
+        )
+
+    def get_table_row(self, admission):
+        referral = admission.patient_referral
+        executive = referral.agent.full_name_or_username if referral and referral.agent else 'Unassigned'
+        doctor = admission.referred_by_doctor
+        type_class = 'bg-warning' if admission.admission_type == 'IPD' else 'bg-info'
+        return [
+            format_html('<span class="text-muted small">{}</span>', date_filter(admission.created_at, 'M d, Y')),
+            format_html(
+                '<strong>{}</strong><div class="small text-muted">{}</div>',
+                admission.patient_name, admission.patient_phone or '',
+            ),
+            format_html(
+                '<div class="small fw-bold">{}</div><div class="small text-muted">{}</div>',
+                doctor.name if doctor else '', (doctor.specialization or '') if doctor else '',
+            ),
+            format_html('<span class="badge bg-light text-dark">{}</span>', executive),
+            format_html('<span class="badge {}">{}</span>', type_class, admission.admission_type),
+            format_html(
+                '<span class="badge bg-primary opacity-75">{}</span>',
+                admission.payment_category.name if admission.payment_category else '',
+            ),
+            format_html('<span class="fw-bold">&#8377; {}</span>', floatformat(admission.total_charges, 2)),
+            format_html(
+                '<span class="fw-bold text-success">&#8377; {}</span>',
+                floatformat(admission.commission_amount or 0, 2),
+            ),
+        ]
 
     def get(self, request, *args, **kwargs):
         if request.GET.get('download') == 'pdf':
-            from .pdf import render_pdf_response
-
-            context = self.get_context_data(**kwargs)
-            filters_data = context.get('filters_data') or {}
-            active_tab = context.get('active_tab') or 'patients'
-
-            name_parts = ['reports', active_tab]
-            if filters_data.get('date_start'):
-                name_parts.append(str(filters_data['date_start']))
-            if filters_data.get('date_end'):
-                name_parts.append(str(filters_data['date_end']))
-            filename = f"{slugify('_'.join(name_parts)) or 'reports'}.pdf"
-
-            return render_pdf_response(
-                template_name='portal/reports/dashboard_pdf.html',
-                context=context,
-                filename=filename,
-            )
+            params = request.GET.dict()
+            params.pop('download', None)
+
+            # Unchanged data and filters: serve the previous render directly.
+            cached = pdfcache.get_cached(pdfcache.report_cache_key(REPORTS_PDF_TEMPLATE, params))
+            if cached is not None:
+                return FileResponse(
+                    cached.open('rb'),
+                    as_attachment=True,
+                    filename=report_pdf_filename(parse_report_filters(params)),
+                    content_type='application/pdf',
+                )
+
+            try:
+                job = enqueue_job(request.user, 'report_pdf', params)
+            except JobLimitExceeded as e:
+                if request.headers.get('Accept', '').startswith('application/json'):
+                    return JsonResponse({'error': str(e)}, status=429)
+                messages.error(request, str(e))
+                query = request.GET.copy()
+                query.pop('download', None)
+                url = reverse('portal:reports_dashboard')
+                return redirect(f"{url}?{query.urlencode()}" if query else url)
+
+            if request.headers.get('Accept', '').startswith('application/json'):
+                return JsonResponse({
+                    'job_id': job.pk,
+                    'status_url': reverse('portal:job_status', args=[job.pk]),
+                }, status=202)
+            return redirect('portal:job_detail', pk=job.pk)
 
         return super().get(request, *args, **kwargs)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        
-        # --- Filters for Dropdowns ---
-        context['areas'] = Area.objects.all().order_by('name')
-        context['agents'] = User.objects.filter(role='advisor', is_active=True).order_by('username')
-        context['doctors_list'] = DoctorReferral.objects.all().order_by('name')
-        context['specializations'] = DoctorReferral.objects.values_list('specialization', flat=True).distinct().order_by('specialization')
-
-        # --- Base Queryset for Admissions ---
-        admissions = Admission.objects.all()
-        
-        # --- Apply Filters from GET ---
-        area_id = self.request.GET.get('area')
-        agent_id = self.request.GET.get('agent')
-        doctor_id = self.request.GET.get('doctor')
-        spec = self.request.GET.get('specialization')
-        date_start = self.request.GET.get('date_start')
-        date_end = self.request.GET.get('date_end')
+        context.update(build_reports_context(self.request.GET))
+        context['filters'] = self.request.GET
+        context['export_datasets'] = [(name, spec[0]) for name, spec in EXPORTS.items()]
+        return context
 
-        filter_q = Q()
-        if area_id:
-            filter_q &= Q(referred_by_doctor__address_details__area_id=area_id)
-        if agent_id:
-            filter_q &= Q(patient_referral__agent_id=agent_id)
-        if doctor_id:
-            filter_q &= Q(referred_by_doctor_id=doctor_id)
-        if spec:
-            filter_q &= Q(referred_by_doctor__specialization__iexact=spec)
-        if date_start:
-            filter_q &= Q(created_at__date__gte=date_start)
-        if date_end:
-            filter_q &= Q(created_at__date__lte=date_end)
-
-        # Use the filtered dataset for ALL reports to ensure consistency
-        filtered_admissions = admissions.filter(filter_q)
-
-        # --- 1. Doctor-wise Revenue Report ---
-        doctor_revenue = filtered_admissions.filter(referred_by_doctor__isnull=False).values(
-            'referred_by_doctor__name'
-        ).annotate(
-            total_revenue=Sum(
-                F('bed_charges') + F('nursing_charges') + F('doctor_consultation_charges') + 
-                F('investigation_charges') + F('procedural_surgical_charges') + 
-                F('anaesthesia_charges') + F('surgeon_charges') + F('other_charges')
-            ),
-            total_commission=Sum('commission_amount'),
-            opd_count=Count('id', filter=Q(admission_type='OPD')),
-            ipd_count=Count('id', filter=Q(admission_type='IPD'))
-        ).order_by('-total_revenue')
-
-        # --- 1b. Merge with All Doctors in Context (to show 0 revenue doctors) ---
-        # Fetch all doctors that match the current filter context
-        doc_init_q = Q()
-        if area_id: doc_init_q &= Q(address_details__area_id=area_id)
-        if spec: doc_init_q &= Q(specialization__iexact=spec)
-        if doctor_id: doc_init_q &= Q(id=doctor_id)
-        if agent_id: 
-            # Check legacy executive field OR area-based assignment
-            doc_init_q &= (Q(agent_id=agent_id) | Q(address_details__area__agent_id=agent_id))
-        
-        doctors_in_context = DoctorReferral.objects.filter(doc_init_q).values('name')
-        
-        # Start with everyone who actually has revenue for this period to ensure no data loss
-        full_doctor_stats = list(doctor_revenue)
-        existing_names = {d['referred_by_doctor__name'] for d in full_doctor_stats}
-        
-        # Add assigned doctors who referred no patients (0 revenue)
-        for doc in doctors_in_context:
-            doc_name = doc['name']
-            if doc_name not in existing_names:
-                full_doctor_stats.append({
-                    'referred_by_doctor__name': doc_name,
-                    'total_revenue': 0,
-                    'total_commission': 0,
-                    'opd_count': 0,
-                    'ipd_count': 0
-                })
-        
-        # Sort by total revenue descending
-        full_doctor_stats.sort(key=lambda x: x.get('total_revenue', 0) or 0, reverse=True)
 
-        
-        # --- 2. Executive-wise Activity Report ---
-        agent_qs = User.objects.filter(role='advisor', is_active=True)
-        if agent_id:
-            agent_qs = agent_qs.filter(id=agent_id)
+class ReportsDoctorRevenueTableView(PortalMixin, ServerSideTableMixin, View):
+    """Server-side pages of the doctor revenue tab, sorted and sliced in SQL."""
+    table_columns = (
+        ('doctor', 'canonical_name'),
+        ('opd', 'opd_count'),
+        ('ipd', 'ipd_count'),
+        ('revenue', 'total_revenue'),
+        ('referral', 'total_commission'),
+    )
+    table_search_fields = ('name',)
+    table_default_ordering = ('-total_revenue',)
+    table_tiebreaker = 'canonical_name'
 
-        agent_ids = list(agent_qs.values_list('id', flat=True))
+    def get(self, request, *args, **kwargs):
+        return self.render_table_page(request)
+
+    def get_table_queryset(self):
+        return doctor_revenue_rows(parse_report_filters(self.request.GET))
+
+    def get_table_row(self, row):
+        return [
+            format_html('<strong>{}</strong>', row['doctor_name']),
+            format_html('<span class="badge bg-light text-dark border">{}</span>', row['opd_count']),
+            format_html('<span class="badge bg-light text-dark border">{}</span>', row['ipd_count']),
+            format_html('<span class="fw-bold text-primary">&#8377; {}</span>', floatformat(row['total_revenue'], 2)),
+            format_html('<span class="fw-bold text-success">&#8377; {}</span>', floatformat(row['total_commission'], 2)),
+        ]
+
+
+class ReportsAgentActivityTableView(PortalMixin, ServerSideTableMixin, View):
+    """Server-side pages of the executive activity tab."""
+    table_columns = (
+        ('executive', 'username'),
+        ('doctors_visited', 'doctors_visited'),
+        ('kms_travelled', 'kms_travelled'),
+        ('areas_visited', 'areas_visited'),
+        ('direct_patients_referred', 'direct_patients_referred'),
+    )
+    table_search_fields = ('username', 'first_name', 'last_name')
+    table_default_ordering = ('-direct_patients_referred', '-doctors_visited', '-kms_travelled')
+    table_tiebreaker = 'id'
 
-        # Doctors visited / areas visited via DoctorVisit records.
-        doctor_visit_qs = DoctorVisit.objects.filter(trip__agent_id__in=agent_ids)
-        if date_start:
-            doctor_visit_qs = doctor_visit_qs.filter(trip__start_time__date__gte=date_start)
-        if date_end:
-            doctor_visit_qs = doctor_visit_qs.filter(trip__start_time__date__lte=date_end)
-        if area_id:
-            doctor_visit_qs = doctor_visit_qs.filter(doctor__address_details__area_id=area_id)
-        if doctor_id:
-            doctor_visit_qs = doctor_visit_qs.filter(doctor_id=doctor_id)
-        if spec:
-            doctor_visit_qs = doctor_visit_qs.filter(doctor__specialization__iexact=spec)
-
-        visit_stats = doctor_visit_qs.values('trip__agent_id').annotate(
-            doctors_visited=Count('doctor_id', distinct=True),
-            areas_visited=Count('doctor__address_details__area_id', distinct=True),
-        )
-        visit_map = {
-            row['trip__agent_id']: {
-                'doctors_visited': row.get('doctors_visited', 0) or 0,
-                'areas_visited': row.get('areas_visited', 0) or 0,
-            }
-            for row in visit_stats
-        }
+    def get(self, request, *args, **kwargs):
+        return self.render_table_page(request)
+
+    def get_table_queryset(self):
+        return agent_activity_rows(parse_report_filters(self.request.GET))
+
+    def get_table_row(self, row):
+        name = ' '.join(filter(None, [row['first_name'], row['last_name']])) or row['username']
+        badge = '<span class="badge bg-light text-dark border">{}</span>'
+        return [
+            format_html('<strong>{}</strong>', name),
+            format_html(badge, row['doctors_visited']),
+            format_html(badge, floatformat(row['kms_travelled'], 2)),
+            format_html(badge, row['areas_visited']),
+            format_html(badge, row['direct_patients_referred']),
+        ]
+
+
+class ReportsExportView(PortalMixin, View):
+    """Stream one report dataset as CSV or XLSX using the dashboard filters."""
+
+    def get(self, request, dataset):
+        response = export_response(dataset, request.GET.get('format') or 'csv', request.GET)
+        if response is None:
+            raise Http404("Unknown export.")
+        return response
 
-        # KM travelled via Trip records.
-        trip_qs = Trip.objects.filter(agent_id__in=agent_ids)
-        if date_start:
-            trip_qs = trip_qs.filter(start_time__date__gte=date_start)
-        if date_end:
-            trip_qs = trip_qs.filter(start_time__date__lte=date_end)
-        if area_id:
-            trip_qs = trip_qs.filter(doctor_visits__doctor__address_details__area_id=area_id)
-        if doctor_id:
-            trip_qs = trip_qs.filter(doctor_visits__doctor_id=doctor_id)
-        if spec:
-            trip_qs = trip_qs.filter(doctor_visits__doctor__specialization__iexact=spec)
-        trip_rows = trip_qs.values('agent_id', 'id', 'total_kilometers').distinct()
-        km_map = {}
-        for row in trip_rows:
-            a_id = row['agent_id']
-            km_map[a_id] = km_map.get(a_id, 0.0) + float(row.get('total_kilometers') or 0.0)
-
-        # Direct patients referred via PatientReferral records.
-        patient_ref_qs = PatientReferral.objects.filter(agent_id__in=agent_ids)
-        if date_start:
-            patient_ref_qs = patient_ref_qs.filter(reported_on__date__gte=date_start)
-        if date_end:
-            patient_ref_qs = patient_ref_qs.filter(reported_on__date__lte=date_end)
-        if area_id:
-            patient_ref_qs = patient_ref_qs.filter(referred_by_doctor__address_details__area_id=area_id)
-        if doctor_id:
-            patient_ref_qs = patient_ref_qs.filter(referred_by_doctor_id=doctor_id)
-        if spec:
-            patient_ref_qs = patient_ref_qs.filter(referred_by_doctor__specialization__iexact=spec)
-
-        patient_ref_stats = patient_ref_qs.values('agent_id').annotate(
-            direct_patients_referred=Count('id')
-        )
-        patient_ref_map = {
-            row['agent_id']: row.get('direct_patients_referred', 0) or 0
-            for row in patient_ref_stats
-        }
 
-        full_agent_stats = []
-        for agent in agent_qs.values('id', 'username', 'first_name', 'last_name'):
-            a_id = agent['id']
-            full_agent_stats.append({
-                'patient_referral__agent__username': agent['username'],
-                'patient_referral__agent__first_name': agent.get('first_name'),
-                'patient_referral__agent__last_name': agent.get('last_name'),
-                'doctors_visited': visit_map.get(a_id, {}).get('doctors_visited', 0),
-                'kms_travelled': km_map.get(a_id, 0.0),
-                'areas_visited': visit_map.get(a_id, {}).get('areas_visited', 0),
-                'direct_patients_referred': patient_ref_map.get(a_id, 0),
-            })
-
-        full_agent_stats.sort(
-            key=lambda x: (
-                x.get('direct_patients_referred', 0),
-                x.get('doctors_visited', 0),
-                x.get('kms_travelled', 0),
-            ),
-            reverse=True
-        )
+class BackgroundJobMixin:
+    """Users see their own jobs; superusers see everyone's."""
 
-        
-        # --- 3. Category-wise Patient Details ---
-        category_stats = filtered_admissions.values(
-            'payment_category__name'
-        ).annotate(
-            patient_count=Count('id'),
-            total_revenue=Sum(
-                F('bed_charges') + F('nursing_charges') + F('doctor_consultation_charges') + 
-                F('investigation_charges') + F('procedural_surgical_charges') + 
-                F('anaesthesia_charges') + F('surgeon_charges') + F('other_charges')
-            )
-        ).order_by('-patient_count')
+    def get_job(self, pk):
+        jobs = BackgroundJob.objects.all()
+        if not self.request.user.is_superuser:
+            jobs = jobs.filter(user=self.request.user)
+        return get_object_or_404(jobs, pk=pk)
 
-        # --- 3b. Merge with All Categories ---
-        all_cats = PaymentCategory.objects.values('name')
-        cat_map = {c['payment_category__name']: c for c in category_stats}
-        
-        full_category_stats = []
-        for cat in all_cats:
-            cat_name = cat['name']
-            if cat_name in cat_map:
-                full_category_stats.append(cat_map[cat_name])
-            else:
-                full_category_stats.append({
-                    'payment_category__name': cat_name,
-                    'patient_count': 0,
-                    'total_revenue': 0
-                })
-        full_category_stats.sort(key=lambda x: x.get('patient_count', 0) or 0, reverse=True)
-        
-        # --- 4. Custom Analytics / Explorer Stats ---
-        explorer_stats = filtered_admissions.aggregate(
-            total_revenue=Sum(
-                F('bed_charges') + F('nursing_charges') + F('doctor_consultation_charges') + 
-                F('investigation_charges') + F('procedural_surgical_charges') + 
-                F('anaesthesia_charges') + F('surgeon_charges') + F('other_charges')
-            ),
-            total_referral_amount=Sum('commission_amount'),
-            patient_count=Count('id'),
-            opd_count=Count('id', filter=Q(admission_type='OPD')),
-            ipd_count=Count('id', filter=Q(admission_type='IPD'))
-        )
 
-        # --- 5. Total Summary Stats (Filtered) ---
-        total_summary = filtered_admissions.aggregate(
-            total_revenue=Sum(
-                F('bed_charges') + F('nursing_charges') + F('doctor_consultation_charges') + 
-                F('investigation_charges') + F('procedural_surgical_charges') + 
-                F('anaesthesia_charges') + F('surgeon_charges') + F('other_charges')
-            ),
-            total_patients=Count('id'),
-            opd_total=Count('id', filter=Q(admission_type='OPD')),
-            ipd_total=Count('id', filter=Q(admission_type='IPD'))
-        )
-        
-        # Provide a cleaner filters dict for the template to avoid complex logic/formatting issues
-        context['filters_data'] = {
-            'area_id': int(area_id) if area_id and area_id.isdigit() else None,
-            'agent_id': int(agent_id) if agent_id and agent_id.isdigit() else None,
-            'doctor_id': int(doctor_id) if doctor_id and doctor_id.isdigit() else None,
-            'specialization': spec,
-            'date_start': date_start,
-            'date_end': date_end,
-        }
+class BackgroundJobDetailView(PortalMixin, BackgroundJobMixin, TemplateView):
+    template_name = 'portal/jobs/detail.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        job = self.get_job(kwargs['pk'])
+        context['job'] = job
+        if job.kind == 'report_pdf':
+            context['title'] = 'Report Job'
+            context['back_url'], context['back_label'] = reverse('portal:reports_dashboard'), 'Back to Reports'
+        else:
+            context['title'] = job.params.get('label') or job.get_kind_display()
+            context['back_url'], context['back_label'] = job.params.get('next') or reverse('portal:dashboard'), 'Back'
+        return context
 
-        context['has_filters'] = any([area_id, agent_id, doctor_id, spec, date_start, date_end])
 
-        context.update({
-            'doctor_revenue': full_doctor_stats,
-            'agent_revenue': full_agent_stats,
-            'category_stats': full_category_stats,
-            'explorer_stats': explorer_stats,
-            'filtered_admissions': filtered_admissions.select_related('patient_referral', 'referred_by_doctor', 'payment_category').order_by('-created_at'),
-            'total_summary': total_summary,
-            'title': 'Hospital Reports Dashboard',
-            'filters': self.request.GET,
-            'active_tab': self.request.GET.get('active_tab', 'patients')
+class BackgroundJobStatusView(PortalMixin, BackgroundJobMixin, View):
+    def get(self, request, pk):
+        job = self.get_job(pk)
+        return JsonResponse({
+            'id': job.pk,
+            'kind': job.kind,
+            'status': job.status,
+            'progress': job.progress,
+            'message': job.message,
+            'error': job.error,
+            'download_url': (
+                reverse('portal:job_download', args=[job.pk])
+                if job.status == job.STATUS_SUCCEEDED and job.result_file else None
+            ),
         })
-        return context
+
+
+class BackgroundJobDownloadView(PortalMixin, BackgroundJobMixin, View):
+    def get(self, request, pk):
+        job = self.get_job(pk)
+        if job.status != job.STATUS_SUCCEEDED or not job.result_file:
+            raise Http404("This job has no result to download.")
+        try:
+            handle = job.result_file.open('rb')
+        except FileNotFoundError:
+            raise Http404("The result file has expired.")
+        return FileResponse(handle, as_attachment=True, filename=job.result_name or None)
 
 
 class DoctorAssignmentView(PortalMixin, ListView):
-    """View to bulk assign doctors to agents."""
+    """View to bulk assign doctors to agents, by selection or by filter."""
     model = DoctorReferral
     template_name = 'portal/doctors/assign.html'
     context_object_name = 'doctors'
     paginate_by = 50
 
     def get_queryset(self):
-        queryset = DoctorReferral.objects.all().order_by('name')
-        search = self.request.GET.get('search')
-        if search:
-            queryset = queryset.filter(
-                Q(name__icontains=search) | 
-                Q(address_details__area__name__icontains=search) | 
-                Q(address_details__area__city__icontains=search) | 
-                Q(specialization__icontains=search)
-            )
-        
-        status = self.request.GET.get('status')
-        if status == 'unassigned':
-            queryset = queryset.filter(agent__isnull=True)
-        elif status == 'assigned':
-            queryset = queryset.filter(agent__isnull=False)
-            
-        return queryset
+        return filter_doctors(self.request.GET).select_related('agent', 'address_details__area').order_by('name')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['form'] = AgentSelectionForm()
         context['title'] = 'Assign Doctors to Executives'
         context['current_status'] = self.request.GET.get('status', 'all')
+        context['filters'] = {key: self.request.GET.get(key, '') for key in FILTER_KEYS}
+        context['matching_count'] = context['paginator'].count if context.get('paginator') else len(context['doctors'])
+        context['areas'] = Area.objects.filter(deleted_at__isnull=True).order_by('name').only('id', 'name', 'city')
+        context['cities'] = Area.objects.filter(deleted_at__isnull=True).order_by('city').values_list('city', flat=True).distinct()
+        context['specializations'] = (
+            DoctorReferral.objects.exclude(specialization__isnull=True).exclude(specialization='')
+            .order_by('specialization').values_list('specialization', flat=True).distinct()
+        )
+        context['agents'] = AgentSelectionForm.base_fields['agent'].queryset.order_by('username')
         return context
-    
+
     def post(self, request, *args, **kwargs):
+        filters = {key: request.POST.get(key, '') for key in FILTER_KEYS}
+        redirect_url = reverse('portal:doctor_assignment')
+        query = urlencode({key: value for key, value in filters.items() if value})
+        if query:
+            redirect_url = f'{redirect_url}?{query}'
+
         form = AgentSelectionForm(request.POST)
-        if form.is_valid():
-            agent = form.cleaned_data['agent']
-            doctor_ids = request.POST.getlist('doctor_ids')
-            
-            if doctor_ids:
-                # Filter out doctors who are currently on an ONGOING trip
-                busy_doctors = DoctorReferral.objects.filter(
-                    id__in=doctor_ids, 
-                    trip__status='ONGOING'
-                ).select_related('trip')
-                
-                busy_ids = [d.id for d in busy_doctors]
-                available_ids = [d_id for d_id in doctor_ids if int(d_id) not in busy_ids]
-                
-                # Perform the update on available doctors
-                updated_count = 0
-                if available_ids:
-                    updated_count = DoctorReferral.objects.filter(id__in=available_ids).update(agent=agent, status='Assigned')
-                    messages.success(request, f'Successfully assigned {updated_count} doctors to {agent.username}.')
-                
-                # Warn about busy doctors
-                if busy_doctors:
-                    names = ", ".join([d.name for d in busy_doctors])
-                    messages.warning(request, f'Skipped {len(busy_doctors)} doctors ({names}) because they are currently on an active Trip. Please wait for the trip to complete.')
-            else:
-                messages.warning(request, 'No doctors selected.')
-        else:
+        if not form.is_valid():
             messages.error(request, 'Invalid assignment.')
-        
-        return redirect('portal:doctor_assignment')
+            return redirect(redirect_url)
+        agent = form.cleaned_data['agent']
+
+        if request.POST.get('scope') == 'matching':
+            doctors = filter_doctors(filters)
+        else:
+            doctor_ids = [d_id for d_id in request.POST.getlist('doctor_ids') if d_id.isdigit()]
+            if not doctor_ids:
+                messages.warning(request, 'No doctors selected.')
+                return redirect(redirect_url)
+            doctors = DoctorReferral.objects.filter(id__in=doctor_ids)
+
+        counts = reassign_doctors(doctors, agent, notes=f'Bulk reassignment by {request.user.username}.')
+        name = agent.full_name_or_username
+        if counts['updated']:
+            messages.success(
+                request,
+                f"Assigned {counts['updated']} of {counts['matched']} matching doctors to {name} "
+                f"across {counts['areas']} area(s).",
+            )
+        elif not counts['matched']:
+            messages.warning(request, 'No assignable doctors matched.')
+        if counts['internal']:
+            messages.warning(request, f"Skipped {counts['internal']} internal doctor(s); they cannot be assigned to executives.")
+        if counts['busy']:
+            messages.warning(
+                request,
+                f"Skipped {counts['busy']} doctor(s) currently on an active Trip. "
+                "Please wait for the trip to complete.",
+            )
+        if counts['without_area']:
+            messages.info(request, f"{counts['without_area']} assigned doctor(s) have no area, so no assignment history was recorded for them.")
+        return redirect(redirect_url)
 
 class AgentAssignmentListView(PortalMixin, ListView):
     """List history of executive assignments."""
@@ -1608,12 +1982,23 @@ class AgentAssignmentDeleteView(PortalMixin, DeleteView):
 
 # ============ Patient Referrals ============
 
-class PatientReferralListView(PortalMixin, ListView):
+class PatientReferralListView(PortalMixin, ServerSideTableMixin, ListView):
     """List all patient referrals."""
     model = PatientReferral
     template_name = 'portal/patients/list.html'
     context_object_name = 'patients'
     ordering = ['-reported_on']
+    table_columns = (
+        ('patient_name', 'patient_name'),
+        ('age_gender', None),
+        ('phone', None),
+        ('illness', 'illness'),
+        ('agent', 'agent__username'),
+        ('reported_on', 'reported_on'),
+        ('status', 'status'),
+    )
+    table_search_fields = ('patient_name', 'phone', 'illness', 'agent__username')
+    table_default_ordering = ('-reported_on',)
     
     def get_queryset(self):
         queryset = super().get_queryset().select_related('agent')
@@ -1634,6 +2019,39 @@ class PatientReferralListView(PortalMixin, ListView):
             
         return queryset
 
+    def get_table_row(self, patient):
+        agent_name = patient.agent.full_name_or_username
+        name = format_html('<i class="bi bi-person me-1"></i>{}', patient.patient_name)
+        if patient.is_urgent:
+            name += format_html(' <span class="badge bg-danger ms-2">Urgent</span>')
+        if patient.status == 'Pending':
+            status_badge = format_html('<span class="badge bg-warning-subtle text-warning border border-warning-subtle">Pending</span>')
+        elif patient.status == 'Admitted':
+            status_badge = format_html('<span class="badge bg-success-subtle text-success border border-success-subtle">Admitted</span>')
+        else:
+            status_badge = format_html(
+                '<span class="badge bg-secondary-subtle text-secondary border border-secondary-subtle">{}</span>',
+                patient.status,
+            )
+        return [
+            name,
+            f"{patient.age} / {patient.gender}",
+            format_html('<i class="bi bi-telephone me-1"></i> {}', patient.phone),
+            format_html(
+                '<div class="text-truncate" style="max-width: 150px;" title="{}">{}</div>',
+                patient.illness, patient.illness,
+            ),
+            format_html(
+                '<div class="d-flex align-items-center">'
+                '<div class="avatar-sm bg-light rounded-circle text-primary me-2 d-flex align-items-center justify-content-center" '
+                'style="width: 32px; height: 32px;">{}</div>'
+                '<div><div class="small fw-bold">{}</div></div></div>',
+                agent_name[:1].upper(), agent_name,
+            ),
+            format_html('<small class="text-muted">{}</small>', date_filter(patient.reported_on, 'M d, Y')),
+            status_badge,
+        ]
+
 
 class PatientReferralStatusUpdateView(PortalMixin, View):
     """Update patient referral status (Pending/Admitted/Dismissed)."""
@@ -1656,47 +2074,61 @@ class PatientReferralStatusUpdateView(PortalMixin, View):
 
 
 from django.http import JsonResponse
+def _rates_payload(rates):
+    # referral_percentage is the name the admission form reads.
+    return {**rates, 'referral_percentage': rates['discount_percentage']}
+
+
 @staff_member_required
 def get_commission_rates(request):
     """API to fetch referral rates for a doctor and payment category."""
+
     doctor_id = request.GET.get('doctor_id')
     category_id = request.GET.get('category')  # Now this is a PaymentCategory PK
     
     if not doctor_id or not category_id:
         return JsonResponse({'error': 'Missing parameters'}, status=400)
-    
     try:
-        profile = DoctorCommissionProfile.objects.get(
-            doctor_id=doctor_id, 
-            payment_category_id=category_id
-        )
-        
-        return JsonResponse({
-            'bed_charges_rate': profile.bed_charges_rate,
-            'nursing_charges_rate': profile.nursing_charges_rate,
-            'doctor_consultation_charges_rate': profile.doctor_consultation_charges_rate,
-            'investigation_charges_rate': profile.investigation_charges_rate,
-            'procedural_surgical_charges_rate': profile.procedural_surgical_charges_rate,
-            'anaesthesia_charges_rate': profile.anaesthesia_charges_rate,
-            'surgeon_charges_rate': profile.surgeon_charges_rate,
-            'other_charges_rate': profile.other_charges_rate,
-            'discount_percentage': profile.discount_percentage,
-            'referral_percentage': profile.discount_percentage,
-        })
-    except DoctorCommissionProfile.DoesNotExist:
-        # Return all zeros if no profile exists
-        return JsonResponse({
-            'bed_charges_rate': 0.0,
-            'nursing_charges_rate': 0.0,
-            'doctor_consultation_charges_rate': 0.0,
-            'investigation_charges_rate': 0.0,
-            'procedural_surgical_charges_rate': 0.0,
-            'anaesthesia_charges_rate': 0.0,
-            'surgeon_charges_rate': 0.0,
-            'other_charges_rate': 0.0,
-            'discount_percentage': 0.0,
-            'referral_percentage': 0.0,
-        })
+        rates = get_rates(doctor_id, category_id)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid parameters'}, status=400)
+    # All zeros if no profile exists
+    return JsonResponse(_rates_payload(rates))
+
+
+@staff_member_required
+def get_commission_rates_batch(request):
+    """
+    Rates for many doctor/category pairs in one call.
+
+    ``?pairs=doctor:category,...`` or ``?doctor_id=N`` for every payment
+    category of one doctor (what the admission form prefetches).
+    """
+
+    max_pairs = 500
+    try:
+        if request.GET.get('doctor_id'):
+            doctor_id = int(request.GET['doctor_id'])
+            pairs = [(doctor_id, c) for c in PaymentCategory.objects.values_list('pk', flat=True)]
+        else:
+            pairs = [
+                tuple(int(part) for part in item.split(':', 1))
+                for item in request.GET.get('pairs', '').split(',') if item.strip()
+            ]
+            if any(len(pair) != 2 for pair in pairs):
+                raise ValueError
+    except ValueError:
+        return JsonResponse({'error': 'Invalid parameters'}, status=400)
+    if not pairs or len(pairs) > max_pairs:
+        return JsonResponse({'error': f'Pass between 1 and {max_pairs} pairs.'}, status=400)
+
+    rates = get_rates_many(pairs)
+    return JsonResponse({
+        'rates': [
+            {'doctor_id': d, 'category': c, **_rates_payload(rates[(d, c)])}
+            for d, c in sorted(rates)
+        ],
+    })
 
 
 class PaymentCategoryCreateView(PortalMixin, CreateView):
@@ -1769,7 +2201,7 @@ def get_all_portal_pages():
     pages = []
     excluded_names = [
         'permission_list', 'permission_update', 'create_custom_role', 
-        'backup_dashboard', 'backup_export', 'backup_import'
+        'backup_dashboard', 'backup_export', 'backup_import', 'backup_download'
     ]
     for pattern in portal_urlpatterns:
         if hasattr(pattern, 'name') and pattern.name:
@@ -0,0 +1,49 @@
+from urllib.parse import urlencode
+
+from django import forms
+from django.core.exceptions import ValidationError
+from django.urls import reverse
+
+
+class AutocompleteSelect(forms.Select):
+    """
+    Select that renders only the current value and loads the rest on demand.
+
+    Options are fetched by select2 from ``url_name`` (see ``initAutocomplete``
+    in base.html), so rendering never iterates the field's queryset. The
+    field stays a ModelChoiceField, which validates just the submitted id
+    against its queryset.
+    """
+
+    def __init__(self, url_name, attrs=None, placeholder='', url_params=None):
+        super().__init__(attrs)
+        self.url_name = url_name
+        self.placeholder = placeholder
+        self.url_params = url_params or {}
+
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super().build_attrs(base_attrs, extra_attrs)
+        url = reverse(self.url_name)
+        if self.url_params:
+            url = f"{url}?{urlencode(self.url_params)}"
+        attrs['data-autocomplete-url'] = url
+        attrs['data-placeholder'] = self.placeholder
+        attrs.setdefault('class', 'form-select')
+        return attrs
+
+    def optgroups(self, name, value, attrs=None):
+        options = []
+        if not self.is_required:
+            options.append(self.create_option(name, '', '', False, 0))
+
+        field = getattr(self.choices, 'field', None)
+        selected = [v for v in value if v not in ('', None)]
+        if field is not None and selected:
+            try:
+                objects = list(field.queryset.filter(pk__in=selected))
+            except (TypeError, ValueError, ValidationError):
+                # A tampered value; the field's own validation reports it.
+                objects = []
+            for index, obj in enumerate(objects, start=len(options)):
+                options.append(self.create_option(name, obj.pk, field.label_from_instance(obj), True, index))
+        return [(None, options, 0)]
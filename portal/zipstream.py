@@ -0,0 +1,127 @@
+"""
+Write a zip archive as a stream of byte chunks.
+
+``zipfile`` can target unseekable outputs: it then writes sizes and CRCs
+in data descriptors after each member instead of seeking back. Pointing
+it at ``_ChunkBuffer`` lets a generator hand out whatever has been
+written so far, so an archive of any size is produced in constant memory
+and a response can start before the last member is compressed.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import zipfile
+from datetime import datetime
+
+# Zip timestamps cannot predate 1980.
+_MIN_ZIP_TIMESTAMP = 315619200
+
+
+class _ChunkBuffer:
+    """Append-only, unseekable file object that collects written bytes."""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        if data:
+            self._chunks.append(bytes(data))
+            self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class ZipStream:
+    """
+    Build a zip archive incrementally.
+
+    Usage::
+
+        archive = ZipStream()
+        with archive.open('data.json') as member:
+            for part in parts:
+                member.write(part)
+                yield archive.drain()
+        yield archive.close()
+    """
+
+    def __init__(self, compression=zipfile.ZIP_DEFLATED, compresslevel=6):
+        self._buffer = _ChunkBuffer()
+        self._zip = zipfile.ZipFile(
+            self._buffer,
+            mode='w',
+            compression=compression,
+            compresslevel=compresslevel,
+            allowZip64=True,
+        )
+
+    def open(self, name, compress_type=None, size=None, date_time=None):
+        """
+        Open a member for writing.
+
+        Without ``size`` the member is written as zip64, since its size is
+        not known in advance.
+        """
+        if compress_type is None and size is None and date_time is None:
+            return self._zip.open(name, mode='w', force_zip64=True)
+        info = zipfile.ZipInfo(name, date_time=date_time or datetime.now().timetuple()[:6])
+        info.compress_type = self._zip.compression if compress_type is None else compress_type
+        info.external_attr = 0o644 << 16
+        if size is not None:
+            info.file_size = size
+        return self._zip.open(info, mode='w', force_zip64=size is None or size > zipfile.ZIP64_LIMIT)
+
+    def writestr(self, name, data):
+        self._zip.writestr(name, data)
+
+    def write_file(self, name, path, compress_type=None, chunk_size=64 * 1024, stat=None):
+        """
+        Copy a file on disk into the archive, yielding output as it grows.
+
+        Returns (as the generator's value) the SHA-256 hex digest of the file.
+        """
+        stat = stat or os.stat(path)
+        date_time = datetime.fromtimestamp(max(stat.st_mtime, _MIN_ZIP_TIMESTAMP)).timetuple()[:6]
+        with open(path, 'rb') as source:
+            return (yield from self.write_fileobj(
+                name, source, stat.st_size, compress_type=compress_type, chunk_size=chunk_size, date_time=date_time,
+            ))
+
+    def write_fileobj(self, name, source, size, compress_type=None, chunk_size=64 * 1024, date_time=None):
+        """Like ``write_file`` for an open binary file of ``size`` bytes."""
+        digest = hashlib.sha256()
+        with self.open(name, compress_type=compress_type, size=size, date_time=date_time) as member:
+            while True:
+                block = source.read(chunk_size)
+                if not block:
+                    break
+                digest.update(block)
+                member.write(block)
+                data = self.drain()
+                if data:
+                    yield data
+        data = self.drain()
+        if data:
+            yield data
+        return digest.hexdigest()
+
+    def drain(self):
+        """Return (and forget) everything written since the last drain."""
+        return self._buffer.drain()
+
+    def close(self):
+        """Finish the central directory and return the remaining bytes."""
+        self._zip.close()
+        return self._buffer.drain()